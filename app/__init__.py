@@ -1,29 +1,90 @@
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from config import Config
+from config import get_config
+from app.db_routing import session_router
+from app.dimensions import event_dimensions
+from app.enrichment import event_enrichment
+from app.machine_events import machine_events
+from app.repeat_opens import repeat_opens
+from app.idempotency import idempotency_keys
+from app.admission import admission_control
+from app.heavy_hitters import heavy_hitters
+from app.event_stream import event_stream
+from app.webhooks import webhooks
+from app.mailer import mailer
+from app.templating import template_engine
+from app.partitions import event_partitions
+from app.archive import event_archive
+from app.columnar import columnar_events
+from app.query_stats import query_instrumentation
+from app.metrics import metrics
 
 db = SQLAlchemy()
 migrate = Migrate()
+session_router.register_write_listener(db.session)
 
 
-def create_app(config_class=Config):
-    """Application factory pattern"""
+def create_app(config_class=None):
+    """
+    Application factory pattern
+
+    Args:
+        config_class: Configuration class (defaults to the profile named by FLASK_CONFIG)
+    """
     app = Flask(__name__)
-    app.config.from_object(config_class)
+    app.config.from_object(config_class or get_config())
     app.url_map.strict_slashes = False  # Allow URLs with or without trailing slashes
 
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
+    session_router.init_app(app)
+    event_dimensions.init_app(app)
+    event_enrichment.init_app(app)
+    machine_events.init_app(app)
+    repeat_opens.init_app(app)
+    idempotency_keys.init_app(app)
+    admission_control.init_app(app)
+    heavy_hitters.init_app(app)
+    event_stream.init_app(app)
+    webhooks.init_app(app)
+    mailer.init_app(app)
+    template_engine.init_app(app)
+    event_partitions.init_app(app)
+    event_archive.init_app(app)
+    columnar_events.init_app(app)
+
+    # Apply per-connection SQLite tuning for the selected profile
+    from app.database import apply_sqlite_pragmas
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, app.config.get('SQLITE_PRAGMAS'))
+
+        # Per-request query counts and N+1 detection
+        engines = list(db.engines.values())
+        if session_router.replica_engine is not None:
+            engines.append(session_router.replica_engine)
+        query_instrumentation.init_app(app, engines)
+
+        # Request latency, ingest counters and cache hit ratios at /metrics
+        metrics.init_app(app, engines)
 
     # Register blueprints
-    from app.routes import email_bp, campaign_bp, tracking_bp, analytics_bp, template_bp
+    from app.routes import email_bp, campaign_bp, tracking_bp, analytics_bp, template_bp, metrics_bp
     app.register_blueprint(email_bp, url_prefix='/api/emails')
     app.register_blueprint(campaign_bp, url_prefix='/api/emails/campaigns')
     app.register_blueprint(tracking_bp, url_prefix='/track')
     app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
     app.register_blueprint(template_bp, url_prefix='/api/emails/templates')
+    if app.config.get('METRICS_ENABLED', True):
+        app.register_blueprint(metrics_bp, url_prefix='/metrics')
+
+    # Optional WSGI fast path for pixel/click hits (falls through to Flask for everything else)
+    if app.config.get('TRACKING_FAST_PATH'):
+        from app.fast_path import TrackingFastPath
+        app.wsgi_app = TrackingFastPath(app, app.wsgi_app)
 
     # Health check route
     @app.route('/health')
@@ -35,6 +96,9 @@ def create_app(config_class=Config):
     def init_db_command():
         """Initialize the database"""
         db.create_all()
+        if event_partitions.enabled:
+            with db.engine.begin() as connection:
+                event_partitions.install(connection)
         print("Database initialized successfully!")
 
     @app.cli.command('drop-db')
@@ -42,11 +106,96 @@ def create_app(config_class=Config):
         """Drop all database tables"""
         import sys
         if '--force' in sys.argv:
+            if event_partitions.enabled:
+                with db.engine.begin() as connection:
+                    event_partitions.drop_all(connection)
             db.drop_all()
             print("Database dropped successfully!")
         else:
             print("Add --force flag to confirm: flask drop-db --force")
 
+    from app.partitions import partitions_cli
+    app.cli.add_command(partitions_cli)
+
+    from app.archive import archive_cli
+    app.cli.add_command(archive_cli)
+
+    from app.enrichment import enrichment_cli
+    app.cli.add_command(enrichment_cli)
+
+    from app.idempotency import idempotency_cli
+    app.cli.add_command(idempotency_cli)
+
+    from app.heavy_hitters import heavy_hitters_cli
+    app.cli.add_command(heavy_hitters_cli)
+
+    from app.webhooks import webhooks_cli
+    app.cli.add_command(webhooks_cli)
+
+    from app.mailer import mail_cli
+    app.cli.add_command(mail_cli)
+
+    @app.cli.command('seed')
+    @click.option('--campaigns', default=10, show_default=True, help='Number of campaigns')
+    @click.option('--emails', default=10000, show_default=True, help='Number of emails')
+    @click.option('--events', default=100000, show_default=True, help='Number of tracking events')
+    @click.option('--seed', 'random_seed', default=42, show_default=True, help='Random seed (fixed seed = same rows)')
+    @click.option('--end-date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Latest sent_at, YYYY-MM-DD (defaults to today)')
+    @click.option('--days', default=30, show_default=True, help='Days over which emails are sent')
+    @click.option('--open-rate', default=0.45, show_default=True, help='Share of emails with any events')
+    @click.option('--open-skew', default=1.5, show_default=True, help='Pareto shape of events per email')
+    @click.option('--click-ratio', default=0.15, show_default=True, help='Share of events that are clicks')
+    @click.option('--ip-pool', default=None, type=int, help='Distinct IPs (defaults to events / 20)')
+    @click.option('--ip-skew', default=1.1, show_default=True, help='Zipf exponent for IP reuse')
+    @click.option('--links', default=5, show_default=True, help='Distinct click URLs per campaign')
+    @click.option('--url-skew', default=1.2, show_default=True, help='Zipf exponent for click URL popularity')
+    @click.option('--decay-hours', default=12.0, show_default=True, help='Mean delay from sent_at to an event')
+    @click.option('--batch-size', default=10000, show_default=True, help='Rows per bulk insert')
+    def seed_command(campaigns, emails, events, random_seed, end_date, days, open_rate, open_skew,
+                     click_ratio, ip_pool, ip_skew, links, url_skew, decay_hours, batch_size):
+        """Generate a synthetic dataset"""
+        from app.seeding import seed_database
+
+        db.create_all()
+
+        def progress(table, done, total):
+            click.echo(f"\r{table}: {done}/{total}", nl=done == total)
+
+        result = seed_database(
+            campaigns=campaigns, emails=emails, events=events, seed=random_seed, end_date=end_date,
+            days=days, open_rate=open_rate, open_skew=open_skew, click_ratio=click_ratio,
+            ip_pool=ip_pool, ip_skew=ip_skew, links_per_campaign=links, url_skew=url_skew,
+            decay_hours=decay_hours, batch_size=batch_size, progress=progress,
+        )
+        rows = result['campaigns'] + result['emails'] + result['events']
+        click.echo(f"Seeded {result['campaigns']} campaigns, {result['emails']} emails, "
+                   f"{result['events']} events in {result['seconds']:.1f}s "
+                   f"({rows / max(result['seconds'], 1e-9):,.0f} rows/s)")
+
+    @app.cli.command('compact-events')
+    @click.option('--days', default=None, type=int, help='Days of raw events to keep (defaults to RETENTION_DAYS)')
+    @click.option('--chunk-size', default=None, type=int, help='Events per transaction (defaults to RETENTION_CHUNK_SIZE)')
+    @click.option('--pause', default=0.05, show_default=True, help='Seconds between chunks, to let ingest write')
+    @click.option('--max-chunks', default=None, type=int, help='Stop after this many chunks')
+    def compact_events_command(days, chunk_size, pause, max_chunks):
+        """Roll raw events past the retention window into daily aggregates"""
+        from app.exceptions import EmailTrackerException
+        from app.services.retention_service import RetentionService
+
+        try:
+            result = RetentionService().compact(days=days, chunk_size=chunk_size, pause=pause,
+                                                max_chunks=max_chunks)
+        except EmailTrackerException as e:
+            raise click.ClickException(str(e))
+
+        if result['archived'] is not None:
+            click.echo(f"Archived {result['archived']['events']} events "
+                       f"in {result['archived']['segments']} segments")
+        click.echo(f"Compacted {result['events']} events before {result['cutoff']} in {result['chunks']} chunks")
+        for name in result['partitions_dropped']:
+            click.echo(f"dropped empty partition {name}")
+
     return app
 
 
@@ -0,0 +1,188 @@
+"""
+Admission control for the tracking pixel and click redirect
+
+A misbehaving scanner or a replayed link can hit /track/pixel and
+/track/click fast enough to saturate database writes. Each hit first takes a
+token from two token buckets - one per client IP (TRACKING_IP_RATE tokens per
+second, up to TRACKING_IP_BURST) and one per tracking ID (TRACKING_ID_RATE,
+TRACKING_ID_BURST). A hit either bucket refuses still gets its pixel or
+redirect, but is not recorded. A rate of 0 turns that limiter off; both are
+off by default.
+
+Buckets live in a fixed table of TRACKING_LIMITER_SLOTS slots in shared
+memory, so gunicorn workers draw from the same buckets:
+
+- by default an anonymous shared mapping created with the app - shared by
+  workers forked after create_app() (gunicorn --preload), per worker otherwise
+- with TRACKING_LIMITER_PATH, a file every process maps (put it on a tmpfs
+  such as /dev/shm), shared whatever the server model. Slot updates are
+  serialized with POSIX record locks (lockf), which belong to a process, so
+  workers forked with the file already open still exclude each other
+
+The table is direct-mapped on a 64-bit hash of the key: a key landing on a
+slot held by another key takes it over with a full bucket, so collisions err
+towards admitting. Decisions are counted in tracking_admissions_total.
+"""
+
+import hashlib
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import time
+
+from flask import current_app
+
+from app.exceptions import ValidationError
+from app.metrics import tracking_admissions, tracking_events_dropped
+
+# key hash (0 = empty slot), tokens left, time.monotonic() of the last take
+SLOT = struct.Struct('<Qdd')
+
+
+class _FileLock:
+    """Lock on a shared table file, between threads and between processes"""
+
+    def __init__(self, fd):
+        import fcntl
+
+        self._fcntl = fcntl
+        self._fd = fd
+        # lockf locks are per process (unlike flock's, which forked children share
+        # through the inherited descriptor), so they don't exclude this process's threads
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+class BucketTable:
+    """Token buckets in a shared memory table (see module docstring)"""
+
+    def __init__(self, slots, path=None):
+        """
+        Args:
+            slots: Number of buckets the table holds
+            path: File to map (optional - an anonymous mapping otherwise)
+        """
+        self.slots = slots
+        size = slots * SLOT.size
+        if path:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._lock = _FileLock(self._fd)
+            with self._lock:
+                if os.fstat(self._fd).st_size < size:
+                    os.ftruncate(self._fd, size)
+            self.memory = mmap.mmap(self._fd, size)
+        else:
+            self.memory = mmap.mmap(-1, size)
+            self._lock = multiprocessing.Lock()
+
+    @staticmethod
+    def key_hash(key):
+        """Stable 64-bit hash of a bucket key (the same in every process)"""
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def take(self, key, rate, burst, now=None):
+        """
+        Take a token from a key's bucket
+
+        Args:
+            key: Bucket key
+            rate: Tokens added per second
+            burst: Bucket capacity
+            now: time.monotonic() of the hit (defaults to now)
+
+        Returns:
+            bool: Whether a token was left
+        """
+        if now is None:
+            now = time.monotonic()
+        key_hash = self.key_hash(key)
+        offset = key_hash % self.slots * SLOT.size
+        with self._lock:
+            stored, tokens, updated = SLOT.unpack_from(self.memory, offset)
+            if stored != key_hash:
+                tokens = burst
+            else:
+                tokens = min(burst, tokens + max(now - updated, 0) * rate)
+            admitted = tokens >= 1
+            if admitted:
+                tokens -= 1
+            SLOT.pack_into(self.memory, offset, key_hash, tokens, now)
+        return admitted
+
+
+class AdmissionControl:
+    """Per-IP and per-tracking-ID token bucket limiter for tracking hits (see module docstring)"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRACKING_IP_RATE', 0)
+        app.config.setdefault('TRACKING_IP_BURST', 20)
+        app.config.setdefault('TRACKING_ID_RATE', 0)
+        app.config.setdefault('TRACKING_ID_BURST', 50)
+        app.config.setdefault('TRACKING_LIMITER_SLOTS', 65536)
+        app.config.setdefault('TRACKING_LIMITER_PATH', None)
+
+        for rate, burst in (('TRACKING_IP_RATE', 'TRACKING_IP_BURST'), ('TRACKING_ID_RATE', 'TRACKING_ID_BURST')):
+            if app.config[rate] < 0:
+                raise ValidationError("Rate limit cannot be negative", field=rate)
+            if app.config[rate] and app.config[burst] < 1:
+                raise ValidationError("Bucket must hold at least one token", field=burst)
+        if app.config['TRACKING_LIMITER_SLOTS'] < 1:
+            raise ValidationError("Limiter table needs at least one slot", field='TRACKING_LIMITER_SLOTS')
+
+        table = None
+        if app.config['TRACKING_IP_RATE'] or app.config['TRACKING_ID_RATE']:
+            table = BucketTable(app.config['TRACKING_LIMITER_SLOTS'], app.config['TRACKING_LIMITER_PATH'])
+        app.extensions['admission_control'] = table
+
+    def admit(self, event_type, ip_address, tracking_id):
+        """
+        Decide whether a tracking hit is recorded
+
+        Args:
+            event_type: 'open' or 'click'
+            ip_address: Client IP address
+            tracking_id: Tracking ID of the hit
+
+        Returns:
+            bool: False if the IP or tracking ID is over its limit (counted
+                  as a dropped event)
+        """
+        table = current_app.extensions['admission_control']
+        if table is None:
+            return True
+
+        config = current_app.config
+        now = time.monotonic()
+        decision = 'admitted'
+        if config['TRACKING_IP_RATE'] and ip_address and not table.take(
+                'ip:' + ip_address, config['TRACKING_IP_RATE'], config['TRACKING_IP_BURST'], now):
+            decision = 'limited_ip'
+        elif config['TRACKING_ID_RATE'] and not table.take(
+                'id:' + tracking_id, config['TRACKING_ID_RATE'], config['TRACKING_ID_BURST'], now):
+            decision = 'limited_tracking_id'
+
+        tracking_admissions.inc(event_type, decision)
+        if decision != 'admitted':
+            tracking_events_dropped.inc(event_type, 'rate_limited')
+            return False
+        return True
+
+
+admission_control = AdmissionControl()
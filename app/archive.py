@@ -0,0 +1,389 @@
+"""
+Cold archive for tracking events in immutable, compressed segment files
+
+Events that leave the hot tracking_events table (see RetentionService) are
+first copied here for audits and re-analysis. Each segment holds a few
+thousand to a few hundred thousand events stored column by column:
+
+    MAGIC | header length (4 bytes) | JSON header | one zlib block per column
+
+Integer columns (id, email_id, machine_reason, repeat_count, created_at as
+epoch microseconds) are packed 64-bit arrays, with id and created_at delta-encoded; text columns are JSON
+lists, which zlib shrinks well since values repeat. Segments are never
+rewritten. manifest.json lists them with min/max email_id and created_at,
+so a scan opens only the segments that can match, and inside a segment only
+decompresses the filter columns until a row matches.
+"""
+
+import json
+import os
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.exceptions import ValidationError
+
+SEGMENT_MAGIC = b'ETSEG1\n'
+MANIFEST = 'manifest.json'
+COLUMNS = ('id', 'email_id', 'event_type', 'ip_address', 'user_agent', 'location', 'device_type',
+           'clicked_url', 'created_at', 'repeat_count', 'machine_reason')
+INT_COLUMNS = ('id', 'email_id', 'created_at', 'repeat_count', 'machine_reason')
+# Columns added after the first segments were written, with the value older segments imply
+LATER_COLUMNS = {'repeat_count': 0, 'machine_reason': 0}
+DELTA_COLUMNS = ('id', 'created_at')
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_micros(value):
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_micros(value):
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def _pack_ints(values, delta):
+    if delta:
+        previous = 0
+        encoded = []
+        for value in values:
+            encoded.append(value - previous)
+            previous = value
+        values = encoded
+    packed = array('q', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack_ints(data, delta):
+    values = array('q')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    if delta:
+        total = 0
+        for i, value in enumerate(values):
+            total += value
+            values[i] = total
+    return values
+
+
+def write_segment(path, rows):
+    """
+    Write events to a new segment file
+
+    Args:
+        path: Destination file (written to a temp name, then renamed into place)
+        rows: Event dicts with the COLUMNS keys, sorted by (created_at, id)
+
+    Returns:
+        dict: Segment metadata for the manifest
+    """
+    columns = {name: [row[name] for row in rows] for name in COLUMNS}
+    columns['created_at'] = [_to_micros(value) for value in columns['created_at']]
+
+    blocks = []
+    layout = {}
+    offset = 0
+    for name in COLUMNS:
+        if name in INT_COLUMNS:
+            raw = _pack_ints(columns[name], name in DELTA_COLUMNS)
+        else:
+            raw = json.dumps(columns[name], separators=(',', ':')).encode()
+        block = zlib.compress(raw, 6)
+        layout[name] = [offset, len(block)]
+        blocks.append(block)
+        offset += len(block)
+
+    meta = {
+        'file': os.path.basename(path),
+        'rows': len(rows),
+        'min_email_id': min(columns['email_id']),
+        'max_email_id': max(columns['email_id']),
+        'min_created_at': columns['created_at'][0],
+        'max_created_at': columns['created_at'][-1],
+    }
+    header = json.dumps(dict(meta, columns=layout)).encode()
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SEGMENT_MAGIC)
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+
+    meta['bytes'] = os.path.getsize(path)
+    return meta
+
+
+class Segment:
+    """Read access to one segment file, decompressing columns on demand"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                raise ValidationError(f"Not an event archive segment: {path}", field='path')
+            length = int.from_bytes(f.read(4), 'little')
+            self.header = json.loads(f.read(length))
+            self._data_offset = len(SEGMENT_MAGIC) + 4 + length
+        self._columns = {}
+
+    @property
+    def rows(self):
+        return self.header['rows']
+
+    def column(self, name):
+        """Decoded values of one column (created_at as epoch microseconds)"""
+        values = self._columns.get(name)
+        if values is None and name not in self.header['columns']:
+            values = self._columns[name] = [LATER_COLUMNS[name]] * self.rows
+        if values is None:
+            offset, length = self.header['columns'][name]
+            with open(self.path, 'rb') as f:
+                f.seek(self._data_offset + offset)
+                raw = zlib.decompress(f.read(length))
+            values = _unpack_ints(raw, name in DELTA_COLUMNS) if name in INT_COLUMNS else json.loads(raw)
+            self._columns[name] = values
+        return values
+
+    def scan(self, email_ids=None, start=None, end=None):
+        """
+        Matching rows as event dicts
+
+        Args:
+            email_ids: Set of email ids to keep (optional)
+            start: Inclusive created_at lower bound (optional)
+            end: Exclusive created_at upper bound (optional)
+        """
+        created = self.column('created_at')
+        lower = _to_micros(start) if start is not None else None
+        upper = _to_micros(end) if end is not None else None
+        emails = self.column('email_id') if email_ids is not None else None
+
+        matches = [i for i in range(self.rows)
+                   if (lower is None or created[i] >= lower) and (upper is None or created[i] < upper)
+                   and (emails is None or emails[i] in email_ids)]
+        if not matches:
+            return
+
+        columns = {name: self.column(name) for name in COLUMNS}
+        for i in matches:
+            row = {name: columns[name][i] for name in COLUMNS}
+            row['created_at'] = _from_micros(row['created_at'])
+            yield row
+
+
+class _ArchiveState:
+    """Per-application archive location"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+
+class EventArchive:
+    """Appends segments to the archive directory and scans them with segment skipping"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ARCHIVE_DIR', None)
+        directory = app.config['ARCHIVE_DIR']
+        app.extensions['event_archive'] = _ArchiveState(os.path.abspath(directory) if directory else None)
+
+    @property
+    def directory(self):
+        return current_app.extensions['event_archive'].directory
+
+    @property
+    def enabled(self):
+        """Whether the current app has an archive directory configured"""
+        return self.directory is not None
+
+    # Manifest
+
+    def manifest(self):
+        """
+        Archive manifest
+
+        Returns:
+            dict: segments (metadata list, oldest first), archived_before (ISO
+                  datetime - every older event is archived) and position
+                  ([created_at micros, id] of the last archived event)
+        """
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return {'segments': [], 'archived_before': None, 'position': None}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    @property
+    def archived_before(self):
+        """Datetime before which every event has been archived (None when nothing is)"""
+        value = self.manifest()['archived_before']
+        return datetime.fromisoformat(value) if value else None
+
+    def position(self):
+        """(created_at, id) of the last archived event, or None"""
+        position = self.manifest()['position']
+        return (_from_micros(position[0]), position[1]) if position else None
+
+    # Writes
+
+    def append(self, rows):
+        """
+        Write rows as a new segment and record it in the manifest
+
+        Args:
+            rows: Event dicts sorted by (created_at, id), all after position()
+
+        Returns:
+            dict: Segment metadata
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self.manifest()
+        number = len(manifest['segments']) + 1
+        meta = write_segment(os.path.join(self.directory, f'segment-{number:06d}.etseg'), rows)
+
+        manifest['segments'].append(meta)
+        manifest['position'] = [meta['max_created_at'], rows[-1]['id']]
+        self._save_manifest(manifest)
+        return meta
+
+    def mark_archived_before(self, cutoff):
+        """Record that every event before cutoff is archived (never moves backwards)"""
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self.manifest()
+        current = manifest['archived_before']
+        if current is None or datetime.fromisoformat(current) < cutoff:
+            manifest['archived_before'] = cutoff.isoformat()
+            self._save_manifest(manifest)
+
+    # Reads
+
+    def segments(self, email_ids=None, start=None, end=None):
+        """Metadata of the segments whose min/max ranges can contain matches"""
+        if not self.enabled:
+            return []
+
+        lower = _to_micros(start) if start is not None else None
+        upper = _to_micros(end) if end is not None else None
+        low_id = min(email_ids) if email_ids else None
+        high_id = max(email_ids) if email_ids else None
+
+        return [meta for meta in self.manifest()['segments']
+                if (lower is None or meta['max_created_at'] >= lower)
+                and (upper is None or meta['min_created_at'] < upper)
+                and (low_id is None or (meta['max_email_id'] >= low_id and meta['min_email_id'] <= high_id))]
+
+    def scan(self, email_ids=None, start=None, end=None):
+        """
+        Archived events matching the filters, oldest segment first
+
+        Args:
+            email_ids: Iterable of email ids (optional)
+            start: Inclusive created_at lower bound (optional)
+            end: Exclusive created_at upper bound (optional)
+
+        Yields:
+            dict: Event with the tracking_events columns
+        """
+        email_ids = set(email_ids) if email_ids is not None else None
+        if email_ids is not None and not email_ids:
+            return
+        for meta in self.segments(email_ids, start, end):
+            yield from Segment(os.path.join(self.directory, meta['file'])).scan(email_ids, start, end)
+
+
+event_archive = EventArchive()
+
+
+archive_cli = AppGroup('archive', help='Manage the cold event archive')
+
+
+def _require_enabled():
+    if not event_archive.enabled:
+        raise click.ClickException("Event archive is disabled - set ARCHIVE_DIR")
+
+
+@archive_cli.command('write')
+@click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Archive events created before this date (defaults to the retention cutoff)')
+@click.option('--segment-rows', default=None, type=int, help='Events per segment (defaults to ARCHIVE_SEGMENT_ROWS)')
+def write_command(before, segment_rows):
+    """Copy old events into new segments (compact-events does this before deleting)"""
+    from app.services.archive_service import ArchiveService
+    from app.services.retention_service import RetentionService
+
+    _require_enabled()
+    try:
+        result = ArchiveService().archive(before or RetentionService().cutoff(), segment_rows=segment_rows)
+    except ValidationError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Archived {result['events']} events in {result['segments']} segments "
+               f"(everything before {result['archived_before']})")
+
+
+@archive_cli.command('list')
+def list_command():
+    """List segments with their ranges and sizes"""
+    _require_enabled()
+    for meta in event_archive.manifest()['segments']:
+        click.echo(f"{meta['file']}  {_from_micros(meta['min_created_at']):%Y-%m-%d %H:%M} .. "
+                   f"{_from_micros(meta['max_created_at']):%Y-%m-%d %H:%M}  "
+                   f"emails {meta['min_email_id']}-{meta['max_email_id']}  {meta['rows']} rows  {meta['bytes']} bytes")
+
+
+@archive_cli.command('export')
+@click.option('--start', type=click.DateTime(), default=None, help='Inclusive lower created_at bound')
+@click.option('--end', type=click.DateTime(), default=None, help='Exclusive upper created_at bound')
+@click.option('--email-id', 'email_ids', type=int, multiple=True, help='Only these emails (repeatable)')
+@click.option('--include-hot', is_flag=True, help='Also export matching events still in the database')
+@click.option('--output', type=click.File('w'), default='-', help='JSON lines destination (default stdout)')
+def export_command(start, end, email_ids, include_hot, output):
+    """Export archived events as JSON lines, skipping segments outside the filters"""
+    from app import db
+    from app.models import TrackingEvent
+
+    _require_enabled()
+    email_ids = set(email_ids) or None
+    count = 0
+
+    def emit(row):
+        output.write(json.dumps(dict(row, created_at=row['created_at'].isoformat())) + '\n')
+
+    for row in event_archive.scan(email_ids, start, end):
+        emit(row)
+        count += 1
+
+    if include_hot:
+        query = db.session.query(*[getattr(TrackingEvent, name) for name in COLUMNS])
+        if email_ids:
+            query = query.filter(TrackingEvent.email_id.in_(email_ids))
+        if start is not None:
+            query = query.filter(TrackingEvent.created_at >= start)
+        if end is not None:
+            query = query.filter(TrackingEvent.created_at < end)
+        for row in query.order_by(TrackingEvent.created_at, TrackingEvent.id).yield_per(1000):
+            emit(row._asdict())
+            count += 1
+
+    click.echo(f"exported {count} events", err=True)
@@ -0,0 +1,402 @@
+"""
+Optional NumPy column store for analytics over tracking events
+
+With ANALYTICS_ENGINE = 'columnar', AnalyticsService computes the raw-event
+part of its email, campaign and global stats from per-process column arrays
+instead of ORM TrackingEvent objects:
+
+    id         int64      email_id  int32        event    uint8 code
+    device     uint8 code (0 = none)              ip       int32 code (-1 = none)
+    created    int64 epoch microseconds           machine  uint8 machine_reason
+    hits       int32 1 + repeat_count (app.repeat_opens)
+
+Strings are dictionary-encoded, so a row costs ~39 bytes instead of a mapped
+object. Rows are kept in id order. Before each use (at most every
+COLUMNAR_REFRESH_SECONDS) the store appends rows with an id above its
+watermark. It reloads when the pipeline's EnrichmentState.generation moves -
+every delete of stored events (retention, dropped partitions, deleted emails)
+bumps it in the same transaction - or when the last few seconds of rows at or
+below the watermark number more than it holds: a transaction that committed
+after a later one left a row below the watermark. Neither check reads more
+than one row or that recent window, so a refresh stays incremental however
+large the table.
+
+With background enrichment (app.enrichment), rows may be loaded before their
+device type is filled in: each refresh re-reads the device of loaded rows the
+pipeline has since passed, and `flask enrichment rerun` forces a reload.
+Likewise each refresh re-reads the rows ingest may have updated after they
+were loaded - clicks a scanner burst flagged (app.machine_events) and opens
+that collected repeats (app.repeat_opens) - only ever the last few seconds
+or minutes of rows.
+
+NumPy is optional (pip install numpy); the SQL engine needs nothing extra.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_, select
+
+from app.exceptions import ValidationError
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    np = None
+
+ENGINES = ('sql', 'columnar')
+LOAD_BATCH = 50000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_micros(value):
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_micros(value):
+    return _EPOCH + timedelta(microseconds=int(value))
+
+
+class _Column:
+    """Growable typed array (capacity doubles, so appends are amortized O(1))"""
+
+    def __init__(self, dtype):
+        self.data = np.empty(1024, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        needed = self.size + len(values)
+        if needed > len(self.data):
+            grown = np.empty(max(needed, 2 * len(self.data)), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = values
+        self.size = needed
+
+    def fit(self, largest):
+        """Widen the dtype if `largest` does not fit (e.g. more than 255 custom event types)"""
+        if largest > np.iinfo(self.data.dtype).max:
+            self.data = self.data.astype(np.min_scalar_type(largest))
+
+    @property
+    def values(self):
+        return self.data[:self.size]
+
+
+class _Dictionary:
+    """String <-> small integer code mapping"""
+
+    def __init__(self, first=()):
+        self.values = list(first)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _Store:
+    """Column arrays for one application's events"""
+
+    def __init__(self, generation=0):
+        self.id = _Column(np.int64)
+        self.email_id = _Column(np.int32)
+        self.event = _Column(np.uint8)
+        self.device = _Column(np.uint8)
+        self.ip = _Column(np.int32)
+        self.created = _Column(np.int64)
+        self.machine = _Column(np.uint8)
+        self.hits = _Column(np.int32)
+        self.event_types = _Dictionary()
+        self.devices = _Dictionary([None])  # code 0 = no device type
+        self.ips = _Dictionary()
+        self.watermark = 0
+        self.enriched_mark = 0  # loaded rows up to here have their derived columns
+        self.generation = generation  # EnrichmentState.generation the rows were loaded at
+        self.refreshed_at = None
+        self.refreshed_wall = None  # utcnow() of the last refresh, for burst re-reads
+
+    @property
+    def size(self):
+        return self.email_id.size
+
+    def append(self, rows):
+        """
+        Append (id, email_id, event_type, device_type, ip_address, created_at,
+        machine_reason, hits) rows in id order
+        """
+        if not rows:
+            return
+        ids, email_ids, event_types, devices, ips, created, machine, hits = zip(*rows)
+        self.id.extend(ids)
+        self.email_id.extend(email_ids)
+        event_codes = [self.event_types.encode(value) for value in event_types]
+        device_codes = [self.devices.encode(value) for value in devices]
+        self.event.fit(len(self.event_types.values) - 1)
+        self.device.fit(len(self.devices.values) - 1)
+        self.event.extend(event_codes)
+        self.device.extend(device_codes)
+        self.ip.extend([self.ips.encode(value) if value else -1 for value in ips])
+        self.created.extend(np.array(created, dtype='datetime64[us]').astype(np.int64))
+        self.machine.extend(machine)
+        self.hits.extend(hits)
+        self.watermark = ids[-1]
+
+    def set_devices(self, rows):
+        """Overwrite the device type of already loaded (id, device_type) rows"""
+        if not rows:
+            return
+        ids, devices = zip(*rows)
+        codes = [self.devices.encode(value) for value in devices]
+        self.device.fit(len(self.devices.values) - 1)
+        self.device.values[np.searchsorted(self.id.values, ids)] = codes
+
+    def set_updated(self, rows):
+        """Overwrite the machine_reason and hits of already loaded (id, machine_reason, hits) rows"""
+        if not rows:
+            return
+        ids, reasons, hits = zip(*rows)
+        positions = np.searchsorted(self.id.values, ids)
+        self.machine.values[positions] = reasons
+        self.hits.values[positions] = hits
+
+    def count_since(self, since):
+        """Number of loaded rows created at or after a datetime"""
+        return int(np.count_nonzero(self.created.values >= _to_micros(since)))
+
+    def event_code(self, event_type):
+        """Code of an event type, or None if it never occurs (so nothing matches)"""
+        return self.event_types.codes.get(event_type)
+
+    def device_breakdown(self, mask):
+        counts = np.bincount(self.device.values[mask], weights=self.hits.values[mask],
+                             minlength=len(self.devices.values))
+        return {self.devices.values[code]: int(count) for code, count in enumerate(counts) if code and count}
+
+    def type_mask(self, mask, event_type):
+        code = self.event_code(event_type)
+        if code is None:
+            return np.zeros_like(mask)
+        return mask & (self.event.values == code)
+
+
+class ColumnarEvents:
+    """Optional column-store analytics engine (see module docstring)"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ANALYTICS_ENGINE', 'sql')
+        app.config.setdefault('COLUMNAR_REFRESH_SECONDS', 1.0)
+
+        engine = app.config['ANALYTICS_ENGINE']
+        if engine not in ENGINES:
+            raise ValidationError(f"Unknown analytics engine: {engine} (expected one of {', '.join(ENGINES)})",
+                                  field='ANALYTICS_ENGINE')
+        if engine == 'columnar' and np is None:
+            raise ValidationError("ANALYTICS_ENGINE=columnar needs numpy (pip install numpy)",
+                                  field='ANALYTICS_ENGINE')
+
+        app.extensions['columnar_events'] = {'store': None}
+
+    @property
+    def enabled(self):
+        """Whether the current app computes analytics from the column store"""
+        return current_app.config['ANALYTICS_ENGINE'] == 'columnar'
+
+    # Loading
+
+    def store(self, session):
+        """
+        Column store for the current app, refreshed if it is older than COLUMNAR_REFRESH_SECONDS
+
+        Args:
+            session: Session to read tracking_events through
+        """
+        state = current_app.extensions['columnar_events']
+        interval = current_app.config['COLUMNAR_REFRESH_SECONDS']
+        with self._lock:
+            store = state['store']
+            if store is None or store.refreshed_at is None or time.monotonic() - store.refreshed_at >= interval:
+                store = state['store'] = self._refresh(session, store)
+        return store
+
+    def invalidate(self):
+        """Drop the current app's store; the next use reloads it"""
+        current_app.extensions['columnar_events']['store'] = None
+
+    def _refresh(self, session, store):
+        from app.enrichment import PIPELINE, event_enrichment
+        from app.machine_events import HUMAN
+        from app.models import TrackingEvent, EnrichmentState
+
+        now = datetime.utcnow()
+
+        # Read before loading: every row at or below the mark is loaded enriched
+        enrichment = session.execute(select(EnrichmentState.high_water_mark, EnrichmentState.generation).where(
+            EnrichmentState.name == PIPELINE)).first()
+        high_water_mark, generation = enrichment if enrichment else (0, 0)
+
+        if store is None or store.generation != generation:
+            # First use, or history was re-enriched or deleted from
+            store = _Store(generation)
+        loaded = store.watermark
+        self._load(session, store, TrackingEvent.id > store.watermark)
+
+        since = None
+        if store.refreshed_wall is not None and loaded:
+            # A burst flags clicks up to MACHINE_BURST_SECONDS older than the click completing
+            # it; repeats are added to opens up to TRACKING_COLLAPSE_SECONDS old
+            window = max(current_app.config['MACHINE_BURST_SECONDS'], current_app.config['TRACKING_COLLAPSE_SECONDS'])
+            since = store.refreshed_wall - timedelta(seconds=window)
+            recent = session.execute(select(func.count(TrackingEvent.id)).where(
+                TrackingEvent.created_at >= since, TrackingEvent.id <= store.watermark)).scalar()
+            if recent > store.count_since(since):
+                # A row committed below the watermark - start over
+                store = _Store(generation)
+                loaded = 0
+                self._load(session, store, None)
+
+        if event_enrichment.background:
+            upper = min(high_water_mark, loaded)
+            if upper > store.enriched_mark:
+                store.set_devices(session.execute(
+                    select(TrackingEvent.id, TrackingEvent.device_type).where(
+                        TrackingEvent.id > store.enriched_mark, TrackingEvent.id <= upper
+                    ).order_by(TrackingEvent.id)).all())
+            store.enriched_mark = max(store.enriched_mark, min(high_water_mark, store.watermark))
+
+        if since is not None and loaded:
+            store.set_updated(session.execute(
+                select(TrackingEvent.id, TrackingEvent.machine_reason, TrackingEvent.hits).where(
+                    TrackingEvent.created_at >= since, TrackingEvent.id <= loaded,
+                    or_(TrackingEvent.machine_reason != HUMAN, TrackingEvent.repeat_count > 0)
+                ).order_by(TrackingEvent.id)).all())
+
+        store.refreshed_at = time.monotonic()
+        store.refreshed_wall = now
+        return store
+
+    @staticmethod
+    def _load(session, store, condition):
+        from app.models import TrackingEvent
+
+        query = select(TrackingEvent.id, TrackingEvent.email_id, TrackingEvent.event_type,
+                       TrackingEvent.device_type, TrackingEvent.ip_address, TrackingEvent.created_at,
+                       TrackingEvent.machine_reason, TrackingEvent.hits)
+        if condition is not None:
+            query = query.where(condition)
+        result = session.execute(query.order_by(TrackingEvent.id).execution_options(yield_per=LOAD_BATCH))
+        for rows in result.partitions():
+            store.append(rows)
+
+    # Stats
+
+    def email_activity(self, session, email_id, exclude_machine=False):
+        """
+        Raw-event part of AnalyticsService.get_email_stats
+
+        Args:
+            email_id: Email ID
+            exclude_machine: Leave out machine opens and scanner clicks
+
+        Returns:
+            dict: total_opens, total_clicks, open_ips, click_ips (sets),
+                  device_breakdown, first_open, last_open, last_click
+        """
+        store = self.store(session)
+        mask = self._human_mask(store, store.email_id.values == email_id, exclude_machine)
+        opens = store.type_mask(mask, 'open')
+        clicks = store.type_mask(mask, 'click')
+
+        def ip_set(selected):
+            codes = store.ip.values[selected]
+            return {store.ips.values[code] for code in np.unique(codes[codes >= 0])}
+
+        def created_at(selected, position):
+            rows = np.flatnonzero(selected)
+            return _from_micros(store.created.values[rows[position]]) if len(rows) else None
+
+        return {
+            'total_opens': int(store.hits.values[opens].sum()),
+            'total_clicks': int(store.hits.values[clicks].sum()),
+            'open_ips': ip_set(opens),
+            'click_ips': ip_set(clicks),
+            'device_breakdown': store.device_breakdown(mask),
+            # Rows are in id order, like email.events
+            'first_open': created_at(opens, 0),
+            'last_open': created_at(opens, -1),
+            'last_click': created_at(clicks, -1),
+        }
+
+    def campaign_activity(self, session, email_ids, exclude_machine=False):
+        """
+        Raw-event part of AnalyticsService.get_campaign_stats
+
+        Args:
+            email_ids: Ids of the campaign's emails
+            exclude_machine: Leave out machine opens and scanner clicks
+
+        Returns:
+            dict: total_opens, total_clicks, emails_with_opens, emails_with_clicks (sets), device_breakdown
+        """
+        store = self.store(session)
+        mask = np.isin(store.email_id.values, np.asarray(list(email_ids), dtype=np.int32))
+        return self._activity(store, self._human_mask(store, mask, exclude_machine))
+
+    def global_activity(self, session, start_date=None, end_date=None, exclude_machine=False):
+        """
+        Raw-event part of AnalyticsService.get_global_stats
+
+        Returns:
+            dict: total_events plus everything campaign_activity returns
+        """
+        store = self.store(session)
+        mask = np.ones(store.size, dtype=bool)
+        if start_date is not None:
+            mask &= store.created.values >= _to_micros(start_date)
+        if end_date is not None:
+            mask &= store.created.values < _to_micros(end_date)
+        mask = self._human_mask(store, mask, exclude_machine)
+
+        activity = self._activity(store, mask)
+        activity['total_events'] = int(store.hits.values[mask].sum())
+        return activity
+
+    @staticmethod
+    def _human_mask(store, mask, exclude_machine):
+        return mask & (store.machine.values == 0) if exclude_machine else mask
+
+    @staticmethod
+    def _activity(store, mask):
+        counts = np.bincount(store.event.values[mask], weights=store.hits.values[mask],
+                             minlength=len(store.event_types.values))
+
+        def count(event_type):
+            code = store.event_code(event_type)
+            return int(counts[code]) if code is not None else 0
+
+        def emails(event_type):
+            return set(np.unique(store.email_id.values[store.type_mask(mask, event_type)]).tolist())
+
+        return {
+            'total_opens': count('open'),
+            'total_clicks': count('click'),
+            'emails_with_opens': emails('open'),
+            'emails_with_clicks': emails('click'),
+            'device_breakdown': store.device_breakdown(mask),
+        }
+
+
+columnar_events = ColumnarEvents()
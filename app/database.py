@@ -0,0 +1,48 @@
+"""
+Database engine setup helpers
+"""
+
+from sqlalchemy import event
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """
+    Run PRAGMA statements on every new connection of a SQLite engine
+
+    PRAGMAs such as synchronous, cache_size and busy_timeout are per-connection,
+    so they have to be applied on connect rather than once at startup.
+
+    Args:
+        engine: SQLAlchemy engine
+        pragmas: Mapping of pragma name to value (e.g. {'journal_mode': 'WAL'})
+    """
+    if not pragmas or engine.dialect.name != 'sqlite':
+        return
+
+    statements = [f"PRAGMA {name}={value}" for name, value in pragmas.items()]
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+def get_sqlite_pragmas(connection, names):
+    """
+    Read the current value of SQLite pragmas on a connection
+
+    Args:
+        connection: SQLAlchemy connection
+        names: Iterable of pragma names
+
+    Returns:
+        dict: Pragma name to current value
+    """
+    values = {}
+    for name in names:
+        values[name] = connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+    return values
@@ -0,0 +1,234 @@
+"""
+Read/write session routing
+
+Writes always go through db.session on the primary engine. Read-only
+service paths (analytics, listings) use `read_session` instead, which
+resolves to a session on the replica engine when one is configured and
+falls back to the primary when:
+
+- the current app context has already committed a write (read-your-writes)
+- an API write committed less than REPLICA_READ_AFTER_WRITE_SECONDS ago
+- the replica is behind the primary by more than REPLICA_MAX_LAG_SECONDS
+- the replica cannot be reached
+
+Tracking ingest commits through `commit_ingest()` so the constant stream of
+pixel writes does not pin every analytics read to the primary.
+"""
+
+import threading
+import time
+
+from flask import current_app, g
+from flask.globals import app_ctx
+from sqlalchemy import create_engine, event, func, make_url, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import apply_sqlite_pragmas
+from app.exceptions import DatabaseError
+
+
+def _app_ctx_id():
+    """Scope replica sessions to the Flask application context, like db.session"""
+    return id(app_ctx._get_current_object())
+
+
+class ReadOnlySession(Session):
+    """Session for the replica engine - refuses to flush changes"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        event.listen(self, 'before_flush', self._reject_flush)
+
+    @staticmethod
+    def _reject_flush(session, flush_context, instances):
+        raise DatabaseError("Replica session is read-only")
+
+
+class _RouterState:
+    """Per-application routing state"""
+
+    def __init__(self, replica_engine=None):
+        self.replica_engine = replica_engine
+        self.replica_session = None
+        self.last_write_at = None
+        self.replica_lagging = False
+        self.last_lag_check = None
+        self.lock = threading.Lock()
+
+
+class SessionRouter:
+    """Chooses the primary or replica session for read-only queries"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the replica engine (if configured) and register routing hooks"""
+        app.config.setdefault('SQLALCHEMY_REPLICA_URI', None)
+        app.config.setdefault('REPLICA_MAX_LAG_SECONDS', 30)
+        app.config.setdefault('REPLICA_LAG_CHECK_INTERVAL', 5)
+        app.config.setdefault('REPLICA_READ_AFTER_WRITE_SECONDS', 5)
+
+        replica_engine = None
+        replica_uri = app.config['SQLALCHEMY_REPLICA_URI']
+        if replica_uri:
+            replica_engine = self._create_replica_engine(
+                replica_uri,
+                app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {},
+                app.config.get('SQLITE_PRAGMAS')
+            )
+
+        app.extensions['session_router'] = _RouterState(replica_engine)
+
+        @app.teardown_appcontext
+        def remove_replica_session(exc):
+            state = app.extensions['session_router']
+            if state.replica_session is not None:
+                state.replica_session.remove()
+
+    @staticmethod
+    def _create_replica_engine(uri, engine_options, sqlite_pragmas):
+        url = make_url(uri)
+        options = dict(engine_options)
+
+        if url.get_backend_name() == 'sqlite':
+            # Pool settings only apply to server databases
+            for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+                options.pop(key, None)
+            if url.database in (None, '', ':memory:'):
+                options['poolclass'] = StaticPool
+                options['connect_args'] = {'check_same_thread': False}
+
+        engine = create_engine(url, **options)
+        apply_sqlite_pragmas(engine, sqlite_pragmas)
+        return engine
+
+    @property
+    def replica_engine(self):
+        """Replica engine for the current app (None when no replica is configured)"""
+        return current_app.extensions['session_router'].replica_engine
+
+    def register_write_listener(self, session):
+        """Track commits on the primary session (db.session) for read-your-writes"""
+        event.listen(session, 'after_commit', self._after_commit)
+
+    def _after_commit(self, session):
+        if not app_ctx:
+            return
+
+        g._read_from_primary = True
+
+        if not session.info.get('ingest_commit'):
+            current_app.extensions['session_router'].last_write_at = time.monotonic()
+
+    def commit_ingest(self, session):
+        """
+        Commit a tracking write without pinning later requests to the primary
+
+        Tracking events are never read back by the client that wrote them, so
+        they only need read-your-writes inside the current app context.
+        """
+        session.info['ingest_commit'] = True
+        try:
+            session.commit()
+        finally:
+            session.info.pop('ingest_commit', None)
+
+    def read_session(self):
+        """
+        Session to use for a read-only query
+
+        Returns:
+            Session: Replica session, or db.session when reads must hit the primary
+        """
+        from app import db
+
+        state = current_app.extensions['session_router']
+        if state.replica_engine is None or self._must_read_primary():
+            return db.session
+
+        if state.replica_session is None:
+            with state.lock:
+                if state.replica_session is None:
+                    state.replica_session = scoped_session(
+                        sessionmaker(bind=state.replica_engine, class_=ReadOnlySession, autoflush=False),
+                        scopefunc=_app_ctx_id
+                    )
+
+        return state.replica_session
+
+    def _must_read_primary(self):
+        if g.get('_read_from_primary'):
+            return True
+
+        state = current_app.extensions['session_router']
+        config = current_app.config
+
+        if state.last_write_at is not None:
+            if time.monotonic() - state.last_write_at < config['REPLICA_READ_AFTER_WRITE_SECONDS']:
+                return True
+
+        return self._replica_lagging(state, config)
+
+    def _replica_lagging(self, state, config):
+        """Compare the newest tracking event on both engines, at most once per check interval"""
+        now = time.monotonic()
+        if state.last_lag_check is not None and now - state.last_lag_check < config['REPLICA_LAG_CHECK_INTERVAL']:
+            return state.replica_lagging
+
+        if not state.lock.acquire(blocking=False):
+            # Another thread is measuring - use the last known answer
+            return state.replica_lagging
+
+        try:
+            state.replica_lagging = self.replica_lag() > config['REPLICA_MAX_LAG_SECONDS']
+            state.last_lag_check = now
+        finally:
+            state.lock.release()
+
+        return state.replica_lagging
+
+    def replica_lag(self):
+        """
+        Estimate how far the replica is behind the primary
+
+        Returns:
+            float: Seconds between the newest tracking event on the primary and on
+                   the replica (infinity if the replica is unreachable or empty)
+        """
+        from app import db
+        from app.models import TrackingEvent
+
+        query = select(func.max(TrackingEvent.created_at))
+
+        try:
+            with db.engines[None].connect() as connection:
+                primary_newest = connection.execute(query).scalar()
+            with self.replica_engine.connect() as connection:
+                replica_newest = connection.execute(query).scalar()
+        except SQLAlchemyError:
+            return float('inf')
+
+        if primary_newest is None:
+            return 0.0
+        if replica_newest is None:
+            return float('inf')
+
+        return max((primary_newest - replica_newest).total_seconds(), 0.0)
+
+
+class _ReadSessionProxy:
+    """Stand-in for a session that resolves to the routed read session on every use"""
+
+    def __init__(self, router):
+        self._router = router
+
+    def __getattr__(self, name):
+        return getattr(self._router.read_session(), name)
+
+
+session_router = SessionRouter()
+read_session = _ReadSessionProxy(session_router)
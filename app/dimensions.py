@@ -0,0 +1,299 @@
+"""
+Compact encoding of repetitive tracking event attributes
+
+tracking_events stores no strings for its most repetitive attributes:
+
+    event_type   -> event_type_id   small int code  (event_types)
+    device_type  -> device_type_id  small int code  (device_types)
+    user_agent   -> user_agent_id   64-bit hash     (user_agents)
+    ip_address   -> ip_address_id   64-bit hash     (ip_addresses)
+
+Built-in event and device types have fixed codes, seeded into their tables
+when they are created; other event types get the next code on first use.
+User agents and IPs are keyed by a hash of the value, so the key is known
+without a lookup and identical values from any worker land on the same row.
+
+TrackingEvent keeps event_type/device_type/user_agent/ip_address as hybrid
+attributes: constructors and setters take strings, reads return strings and
+queries compare against the key column (`event_type == 'open'` becomes
+`event_type_id = 1`, no join). Selecting or grouping by the attribute decodes
+through a scalar subquery on the dimension table.
+
+Insert paths intern values through a per-application dictionary cache, so a
+known value costs no extra statement. Values a transaction adds only enter
+the cache once it commits - a rolled back dimension row is never assumed to
+exist. User agents and IPs come from whoever loads the pixel, so each
+dimension's cache keeps only the DIMENSION_CACHE_SIZE most recently used
+values; an evicted value costs one statement the next time it is seen.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import event, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.hybrid import Comparator, hybrid_property
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.sql import operators
+
+from app.exceptions import ValidationError
+
+EVENT_TYPES = ('open', 'click', 'bounce', 'unsubscribe')
+DEVICE_TYPES = ('desktop', 'mobile', 'tablet', 'unknown')
+
+_PENDING = 'event_dimensions_pending'
+
+
+def value_hash(value):
+    """Signed 64-bit key of a user agent or IP address"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+class Dimension:
+    """One encoded TrackingEvent attribute and its dimension table"""
+
+    def __init__(self, name, table_name, hashed=False, builtins=()):
+        """
+        Args:
+            name: TrackingEvent attribute (the key column is `<name>_id`)
+            table_name: Dimension table with `id` and `value` columns
+            hashed: Keys are value_hash(value) instead of assigned codes
+            builtins: Values with fixed codes 1, 2, ... (code dimensions only)
+        """
+        self.name = name
+        self.column = name + '_id'
+        self.table_name = table_name
+        self.hashed = hashed
+        self.builtins = {value: code for code, value in enumerate(builtins, 1)}
+
+    @property
+    def table(self):
+        from app import db
+        return db.metadata.tables[self.table_name]
+
+    def static_key(self, value):
+        """Key known without the database (hashes and built-in codes), else None"""
+        if value is None:
+            return None
+        if self.hashed:
+            return value_hash(value)
+        return self.builtins.get(value)
+
+    def lookup(self, values):
+        """Subquery selecting the keys of values (for ones without a static key)"""
+        table = self.table
+        return select(table.c.id).where(table.c.value.in_(values))
+
+
+EVENT_TYPE = Dimension('event_type', 'event_types', builtins=EVENT_TYPES)
+DEVICE_TYPE = Dimension('device_type', 'device_types', builtins=DEVICE_TYPES)
+USER_AGENT = Dimension('user_agent', 'user_agents', hashed=True)
+IP_ADDRESS = Dimension('ip_address', 'ip_addresses', hashed=True)
+DIMENSIONS = (EVENT_TYPE, DEVICE_TYPE, USER_AGENT, IP_ADDRESS)
+
+
+def insert_ignore(connection, table, rows):
+    """INSERT rows, skipping ones whose key or value already exists"""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        statement = sqlite.insert(table).on_conflict_do_nothing()
+    elif dialect == 'postgresql':
+        statement = postgresql.insert(table).on_conflict_do_nothing()
+    else:
+        statement = insert(table).prefix_with('IGNORE') if dialect in ('mysql', 'mariadb') else insert(table)
+    connection.execute(statement, rows)
+
+
+class _Cache:
+    """Least recently used value <-> key mappings of one dimension that are known to be committed"""
+
+    def __init__(self, dimension, size):
+        self.size = size
+        self._keys = OrderedDict(dimension.builtins)  # value -> key, least recently used first
+        self._values = {key: value for value, key in self._keys.items()}
+        self._lock = threading.Lock()
+
+    def key(self, value):
+        with self._lock:
+            key = self._keys.get(value)
+            if key is not None:
+                self._keys.move_to_end(value)
+            return key
+
+    def value(self, key):
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self._keys.move_to_end(value)
+            return value
+
+    def add(self, value, key):
+        with self._lock:
+            self._keys[value] = key
+            self._keys.move_to_end(value)
+            self._values[key] = value
+            while len(self._keys) > self.size:
+                evicted, evicted_key = self._keys.popitem(last=False)
+                del self._values[evicted_key]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class EventDimensions:
+    """Interns and decodes encoded TrackingEvent attributes (see module docstring)"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DIMENSION_CACHE_SIZE', 100000)
+
+        if app.config['DIMENSION_CACHE_SIZE'] < 1:
+            raise ValidationError("Dimension cache needs room for at least one value", field='DIMENSION_CACHE_SIZE')
+
+        app.extensions['event_dimensions'] = {
+            dimension.name: _Cache(dimension, app.config['DIMENSION_CACHE_SIZE']) for dimension in DIMENSIONS}
+
+    def _cache(self, dimension):
+        return current_app.extensions['event_dimensions'][dimension.name]
+
+    def reset(self):
+        """Forget everything but the built-in codes (after the tables were dropped)"""
+        self.init_app(current_app)
+
+    def intern(self, session, tracking_event):
+        """
+        Set the key columns of a new TrackingEvent, adding unseen values to the dimension tables
+
+        Args:
+            session: Session the event will be written through
+            tracking_event: TrackingEvent whose string attributes were set
+        """
+        for dimension in DIMENSIONS:
+            value = tracking_event.__dict__.get(_stash(dimension))
+            if value is not None:
+                setattr(tracking_event, dimension.column, self.key(session, dimension, value))
+
+    def key(self, session, dimension, value):
+        """Key of a value, inserting it into the dimension table unless it is known"""
+        cache = self._cache(dimension)
+        key = cache.key(value)
+        if key is not None:
+            return key
+
+        pending = session.info.setdefault(_PENDING, {})
+        if (dimension.name, value) in pending:
+            return pending[dimension.name, value][1]
+
+        connection = session.connection()
+        table = dimension.table
+        if dimension.hashed:
+            key = value_hash(value)
+            insert_ignore(connection, table, [{'id': key, 'value': value}])
+        else:
+            key = connection.execute(select(table.c.id).where(table.c.value == value)).scalar()
+            if key is None:
+                insert_ignore(connection, table, [{'value': value}])
+                key = connection.execute(select(table.c.id).where(table.c.value == value)).scalar()
+
+        pending[dimension.name, value] = (cache, key)
+        return key
+
+    def decode(self, session, dimension, key):
+        """Value of a key, loaded through `session` on a cache miss"""
+        if key is None:
+            return None
+        cache = self._cache(dimension)
+        value = cache.value(key)
+        if value is None and session is not None:
+            table = dimension.table
+            value = session.execute(select(table.c.value).where(table.c.id == key)).scalar()
+            if value is not None:
+                cache.add(value, key)
+        return value
+
+
+event_dimensions = EventDimensions()
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_pending(session):
+    for (_, value), (cache, key) in session.info.pop(_PENDING, {}).items():
+        cache.add(value, key)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING, None)
+
+
+@event.listens_for(Session, 'before_flush')
+def _intern_new_events(session, flush_context, instances):
+    from app.models import TrackingEvent
+
+    for obj in session.new:
+        if isinstance(obj, TrackingEvent):
+            event_dimensions.intern(session, obj)
+
+
+# TrackingEvent attributes
+
+def _stash(dimension):
+    return '_' + dimension.name + '_value'
+
+
+class _DimensionComparator(Comparator):
+    """Compares against the key column; anything else works on the decoded value"""
+
+    def __init__(self, dimension, key_column):
+        table = dimension.table
+        super().__init__(select(table.c.value).where(table.c.id == key_column).scalar_subquery().label(dimension.name))
+        self.dimension = dimension
+        self.key_column = key_column
+
+    def operate(self, op, *other, **kwargs):
+        if op in (operators.is_, operators.is_not) or (op in (operators.eq, operators.ne) and other[0] is None):
+            return op(self.key_column, *other, **kwargs)
+        if op in (operators.eq, operators.ne) and isinstance(other[0], str):
+            key = self.dimension.static_key(other[0])
+            if key is not None:
+                return op(self.key_column, key)
+            other = ([other[0]],)
+            op = operators.in_op if op is operators.eq else operators.not_in_op
+        if op in (operators.in_op, operators.not_in_op) and all(isinstance(v, str) for v in other[0]):
+            values = list(other[0])
+            keys = [self.dimension.static_key(value) for value in values]
+            return op(self.key_column, self.dimension.lookup(values) if None in keys else keys)
+        return op(self.expression, *other, **kwargs)
+
+
+def dimension_attribute(dimension):
+    """
+    Hybrid string attribute over a TrackingEvent key column
+
+    Args:
+        dimension: Dimension the attribute encodes
+    """
+    stash = _stash(dimension)
+
+    def fget(self):
+        if stash in self.__dict__:
+            return self.__dict__[stash]
+        return event_dimensions.decode(object_session(self), dimension, getattr(self, dimension.column))
+
+    def fset(self, value):
+        # The value is kept until the event is interned; custom event types get their key then
+        self.__dict__[stash] = value
+        setattr(self, dimension.column, dimension.static_key(value))
+
+    def comparator(cls):
+        return _DimensionComparator(dimension, getattr(cls, dimension.column))
+
+    attribute = hybrid_property(fget, fset)
+    attribute = attribute.comparator(comparator)
+    attribute.__doc__ = f"{dimension.name} as a string (stored as {dimension.column})"
+    return attribute
@@ -0,0 +1,480 @@
+"""
+Asyncio campaign dispatcher
+
+`flask mail send` (app.mailer) sends with one thread per SMTP connection,
+which is fine for a few connections but not for the hundreds a large
+campaign wants open at once. `flask mail dispatch CAMPAIGN_ID`
+(DispatchService.dispatch) runs the campaign on one event loop instead:
+
+- recipients are streamed from the campaign's queued and deferred emails by
+  keyset, MAIL_SEND_BATCH_SIZE rows at a time, and at most
+  DISPATCH_BUFFER_SIZE of them are held in memory - the reader waits for
+  sends to drain the buffer, so memory stays flat however large the campaign.
+  Rows of the same campaign share one copy of their body, and the MIME
+  message is only built when its send starts
+- up to DISPATCH_CONNECTIONS SMTP sessions run at once, persistent and
+  pipelined like the thread pool's (see AsyncSmtpPool)
+- each recipient domain gets at most DISPATCH_DOMAIN_CONCURRENCY sends in
+  flight, and at most DISPATCH_DOMAIN_RATE sends per DISPATCH_RATE_WINDOW
+  seconds. Recipients waiting on their domain are parked in the buffer while
+  other domains go ahead, so one slow provider doesn't hold up the rest
+- outcomes are checkpointed to the emails table every MAIL_SEND_BATCH_SIZE
+  outcomes or DISPATCH_CHECKPOINT_SECONDS, whichever comes first, and on
+  every pause or stop. An email leaves queued/deferred only through its
+  checkpoint, so a restarted dispatch picks up where the last one left off
+- Campaign.status is polled every DISPATCH_STATUS_SECONDS: 'paused' stops new
+  sends (in-flight ones finish and are checkpointed, idle connections are
+  closed) until it is set back to 'active'; any other status ends the run.
+  A run that leaves nothing queued or deferred marks the campaign 'completed'
+
+Limits are per recipient domain: grouping domains by MX host would need a DNS
+resolver, and when MAIL_SERVER is a relay it is the relay that talks to the
+MX hosts anyway.
+"""
+
+import asyncio
+import base64
+import smtplib
+import socket
+import ssl
+from collections import deque
+
+from app.mailer import build_message, dot_stuff, error_outcome, recipient_domain, reply_outcome
+
+ACTIVE = 'active'
+PAUSED = 'paused'
+COMPLETED = 'completed'
+
+
+class AsyncSmtpConnection:
+    """One SMTP session on asyncio streams, sending with PIPELINING when the server offers it"""
+
+    def __init__(self, reader, writer, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.extensions = set()
+        self.sent = 0
+        self.transmitted = False  # whether the current message's data went out
+
+    @classmethod
+    async def open(cls, host, port, use_tls=False, username=None, password=None, timeout=30.0):
+        """
+        Connect, EHLO, and STARTTLS / AUTH PLAIN when configured
+
+        Raises:
+            smtplib.SMTPException, OSError: If the server can't be reached or refuses the session
+        """
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        connection = cls(reader, writer, timeout)
+        try:
+            code, text = await connection.reply()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, text)
+            await connection.ehlo()
+            if use_tls:
+                code, text = await connection.command('STARTTLS')
+                if code != 220:
+                    raise smtplib.SMTPNotSupportedError(f"STARTTLS refused: {code} {text!r}")
+                await writer.start_tls(ssl.create_default_context(), server_hostname=host)
+                await connection.ehlo()
+            if username:
+                token = base64.b64encode(f'\0{username}\0{password or ""}'.encode()).decode()
+                code, text = await connection.command(f'AUTH PLAIN {token}')
+                if code != 235:
+                    raise smtplib.SMTPAuthenticationError(code, text)
+        except BaseException:
+            writer.close()
+            raise
+        return connection
+
+    async def ehlo(self):
+        code, text = await self.command(f'EHLO {socket.getfqdn()}')
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, text)
+        self.extensions = {line.split(b' ', 1)[0].decode('ascii', 'replace').lower()
+                           for line in text.split(b'\n')[1:]}
+
+    async def command(self, line):
+        """Send one command line and read its reply"""
+        self.writer.write(line.encode() + b'\r\n')
+        return await self.reply()
+
+    async def reply(self):
+        """
+        Read one (possibly multi-line) reply
+
+        Returns:
+            tuple: (code, text) like smtplib's, lines joined by newlines
+
+        Raises:
+            smtplib.SMTPServerDisconnected: If the server closed the connection
+            TimeoutError: If no reply came within the timeout
+        """
+        lines = []
+        async with asyncio.timeout(self.timeout):
+            while True:
+                line = await self.reader.readline()
+                if not line.endswith(b'\n'):
+                    raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+                lines.append(line[4:].rstrip(b'\r\n'))
+                if line[3:4] != b'-':
+                    try:
+                        return int(line[:3]), b'\n'.join(lines)
+                    except ValueError:
+                        raise smtplib.SMTPResponseException(-1, line)
+
+    async def send(self, sender, recipient, data):
+        """
+        Send one message
+
+        Returns:
+            tuple: (code, text) of the reply that decided the outcome
+
+        Raises:
+            smtplib.SMTPException, OSError: If the connection fails
+        """
+        self.transmitted = False
+        self.sent += 1
+        mail_from = f'MAIL FROM:{smtplib.quoteaddr(sender)}'
+        rcpt_to = f'RCPT TO:{smtplib.quoteaddr(recipient)}'
+        if 'pipelining' in self.extensions:
+            self.writer.write(f'{mail_from}\r\n{rcpt_to}\r\nDATA\r\n'.encode())
+            mail, rcpt, start = await self.reply(), await self.reply(), await self.reply()
+            if mail[0] != 250 or rcpt[0] not in (250, 251):
+                if start[0] == 354:
+                    # DATA was accepted anyway: end it without a message before resetting
+                    await self.command('.')
+                await self.command('RSET')
+                return mail if mail[0] != 250 else rcpt
+        else:
+            start = await self.command(mail_from)
+            if start[0] == 250:
+                start = await self.command(rcpt_to)
+                if start[0] in (250, 251):
+                    start = await self.command('DATA')
+        if start[0] != 354:
+            await self.command('RSET')
+            return start
+
+        self.transmitted = True
+        self.writer.write(dot_stuff(data))
+        return await self.reply()
+
+    async def close(self):
+        """QUIT, or just drop the connection if that fails"""
+        try:
+            await self.command('QUIT')
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.abort()
+
+    def abort(self):
+        self.writer.close()
+
+
+class AsyncSmtpPool:
+    """
+    Persistent SMTP sessions for the dispatcher
+
+    Unlike SmtpPool it doesn't bound the sessions itself: the dispatcher
+    never has more than DISPATCH_CONNECTIONS sends in flight.
+    """
+
+    def __init__(self, host, port, use_tls=False, username=None, password=None, timeout=30.0, max_messages=100):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self._idle = []
+        self.opened = 0
+
+    async def send(self, sender, recipient, data):
+        """
+        Send one message over an idle session (or a new one)
+
+        A reused session that turns out to be closed before the message went
+        out is replaced once.
+
+        Returns:
+            tuple: (code, text) of the deciding reply
+
+        Raises:
+            smtplib.SMTPException, OSError: If the connection fails; check
+                transmitted(error) for whether the message may have gone out
+        """
+        reused = bool(self._idle)
+        connection = self._idle.pop() if reused else await self._open()
+        try:
+            try:
+                reply = await connection.send(sender, recipient, data)
+            except (smtplib.SMTPException, OSError):
+                if not reused or connection.transmitted:
+                    raise
+                connection.abort()
+                connection = await self._open()
+                reply = await connection.send(sender, recipient, data)
+        except (smtplib.SMTPException, OSError) as e:
+            e.transmitted = connection.transmitted
+            connection.abort()
+            raise
+        except BaseException:
+            connection.abort()
+            raise
+
+        if connection.sent >= self.max_messages:
+            await connection.close()
+        else:
+            self._idle.append(connection)
+        return reply
+
+    async def _open(self):
+        connection = await AsyncSmtpConnection.open(self.host, self.port, use_tls=self.use_tls,
+                                                    username=self.username, password=self.password,
+                                                    timeout=self.timeout)
+        self.opened += 1
+        return connection
+
+    async def close(self):
+        """QUIT every idle session"""
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(connection.close() for connection in idle))
+
+
+class DomainLimits:
+    """
+    Sends in flight and in the current rate window, per recipient domain
+
+    A domain's state goes away once it has nothing in flight and nothing in
+    its window (see prune), so campaigns with millions of domains don't
+    accumulate it.
+    """
+
+    def __init__(self, concurrency, rate=0, window=60.0):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.window = window
+        self._active = {}   # domain -> sends in flight
+        self._started = {}  # domain -> deque of its send start times within the window (rate > 0 only)
+
+    def wait(self, domain, now):
+        """
+        How long until a send to the domain may start
+
+        Returns:
+            float: 0 when it may start now, the seconds until the rate window
+                lets it, or None while the domain is at its concurrency limit
+        """
+        if self._active.get(domain, 0) >= self.concurrency:
+            return None
+        started = self._started.get(domain)
+        if not started:
+            return 0
+        while started and started[0] <= now - self.window:
+            started.popleft()
+        if len(started) < self.rate:
+            return 0
+        return started[0] + self.window - now
+
+    def acquire(self, domain, now):
+        self._active[domain] = self._active.get(domain, 0) + 1
+        if self.rate:
+            self._started.setdefault(domain, deque()).append(now)
+
+    def release(self, domain, now):
+        active = self._active.pop(domain) - 1
+        if active:
+            self._active[domain] = active
+
+    def prune(self, now):
+        """Forget domains whose rate window has emptied"""
+        for domain in [domain for domain, started in self._started.items()
+                       if started[-1] <= now - self.window and domain not in self._active]:
+            del self._started[domain]
+
+    def __len__(self):
+        return len(self._active.keys() | self._started.keys())
+
+
+class Dispatcher:
+    """
+    Sends one campaign's recipients through an AsyncSmtpPool (see module docstring)
+
+    The database side is passed in, so the loop itself never touches a
+    session:
+
+        fetch(after_id, limit): next recipients by id (rows with id,
+            tracking_id, recipient_email, sender_email, subject and body)
+        record(outcomes): checkpoint a list of outcome dicts
+        status(): the campaign's current status
+
+    They are called on the loop's thread, between sends - each is one short
+    query or bulk update.
+    """
+
+    def __init__(self, pool, fetch, record, status, connections=50, domain_concurrency=5, domain_rate=0,
+                 rate_window=60.0, buffer_size=2000, batch_size=500, checkpoint_seconds=1.0, status_seconds=2.0,
+                 tracking_base_url=None, limit=None):
+        self.pool = pool
+        self.fetch = fetch
+        self.record = record
+        self.status = status
+        self.connections = connections
+        self.limits = DomainLimits(domain_concurrency, domain_rate, rate_window)
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.checkpoint_seconds = checkpoint_seconds
+        self.status_seconds = status_seconds
+        self.tracking_base_url = tracking_base_url
+        self.limit = limit
+        self.result = {'sent': 0, 'deferred': 0, 'failed': 0}
+        self.last_status = None
+        self.peak_buffered = 0
+        self._waiting = {}      # domain -> deque of its buffered recipients, in id order
+        self._ready = deque()   # domains with buffered recipients, in turn order
+        self._buffered = 0
+        self._sending = set()
+        self._outcomes = []
+        self._outcomes_since = None
+        self._wake = None
+
+    async def run(self):
+        """
+        Dispatch until the campaign is sent, or its status leaves active/paused
+
+        Cancelling the run (Ctrl-C) lets in-flight sends finish and
+        checkpoints them before it ends.
+
+        Returns:
+            dict: sent, deferred and failed counts of this run
+        """
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        last_id, read, exhausted, paused = 0, 0, False, False
+        next_status = loop.time()
+        try:
+            while True:
+                self._wake.clear()
+                now = loop.time()
+                if now >= next_status:
+                    self.last_status = self.status()
+                    next_status = now + self.status_seconds
+                    if self.last_status not in (ACTIVE, PAUSED):
+                        break
+                    if self.last_status == PAUSED and not paused:
+                        await self._drain()
+                        await self.pool.close()
+                        now = loop.time()
+                    paused = self.last_status == PAUSED
+                timeout = next_status - now
+
+                if not paused:
+                    while not exhausted:
+                        room = self.buffer_size - self._buffered
+                        want = min(self.batch_size, room if self.limit is None else min(room, self.limit - read))
+                        # Refill in whole batches, not a few rows per finished send
+                        if not want or (self._buffered and want < min(self.batch_size, self.buffer_size // 2)):
+                            break
+                        rows = self.fetch(last_id, want)
+                        read += len(rows)
+                        exhausted = len(rows) < want or read == self.limit
+                        if rows:
+                            last_id = rows[-1].id
+                            self._buffer(rows)
+                    delay = self._start_sends(now)
+                    if delay is not None:
+                        timeout = min(timeout, delay)
+
+                if self._outcomes:
+                    due = self._outcomes_since + self.checkpoint_seconds
+                    if len(self._outcomes) >= self.batch_size or now >= due:
+                        self._checkpoint()
+                        self.limits.prune(now)
+                    else:
+                        timeout = min(timeout, due - now)
+                if exhausted and not self._buffered and not self._sending:
+                    break
+                try:
+                    async with asyncio.timeout(max(timeout, 0)):
+                        await self._wake.wait()
+                except TimeoutError:
+                    pass
+        finally:
+            await self._drain()
+            await self.pool.close()
+        return self.result
+
+    def _buffer(self, rows):
+        for row in rows:
+            domain = recipient_domain(row.recipient_email)
+            waiting = self._waiting.get(domain)
+            if waiting is None:
+                waiting = self._waiting[domain] = deque()
+                self._ready.append(domain)
+            waiting.append(row)
+        self._buffered += len(rows)
+        self.peak_buffered = max(self.peak_buffered, self._buffered)
+
+    def _start_sends(self, now):
+        """
+        Start sends, a domain at a time in turn, while connections are free
+
+        Returns:
+            float: Seconds until a rate-limited domain may send again (None if none is)
+        """
+        delay = None
+        started = True
+        while started and self._ready and len(self._sending) < self.connections:
+            started = False
+            for _ in range(len(self._ready)):
+                if len(self._sending) >= self.connections:
+                    break
+                domain = self._ready[0]
+                wait = self.limits.wait(domain, now)
+                if wait == 0:
+                    waiting = self._waiting[domain]
+                    self.limits.acquire(domain, now)
+                    task = asyncio.ensure_future(self._send(domain, waiting.popleft()))
+                    self._sending.add(task)
+                    self._buffered -= 1
+                    started = True
+                    if not waiting:
+                        del self._waiting[domain]
+                        self._ready.popleft()
+                        continue
+                elif wait is not None:
+                    delay = wait if delay is None else min(delay, wait)
+                self._ready.rotate(-1)
+        return delay
+
+    async def _send(self, domain, email):
+        try:
+            data = build_message(email, self.tracking_base_url)
+            code, text = await self.pool.send(email.sender_email, email.recipient_email, data)
+        except (ValueError, smtplib.SMTPException, OSError) as e:
+            outcome = error_outcome(email, e)
+        else:
+            outcome = reply_outcome(email, code, text)
+        finally:
+            self.limits.release(domain, asyncio.get_running_loop().time())
+            # Leave the set before waking the loop, so it sees this send as finished
+            self._sending.discard(asyncio.current_task())
+            self._wake.set()
+        if not self._outcomes:
+            self._outcomes_since = asyncio.get_running_loop().time()
+        self._outcomes.append(outcome)
+        self.result[outcome['delivery_status']] += 1
+
+    async def _drain(self):
+        """Wait for the sends in flight, then checkpoint"""
+        if self._sending:
+            await asyncio.wait(set(self._sending))
+        self._checkpoint()
+
+    def _checkpoint(self):
+        if self._outcomes:
+            self.record(self._outcomes)
+            self._outcomes = []
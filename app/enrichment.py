@@ -0,0 +1,194 @@
+"""
+Background enrichment of tracking events
+
+Ingest only has to store raw facts - email, event type, IP, user agent,
+timestamp. Everything derived from them is filled in by a staged pipeline
+(EnrichmentService.run), run by `flask enrichment run` from cron or with
+--follow as a worker:
+
+1. user agents   every user_agents row not yet enriched gets a device type,
+                 browser, OS and bot flag (app.utils.user_agent)
+2. IP addresses  with GEOIP_DATABASE set, every ip_addresses row not yet
+                 enriched gets a "City, Country" location (needs geoip2)
+3. events        events above the high-water mark get device_type_id from
+                 their user agent and, where the caller gave none, location
+                 from their IP - one batch per transaction, which also moves
+                 the mark (enrichment_state)
+
+Stages 1 and 2 classify each distinct value once, however many events carry
+it. Every column is derived from raw facts only, so re-running a stage over
+the same rows is idempotent; after a classifier change, `flask enrichment
+rerun` re-classifies every dimension row and re-applies them to history.
+
+TRACKING_ENRICHMENT selects what ingest still does itself: 'inline' (the
+default) derives the device type before inserting, as before; 'background'
+leaves it to stage 3, so a pixel hit skips the user agent parser. The bot
+regex still runs at ingest (app.machine_events) unless MACHINE_EVENTS is
+'off'.
+
+The high-water mark assumes event ids become visible in increasing order,
+which holds for SQLite (one writer at a time). With concurrent writers on a
+server database an id can commit below the mark; `rerun --since` covers it.
+"""
+
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.exceptions import DatabaseError, ValidationError
+from app.utils import parse_user_agent
+
+try:
+    import geoip2.database
+    import geoip2.errors
+except ImportError:  # pragma: no cover - exercised only with geoip2 installed
+    geoip2 = None
+
+MODES = ('inline', 'background')
+
+# EnrichmentState row of the event pipeline
+PIPELINE = 'events'
+
+
+class EventEnrichment:
+    """Ingest-time enrichment switch and the lookups shared by the pipeline stages"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRACKING_ENRICHMENT', 'inline')
+        app.config.setdefault('ENRICHMENT_BATCH_SIZE', 1000)
+        app.config.setdefault('GEOIP_DATABASE', None)
+
+        mode = app.config['TRACKING_ENRICHMENT']
+        if mode not in MODES:
+            raise ValidationError(f"Unknown enrichment mode: {mode} (expected one of {', '.join(MODES)})",
+                                  field='TRACKING_ENRICHMENT')
+        if app.config['GEOIP_DATABASE'] and geoip2 is None:
+            raise ValidationError("GEOIP_DATABASE needs geoip2 (pip install geoip2)", field='GEOIP_DATABASE')
+
+        app.extensions['event_enrichment'] = {'geoip': None}
+
+    @property
+    def background(self):
+        """Whether ingest leaves derived columns to the pipeline"""
+        return current_app.config['TRACKING_ENRICHMENT'] == 'background'
+
+    def device_type(self, user_agent):
+        """
+        Device type to store at ingest
+
+        Returns:
+            str: Parsed device type in inline mode, None in background mode
+                 or without a user agent
+        """
+        if not user_agent or self.background:
+            return None
+        return parse_user_agent(user_agent)['device_type']
+
+    @property
+    def geo_enabled(self):
+        """Whether IP addresses are geolocated (GEOIP_DATABASE is set)"""
+        return bool(current_app.config['GEOIP_DATABASE'])
+
+    def locate(self, ip_address):
+        """
+        "City, Country" of an IP address from the GeoIP database
+
+        Returns:
+            str: Location, or None if the address is not in the database
+        """
+        state = current_app.extensions['event_enrichment']
+        with self._lock:
+            if state['geoip'] is None:
+                state['geoip'] = geoip2.database.Reader(current_app.config['GEOIP_DATABASE'])
+        try:
+            response = state['geoip'].city(ip_address)
+        except (geoip2.errors.AddressNotFoundError, ValueError):
+            return None
+        parts = [response.city.name, response.country.name]
+        return ', '.join(part for part in parts if part) or None
+
+
+event_enrichment = EventEnrichment()
+
+
+def bump_generation(connection):
+    """
+    Mark every in-process copy of event rows stale (app.columnar reloads on a new generation)
+
+    Call it in the transaction that deletes stored events or rewrites them
+    wholesale, so the change and the bump commit together.
+
+    Args:
+        connection: Session or Connection of that transaction
+    """
+    from sqlalchemy import insert, update
+    from app.models import EnrichmentState
+
+    bumped = connection.execute(update(EnrichmentState).where(EnrichmentState.name == PIPELINE).values(
+        generation=EnrichmentState.generation + 1))
+    if not bumped.rowcount:
+        connection.execute(insert(EnrichmentState).values(name=PIPELINE, high_water_mark=0, generation=1))
+
+
+enrichment_cli = AppGroup('enrichment', help='Fill in derived tracking event columns in the background')
+
+
+@enrichment_cli.command('run')
+@click.option('--batch-size', default=None, type=int, help='Events per transaction (defaults to ENRICHMENT_BATCH_SIZE)')
+@click.option('--max-batches', default=None, type=int, help='Stop after this many event batches')
+@click.option('--follow', is_flag=True, help='Keep running, polling for new events')
+@click.option('--interval', default=5.0, show_default=True, help='Seconds between polls with --follow')
+def run_command(batch_size, max_batches, follow, interval):
+    """Enrich new user agents, IPs and every event above the high-water mark"""
+    from app import db
+    from app.services.enrichment_service import EnrichmentService
+
+    while True:
+        try:
+            result = EnrichmentService().run(batch_size=batch_size, max_batches=max_batches)
+        except (ValidationError, DatabaseError) as e:
+            raise click.ClickException(str(e))
+        db.session.remove()
+
+        if result['events'] or not follow:
+            click.echo(f"Enriched {result['user_agents']} user agents, {result['ip_addresses']} IPs and "
+                       f"{result['events']} events (high-water mark {result['high_water_mark']})")
+        if not follow:
+            return
+        time.sleep(interval)
+
+
+@enrichment_cli.command('rerun')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Only re-apply to events created on or after this date (defaults to all)')
+@click.option('--batch-size', default=None, type=int, help='Events per transaction (defaults to ENRICHMENT_BATCH_SIZE)')
+def rerun_command(since, batch_size):
+    """Re-classify every user agent and IP and re-apply them to enriched events (after classifier changes)"""
+    from app.services.enrichment_service import EnrichmentService
+
+    try:
+        result = EnrichmentService().rerun(since=since, batch_size=batch_size)
+    except (ValidationError, DatabaseError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Re-enriched {result['user_agents']} user agents, {result['ip_addresses']} IPs and "
+               f"{result['events']} events")
+
+
+@enrichment_cli.command('status')
+def status_command():
+    """Show the high-water mark and what is still pending"""
+    from app.services.enrichment_service import EnrichmentService
+
+    status = EnrichmentService().status()
+    click.echo(f"mode {status['mode']}, high-water mark {status['high_water_mark']} "
+               f"(latest event {status['latest_event_id']})")
+    click.echo(f"pending: {status['pending_events']} events, {status['pending_user_agents']} user agents, "
+               f"{status['pending_ip_addresses']} IPs")
@@ -0,0 +1,191 @@
+"""
+In-process fan-out of tracking events to live dashboards
+
+GET /api/analytics/stream sends Server-Sent Events instead of having
+dashboards re-run the overview aggregation every few seconds. Ingest
+publishes each recorded hit here (TrackingService, after the commit); that is
+a no-op while nobody is subscribed.
+
+Hits are not forwarded one by one. They are added to per-scope counts - one
+scope per campaign with subscribers, plus one for all events - and every
+EVENT_STREAM_INTERVAL seconds a ticker thread turns each changed scope into a
+single delta update ({"campaign_id": 1, "events": {"open": 40, "click": 3}})
+queued for that scope's subscribers. A campaign launch therefore costs each
+client one message per interval, however many hits it brings.
+
+Each subscriber has a queue of at most EVENT_STREAM_QUEUE_SIZE updates. A
+client too slow to keep up does not hold up the others: when its queue is
+full, its two oldest updates are folded into one (deltas add up, so no counts
+are lost - the client just gets fewer, larger updates), counted as coalesced
+in event_stream_updates_total. At most EVENT_STREAM_MAX_SUBSCRIBERS streams are
+open per worker.
+
+The hub is per process: under a prefork server each stream sees the hits its
+own worker records. Run dashboards against a single worker (or one stream
+worker per ingest worker) when they need every hit.
+"""
+
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import current_app
+
+from app.exceptions import ServiceUnavailableError, ValidationError
+from app.metrics import event_stream_updates
+
+# Scope of subscribers to every campaign's events
+ALL_EVENTS = None
+
+
+class Subscription:
+    """Bounded queue of delta updates for one stream"""
+
+    def __init__(self, hub, scope):
+        self.hub = hub
+        self.scope = scope
+        self.queue_size = hub.queue_size
+        self._updates = deque()
+        self._ready = threading.Condition()
+
+    def put(self, update):
+        """Queue an update, folding the oldest two together when the queue is full"""
+        with self._ready:
+            self._updates.append(update)
+            if len(self._updates) > self.queue_size:
+                oldest = self._updates.popleft()
+                self._updates[0] = _fold(oldest, self._updates[0])
+                event_stream_updates.inc('coalesced')
+            self._ready.notify()
+
+    def get(self, timeout):
+        """
+        Next update
+
+        Returns:
+            dict: The update, or None if none came within timeout seconds
+        """
+        with self._ready:
+            if not self._updates:
+                self._ready.wait(timeout)
+            return self._updates.popleft() if self._updates else None
+
+    def close(self):
+        """Stop receiving updates (needs no app context)"""
+        hub = self.hub
+        with hub.lock:
+            subscriptions = hub.subscriptions.get(self.scope)
+            if subscriptions is not None:
+                subscriptions.discard(self)
+                if not subscriptions:
+                    del hub.subscriptions[self.scope]
+                    hub.pending.pop(self.scope, None)
+
+
+def _fold(older, newer):
+    """One update standing for two consecutive ones"""
+    events = Counter(older['events'])
+    events.update(newer['events'])
+    return dict(newer, events=dict(events), since=older['since'])
+
+
+class _Hub:
+    """Per-application subscriptions and the counts pending for the next tick"""
+
+    def __init__(self, config):
+        self.interval = config['EVENT_STREAM_INTERVAL']
+        self.queue_size = config['EVENT_STREAM_QUEUE_SIZE']
+        self.max_subscribers = config['EVENT_STREAM_MAX_SUBSCRIBERS']
+        self.lock = threading.Lock()
+        self.subscriptions = {}  # scope -> set of Subscription
+        self.pending = {}  # scope -> Counter of event type -> hits
+        self.since = datetime.utcnow()
+        self.ticker = None
+
+    def tick(self):
+        """Turn the pending counts into one update per changed scope"""
+        now = datetime.utcnow()
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            since, self.since = self.since, now
+            targets = {scope: list(self.subscriptions.get(scope, ())) for scope in pending}
+        for scope, counts in pending.items():
+            update = {'campaign_id': scope, 'events': dict(counts),
+                      'since': since.isoformat(), 'until': now.isoformat()}
+            for subscription in targets[scope]:
+                subscription.put(update)
+                event_stream_updates.inc('queued')
+
+    def run_ticker(self):
+        """Tick every interval while anyone is subscribed"""
+        while True:
+            time.sleep(self.interval)
+            self.tick()
+            with self.lock:
+                if not self.subscriptions:
+                    self.ticker = None
+                    return
+
+
+class EventStream:
+    """Pub/sub of recorded tracking events for SSE streams (see module docstring)"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENT_STREAM_INTERVAL', 1.0)
+        app.config.setdefault('EVENT_STREAM_QUEUE_SIZE', 30)
+        app.config.setdefault('EVENT_STREAM_MAX_SUBSCRIBERS', 1000)
+        app.config.setdefault('EVENT_STREAM_HEARTBEAT', 15)
+
+        if app.config['EVENT_STREAM_INTERVAL'] <= 0:
+            raise ValidationError("Stream interval must be positive", field='EVENT_STREAM_INTERVAL')
+        if app.config['EVENT_STREAM_QUEUE_SIZE'] < 1:
+            raise ValidationError("Stream queues need room for at least one update", field='EVENT_STREAM_QUEUE_SIZE')
+
+        app.extensions['event_stream'] = _Hub(app.config)
+
+    @property
+    def _hub(self):
+        return current_app.extensions['event_stream']
+
+    def publish(self, event, campaign_id):
+        """Count a recorded event towards the next update of its campaign's and the global streams"""
+        hub = self._hub
+        if not hub.subscriptions:
+            return
+        scopes = (ALL_EVENTS,) if campaign_id is None else (ALL_EVENTS, campaign_id)
+        with hub.lock:
+            for scope in scopes:
+                if scope in hub.subscriptions:
+                    hub.pending.setdefault(scope, Counter())[event.event_type] += 1
+
+    def subscribe(self, campaign_id=None):
+        """
+        Open a stream of delta updates
+
+        Args:
+            campaign_id: Only this campaign's events (optional, all events by default)
+
+        Returns:
+            Subscription: Read with get(), close() when done
+
+        Raises:
+            ServiceUnavailableError: If the worker serves EVENT_STREAM_MAX_SUBSCRIBERS streams
+        """
+        hub = self._hub
+        subscription = Subscription(hub, campaign_id)
+        with hub.lock:
+            if sum(len(subscriptions) for subscriptions in hub.subscriptions.values()) >= hub.max_subscribers:
+                raise ServiceUnavailableError("Too many open event streams, try again later")
+            hub.subscriptions.setdefault(campaign_id, set()).add(subscription)
+            if hub.ticker is None:
+                hub.ticker = threading.Thread(target=hub.run_ticker, name='event-stream-ticker', daemon=True)
+                hub.ticker.start()
+        return subscription
+
+
+event_stream = EventStream()
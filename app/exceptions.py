@@ -34,3 +34,19 @@ class DatabaseError(EmailTrackerException):
         self.field = field
         self.status_code = 400
 
+
+
+class NPlusOneError(EmailTrackerException):
+    """Raised when a request repeats the same SQL statement past the N+1 threshold"""
+    def __init__(self, message, field=None):
+        super().__init__(message, field)
+        self.field = field
+        self.status_code = 500
+
+
+class ServiceUnavailableError(EmailTrackerException):
+    """Raised when a worker is at capacity for a request (e.g. open event streams)"""
+    def __init__(self, message, field=None):
+        super().__init__(message, field)
+        self.field = field
+        self.status_code = 503
@@ -0,0 +1,132 @@
+"""
+WSGI fast path for the tracking pixel and click redirect
+
+Pixel and click hits are by far the highest-volume requests and the work
+they need is tiny: parse the tracking ID, record the event, return constant
+bytes. This middleware answers them straight from the WSGI environ, skipping
+Flask request setup, URL routing and send_file. Only an app context is
+pushed, so db.session and its teardown behave exactly as in the blueprint.
+
+Anything it does not recognise (other paths, non-GET methods, invalid click
+destinations that need the JSON error) falls through to Flask unchanged.
+"""
+
+import logging
+import time
+from urllib.parse import parse_qs
+
+from werkzeug.urls import iri_to_uri
+
+from app.admission import admission_control
+from app.exceptions import NotFoundError
+from app.metrics import registry, http_request_duration, http_requests, tracking_events_dropped
+from app.services.tracking_service import TrackingService
+from app.utils import create_tracking_pixel, validate_url
+
+PIXEL_PREFIX = '/track/pixel/'
+PIXEL_SUFFIX = '.png'
+CLICK_PREFIX = '/track/click/'
+
+# Same route labels as the blueprint, so /metrics looks identical with or without the fast path
+PIXEL_ROUTE = '/track/pixel/<tracking_id>.png'
+CLICK_ROUTE = '/track/click/<tracking_id>'
+
+logger = logging.getLogger(__name__)
+
+PIXEL_BODY = create_tracking_pixel()
+PIXEL_HEADERS = [
+    ('Content-Type', 'image/png'),
+    ('Content-Length', str(len(PIXEL_BODY))),
+    ('Content-Disposition', 'inline; filename=pixel.png'),
+    ('Cache-Control', 'no-cache'),
+]
+
+
+class TrackingFastPath:
+    """WSGI middleware that serves /track/pixel and /track/click without Flask dispatch"""
+
+    def __init__(self, app, wsgi_app, tracking_service=None):
+        """
+        Args:
+            app: Flask application (used for the app context)
+            wsgi_app: Downstream WSGI callable (normally app.wsgi_app)
+            tracking_service: TrackingService instance (optional)
+        """
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.tracking_service = tracking_service or TrackingService()
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+
+        if environ.get('REQUEST_METHOD') == 'GET':
+            path = environ.get('PATH_INFO', '')
+
+            if path.startswith(PIXEL_PREFIX) and path.endswith(PIXEL_SUFFIX):
+                tracking_id = path[len(PIXEL_PREFIX):-len(PIXEL_SUFFIX)]
+                if tracking_id and '/' not in tracking_id:
+                    response = self._pixel(environ, start_response, tracking_id)
+                    self._observe(start, PIXEL_ROUTE, '200')
+                    return response
+
+            elif path.startswith(CLICK_PREFIX):
+                tracking_id = path[len(CLICK_PREFIX):].rstrip('/')
+                if tracking_id and '/' not in tracking_id:
+                    response = self._click(environ, start_response, tracking_id)
+                    if response is not None:
+                        self._observe(start, CLICK_ROUTE, '302')
+                        return response
+
+        return self.wsgi_app(environ, start_response)
+
+    @staticmethod
+    def _observe(start, route, status):
+        http_request_duration.observe(time.perf_counter() - start, 'tracking', route, 'GET')
+        http_requests.inc('tracking', route, 'GET', status)
+        registry.maybe_flush()
+
+    def _pixel(self, environ, start_response, tracking_id):
+        self._record(environ, 'open', self.tracking_service.record_open, tracking_id=tracking_id)
+
+        start_response('200 OK', PIXEL_HEADERS)
+        return [PIXEL_BODY]
+
+    def _click(self, environ, start_response, tracking_id):
+        # Keep blank values: like request.args, `?url=` means an empty destination, not none
+        query = parse_qs(environ.get('QUERY_STRING', ''), keep_blank_values=True)
+        destination_url = query['url'][0] if 'url' in query else '/'
+
+        # Let Flask build the 400 JSON error for bad destinations
+        if destination_url != '/' and not validate_url(destination_url):
+            return None
+
+        self._record(environ, 'click', self.tracking_service.record_click,
+                     tracking_id=tracking_id, clicked_url=destination_url)
+
+        location = iri_to_uri(destination_url)
+        body = f'<a href="{location}">{location}</a>'.encode()
+        start_response('302 FOUND', [
+            ('Location', location),
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+        ])
+        return [body]
+
+    def _record(self, environ, event_type, record, **kwargs):
+        """Record the event inside an app context (if admitted), never failing the response"""
+        try:
+            with self.app.app_context():
+                if not admission_control.admit(event_type, environ.get('REMOTE_ADDR'), kwargs['tracking_id']):
+                    return
+                record(
+                    ip_address=environ.get('REMOTE_ADDR'),
+                    user_agent=environ.get('HTTP_USER_AGENT'),
+                    location=None,
+                    **kwargs
+                )
+        except NotFoundError:
+            # Email not found - still respond but don't track
+            tracking_events_dropped.inc(event_type, 'not_found')
+        except Exception:
+            tracking_events_dropped.inc(event_type, 'error')
+            logger.exception("Tracking error recording %s for %s", event_type, kwargs['tracking_id'])
@@ -0,0 +1,244 @@
+"""
+Heavy-hitter sketches of clicked links, link domains, IPs and user agents
+
+"Which links get clicked most in this campaign" or "which IPs open the most"
+used to mean a GROUP BY over every raw event of the scope. Instead, ingest
+counts each recorded hit into a bounded summary per dimension, for the hit's
+campaign and for all campaigns together:
+
+    links        clicked_url of clicks
+    domains      host of clicked_url of clicks
+    ips          ip_address of opens and clicks
+    user_agents  user_agent of opens and clicks
+
+Summaries are Space-Saving style: at most HEAVY_HITTERS_CAPACITY values, each
+with a count that is an upper bound on its hits and an error (count - error
+is a lower bound), plus a floor - no value outside the summary has more hits
+than that. Any value with more hits than the floor is in the summary.
+
+Each worker adds hits to exact in-memory counts; every
+HEAVY_HITTERS_FLUSH_SECONDS (or once HEAVY_HITTERS_PENDING_KEYS values are
+pending) the next ingest wakes the worker's flusher thread, which folds them
+into the heavy_hitter_sketches rows (HeavyHitterService.flush) while the hit
+that woke it is answered - ingest never waits on the sketch rows. Counts of listed values are added, unlisted values
+enter at floor + hits with error floor, and the summary is cut back to
+capacity, raising the floor to the largest count cut. Reading the top k is a
+slice of the stored entries, which are kept sorted by count.
+
+Sketches count every hit recorded since they were enabled (retention and the
+archive do not subtract) and lag ingest by up to the flush interval; hits
+still pending in a worker that exits are lost. `flask heavy-hitters rebuild`
+recomputes them exactly from the raw events. HEAVY_HITTERS_CAPACITY = 0 turns
+them off, and analytics then answers exactly (see
+AnalyticsService.get_top_values).
+"""
+
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.exceptions import DatabaseError, ValidationError
+
+# Summarized dimension -> event types counted into it
+DIMENSIONS = {
+    'links': ('click',),
+    'domains': ('click',),
+    'ips': ('open', 'click'),
+    'user_agents': ('open', 'click'),
+}
+
+# campaign_id of the sketches over all campaigns
+ALL_CAMPAIGNS = 0
+
+logger = logging.getLogger(__name__)
+
+
+def url_domain(url):
+    """Lower-cased host of a URL, or None"""
+    try:
+        return urlsplit(url).hostname if url else None
+    except ValueError:
+        return None
+
+
+def dimension_values(event):
+    """(dimension, value) pairs a recorded event counts towards"""
+    if event.event_type == 'click':
+        yield 'links', event.clicked_url
+        yield 'domains', url_domain(event.clicked_url)
+    if event.event_type in ('open', 'click'):
+        yield 'ips', event.ip_address
+        yield 'user_agents', event.user_agent
+
+
+def merge_counts(entries, floor, counts, capacity):
+    """
+    Fold exact hit counts into a summary
+
+    Args:
+        entries: dict value -> (count, error) of the summary
+        floor: Upper bound on the hits of any value not in entries
+        counts: dict value -> hits to add
+        capacity: Most values to keep
+
+    Returns:
+        tuple: (list of [value, count, error] sorted by count, most first; new floor)
+    """
+    merged = {value: [value, count + counts.get(value, 0), error] for value, (count, error) in entries.items()}
+    for value, hits in counts.items():
+        if value not in merged:
+            merged[value] = [value, floor + hits, floor]
+
+    ranked = sorted(merged.values(), key=lambda entry: entry[1], reverse=True)
+    if len(ranked) > capacity:
+        floor = max(floor, ranked[capacity][1])
+        ranked = ranked[:capacity]
+    return ranked, floor
+
+
+class _PendingHits:
+    """Per-application hits not yet flushed to the database"""
+
+    def __init__(self):
+        self.counts = {}  # (dimension, campaign_id) -> {value: hits}
+        self.keys = 0
+        self.last_flush = time.monotonic()
+        self.wake = threading.Event()  # set when a flush is due
+        self.idle = threading.Event()  # set while no flush is due or running
+        self.idle.set()
+        self.flusher = None
+
+
+class HeavyHitters:
+    """Ingest-side counting for the heavy-hitter sketches (see module docstring)"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('HEAVY_HITTERS_CAPACITY', 100)
+        app.config.setdefault('HEAVY_HITTERS_FLUSH_SECONDS', 30)
+        app.config.setdefault('HEAVY_HITTERS_PENDING_KEYS', 50000)
+
+        if app.config['HEAVY_HITTERS_CAPACITY'] < 0:
+            raise ValidationError("Sketch capacity cannot be negative", field='HEAVY_HITTERS_CAPACITY')
+        if app.config['HEAVY_HITTERS_FLUSH_SECONDS'] < 0:
+            raise ValidationError("Flush interval cannot be negative", field='HEAVY_HITTERS_FLUSH_SECONDS')
+
+        app.extensions['heavy_hitters'] = _PendingHits()
+
+    @property
+    def enabled(self):
+        """Whether ingest maintains sketches (HEAVY_HITTERS_CAPACITY > 0)"""
+        return current_app.config['HEAVY_HITTERS_CAPACITY'] > 0
+
+    @property
+    def capacity(self):
+        return current_app.config['HEAVY_HITTERS_CAPACITY']
+
+    def observe(self, event, campaign_id):
+        """Count a recorded event towards the sketches of its campaign and of all campaigns"""
+        scopes = (ALL_CAMPAIGNS,) if campaign_id is None else (ALL_CAMPAIGNS, campaign_id)
+        pending = current_app.extensions['heavy_hitters']
+        with self._lock:
+            for dimension, value in dimension_values(event):
+                if value is None:
+                    continue
+                for scope in scopes:
+                    counts = pending.counts.setdefault((dimension, scope), {})
+                    if value not in counts:
+                        pending.keys += 1
+                    counts[value] = counts.get(value, 0) + 1
+
+    def flush_due(self):
+        """Whether pending hits should be written now"""
+        pending = current_app.extensions['heavy_hitters']
+        return bool(pending.keys) and (
+            pending.keys >= current_app.config['HEAVY_HITTERS_PENDING_KEYS']
+            or time.monotonic() - pending.last_flush >= current_app.config['HEAVY_HITTERS_FLUSH_SECONDS'])
+
+    def request_flush(self):
+        """Wake the current app's flusher thread (started on first use, and again after a fork)"""
+        pending = current_app.extensions['heavy_hitters']
+        with self._lock:
+            pending.idle.clear()
+            pending.wake.set()
+            if pending.flusher is None or not pending.flusher.is_alive():
+                pending.flusher = threading.Thread(target=self._run_flusher,
+                                                   args=(current_app._get_current_object(), pending),
+                                                   name='heavy-hitters-flusher', daemon=True)
+                pending.flusher.start()
+
+    def wait_flushed(self, timeout=None):
+        """
+        Wait until every requested flush of the current app is written
+
+        Returns:
+            bool: False if the timeout passed first
+        """
+        return current_app.extensions['heavy_hitters'].idle.wait(timeout)
+
+    def _run_flusher(self, app, pending):
+        """Flush whenever ingest asks, each time in a fresh app context (and session)"""
+        from app.services.heavy_hitter_service import HeavyHitterService
+
+        while True:
+            pending.wake.wait()
+            pending.wake.clear()
+            try:
+                with app.app_context():
+                    HeavyHitterService().flush()
+            except Exception:
+                logger.exception("Heavy-hitter flush failed")
+            with self._lock:
+                if not pending.wake.is_set():
+                    pending.idle.set()
+
+    def take_pending(self):
+        """
+        Remove and return the pending hits
+
+        Returns:
+            dict: (dimension, campaign_id) -> {value: hits}
+        """
+        pending = current_app.extensions['heavy_hitters']
+        with self._lock:
+            counts, pending.counts, pending.keys = pending.counts, {}, 0
+            pending.last_flush = time.monotonic()
+        return counts
+
+    def restore_pending(self, counts):
+        """Put back hits whose flush failed, to go with the next one"""
+        pending = current_app.extensions['heavy_hitters']
+        with self._lock:
+            for key, values in counts.items():
+                target = pending.counts.setdefault(key, {})
+                for value, hits in values.items():
+                    if value not in target:
+                        pending.keys += 1
+                    target[value] = target.get(value, 0) + hits
+
+
+heavy_hitters = HeavyHitters()
+
+
+heavy_hitters_cli = AppGroup('heavy-hitters', help='Manage the heavy-hitter sketches of top links, IPs and user agents')
+
+
+@heavy_hitters_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every sketch exactly from the raw events (run while ingest is quiet)"""
+    from app.services.heavy_hitter_service import HeavyHitterService
+
+    try:
+        rebuilt = HeavyHitterService().rebuild()
+    except (ValidationError, DatabaseError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Rebuilt {rebuilt} sketches")
@@ -0,0 +1,138 @@
+"""
+Idempotency keys for POST /track/event
+
+ESP webhooks and collectors retry on timeout. A request carrying an
+Idempotency-Key header (or an event_id field) is recorded at most once: the
+key is inserted into idempotency_keys - primary key, so unique - in the same
+transaction as the event, together with the event as first returned. A retry
+gets that stored response back instead of a second event.
+
+The common path costs no lookup: a new key is simply inserted, and only a
+conflicting insert (a genuine retry) reads the stored row. Recently seen keys
+are also kept in a bounded per-worker cache (IDEMPOTENCY_CACHE_SIZE, least
+recent evicted first), so most retries are answered in O(1) without touching
+the database at all.
+
+Keys are remembered for at least IDEMPOTENCY_TTL_SECONDS; `flask idempotency
+purge` (from cron) deletes older rows. Keys are global, not per email - use
+something unique per event, e.g. the ESP's event id.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.exceptions import DatabaseError, ValidationError
+
+MAX_KEY_LENGTH = 255
+
+
+class ReplayedEvent(NamedTuple):
+    """Response of an already recorded event, returned for a retried idempotency key"""
+    event: Dict[str, Any]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The event as it was returned the first time"""
+        return self.event
+
+
+class _KeyCache:
+    """Per-application recently seen keys"""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()  # key -> (response, monotonic time recorded)
+
+
+class IdempotencyKeys:
+    """Cache of recent idempotency keys and key validation (see module docstring)"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IDEMPOTENCY_TTL_SECONDS', 86400)
+        app.config.setdefault('IDEMPOTENCY_CACHE_SIZE', 10000)
+
+        if app.config['IDEMPOTENCY_TTL_SECONDS'] < 1:
+            raise ValidationError("Idempotency keys must be kept at least a second", field='IDEMPOTENCY_TTL_SECONDS')
+        if app.config['IDEMPOTENCY_CACHE_SIZE'] < 1:
+            raise ValidationError("Idempotency cache needs room for at least one key", field='IDEMPOTENCY_CACHE_SIZE')
+
+        app.extensions['idempotency_keys'] = _KeyCache(app.config['IDEMPOTENCY_CACHE_SIZE'])
+
+    @property
+    def ttl(self):
+        return current_app.config['IDEMPOTENCY_TTL_SECONDS']
+
+    @staticmethod
+    def validate(key):
+        """
+        Normalize a client-supplied key
+
+        Returns:
+            str: The key, or None if none was given
+
+        Raises:
+            ValidationError: If the key is too long
+        """
+        if key is None:
+            return None
+        key = str(key).strip()
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError(f"Idempotency key is longer than {MAX_KEY_LENGTH} characters",
+                                  field='Idempotency-Key')
+        return key or None
+
+    def cached(self, key):
+        """
+        Response stored for a recently seen key, without a database round trip
+
+        Returns:
+            dict: The first response for the key, or None if this worker has not seen it
+        """
+        cache = current_app.extensions['idempotency_keys']
+        with self._lock:
+            entry = cache.entries.get(key)
+            if entry is None:
+                return None
+            response, recorded = entry
+            if time.monotonic() - recorded >= self.ttl:
+                del cache.entries[key]
+                return None
+            cache.entries.move_to_end(key)
+        return response
+
+    def remember(self, key, response):
+        """Cache the response recorded for a key"""
+        cache = current_app.extensions['idempotency_keys']
+        with self._lock:
+            cache.entries[key] = (response, time.monotonic())
+            cache.entries.move_to_end(key)
+            while len(cache.entries) > cache.size:
+                cache.entries.popitem(last=False)
+
+
+idempotency_keys = IdempotencyKeys()
+
+
+idempotency_cli = AppGroup('idempotency', help='Manage idempotency keys of tracked events')
+
+
+@idempotency_cli.command('purge')
+def purge_command():
+    """Delete idempotency keys older than IDEMPOTENCY_TTL_SECONDS"""
+    from app.services.tracking_service import TrackingService
+
+    try:
+        purged = TrackingService().purge_idempotency_keys()
+    except (ValidationError, DatabaseError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Purged {purged} idempotency keys")
@@ -0,0 +1,217 @@
+"""
+Streaming classification of machine opens and scanner clicks
+
+Privacy proxies that prefetch every image (Apple Mail Privacy Protection) and
+security gateways that follow every link before delivery produce events no
+person caused. TrackingService classifies each hit before it is written and
+stores the first matching rule in tracking_events.machine_reason (0 = human):
+
+    proxy_ip    the IP is in MACHINE_IP_RANGES
+    user_agent  a bot/scanner signature (app.utils.user_agent), or an open
+                with the bare "Mozilla/5.0" Apple's prefetcher sends
+    fast        an open within MACHINE_OPEN_SECONDS or a click within
+                MACHINE_CLICK_SECONDS of the email's sent_at
+    burst       MACHINE_BURST_CLICKS clicks on one email within
+                MACHINE_BURST_SECONDS - a scanner following every link; the
+                earlier clicks of the burst are flagged too
+
+Burst windows live in memory: one short deque of recent clicks per email, in
+an LRU of at most MACHINE_BURST_EMAILS emails, so memory stays bounded however
+many emails are being clicked. Each worker process only sees its own share of
+the hits, which is enough for scanners (they click within a second or two,
+mostly over one keep-alive connection) but not an exact global count.
+
+MACHINE_EVENTS selects what happens to flagged hits: 'flag' (default) stores
+them with their reason, 'drop' does not write them at all (they still count
+towards burst windows and the tracking_events_dropped_total metric), 'off'
+skips classification. Analytics exclude flagged events on request
+(exclude_machine) through the indexed machine_reason column.
+"""
+
+import ipaddress
+import threading
+from collections import OrderedDict, deque
+from datetime import timedelta
+
+from flask import current_app
+
+from app.exceptions import ValidationError
+from app.utils import is_bot_user_agent
+
+# machine_reason code -> name (code 0 = human, reported as None)
+MACHINE_REASONS = (None, 'proxy_ip', 'user_agent', 'fast', 'burst')
+HUMAN, PROXY_IP, USER_AGENT, FAST, BURST = range(len(MACHINE_REASONS))
+
+POLICIES = ('flag', 'drop', 'off')
+
+# User agent Apple Mail Privacy Protection fetches images with
+PREFETCH_USER_AGENT = 'Mozilla/5.0'
+
+# Bounded per-IP memo of range checks
+_IP_CACHE_SIZE = 65536
+
+
+def machine_reason_name(code):
+    """Name of a machine_reason code (None for human events)"""
+    return MACHINE_REASONS[code or HUMAN]
+
+
+class _ClassifierState:
+    """Per-application rules and burst windows"""
+
+    def __init__(self, config):
+        self.policy = config['MACHINE_EVENTS']
+        self.networks = []
+        for value in config['MACHINE_IP_RANGES']:
+            try:
+                self.networks.append(ipaddress.ip_network(value.strip(), strict=False))
+            except ValueError:
+                raise ValidationError(f"Invalid IP range: {value}", field='MACHINE_IP_RANGES')
+        self.open_window = timedelta(seconds=config['MACHINE_OPEN_SECONDS'])
+        self.click_window = timedelta(seconds=config['MACHINE_CLICK_SECONDS'])
+        self.burst_window = timedelta(seconds=config['MACHINE_BURST_SECONDS'])
+        self.burst_clicks = config['MACHINE_BURST_CLICKS']
+        self.burst_emails = config['MACHINE_BURST_EMAILS']
+        self.ip_cache = {}
+        # email_id -> deque of [created_at, event id or None, flagged], oldest first
+        self.clicks = OrderedDict()
+
+
+class MachineEventClassifier:
+    """Flags machine opens and scanner clicks at ingest (see module docstring)"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MACHINE_EVENTS', 'flag')
+        app.config.setdefault('MACHINE_IP_RANGES', ())
+        app.config.setdefault('MACHINE_OPEN_SECONDS', 2)
+        app.config.setdefault('MACHINE_CLICK_SECONDS', 10)
+        app.config.setdefault('MACHINE_BURST_SECONDS', 2)
+        app.config.setdefault('MACHINE_BURST_CLICKS', 3)
+        app.config.setdefault('MACHINE_BURST_EMAILS', 10000)
+
+        if app.config['MACHINE_EVENTS'] not in POLICIES:
+            raise ValidationError(f"Unknown machine event policy: {app.config['MACHINE_EVENTS']} "
+                                  f"(expected one of {', '.join(POLICIES)})", field='MACHINE_EVENTS')
+        if app.config['MACHINE_BURST_CLICKS'] < 2:
+            raise ValidationError("A burst needs at least 2 clicks", field='MACHINE_BURST_CLICKS')
+
+        app.extensions['machine_events'] = _ClassifierState(app.config)
+
+    @property
+    def _state(self):
+        return current_app.extensions['machine_events']
+
+    @property
+    def enabled(self):
+        return self._state.policy != 'off'
+
+    @property
+    def drop(self):
+        """Whether flagged hits are left out of tracking_events"""
+        return self._state.policy == 'drop'
+
+    def classify(self, event, sent_at):
+        """
+        machine_reason code of a new event, before it is written
+
+        Args:
+            event: New TrackingEvent (event_type, ip_address, user_agent and created_at set)
+            sent_at: When the event's email was sent
+
+        Returns:
+            int: Reason code (HUMAN = 0 for a person, or with MACHINE_EVENTS = 'off')
+        """
+        state = self._state
+        if state.policy == 'off':
+            return HUMAN
+
+        if event.ip_address and self._in_ranges(state, event.ip_address):
+            return PROXY_IP
+
+        user_agent = event.user_agent
+        if user_agent and (is_bot_user_agent(user_agent) or
+                           (event.event_type == 'open' and user_agent.strip() == PREFETCH_USER_AGENT)):
+            return USER_AGENT
+
+        if sent_at is not None and event.created_at is not None:
+            elapsed = event.created_at - sent_at
+            window = {'open': state.open_window, 'click': state.click_window}.get(event.event_type)
+            if window and timedelta(0) <= elapsed < window:
+                return FAST
+
+        if event.event_type == 'click' and self._burst_size(state, event) + 1 >= state.burst_clicks:
+            return BURST
+
+        return HUMAN
+
+    def observe_click(self, email_id, event):
+        """
+        Add a classified click to its email's burst window
+
+        Args:
+            email_id: Email the click belongs to
+            event: The click (id None if it was dropped)
+
+        Returns:
+            list: Ids of earlier, still unflagged clicks of the burst this
+                  click completes (to be flagged as BURST)
+        """
+        state = self._state
+        if state.policy == 'off':
+            return []
+
+        with self._lock:
+            window = self._window(state, email_id, event.created_at)
+            flagged = event.machine_reason == BURST
+            earlier = []
+            if flagged:
+                for entry in window:
+                    if not entry[2]:
+                        entry[2] = True
+                        if entry[1] is not None:
+                            earlier.append(entry[1])
+            window.append([event.created_at, event.id, flagged])
+        return earlier
+
+    @staticmethod
+    def _in_ranges(state, ip_address):
+        hit = state.ip_cache.get(ip_address)
+        if hit is None:
+            try:
+                address = ipaddress.ip_address(ip_address)
+            except ValueError:
+                hit = False
+            else:
+                hit = any(address in network for network in state.networks)
+            if len(state.ip_cache) >= _IP_CACHE_SIZE:
+                state.ip_cache.clear()
+            state.ip_cache[ip_address] = hit
+        return hit
+
+    def _burst_size(self, state, event):
+        """Clicks of the event's email still inside the burst window"""
+        with self._lock:
+            return len(self._window(state, event.email_id, event.created_at))
+
+    @staticmethod
+    def _window(state, email_id, now):
+        """Pruned click window of an email, created (evicting the least recent email) if missing"""
+        window = state.clicks.get(email_id)
+        if window is None:
+            window = state.clicks[email_id] = deque()
+            if len(state.clicks) > state.burst_emails:
+                state.clicks.popitem(last=False)
+        else:
+            state.clicks.move_to_end(email_id)
+        start = now - state.burst_window
+        while window and window[0][0] < start:
+            window.popleft()
+        return window
+
+
+machine_events = MachineEventClassifier()
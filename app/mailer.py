@@ -0,0 +1,464 @@
+"""
+SMTP send engine for campaign emails
+
+Emails created with queue=True wait in the emails table with delivery_status
+'queued'; `flask mail send` (SendService.send_queued) sends them:
+
+- recipients are read by keyset in MAIL_SEND_BATCH_SIZE chunks, and each
+  chunk is sent by MAIL_SEND_WORKERS threads and recorded in one transaction
+- every email becomes a multipart/alternative MIME message (plain text
+  derived from the HTML body, plus the body itself with a tracking pixel when
+  MAIL_TRACKING_BASE_URL is set), its Message-ID built from the tracking id.
+  The encoded parts are cached per subject and body, so a campaign's
+  messages only differ in headers and pixel
+- messages go over a pool of persistent SMTP connections (one per worker,
+  STARTTLS/login once per connection, replaced after
+  MAIL_MAX_MESSAGES_PER_CONNECTION messages). When the server advertises
+  PIPELINING, MAIL FROM, RCPT TO and DATA go out in one write, so a message
+  costs two round trips instead of four
+- sends to one recipient domain are spaced to at most MAIL_DOMAIN_RATE per
+  second (0 = unthrottled), as large mailbox providers defer bursts
+
+Each email records its outcome: 'sent' with sent_at set to the time the
+server accepted it, 'deferred' on a 4xx reply or a connection failure before
+the message went out (retried by the next run), 'failed' on a 5xx reply.
+delivery_result keeps the server's reply. A connection lost after the message
+was transmitted is recorded as failed rather than deferred, so a message the
+server may have accepted is never sent twice.
+
+Large campaigns can go through `flask mail dispatch` instead, which runs
+many more connections on one event loop (see app.dispatcher).
+"""
+
+import binascii
+import html
+import re
+import secrets
+import smtplib
+import ssl
+import threading
+import time
+from datetime import datetime
+from email.header import Header
+from email.utils import formatdate
+from functools import lru_cache
+from queue import Empty, LifoQueue
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.exceptions import DatabaseError, NotFoundError, ValidationError
+
+# Values of Email.delivery_status (NULL = recorded as sent by the caller, not sent here)
+QUEUED = 'queued'
+SENT = 'sent'
+DEFERRED = 'deferred'
+FAILED = 'failed'
+DELIVERY_STATUSES = (QUEUED, SENT, DEFERRED, FAILED)
+PENDING = (QUEUED, DEFERRED)
+
+_TAGS = re.compile(r'<(script|style)\b.*?</\1\s*>|<[^>]+>', re.IGNORECASE | re.DOTALL)
+_BLANK_LINES = re.compile(r'\n\s*\n\s*')
+_LINE_ENDS = re.compile(rb'\r\n|\n|\r(?!\n)')
+_LEADING_DOTS = re.compile(rb'^\.', re.MULTILINE)
+_PART_HEADERS = 'Content-Type: text/{}; charset="utf-8"\r\nContent-Transfer-Encoding: quoted-printable\r\n\r\n'
+
+
+def html_to_text(body):
+    """Plain-text alternative of an HTML body"""
+    return _BLANK_LINES.sub('\n\n', html.unescape(_TAGS.sub('', body))).strip()
+
+
+def build_message(email, tracking_base_url=None):
+    """
+    MIME message of an email: multipart/alternative with a plain-text part
+    derived from the HTML body, and the body itself
+
+    Campaign emails share subject and body, so their encoded parts are built
+    once (see _encoded_parts) and only the headers and tracking pixel are
+    per recipient - the email package's header objects would cost
+    milliseconds per message.
+
+    Args:
+        email: Row with tracking_id, recipient_email, sender_email, subject and body
+        tracking_base_url: Public URL of this app; adds the tracking pixel when set
+
+    Returns:
+        bytes: The message, CRLF line endings, Message-ID <tracking_id@sender domain>
+
+    Raises:
+        ValueError: If a header value contains a line break
+    """
+    subject, text, html_body = _encoded_parts(email.subject or '', email.body or '')
+    for value in (email.sender_email, email.recipient_email):
+        if '\r' in value or '\n' in value:
+            raise ValueError(f"Line break in header value: {value!r}")
+    if tracking_base_url:
+        pixel = (f'<img src="{tracking_base_url.rstrip("/")}/track/pixel/{email.tracking_id}.png" '
+                 f'width="1" height="1" alt="" style="display:none">')
+        html_body += b'\r\n' + _qp(pixel)
+    boundary = f'=_{secrets.token_hex(12)}'  # '=_' never occurs in quoted-printable text
+
+    head = (f'From: {email.sender_email}\r\n'
+            f'To: {email.recipient_email}\r\n'
+            f'Subject: {subject}\r\n'
+            f'Date: {formatdate(usegmt=True)}\r\n'
+            f'Message-ID: {message_id(email)}\r\n'
+            'MIME-Version: 1.0\r\n'
+            f'Content-Type: multipart/alternative; boundary="{boundary}"\r\n\r\n'
+            f'--{boundary}\r\n{_PART_HEADERS.format("plain")}')
+    middle = f'\r\n--{boundary}\r\n{_PART_HEADERS.format("html")}'
+    return b''.join((head.encode(), text, middle.encode(), html_body, f'\r\n--{boundary}--\r\n'.encode()))
+
+
+def message_id(email):
+    """Message-ID header of an email - the same for every attempt to send it"""
+    return f'<{email.tracking_id}@{recipient_domain(email.sender_email)}>'
+
+
+@lru_cache(maxsize=64)
+def _encoded_parts(subject, body):
+    """(Subject header value, quoted-printable text part, quoted-printable HTML part) of a subject and body"""
+    if '\r' in subject or '\n' in subject:
+        raise ValueError(f"Line break in subject: {subject!r}")
+    if not subject.isascii():
+        subject = Header(subject, 'utf-8').encode()
+    return subject, _qp(html_to_text(body)), _qp(body)
+
+
+def _qp(text):
+    """Quoted-printable UTF-8 of a text, CRLF line endings"""
+    return _LINE_ENDS.sub(b'\r\n', binascii.b2a_qp(text.encode(), istext=True))
+
+
+def recipient_domain(address):
+    """Lower-cased domain of an address"""
+    return address.rpartition('@')[2].lower()
+
+
+def dot_stuff(data):
+    """A message as sent after DATA: CRLF line endings, leading dots doubled, terminated by <CRLF>.<CRLF>"""
+    data = _LEADING_DOTS.sub(b'..', _LINE_ENDS.sub(b'\r\n', data))
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+
+def reply_outcome(email, code, text):
+    """
+    Column values recording the server's final reply to an email
+
+    Returns:
+        dict: 'sent' (with sent_at and message_id) on 250, 'deferred' on 4xx, else 'failed'
+    """
+    reply = f"{code} {text.decode(errors='replace') if isinstance(text, bytes) else text}"[:255]
+    if code == 250:
+        return {'id': email.id, 'delivery_status': SENT, 'delivery_result': reply,
+                'sent_at': datetime.utcnow(), 'message_id': message_id(email)}
+    return {'id': email.id, 'delivery_status': DEFERRED if 400 <= code < 500 else FAILED, 'delivery_result': reply}
+
+
+def error_outcome(email, error):
+    """
+    Column values recording an email that could not be sent
+
+    Returns:
+        dict: 'failed' for an invalid message (ValueError) or when the message
+            may have gone out before the connection failed, else 'deferred'
+    """
+    if isinstance(error, ValueError):
+        return {'id': email.id, 'delivery_status': FAILED, 'delivery_result': f"Invalid message: {error}"[:255]}
+    if transmitted(error):
+        return {'id': email.id, 'delivery_status': FAILED,
+                'delivery_result': f"Connection lost after sending, may be delivered: {error}"[:255]}
+    return {'id': email.id, 'delivery_status': DEFERRED, 'delivery_result': f"{type(error).__name__}: {error}"[:255]}
+
+
+class _Connection:
+    """One SMTP session, sending with PIPELINING when the server offers it"""
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.pipelining = smtp.has_extn('pipelining')
+        self.sent = 0
+        self.transmitted = False  # whether the current message's data went out
+
+    def send(self, sender, recipient, data):
+        """
+        Send one message
+
+        Returns:
+            tuple: (code, text) of the reply that decided the outcome
+
+        Raises:
+            smtplib.SMTPException, OSError: If the connection fails
+        """
+        self.transmitted = False
+        self.sent += 1
+        if not self.pipelining:
+            reply = self.smtp.mail(sender)
+            if reply[0] == 250:
+                reply = self.smtp.rcpt(recipient)
+                if reply[0] in (250, 251):
+                    reply = self.smtp.docmd('DATA')
+            if reply[0] != 354:
+                self.smtp.rset()
+                return reply
+            return self._transmit(data)
+
+        self.smtp.send(f'MAIL FROM:{smtplib.quoteaddr(sender)}\r\n'
+                       f'RCPT TO:{smtplib.quoteaddr(recipient)}\r\nDATA\r\n')
+        mail, rcpt, start = self.smtp.getreply(), self.smtp.getreply(), self.smtp.getreply()
+        if mail[0] != 250 or rcpt[0] not in (250, 251):
+            if start[0] == 354:
+                # DATA was accepted anyway: end it without a message before resetting
+                self.smtp.send(b'.\r\n')
+                self.smtp.getreply()
+            self.smtp.rset()
+            return mail if mail[0] != 250 else rcpt
+        if start[0] != 354:
+            self.smtp.rset()
+            return start
+        return self._transmit(data)
+
+    def _transmit(self, data):
+        """Send the message after a 354 to DATA, dot-stuffed and terminated"""
+        data = dot_stuff(data)
+        self.transmitted = True
+        self.smtp.send(data)
+        return self.smtp.getreply()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+
+
+class SmtpPool:
+    """Persistent SMTP connections, at most size of them in use at once"""
+
+    def __init__(self, host, port, use_tls=False, username=None, password=None, timeout=30.0, size=8,
+                 max_messages=100):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = LifoQueue()
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def send(self, sender, recipient, data):
+        """
+        Send one message over an idle connection (or a new one)
+
+        A reused connection that turns out to be closed before the message
+        went out is replaced once.
+
+        Returns:
+            tuple: (code, text) of the deciding reply
+
+        Raises:
+            smtplib.SMTPException, OSError: If the connection fails; check
+                transmitted(error) for whether the message may have gone out
+        """
+        with self._slots:
+            connection, reused = self._checkout()
+            try:
+                try:
+                    reply = connection.send(sender, recipient, data)
+                except (smtplib.SMTPException, OSError):
+                    if not reused or connection.transmitted:
+                        raise
+                    connection.smtp.close()
+                    connection = self._open()
+                    reply = connection.send(sender, recipient, data)
+            except (smtplib.SMTPException, OSError) as e:
+                e.transmitted = connection.transmitted
+                connection.smtp.close()
+                raise
+            except BaseException:
+                connection.smtp.close()
+                raise
+
+            if connection.sent >= self.max_messages:
+                connection.close()
+            else:
+                self._idle.put(connection)
+            return reply
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait(), True
+        except Empty:
+            return self._open(), False
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.use_tls:
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+            if self.username:
+                smtp.login(self.username, self.password or '')
+        except BaseException:
+            smtp.close()
+            raise
+        with self._lock:
+            self.opened += 1
+        return _Connection(smtp)
+
+    def close(self):
+        """QUIT every idle connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+def transmitted(error):
+    """Whether a message may have reached the server before the connection failed"""
+    return getattr(error, 'transmitted', False)
+
+
+class DomainThrottle:
+    """Spaces sends to each recipient domain at least 1 / rate seconds apart (rate 0 = no limit)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = {}  # domain -> monotonic time of its next free slot
+
+    def wait(self, domain):
+        """Block until a send to the domain is allowed"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(domain, now))
+            self._next[domain] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class Mailer:
+    """SMTP and dispatcher settings, and the connection pool shared by send runs (see module docstring)"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_SERVER', 'localhost')
+        app.config.setdefault('MAIL_PORT', 25)
+        app.config.setdefault('MAIL_USE_TLS', False)
+        app.config.setdefault('MAIL_USERNAME', None)
+        app.config.setdefault('MAIL_PASSWORD', None)
+        app.config.setdefault('MAIL_TIMEOUT', 30.0)
+        app.config.setdefault('MAIL_SEND_WORKERS', 8)
+        app.config.setdefault('MAIL_SEND_BATCH_SIZE', 500)
+        app.config.setdefault('MAIL_MAX_MESSAGES_PER_CONNECTION', 100)
+        app.config.setdefault('MAIL_DOMAIN_RATE', 0)
+        app.config.setdefault('MAIL_TRACKING_BASE_URL', None)
+        # Asyncio campaign dispatcher (app.dispatcher)
+        app.config.setdefault('DISPATCH_CONNECTIONS', 50)
+        app.config.setdefault('DISPATCH_DOMAIN_CONCURRENCY', 5)
+        app.config.setdefault('DISPATCH_DOMAIN_RATE', 0)
+        app.config.setdefault('DISPATCH_RATE_WINDOW', 60.0)
+        app.config.setdefault('DISPATCH_BUFFER_SIZE', 2000)
+        app.config.setdefault('DISPATCH_CHECKPOINT_SECONDS', 1.0)
+        app.config.setdefault('DISPATCH_STATUS_SECONDS', 2.0)
+
+        for key in ('MAIL_SEND_WORKERS', 'MAIL_SEND_BATCH_SIZE', 'MAIL_MAX_MESSAGES_PER_CONNECTION',
+                    'DISPATCH_CONNECTIONS', 'DISPATCH_DOMAIN_CONCURRENCY', 'DISPATCH_BUFFER_SIZE'):
+            if app.config[key] < 1:
+                raise ValidationError(f"{key} must be at least 1", field=key)
+        for key in ('MAIL_DOMAIN_RATE', 'DISPATCH_DOMAIN_RATE'):
+            if app.config[key] < 0:
+                raise ValidationError("Per-domain send rate cannot be negative", field=key)
+        for key in ('DISPATCH_RATE_WINDOW', 'DISPATCH_CHECKPOINT_SECONDS', 'DISPATCH_STATUS_SECONDS'):
+            if app.config[key] <= 0:
+                raise ValidationError(f"{key} must be positive", field=key)
+
+        app.extensions['mailer'] = {'pool': None, 'lock': threading.Lock()}
+
+    @property
+    def pool(self):
+        """SMTP connection pool of this app, created on first use"""
+        state = current_app.extensions['mailer']
+        with state['lock']:
+            if state['pool'] is None:
+                config = current_app.config
+                state['pool'] = SmtpPool(
+                    config['MAIL_SERVER'], config['MAIL_PORT'], use_tls=config['MAIL_USE_TLS'],
+                    username=config['MAIL_USERNAME'], password=config['MAIL_PASSWORD'],
+                    timeout=config['MAIL_TIMEOUT'], size=config['MAIL_SEND_WORKERS'],
+                    max_messages=config['MAIL_MAX_MESSAGES_PER_CONNECTION'])
+            return state['pool']
+
+    def close(self):
+        """QUIT the pooled connections"""
+        state = current_app.extensions['mailer']
+        with state['lock']:
+            pool, state['pool'] = state['pool'], None
+        if pool is not None:
+            pool.close()
+
+
+mailer = Mailer()
+
+
+mail_cli = AppGroup('mail', help='Send queued emails over SMTP')
+
+
+@mail_cli.command('send')
+@click.option('--campaign-id', default=None, type=int, help="Only this campaign's emails")
+@click.option('--limit', default=None, type=int, help='Stop after this many emails')
+def send_command(campaign_id, limit):
+    """Send queued emails, and retry deferred ones"""
+    from app.services.send_service import SendService
+
+    try:
+        result = SendService().send_queued(campaign_id=campaign_id, limit=limit)
+    except (ValidationError, NotFoundError, DatabaseError) as e:
+        raise click.ClickException(str(e))
+    finally:
+        mailer.close()
+    click.echo(f"Sent {result['sent']}, deferred {result['deferred']}, failed {result['failed']} "
+               f"in {result['seconds']:.1f}s ({result['sent'] / max(result['seconds'], 1e-9):,.0f} emails/s)")
+
+
+@mail_cli.command('dispatch')
+@click.argument('campaign_id', type=int)
+@click.option('--limit', default=None, type=int, help='Stop after this many emails')
+def dispatch_command(campaign_id, limit):
+    """Send an active campaign on the asyncio dispatcher (pause it through Campaign.status)"""
+    from app.services.dispatch_service import DispatchService
+
+    try:
+        result = DispatchService().dispatch(campaign_id, limit=limit)
+    except (ValidationError, NotFoundError, DatabaseError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Sent {result['sent']}, deferred {result['deferred']}, failed {result['failed']} "
+               f"in {result['seconds']:.1f}s ({result['sent'] / max(result['seconds'], 1e-9):,.0f} emails/s); "
+               f"campaign is {result['status']}")
+
+
+@mail_cli.command('status')
+@click.option('--campaign-id', default=None, type=int, help="Only this campaign's emails")
+def status_command(campaign_id):
+    """Count emails per delivery status"""
+    from app.services.send_service import SendService
+
+    try:
+        counts = SendService().delivery_counts(campaign_id=campaign_id)
+    except NotFoundError as e:
+        raise click.ClickException(str(e))
+    click.echo(', '.join(f"{counts[status]} {status}" for status in DELIVERY_STATUSES))
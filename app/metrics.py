@@ -0,0 +1,441 @@
+"""
+In-process metrics with Prometheus text exposition
+
+Every thread increments its own dict of values, so the hot path (a pixel
+hit) never takes a lock - the shards are only merged when /metrics is
+scraped. When a thread exits its shard is folded into one retired total,
+so thread-per-request servers and short-lived pools don't grow the shard
+list. Under a prefork server (gunicorn) each worker periodically dumps
+its merged values to METRICS_MULTIPROC_DIR/<pid>.json; a scrape sums the
+files of every worker so the totals do not depend on which worker answers.
+The files of exited workers are folded into retired.json the same way, so
+restarted workers neither lose their counts nor leave a file behind.
+
+Metric objects are module-level singletons:
+
+    tracking_events_recorded.inc('open')
+    http_request_duration.observe(0.004, 'tracking', '/track/pixel/<tracking_id>.png', 'GET')
+"""
+
+import atexit
+import bisect
+import contextlib
+import glob
+import json
+import os
+import threading
+import time
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+
+RETIRED_SNAPSHOT = 'retired.json'
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+    type_name = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        values = self.registry._thread_values()
+        key = (self.name, label_values)
+        values[key] = values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values (cumulative buckets are built at render time)"""
+    type_name = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        values = self.registry._thread_values()
+        key = (self.name, label_values)
+        data = values.get(key)
+        if data is None:
+            # per-bucket counts (+Inf last), then sum and count
+            data = values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+
+class _ShardOwner:
+    """Held only by a thread's local storage, so it is freed when the thread exits"""
+    __slots__ = ('__weakref__',)
+
+
+class MetricsRegistry:
+    """Holds metric definitions and the per-thread value shards"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._local = threading.local()
+        self._shards = {}  # id(values) -> values of each live thread
+        self._retired = {}  # merged values of exited threads
+        # Reentrant: dropping a thread's local storage (reset) runs _retire under the lock
+        self._lock = threading.RLock()
+        self.multiproc_dir = None
+        self.flush_interval = 5
+        self._last_flush = 0.0
+        self._snapshot_pid = None  # pid whose snapshot file this process has claimed
+        self._dir_lock = threading.Lock()
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _thread_values(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            owner = self._local.owner = _ShardOwner()
+            with self._lock:
+                self._shards[id(values)] = values
+            weakref.finalize(owner, self._retire, values).atexit = False
+            return values
+
+    def _retire(self, values):
+        """Fold an exited thread's shard into the retired total"""
+        with self._lock:
+            # A shard dropped by reset() is not counted again
+            if self._shards.pop(id(values), None) is values:
+                for key, value in values.items():
+                    _merge_value(self._retired, key, value)
+
+    def reset(self):
+        """Drop all recorded values (used after fork and in tests)"""
+        with self._lock:
+            self._shards = {}
+            self._retired = {}
+            self._local = threading.local()
+
+    def collect(self):
+        """
+        Merge the per-thread shards and the retired total
+
+        Returns:
+            dict: (metric name, label values) -> counter value or histogram data list
+        """
+        merged = {}
+        with self._lock:
+            # Copied together, so a shard retiring meanwhile is counted exactly once
+            shards = list(self._shards.values())
+            for key, value in self._retired.items():
+                _merge_value(merged, key, value)
+
+        for shard in shards:
+            for key, value in shard.copy().items():
+                _merge_value(merged, key, value)
+        return merged
+
+    # Prefork aggregation
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.multiproc_dir, f'{pid or os.getpid()}.json')
+
+    @contextlib.contextmanager
+    def _locked_dir(self):
+        """Exclude other threads and other processes sharing the multiprocess directory"""
+        import fcntl
+
+        with self._dir_lock, open(os.path.join(self.multiproc_dir, 'retired.lock'), 'a') as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+            yield
+
+    def _retire_snapshots(self, pids):
+        """Fold the snapshot files of exited processes into retired.json (directory locked)"""
+        paths = [path for path in map(self._snapshot_path, pids) if os.path.exists(path)]
+        if not paths:
+            return
+
+        retired_path = os.path.join(self.multiproc_dir, RETIRED_SNAPSHOT)
+        retired = {}
+        for path in [retired_path] + paths:
+            for key, value in _read_snapshot(path).items():
+                _merge_value(retired, key, value)
+        _write_snapshot(retired_path, retired)
+        for path in paths:
+            os.remove(path)
+
+    def flush(self):
+        """Write this process's merged values to the multiprocess directory"""
+        if not self.multiproc_dir:
+            return
+
+        self._last_flush = time.monotonic()
+        pid = os.getpid()
+        if self._snapshot_pid != pid:
+            # A file already at our path was left by an exited process given the same pid
+            with self._locked_dir():
+                self._retire_snapshots([pid])
+            self._snapshot_pid = pid
+        _write_snapshot(self._snapshot_path(), self.collect())
+
+    def maybe_flush(self):
+        """Flush if the flush interval has passed (cheap enough to call per request)"""
+        if self.multiproc_dir and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def collect_all_processes(self):
+        """Merge this process's live values with the snapshots of every other worker"""
+        merged = self.collect()
+        if not self.multiproc_dir:
+            return merged
+
+        own_path = self._snapshot_path()
+        with self._locked_dir():
+            paths = glob.glob(os.path.join(self.multiproc_dir, '*.json'))
+            pids = [int(name) for name in (os.path.basename(path)[:-5] for path in paths) if name.isdigit()]
+            exited = [pid for pid in pids if pid != os.getpid() and _process_exited(pid)]
+            if exited:
+                self._retire_snapshots(exited)
+                paths = glob.glob(os.path.join(self.multiproc_dir, '*.json'))
+
+            for path in paths:
+                if path != own_path:
+                    for key, value in _read_snapshot(path).items():
+                        _merge_value(merged, key, value)
+        return merged
+
+    # Exposition
+
+    def render(self):
+        """Render every metric in the Prometheus text format (version 0.0.4)"""
+        values = self.collect_all_processes()
+
+        by_metric = {}
+        for (name, labels), value in values.items():
+            by_metric.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {metric.help_text}')
+            lines.append(f'# TYPE {name} {metric.type_name}')
+            for labels, value in sorted(by_metric.get(name, []), key=lambda item: item[0]):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.type_name == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float('inf'),), value):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{_format_labels(pairs + [("le", le)])} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(pairs)} {_format_number(value[-2])}')
+                    lines.append(f'{name}_count{_format_labels(pairs)} {value[-1]}')
+                else:
+                    lines.append(f'{name}{_format_labels(pairs)} {_format_number(value)}')
+
+        lines.extend(_cache_hit_ratio_lines(values))
+        return '\n'.join(lines) + '\n'
+
+
+def _read_snapshot(path):
+    """Load a snapshot file as {(name, label values): value}; unreadable files count as empty"""
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {(name, tuple(labels)): value for name, labels, value in snapshot}
+
+
+def _write_snapshot(path, values):
+    """Atomically replace a snapshot file"""
+    snapshot = [[name, list(labels), value] for (name, labels), value in values.items()]
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def _process_exited(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:  # alive, run by another user
+        pass
+    return False
+
+
+def _merge_value(merged, key, value):
+    existing = merged.get(key)
+    if existing is None:
+        merged[key] = list(value) if isinstance(value, list) else value
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            existing[i] += v
+    else:
+        merged[key] = existing + value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _cache_hit_ratio_lines(values):
+    """Derived gauge: hits / (hits + misses) per cache"""
+    lookups = {}
+    for (name, labels), value in values.items():
+        if name == 'cache_lookups_total':
+            cache, result = labels
+            lookups.setdefault(cache, {'hit': 0, 'miss': 0})[result] += value
+
+    lines = ['# HELP cache_hit_ratio Fraction of cache lookups that were hits',
+             '# TYPE cache_hit_ratio gauge']
+    for cache, counts in sorted(lookups.items()):
+        total = counts['hit'] + counts['miss']
+        ratio = counts['hit'] / total if total else 0.0
+        lines.append(f'cache_hit_ratio{_format_labels([("cache", cache)])} {ratio!r}')
+    return lines
+
+
+registry = MetricsRegistry()
+os.register_at_fork(after_in_child=registry.reset)
+
+http_requests = registry.counter(
+    'http_requests_total', 'HTTP requests by route and status',
+    ('blueprint', 'route', 'method', 'status'))
+http_request_duration = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route',
+    ('blueprint', 'route', 'method'))
+tracking_events_recorded = registry.counter(
+    'tracking_events_recorded_total', 'Tracking events written to the database',
+    ('event_type',))
+tracking_events_dropped = registry.counter(
+    'tracking_events_dropped_total', 'Tracking hits that were not recorded',
+    ('event_type', 'reason'))
+tracking_events_collapsed = registry.counter(
+    'tracking_events_collapsed_total', 'Repeat hits added to an earlier event instead of a new row',
+    ('event_type',))
+tracking_admissions = registry.counter(
+    'tracking_admissions_total', 'Rate limiter decisions on tracking hits',
+    ('event_type', 'decision'))
+event_stream_updates = registry.counter(
+    'event_stream_updates_total', 'Live stream delta updates queued for subscribers, and folded into another',
+    ('result',))
+webhook_deliveries = registry.counter(
+    'webhook_deliveries_total', 'Webhook batch POSTs by result (delivered/retried/failed)',
+    ('result',))
+emails_sent = registry.counter(
+    'emails_sent_total', 'Queued emails sent over SMTP by outcome (sent/deferred/failed)',
+    ('status',))
+cache_lookups = registry.counter(
+    'cache_lookups_total', 'Cache lookups by result (hit/miss)',
+    ('cache', 'result'))
+db_request_duration = registry.histogram(
+    'db_request_duration_seconds', 'Total time spent in SQL per request',
+    ('blueprint', 'route'))
+db_queries = registry.counter(
+    'db_queries_total', 'SQL statements executed by requests',
+    ('blueprint', 'route'))
+
+
+def record_cache_lookup(cache, hit):
+    """Count a lookup in a named in-process cache"""
+    cache_lookups.inc(cache, 'hit' if hit else 'miss')
+
+
+def _count_compiled_cache(conn, cursor, statement, parameters, context, executemany):
+    """SQLAlchemy's compiled statement cache is the hottest cache we have"""
+    cache_hit = getattr(context, 'cache_hit', None)
+    if cache_hit is CACHE_HIT:
+        cache_lookups.inc('sqlalchemy_compiled', 'hit')
+    elif cache_hit is CACHE_MISS:
+        cache_lookups.inc('sqlalchemy_compiled', 'miss')
+
+
+def instrument_engine(engine):
+    """Count compiled-statement cache hits on an engine (idempotent)"""
+    if not event.contains(engine, 'after_cursor_execute', _count_compiled_cache):
+        event.listen(engine, 'after_cursor_execute', _count_compiled_cache)
+
+
+class Metrics:
+    """Flask extension recording request metrics and serving /metrics"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, engines=()):
+        """
+        Args:
+            app: Flask application
+            engines: Engines whose compiled-cache hits should be counted
+        """
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_MULTIPROC_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        registry.multiproc_dir = app.config['METRICS_MULTIPROC_DIR']
+        registry.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        if registry.multiproc_dir:
+            os.makedirs(registry.multiproc_dir, exist_ok=True)
+            atexit.register(registry.flush)
+
+        for engine in engines:
+            instrument_engine(engine)
+
+        from flask import g, request
+
+        @app.before_request
+        def start_request_timer():
+            g._metrics_start = time.perf_counter()
+
+        @app.after_request
+        def record_request_metrics(response):
+            start = g.pop('_metrics_start', None)
+            if start is None:
+                return response
+
+            route = request.url_rule.rule if request.url_rule else '<unmatched>'
+            blueprint = request.blueprint or ''
+
+            http_request_duration.observe(time.perf_counter() - start, blueprint, route, request.method)
+            http_requests.inc(blueprint, route, request.method, str(response.status_code))
+
+            stats = g.get('_query_stats')
+            if stats is not None:
+                db_request_duration.observe(stats.total_time, blueprint, route)
+                db_queries.inc(blueprint, route, amount=stats.count)
+
+            registry.maybe_flush()
+            return response
+
+
+metrics = Metrics()
@@ -1,6 +1,12 @@
 from datetime import datetime
 from typing import Optional, Dict, Any
+
+from sqlalchemy import event
+from sqlalchemy.ext.hybrid import hybrid_property
+
 from app import db
+from app.dimensions import EVENT_TYPE, DEVICE_TYPE, USER_AGENT, IP_ADDRESS, dimension_attribute
+from app.machine_events import machine_reason_name
 
 
 class Email(db.Model):
@@ -19,13 +25,21 @@ class Email(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Sending through app.mailer: queued, sent, deferred, failed (NULL = sent by the caller)
+    delivery_status = db.Column(db.String(20), index=True)
+    delivery_result = db.Column(db.String(255))  # last SMTP reply or connection error
+    message_id = db.Column(db.String(255))  # Message-ID header of the sent message
+
     # Relationships
     events = db.relationship('TrackingEvent', backref='email', lazy='dynamic', cascade='all, delete-orphan')
+    daily_stats = db.relationship('EmailDailyStats', lazy='dynamic', cascade='all, delete-orphan')
+    unique_ips = db.relationship('EmailUniqueIp', lazy='dynamic', cascade='all, delete-orphan')
     campaign = db.relationship('Campaign', back_populates='emails')
     template = db.relationship('Template', back_populates='emails')
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert email to dictionary"""
+        compacted = self.compacted_counts()
         return {
             'id': self.id,
             'tracking_id': self.tracking_id,
@@ -38,31 +52,73 @@ class Email(db.Model):
             'sent_at': self.sent_at.isoformat() if self.sent_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'total_opens': self.events.filter_by(event_type='open').count(),
-            'total_clicks': self.events.filter_by(event_type='click').count()
+            'total_opens': self.event_hits('open') + compacted.get('open', 0),
+            'total_clicks': self.event_hits('click') + compacted.get('click', 0)
         }
 
+    def event_hits(self, event_type) -> int:
+        """Raw events of a type, counting collapsed repeats"""
+        return self.events.filter_by(event_type=event_type).with_entities(
+            db.func.coalesce(db.func.sum(TrackingEvent.hits), 0)).scalar()
+
+    def compacted_counts(self) -> Dict[str, int]:
+        """Event counts per type that retention has rolled into daily aggregates"""
+        return dict(self.daily_stats.with_entities(
+            EmailDailyStats.event_type, db.func.sum(EmailDailyStats.event_count)
+        ).group_by(EmailDailyStats.event_type).all())
+
 
 class TrackingEvent(db.Model):
     """Model for tracking email events (opens, clicks, etc.)"""
     __tablename__ = 'tracking_events'
+    # With time partitioning, tracking_events is a view and deletes go through
+    # an INSTEAD OF trigger, which SQLite reports as 0 rows changed
+    __mapper_args__ = {'confirm_deleted_rows': False}
 
     id = db.Column(db.Integer, primary_key=True)
     email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), nullable=False, index=True)
-    event_type = db.Column(db.String(50), nullable=False)  # 'open', 'click', 'bounce', etc.
+
+    # Repetitive attributes are stored as keys into dimension tables (see app.dimensions)
+    event_type_id = db.Column(db.SmallInteger, db.ForeignKey('event_types.id'), nullable=False)
+    device_type_id = db.Column(db.SmallInteger, db.ForeignKey('device_types.id'))
+    user_agent_id = db.Column(db.BigInteger, db.ForeignKey('user_agents.id'))
+    ip_address_id = db.Column(db.BigInteger, db.ForeignKey('ip_addresses.id'))
+
+    # ... exposed as strings: 'open', 'click', 'bounce', etc.; desktop, mobile, tablet
+    event_type = dimension_attribute(EVENT_TYPE)
+    device_type = dimension_attribute(DEVICE_TYPE)
+    user_agent = dimension_attribute(USER_AGENT)
+    ip_address = dimension_attribute(IP_ADDRESS)  # IPv6 support
 
     # Event metadata
-    ip_address = db.Column(db.String(45))  # IPv6 support
-    user_agent = db.Column(db.String(500))
     location = db.Column(db.String(255))  # City, Country
-    device_type = db.Column(db.String(50))  # desktop, mobile, tablet
 
     # Click-specific data
     clicked_url = db.Column(db.String(2048))
 
+    # Why ingest took the event for a machine (app.machine_events.MACHINE_REASONS), 0 = human
+    machine_reason = db.Column(db.SmallInteger, nullable=False, default=0, server_default='0', index=True)
+
+    # Later identical opens folded into this row (app.repeat_opens)
+    repeat_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
+    @hybrid_property
+    def hits(self):
+        """Hits the row stands for - itself plus collapsed repeats (sum this, not count rows)"""
+        return 1 + (self.repeat_count or 0)
+
+    @hits.expression
+    def hits(cls):
+        return 1 + cls.repeat_count
+
+    @property
+    def is_machine(self) -> bool:
+        """Whether the event was flagged as a machine open or scanner click"""
+        return bool(self.machine_reason)
+
     def to_dict(self) -> Dict[str, Any]:
         """Convert tracking event to dictionary"""
         return {
@@ -74,10 +130,224 @@ class TrackingEvent(db.Model):
             'location': self.location,
             'device_type': self.device_type,
             'clicked_url': self.clicked_url,
+            'machine_reason': machine_reason_name(self.machine_reason),
+            'repeat_count': self.repeat_count or 0,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class EventType(db.Model):
+    """Event type codes (built-in types are seeded with fixed codes)"""
+    __tablename__ = 'event_types'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(50), unique=True, nullable=False)
+
+
+class DeviceType(db.Model):
+    """Device type codes (built-in types are seeded with fixed codes)"""
+    __tablename__ = 'device_types'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(50), unique=True, nullable=False)
+
+
+class UserAgent(db.Model):
+    """Distinct user agent strings, keyed by value_hash"""
+    __tablename__ = 'user_agents'
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    value = db.Column(db.String(500), nullable=False)
+
+    # Filled in by the enrichment pipeline (app.enrichment); NULL enriched_at = pending
+    device_type_id = db.Column(db.SmallInteger, db.ForeignKey('device_types.id'))
+    browser = db.Column(db.String(50))
+    os = db.Column(db.String(50))
+    is_bot = db.Column(db.Boolean)
+    enriched_at = db.Column(db.DateTime, index=True)
+
+
+class IpAddress(db.Model):
+    """Distinct IP addresses, keyed by value_hash"""
+    __tablename__ = 'ip_addresses'
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    value = db.Column(db.String(45), nullable=False)
+
+    # Filled in by the enrichment pipeline (app.enrichment); NULL enriched_at = pending
+    location = db.Column(db.String(255))
+    enriched_at = db.Column(db.DateTime, index=True)
+
+
+class EnrichmentState(db.Model):
+    """Progress of an enrichment pipeline: every event id up to high_water_mark is enriched"""
+    __tablename__ = 'enrichment_state'
+
+    name = db.Column(db.String(50), primary_key=True)
+    high_water_mark = db.Column(db.BigInteger, nullable=False, default=0)
+    # Bumped by every re-enrichment of history and every delete of stored events
+    # (app.enrichment.bump_generation), so caches of event rows know to reload
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IdempotencyKey(db.Model):
+    """Idempotency key of a tracked event and the response first returned for it (see app.idempotency)"""
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(255), primary_key=True)
+    response = db.Column(db.Text, nullable=False)  # JSON of the event's to_dict()
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class HeavyHitterSketch(db.Model):
+    """Most frequent values of one dimension, per campaign or over all of them (see app.heavy_hitters)"""
+    __tablename__ = 'heavy_hitter_sketches'
+
+    dimension = db.Column(db.String(20), primary_key=True)  # links, domains, ips, user_agents
+    campaign_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0 = all campaigns
+    total = db.Column(db.BigInteger, nullable=False, default=0)  # hits counted
+    floor = db.Column(db.BigInteger, nullable=False, default=0)  # most hits of any value not in entries
+    entries = db.Column(db.Text, nullable=False, default='[]')  # JSON [[value, count, error], ...], most hits first
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class WebhookEndpoint(db.Model):
+    """Downstream URL that recorded tracking events are pushed to in batches (see app.webhooks)"""
+    __tablename__ = 'webhook_endpoints'
+
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(2048), nullable=False)
+    secret = db.Column(db.String(64), nullable=False)  # HMAC-SHA256 key of the X-Webhook-Signature header
+    # Filters: comma-separated event types and a campaign id, NULL = all
+    event_types = db.Column(db.String(255))
+    campaign_id = db.Column(db.Integer)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    # Every event id up to here has been batched into the outbox (or did not match the filters)
+    high_water_mark = db.Column(db.BigInteger, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    deliveries = db.relationship('WebhookDelivery', lazy='dynamic', cascade='all, delete-orphan')
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert webhook endpoint to dictionary (without the secret)"""
+        return {
+            'id': self.id,
+            'url': self.url,
+            'event_types': self.event_types.split(',') if self.event_types else None,
+            'campaign_id': self.campaign_id,
+            'active': self.active,
+            'high_water_mark': self.high_water_mark,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class WebhookDelivery(db.Model):
+    """Outbox row: one batch of events waiting to be POSTed to an endpoint (deleted once delivered)"""
+    __tablename__ = 'webhook_deliveries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    endpoint_id = db.Column(db.Integer, db.ForeignKey('webhook_endpoints.id'), nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False)  # JSON request body
+    event_count = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, failed (gave up)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert webhook delivery to dictionary (without the payload)"""
+        return {
+            'id': self.id,
+            'endpoint_id': self.endpoint_id,
+            'event_count': self.event_count,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 
+@event.listens_for(EventType.__table__, 'after_create')
+@event.listens_for(DeviceType.__table__, 'after_create')
+def _insert_builtin_codes(table, connection, **kw):
+    dimension = EVENT_TYPE if table.name == EVENT_TYPE.table_name else DEVICE_TYPE
+    connection.execute(table.insert(), [{'id': code, 'value': value} for value, code in dimension.builtins.items()])
+
+
+class EmailDailyStats(db.Model):
+    """Tracking events of one email, day, type and device rolled up by the retention job"""
+    __tablename__ = 'email_daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('email_id', 'day', 'event_type', 'device_type', name='uq_email_daily_stats_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    device_type = db.Column(db.String(50))
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    machine_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # of event_count
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert daily email aggregate to dictionary"""
+        return {
+            'email_id': self.email_id,
+            'day': self.day.isoformat(),
+            'event_type': self.event_type,
+            'device_type': self.device_type,
+            'event_count': self.event_count,
+            'machine_count': self.machine_count,
+            'first_at': self.first_at.isoformat(),
+            'last_at': self.last_at.isoformat()
+        }
+
+
+class EmailUniqueIp(db.Model):
+    """Distinct IPs seen per email and event type in compacted events (keeps unique counts exact)"""
+    __tablename__ = 'email_unique_ips'
+    __table_args__ = (
+        db.UniqueConstraint('email_id', 'event_type', 'ip_address', name='uq_email_unique_ips_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), nullable=False, index=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    ip_address = db.Column(db.String(45), nullable=False)
+    # Every compacted event from this IP was a machine one (left out by exclude_machine)
+    machine_only = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+
+class CampaignDailyStats(db.Model):
+    """Tracking events of one campaign, day and type rolled up by the retention job"""
+    __tablename__ = 'campaign_daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'day', 'event_type', name='uq_campaign_daily_stats_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    email_count = db.Column(db.Integer, nullable=False, default=0)  # emails with at least one such event that day
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert daily campaign aggregate to dictionary"""
+        return {
+            'campaign_id': self.campaign_id,
+            'day': self.day.isoformat(),
+            'event_type': self.event_type,
+            'event_count': self.event_count,
+            'email_count': self.email_count
+        }
+
+
 class Campaign(db.Model):
     """Model for grouping emails into campaigns"""
     __tablename__ = 'campaigns'
@@ -92,6 +362,7 @@ class Campaign(db.Model):
 
     # Relationships
     emails = db.relationship('Email', back_populates='campaign', lazy='dynamic')
+    daily_stats = db.relationship('CampaignDailyStats', lazy='dynamic', cascade='all, delete-orphan')
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert campaign to dictionary"""
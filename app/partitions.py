@@ -0,0 +1,453 @@
+"""
+Time-partitioned storage for tracking events
+
+With TRACKING_PARTITION_PERIOD set ('month', 'week' or 'day'), events are
+stored in one table per period (tracking_events_p20240101, ...) instead of
+a single ever-growing table:
+
+- `tracking_events` becomes a UNION ALL view over the partitions, so ORM
+  reads (relationships, db.get, counts) keep working unchanged, and SQLite
+  pushes email_id/created_at predicates down to each partition's indexes
+- ingest inserts straight into the partition for the event's created_at
+  (`add()`), creating it on first use
+- range queries use `events(session, start, end)`, which only unions the
+  partitions the range covers
+- dropping a period is a view rebuild plus DROP TABLE - no row-by-row DELETE
+
+Event ids stay unique across partitions: each partition is an AUTOINCREMENT
+table whose sequence starts at period_ordinal << 32, so the id also tells
+which partition a row lives in. Rows migrated from the unpartitioned table
+keep their (small) ids.
+
+This emulates declarative partitioning on SQLite; on PostgreSQL use native
+PARTITION BY RANGE (created_at) instead.
+"""
+
+import re
+from datetime import date, datetime, time, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import Column, Index, MetaData, Table, false, inspect, select, union_all
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import aliased, make_transient_to_detached
+
+from app.dimensions import event_dimensions
+from app.enrichment import bump_generation
+from app.exceptions import ValidationError
+
+BASE_TABLE = 'tracking_events'
+PARTITION_PREFIX = BASE_TABLE + '_p'
+PERIODS = ('month', 'week', 'day')
+_NAME_PATTERN = re.compile(r'^' + PARTITION_PREFIX + r'(\d{8})$')
+
+
+class PartitionScheme:
+    """Maps timestamps to partition periods"""
+
+    def __init__(self, period):
+        if period not in PERIODS:
+            raise ValidationError(f"Unknown partition period: {period} (expected one of {', '.join(PERIODS)})",
+                                  field='TRACKING_PARTITION_PERIOD')
+        self.period = period
+
+    def period_start(self, value):
+        """First day of the period containing a date/datetime"""
+        day = value.date() if isinstance(value, datetime) else value
+        if self.period == 'month':
+            return day.replace(day=1)
+        if self.period == 'week':
+            return day - timedelta(days=day.weekday())
+        return day
+
+    def next_start(self, start):
+        """First day of the following period"""
+        if self.period == 'month':
+            return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        return start + timedelta(days=7 if self.period == 'week' else 1)
+
+    def ordinal(self, start):
+        """Monotonic period number (used for the id range of the partition)"""
+        if self.period == 'month':
+            return start.year * 12 + start.month - 1
+        if self.period == 'week':
+            return start.toordinal() // 7
+        return start.toordinal()
+
+    def name(self, value):
+        return f'{PARTITION_PREFIX}{self.period_start(value):%Y%m%d}'
+
+    @staticmethod
+    def parse(name):
+        """Period start encoded in a partition name (None for other tables)"""
+        match = _NAME_PATTERN.match(name)
+        return datetime.strptime(match.group(1), '%Y%m%d').date() if match else None
+
+    def bounds(self, name):
+        """[start, end) datetimes covered by a partition"""
+        start = self.parse(name)
+        return datetime.combine(start, time.min), datetime.combine(self.next_start(start), time.min)
+
+
+def partition_table(name):
+    """Table object for a partition, with the event columns and per-partition index names"""
+    from app.models import TrackingEvent
+
+    source = TrackingEvent.__table__
+    columns = [Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+                      server_default=column.server_default.arg if column.server_default is not None else None)
+               for column in source.columns]
+    table = Table(name, MetaData(), *columns, sqlite_autoincrement=True)
+    for index in source.indexes:
+        Index(f'ix_{name}_{"_".join(c.name for c in index.columns)}', *[table.c[c.name] for c in index.columns])
+    return table
+
+
+class _PartitionState:
+    """Per-application partitioning state"""
+
+    def __init__(self, scheme):
+        self.scheme = scheme
+        self.known = set()  # partitions known to exist (only ever grows between drops)
+        self.tables = {}  # partition name -> Table
+
+
+class EventPartitions:
+    """Routes tracking event writes and range reads to per-period tables"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRACKING_PARTITION_PERIOD', None)
+
+        period = app.config['TRACKING_PARTITION_PERIOD']
+        if period and not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+            raise ValidationError("Table partitioning is emulated for SQLite only - use native "
+                                  "partitioning on server databases", field='TRACKING_PARTITION_PERIOD')
+
+        app.extensions['event_partitions'] = _PartitionState(PartitionScheme(period) if period else None)
+
+    @property
+    def _state(self):
+        return current_app.extensions['event_partitions']
+
+    @property
+    def enabled(self):
+        """Whether the current app stores events in partitions"""
+        return self._state.scheme is not None
+
+    @property
+    def scheme(self):
+        return self._state.scheme
+
+    # Layout
+
+    def partitions(self, connection):
+        """
+        Existing partitions, oldest first
+
+        Returns:
+            list: (name, start, end) tuples
+        """
+        names = [row[0] for row in connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (PARTITION_PREFIX + '%',))]
+        names = sorted(name for name in names if PartitionScheme.parse(name))
+        return [(name, *self.scheme.bounds(name)) for name in names]
+
+    def install(self, connection):
+        """
+        Switch a database to the partitioned layout (idempotent)
+
+        Moves rows from an existing tracking_events table into partitions,
+        replaces the table with the view and creates the current partition.
+        """
+        kind = connection.exec_driver_sql(
+            "SELECT type FROM sqlite_master WHERE name = ?", (BASE_TABLE,)).scalar()
+
+        if kind == 'table':
+            starts = connection.exec_driver_sql(
+                f"SELECT DISTINCT strftime('%Y-%m-%d', created_at) FROM {BASE_TABLE}").scalars().all()
+            for start in {self.scheme.period_start(date.fromisoformat(value)) for value in starts if value}:
+                table = self._ensure(connection, start, rebuild_view=False)
+                lower, upper = self.scheme.bounds(table.name)
+                columns = ', '.join(c.name for c in table.columns)
+                connection.exec_driver_sql(
+                    f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {BASE_TABLE} "
+                    f"WHERE created_at >= ? AND created_at < ?",
+                    (lower.isoformat(' '), upper.isoformat(' ')))
+            connection.exec_driver_sql(f"DROP TABLE {BASE_TABLE}")
+
+        self._ensure(connection, datetime.utcnow(), rebuild_view=False)
+        self._rebuild_view(connection)
+
+    def _rebuild_view(self, connection):
+        """Recreate the tracking_events view (and its delete trigger) over the current partitions"""
+        names = [name for name, _, _ in self.partitions(connection)]
+        columns = ', '.join(c.name for c in partition_table(names[0]).columns)
+
+        connection.exec_driver_sql(f"DROP VIEW IF EXISTS {BASE_TABLE}")
+        connection.exec_driver_sql(
+            f"CREATE VIEW {BASE_TABLE} AS " +
+            " UNION ALL ".join(f"SELECT {columns} FROM {name}" for name in names))
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER {BASE_TABLE}_delete INSTEAD OF DELETE ON {BASE_TABLE} BEGIN " +
+            " ".join(f"DELETE FROM {name} WHERE id = OLD.id;" for name in names) + " END")
+        self._state.known = set(names) | {BASE_TABLE}
+
+    def _ensure(self, connection, value, rebuild_view=True):
+        """Create the partition for a timestamp if needed and return its table"""
+        state = self._state
+        name = self.scheme.name(value)
+        table = self._table(name)
+        if name in state.known:
+            return table
+
+        table.create(connection, checkfirst=True)
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+        # Start the AUTOINCREMENT sequence at ordinal << 32: a sentinel row bumps
+        # sqlite_sequence and is deleted again (OR IGNORE keeps this idempotent)
+        base = self.scheme.ordinal(self.scheme.period_start(value)) << 32
+        connection.exec_driver_sql(
+            f"INSERT OR IGNORE INTO {name} (id, email_id, event_type_id, created_at) VALUES (?, 0, 0, ?)",
+            (base, datetime.utcnow().isoformat(' ')))
+        connection.exec_driver_sql(f"DELETE FROM {name} WHERE id = ?", (base,))
+
+        if rebuild_view:
+            self._rebuild_view(connection)
+        state.known.add(name)
+        return table
+
+    def _table(self, name):
+        tables = self._state.tables
+        table = tables.get(name)
+        if table is None:
+            table = tables[name] = partition_table(name)
+        return table
+
+    def ensure_partition(self, connection, value):
+        """
+        Table for the partition holding a timestamp, created on first use
+
+        Args:
+            connection: SQLAlchemy connection (the caller commits)
+            value: date or datetime
+
+        Returns:
+            Table: Partition table
+        """
+        if BASE_TABLE not in self._state.known:
+            self._check_layout(connection)
+        return self._ensure(connection, value)
+
+    def _check_layout(self, connection):
+        kind = connection.exec_driver_sql(
+            "SELECT type FROM sqlite_master WHERE name = ?", (BASE_TABLE,)).scalar()
+        if kind != 'view':
+            self.install(connection)
+        else:
+            self._state.known = {name for name, _, _ in self.partitions(connection)} | {BASE_TABLE}
+
+    def drop_partition(self, connection, name):
+        """
+        Drop a whole period - the view is rebuilt without it, then the table is dropped
+
+        Raises:
+            ValidationError: If the name is not an existing partition, or is the only one
+        """
+        existing = [partition for partition, _, _ in self.partitions(connection)]
+        if name not in existing:
+            raise ValidationError(f"Not a partition: {name}", field='name')
+        if len(existing) == 1:
+            raise ValidationError("Cannot drop the only partition", field='name')
+
+        connection.exec_driver_sql(f"DROP TABLE {name}")
+        self._rebuild_view(connection)
+        bump_generation(connection)
+
+    def drop_before(self, connection, cutoff):
+        """Drop every partition that ends on or before `cutoff`; returns the dropped names"""
+        dropped = []
+        for name, _, end in self.partitions(connection):
+            if end <= cutoff:
+                self.drop_partition(connection, name)
+                dropped.append(name)
+        return dropped
+
+    def drop_all(self, connection):
+        """Remove the view and every partition (drop-db)"""
+        connection.exec_driver_sql(f"DROP VIEW IF EXISTS {BASE_TABLE}")
+        for name, _, _ in self.partitions(connection):
+            connection.exec_driver_sql(f"DROP TABLE {name}")
+        self._state.known = set()
+
+    # Writes
+
+    def add(self, session, event):
+        """
+        Insert a new TrackingEvent into its partition and attach it to the session
+
+        The row is written with a Core INSERT (the ORM would target the view);
+        the instance is then attached as persistent, so attribute access after
+        commit refreshes it through the view as usual.
+        """
+        from app.models import TrackingEvent
+
+        if event.created_at is None:
+            event.created_at = datetime.utcnow()
+        event_dimensions.intern(session, event)
+        # Core inserts skip the ORM's column defaults - apply the scalar ones here
+        for column in inspect(TrackingEvent).column_attrs:
+            default = column.columns[0].default
+            if getattr(event, column.key) is None and default is not None and default.is_scalar:
+                setattr(event, column.key, default.arg)
+
+        values = {column.key: getattr(event, column.key) for column in inspect(TrackingEvent).column_attrs
+                  if column.key != 'id'}
+        connection = session.connection()
+
+        try:
+            table = self.ensure_partition(connection, event.created_at)
+            result = connection.execute(table.insert().values(**values))
+        except OperationalError:
+            # Partition cache outlived a rolled-back creation - re-read the layout once
+            self._state.known = set()
+            table = self.ensure_partition(connection, event.created_at)
+            result = connection.execute(table.insert().values(**values))
+
+        event.id = result.inserted_primary_key[0]
+        make_transient_to_detached(event)
+        session.add(event)
+        return event
+
+    def storage_tables(self, connection):
+        """
+        Tables event rows physically live in, for bulk UPDATEs (the view has no UPDATE trigger)
+
+        Returns:
+            list: The partitions when tracking_events is a view, else tracking_events itself
+        """
+        from app.models import TrackingEvent
+
+        if not self.enabled or connection.exec_driver_sql(
+                "SELECT type FROM sqlite_master WHERE name = ?", (BASE_TABLE,)).scalar() != 'view':
+            return [TrackingEvent.__table__]
+        return [self._table(name) for name, _, _ in self.partitions(connection)]
+
+    # Reads
+
+    def events(self, session, start=None, end=None):
+        """
+        TrackingEvent entity to query for a created_at range
+
+        With partitioning enabled and a bounded range, this is an alias over
+        the union of only the partitions that overlap [start, end); otherwise
+        it is TrackingEvent itself. Callers still filter on created_at.
+
+        Args:
+            session: Session the query will run on
+            start: Inclusive lower bound (datetime or None)
+            end: Exclusive upper bound (datetime or None)
+        """
+        from app.models import TrackingEvent
+
+        if not self.enabled or (start is None and end is None):
+            return TrackingEvent
+
+        connection = session.connection()
+        if connection.exec_driver_sql(
+                "SELECT type FROM sqlite_master WHERE name = ?", (BASE_TABLE,)).scalar() != 'view':
+            return TrackingEvent
+
+        tables = [self._table(name) for name, lower, upper in self.partitions(connection)
+                  if (end is None or lower < end) and (start is None or upper > start)]
+        if not tables:
+            # Nothing covers the range - an always-empty select keeps the query shape
+            source = TrackingEvent.__table__
+            return aliased(TrackingEvent, select(source).where(false()).subquery('tracking_events_pruned'),
+                           adapt_on_names=True)
+
+        selects = [select(*[table.c[column.name] for column in TrackingEvent.__table__.columns])
+                   for table in tables]
+        union = selects[0] if len(selects) == 1 else union_all(*selects)
+        return aliased(TrackingEvent, union.subquery('tracking_events_pruned'), adapt_on_names=True)
+
+
+event_partitions = EventPartitions()
+
+
+partitions_cli = AppGroup('partitions', help='Manage time partitions of tracking_events')
+
+
+def _require_enabled():
+    if not event_partitions.enabled:
+        raise click.ClickException("Partitioning is disabled - set TRACKING_PARTITION_PERIOD")
+
+
+@partitions_cli.command('install')
+def install_command():
+    """Switch tracking_events to the partitioned layout (moves existing rows)"""
+    from app import db
+
+    _require_enabled()
+    with db.engine.begin() as connection:
+        event_partitions.install(connection)
+        count = len(event_partitions.partitions(connection))
+    click.echo(f"tracking_events is partitioned by {event_partitions.scheme.period} ({count} partitions)")
+
+
+@partitions_cli.command('list')
+def list_command():
+    """List partitions with their ranges and row counts"""
+    from app import db
+
+    _require_enabled()
+    with db.engine.connect() as connection:
+        for name, start, end in event_partitions.partitions(connection):
+            rows = connection.exec_driver_sql(f"SELECT COUNT(*) FROM {name}").scalar()
+            click.echo(f"{name}  {start:%Y-%m-%d} .. {end:%Y-%m-%d}  {rows} rows")
+
+
+@partitions_cli.command('create')
+@click.option('--ahead', default=1, show_default=True, help='Future periods to create after the current one')
+def create_command(ahead):
+    """Create the current partition and the next --ahead ones (run from cron)"""
+    from app import db
+
+    _require_enabled()
+    scheme = event_partitions.scheme
+    start = scheme.period_start(datetime.utcnow())
+    with db.engine.begin() as connection:
+        for _ in range(ahead + 1):
+            click.echo(event_partitions.ensure_partition(connection, start).name)
+            start = scheme.next_start(start)
+
+
+@partitions_cli.command('drop')
+@click.argument('name', required=False)
+@click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Drop every partition that ends on or before this date')
+def drop_command(name, before):
+    """Drop one partition, or all partitions before a date"""
+    from app import db
+
+    _require_enabled()
+    if bool(name) == bool(before):
+        raise click.UsageError("Give either a partition NAME or --before")
+
+    try:
+        with db.engine.begin() as connection:
+            dropped = [name] if name else []
+            if name:
+                event_partitions.drop_partition(connection, name)
+            else:
+                dropped = event_partitions.drop_before(connection, before)
+    except ValidationError as e:
+        raise click.ClickException(str(e))
+
+    for dropped_name in dropped:
+        click.echo(f"dropped {dropped_name}")
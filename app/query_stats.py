@@ -0,0 +1,210 @@
+"""
+Per-request SQL query counting and N+1 detection
+
+Engine events time every statement executed while a collector is active.
+Statements are grouped by their SQL text, so a lazy relationship fired in a
+loop shows up as the same statement executed many times with different
+parameters - the N+1 signature. Re-running a statement with the same
+parameters (polling a row, say) is wasteful but not an N+1, so only the
+distinct parameter sets count towards the threshold.
+
+In debug mode the per-request totals are returned as X-Query-* response
+headers; otherwise they are written as one JSON log line per request on the
+'app.sql' logger. With SQL_N_PLUS_ONE_RAISE set (the testing profile), any
+statement run with SQL_N_PLUS_ONE_THRESHOLD or more parameter sets fails the request
+with NPlusOneError so regressions break the test suite.
+"""
+
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request
+from sqlalchemy import event
+
+from app.exceptions import NPlusOneError
+
+logger = logging.getLogger('app.sql')
+
+_current_stats = ContextVar('query_stats', default=None)
+
+
+class QueryStats:
+    """Queries executed while a collector is active"""
+
+    def __init__(self, parent=None):
+        """
+        Args:
+            parent: Enclosing collector - it sees every statement recorded here too
+        """
+        self.parent = parent
+        self.count = 0
+        self.total_time = 0.0
+        self.statements = Counter()
+        self._parameters = {}
+
+    def record(self, statement, parameters, duration):
+        self.count += 1
+        self.total_time += duration
+        self.statements[statement] += 1
+        self._parameters.setdefault(statement, set()).add(repr(parameters))
+        if self.parent is not None:
+            self.parent.record(statement, parameters, duration)
+
+    def repeated(self, threshold):
+        """
+        Statements executed with at least `threshold` distinct parameter sets
+
+        Args:
+            threshold: Minimum number of distinct parameter sets
+
+        Returns:
+            list: (statement, executions, distinct parameter sets) tuples, most repeated first
+        """
+        return [
+            (statement, executions, len(self._parameters[statement]))
+            for statement, executions in self.statements.most_common()
+            if len(self._parameters[statement]) >= threshold
+        ]
+
+    @property
+    def max_repeat(self):
+        """Executions of the most repeated statement"""
+        most_common = self.statements.most_common(1)
+        return most_common[0][1] if most_common else 0
+
+
+@contextmanager
+def count_queries():
+    """
+    Collect query stats for the enclosed block
+
+    Collectors nest: an outer block also counts queries made by requests
+    (which collect their own stats) issued inside it.
+
+    Usage:
+        with count_queries() as stats:
+            service.get_campaign_stats(campaign_id)
+        assert not stats.repeated(threshold=5)
+    """
+    stats = QueryStats(parent=_current_stats.get())
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def current_query_stats():
+    """Stats for the active collector (None when nothing is collecting)"""
+    return _current_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_stats.get() is not None:
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    if stats is None:
+        return
+
+    start_times = conn.info.get('query_start_time')
+    if not start_times:
+        return
+
+    stats.record(' '.join(statement.split()), parameters, time.perf_counter() - start_times.pop())
+
+
+def instrument_engine(engine):
+    """Attach the timing listeners to an engine (idempotent)"""
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class QueryInstrumentation:
+    """Flask extension reporting per-request query counts and N+1 suspects"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, engines=()):
+        """
+        Args:
+            app: Flask application
+            engines: Engines to instrument
+        """
+        app.config.setdefault('SQL_QUERY_STATS', True)
+        app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 10)
+        app.config.setdefault('SQL_N_PLUS_ONE_RAISE', False)
+
+        if not app.config['SQL_QUERY_STATS']:
+            return
+
+        for engine in engines:
+            instrument_engine(engine)
+
+        @app.before_request
+        def start_query_stats():
+            g._query_stats = QueryStats(parent=_current_stats.get())
+            g._query_stats_token = _current_stats.set(g._query_stats)
+
+        @app.after_request
+        def report_query_stats(response):
+            stats = g.get('_query_stats')
+            if stats is None:
+                return response
+
+            threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+            repeated = stats.repeated(threshold)
+
+            if app.debug:
+                response.headers['X-Query-Count'] = str(stats.count)
+                response.headers['X-Query-Time-Ms'] = f'{stats.total_time * 1000:.2f}'
+                response.headers['X-Query-Max-Repeat'] = str(stats.max_repeat)
+            else:
+                logger.info(json.dumps({
+                    'event': 'sql_stats',
+                    'method': request.method,
+                    'path': request.path,
+                    'endpoint': request.endpoint,
+                    'status': response.status_code,
+                    'queries': stats.count,
+                    'db_time_ms': round(stats.total_time * 1000, 2),
+                    'max_repeat': stats.max_repeat,
+                }))
+
+            if repeated:
+                statement, executions, distinct = repeated[0]
+                logger.warning(json.dumps({
+                    'event': 'sql_n_plus_one',
+                    'method': request.method,
+                    'path': request.path,
+                    'endpoint': request.endpoint,
+                    'statement': statement,
+                    'executions': executions,
+                    'distinct_parameters': distinct,
+                }))
+
+                if app.config['SQL_N_PLUS_ONE_RAISE']:
+                    raise NPlusOneError(
+                        f"{request.method} {request.path} executed the same statement "
+                        f"{executions} times with {distinct} parameter sets (threshold {threshold}): {statement}"
+                    )
+
+            return response
+
+        @app.teardown_request
+        def stop_query_stats(exc):
+            token = g.pop('_query_stats_token', None)
+            if token is not None:
+                _current_stats.reset(token)
+
+
+query_instrumentation = QueryInstrumentation()
@@ -0,0 +1,139 @@
+"""
+Lightweight read models for listing endpoints
+
+Listings only serialize what they load, so they select plain columns and
+wrap each row in a NamedTuple instead of building mapped objects (no identity
+map entry, change tracking or relationship proxies). to_dict() returns exactly
+what the matching model's to_dict() does, and the attribute names are the
+same, so callers can use either.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import func
+
+from app.machine_events import machine_reason_name
+from app.models import Email, Campaign, TrackingEvent, EmailDailyStats
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+class EmailRow(NamedTuple):
+    """Read-only email with its campaign name and open/click totals (see Email.to_dict)"""
+    id: int
+    tracking_id: str
+    recipient_email: str
+    sender_email: str
+    subject: Optional[str]
+    campaign_id: Optional[int]
+    template_id: Optional[int]
+    campaign_name: Optional[str]
+    sent_at: Optional[datetime]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    total_opens: int = 0
+    total_clicks: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert email row to dictionary"""
+        return {
+            'id': self.id,
+            'tracking_id': self.tracking_id,
+            'recipient_email': self.recipient_email,
+            'sender_email': self.sender_email,
+            'subject': self.subject,
+            'campaign_id': self.campaign_id,
+            'template_id': self.template_id,
+            'campaign_name': self.campaign_name,
+            'sent_at': _isoformat(self.sent_at),
+            'created_at': _isoformat(self.created_at),
+            'updated_at': _isoformat(self.updated_at),
+            'total_opens': self.total_opens,
+            'total_clicks': self.total_clicks
+        }
+
+
+class EventRow(NamedTuple):
+    """Read-only tracking event (see TrackingEvent.to_dict)"""
+    id: int
+    email_id: int
+    event_type: str
+    ip_address: Optional[str]
+    user_agent: Optional[str]
+    location: Optional[str]
+    device_type: Optional[str]
+    clicked_url: Optional[str]
+    created_at: Optional[datetime]
+    # Archive segments written before machine_reason was archived read as human
+    machine_reason: int = 0
+    repeat_count: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert tracking event row to dictionary"""
+        return {
+            'id': self.id,
+            'email_id': self.email_id,
+            'event_type': self.event_type,
+            'ip_address': self.ip_address,
+            'user_agent': self.user_agent,
+            'location': self.location,
+            'device_type': self.device_type,
+            'clicked_url': self.clicked_url,
+            'machine_reason': machine_reason_name(self.machine_reason),
+            'repeat_count': self.repeat_count,
+            'created_at': _isoformat(self.created_at)
+        }
+
+
+EMAIL_COLUMNS = [getattr(Email, name) for name in EmailRow._fields[:7]] + [Campaign.name] + \
+    [getattr(Email, name) for name in ('sent_at', 'created_at', 'updated_at')]
+
+
+def email_rows(session, query, limit=None, offset=0) -> List[EmailRow]:
+    """
+    Load a page of emails as EmailRow
+
+    Args:
+        session: Session to count events through
+        query: Filtered query over Email
+        limit: Page size (optional)
+        offset: Emails to skip
+
+    Returns:
+        list: EmailRow per email in id order - three statements in total,
+              however many emails the page holds
+    """
+    rows = query.outerjoin(Campaign, Campaign.id == Email.campaign_id).with_entities(
+        *EMAIL_COLUMNS).order_by(Email.id).limit(limit).offset(offset).all()
+    if not rows:
+        return []
+
+    counts = event_counts(session, [row.id for row in rows])
+    return [EmailRow(*row, counts.get((row.id, 'open'), 0), counts.get((row.id, 'click'), 0))
+            for row in rows]
+
+
+def event_counts(session, email_ids) -> Dict[tuple, int]:
+    """
+    Open and click totals of several emails, raw plus compacted
+
+    Returns:
+        dict: (email_id, event_type) -> count
+    """
+    counts = {}
+    for model, count in ((TrackingEvent, func.sum(TrackingEvent.hits)),
+                         (EmailDailyStats, func.sum(EmailDailyStats.event_count))):
+        grouped = session.query(model.email_id, model.event_type, count).filter(
+            model.email_id.in_(email_ids), model.event_type.in_(('open', 'click'))
+        ).group_by(model.email_id, model.event_type)
+        for email_id, event_type, total in grouped:
+            counts[email_id, event_type] = counts.get((email_id, event_type), 0) + total
+    return counts
+
+
+def event_columns(events):
+    """Columns of a TrackingEvent entity (or partition alias) in EventRow order"""
+    return [getattr(events, name) for name in EventRow._fields]
@@ -0,0 +1,129 @@
+"""
+Collapsing of repeat opens into the event they repeat
+
+A recipient re-opening the same email in the same client produces a burst of
+identical open rows - same email, IP and user agent within minutes. With
+TRACKING_COLLAPSE_SECONDS set, ingest remembers the row each such open was
+written to, and an open that repeats it within that many seconds of the row's
+created_at only increments its repeat_count (an UPDATE of one unindexed
+column) instead of inserting a row and updating every tracking_events index.
+
+Counts stay exact: a row stands for 1 + repeat_count hits
+(TrackingEvent.hits), which every total in analytics, listings, retention and
+the archive sums up. What collapsing gives up is the timestamp of each
+repeat - they are counted at the first open's created_at. Unique counts are
+unaffected, since repeats share the IP.
+
+The map of recent opens is per worker and bounded (TRACKING_COLLAPSE_KEYS,
+least recently opened evicted first); each worker writes at most one row per
+key and window. Opens classified differently (app.machine_events) never
+collapse into each other, so exclude_machine stays exact.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from flask import current_app
+
+from app.exceptions import ValidationError
+
+
+class _CollapseState:
+    """Per-application map of recent opens"""
+
+    def __init__(self, config):
+        self.max_keys = config['TRACKING_COLLAPSE_KEYS']
+        # (email_id, ip_address, user_agent, machine_reason) -> [table, event id, created_at, repeat_count]
+        self.recent = OrderedDict()
+
+
+class RepeatOpens:
+    """Remembers recent opens so repeats can be folded into them (see module docstring)"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRACKING_COLLAPSE_SECONDS', 0)
+        app.config.setdefault('TRACKING_COLLAPSE_KEYS', 100000)
+
+        if app.config['TRACKING_COLLAPSE_SECONDS'] < 0:
+            raise ValidationError("Collapse window cannot be negative", field='TRACKING_COLLAPSE_SECONDS')
+        if app.config['TRACKING_COLLAPSE_KEYS'] < 1:
+            raise ValidationError("Collapse map needs room for at least one open", field='TRACKING_COLLAPSE_KEYS')
+
+        app.extensions['repeat_opens'] = _CollapseState(app.config)
+
+    @property
+    def _state(self):
+        return current_app.extensions['repeat_opens']
+
+    @property
+    def enabled(self):
+        """Whether repeat opens are collapsed (TRACKING_COLLAPSE_SECONDS > 0)"""
+        return current_app.config['TRACKING_COLLAPSE_SECONDS'] > 0
+
+    @staticmethod
+    def key(event):
+        """Collapse key of an open: repeats share email, IP, user agent and classification"""
+        return event.email_id, event.ip_address, event.user_agent, event.machine_reason
+
+    def find(self, event):
+        """
+        Earlier open a new open repeats
+
+        Args:
+            event: New open (email_id, ip_address, user_agent, machine_reason
+                   and created_at set)
+
+        Returns:
+            tuple: (table, event id) of the row to increment, or None
+        """
+        state = self._state
+        key = self.key(event)
+        window = timedelta(seconds=current_app.config['TRACKING_COLLAPSE_SECONDS'])
+        with self._lock:
+            entry = state.recent.get(key)
+            if entry is None:
+                return None
+            table, event_id, created_at, _ = entry
+            if not created_at <= event.created_at < created_at + window:
+                del state.recent[key]
+                return None
+            state.recent.move_to_end(key)
+        return table, event_id
+
+    def remember(self, event, table):
+        """Make a newly written open the one later repeats collapse into"""
+        state = self._state
+        with self._lock:
+            state.recent[self.key(event)] = [table, event.id, event.created_at, 0]
+            state.recent.move_to_end(self.key(event))
+            while len(state.recent) > state.max_keys:
+                state.recent.popitem(last=False)
+
+    def repeated(self, event):
+        """
+        Count a repeat written to the remembered row
+
+        Returns:
+            int: The row's repeat_count - exact, since only the worker that
+                 wrote a row ever collapses into it
+        """
+        with self._lock:
+            entry = self._state.recent.get(self.key(event))
+            if entry is None:
+                return None
+            entry[3] += 1
+            return entry[3]
+
+    def forget(self, event):
+        """Drop the remembered row of an open's key (it no longer exists)"""
+        with self._lock:
+            self._state.recent.pop(self.key(event), None)
+
+
+repeat_opens = RepeatOpens()
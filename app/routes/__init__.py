@@ -3,5 +3,6 @@ from .campaign import campaign_bp
 from .tracking import tracking_bp
 from .analytics import analytics_bp
 from .templates import template_bp
+from .metrics import metrics_bp
 
-__all__ = ['email_bp', 'campaign_bp', 'tracking_bp', 'analytics_bp', 'template_bp']
\ No newline at end of file
+__all__ = ['email_bp', 'campaign_bp', 'tracking_bp', 'analytics_bp', 'template_bp', 'metrics_bp']
\ No newline at end of file
@@ -1,6 +1,10 @@
-from flask import Blueprint, request, jsonify
+import json
+
+from flask import Blueprint, Response, current_app, request, jsonify
 from app.services.analytics_service import AnalyticsService
+from app.event_stream import event_stream
 from app.exceptions import NotFoundError, ValidationError, EmailTrackerException
+from app.utils import parse_datetime
 
 # Blueprint for analytics
 analytics_bp = Blueprint('analytics', __name__)
@@ -9,22 +13,34 @@ analytics_bp = Blueprint('analytics', __name__)
 analytics_service = AnalyticsService()
 
 
+def _exclude_machine():
+    """The exclude_machine query flag (see app.machine_events)"""
+    return request.args.get('exclude_machine', 'false').lower() in ('1', 'true', 'yes')
+
+
 @analytics_bp.route('/overview', methods=['GET'])
 def analytics_overview():
     """
     GET /api/analytics/overview
     Get overall analytics summary (global stats)
-    Query params: campaign_id (optional, filter by campaign)
+    Query params: campaign_id (optional, filter by campaign),
+                  start_date, end_date (optional ISO 8601 event range for global stats),
+                  exclude_machine (optional, leave out machine opens and scanner clicks)
     """
     try:
         campaign_id = request.args.get('campaign_id', type=int)
+        exclude_machine = _exclude_machine()
 
         if campaign_id:
             # Get campaign-specific stats
-            stats = analytics_service.get_campaign_stats(campaign_id)
+            stats = analytics_service.get_campaign_stats(campaign_id, exclude_machine=exclude_machine)
         else:
             # Get global stats
-            stats = analytics_service.get_global_stats()
+            stats = analytics_service.get_global_stats(
+                start_date=parse_datetime(request.args.get('start_date')),
+                end_date=parse_datetime(request.args.get('end_date')),
+                exclude_machine=exclude_machine
+            )
 
         return jsonify(stats), 200
 
@@ -32,6 +48,8 @@ def analytics_overview():
         return jsonify({'error': str(e)}), 404
     except EmailTrackerException as e:
         return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except ValueError as e:
+        return jsonify({'error': 'Invalid parameter type', 'details': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
@@ -41,9 +59,10 @@ def email_analytics(email_id):
     """
     GET /api/analytics/email/<id>
     Get detailed analytics for a specific email
+    Query params: exclude_machine (optional, leave out machine opens and scanner clicks)
     """
     try:
-        stats = analytics_service.get_email_stats(email_id)
+        stats = analytics_service.get_email_stats(email_id, exclude_machine=_exclude_machine())
 
         return jsonify(stats), 200
 
@@ -60,9 +79,136 @@ def campaign_analytics(campaign_id):
     """
     GET /api/analytics/campaign/<id>
     Get analytics for all emails in a campaign
+    Query params: exclude_machine (optional, leave out machine opens and scanner clicks)
+    """
+    try:
+        stats = analytics_service.get_campaign_stats(campaign_id, exclude_machine=_exclude_machine())
+
+        return jsonify(stats), 200
+
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+@analytics_bp.route('/campaign/<int:campaign_id>/daily', methods=['GET'])
+def campaign_daily_analytics(campaign_id):
+    """
+    GET /api/analytics/campaign/<id>/daily
+    Get per-day opens and clicks for a campaign (raw and compacted days alike)
+    Query params: start_date, end_date (optional ISO 8601 range)
+    """
+    try:
+        days = analytics_service.get_campaign_daily_stats(
+            campaign_id,
+            start_date=parse_datetime(request.args.get('start_date')),
+            end_date=parse_datetime(request.args.get('end_date'))
+        )
+
+        return jsonify({'campaign_id': campaign_id, 'days': days}), 200
+
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except ValueError as e:
+        return jsonify({'error': 'Invalid parameter type', 'details': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+@analytics_bp.route('/top-<any(links, domains, ips, "user-agents"):dimension>', methods=['GET'])
+@analytics_bp.route('/campaign/<int:campaign_id>/top-<any(links, domains, ips, "user-agents"):dimension>',
+                    methods=['GET'])
+def top_values(dimension, campaign_id=None):
+    """
+    GET /api/analytics/top-<links|domains|ips|user-agents>
+    GET /api/analytics/campaign/<id>/top-<links|domains|ips|user-agents>
+    Most clicked links / link domains, most active IPs / user agents - from
+    the heavy-hitter sketches, with per-value error bounds
+    Query params: limit (default 10, at most 100),
+                  exact (optional, group the raw events instead),
+                  exclude_machine (optional, leave out machine opens and scanner clicks; answered exactly)
     """
     try:
-        stats = analytics_service.get_campaign_stats(campaign_id)
+        top = analytics_service.get_top_values(
+            dimension.replace('-', '_'),
+            campaign_id=campaign_id,
+            limit=request.args.get('limit', 10, type=int),
+            exact=request.args.get('exact', 'false').lower() in ('1', 'true', 'yes'),
+            exclude_machine=_exclude_machine()
+        )
+
+        return jsonify(top), 200
+
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+@analytics_bp.route('/stream', methods=['GET'])
+def live_event_stream():
+    """
+    GET /api/analytics/stream
+    Server-Sent Events of live tracking activity: a `delta` event every
+    EVENT_STREAM_INTERVAL seconds in which hits were recorded, with the hits
+    per event type since the previous one (see app.event_stream)
+    Query params: campaign_id (optional, only that campaign's hits)
+    """
+    try:
+        campaign_id = request.args.get('campaign_id', type=int)
+        if campaign_id is not None:
+            analytics_service.campaign_service.get_campaign(campaign_id)
+
+        subscription = event_stream.subscribe(campaign_id)
+        response = Response(_stream_updates(subscription, current_app.config['EVENT_STREAM_HEARTBEAT']),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # Also runs when the client goes away before the first chunk
+        response.call_on_close(subscription.close)
+        return response
+
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+def _stream_updates(subscription, heartbeat):
+    """SSE body: delta events, with a comment line when idle so proxies keep the connection open"""
+    yield ': connected\n\n'
+    while True:
+        update = subscription.get(timeout=heartbeat)
+        if update is None:
+            yield ': keepalive\n\n'
+        else:
+            yield f'event: delta\ndata: {json.dumps(update)}\n\n'
+
+
+@analytics_bp.route('/archive', methods=['GET'])
+def archive_analytics():
+    """
+    GET /api/analytics/archive
+    Recompute event stats from the cold archive (audits, re-analysis)
+    Query params: start_date, end_date (optional ISO 8601 range), email_id, campaign_id,
+                  exclude_machine (optional, leave out machine opens and scanner clicks)
+    """
+    try:
+        stats = analytics_service.get_archive_stats(
+            start_date=parse_datetime(request.args.get('start_date')),
+            end_date=parse_datetime(request.args.get('end_date')),
+            email_id=request.args.get('email_id', type=int),
+            campaign_id=request.args.get('campaign_id', type=int),
+            exclude_machine=_exclude_machine()
+        )
 
         return jsonify(stats), 200
 
@@ -70,6 +216,8 @@ def campaign_analytics(campaign_id):
         return jsonify({'error': str(e)}), 404
     except EmailTrackerException as e:
         return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except ValueError as e:
+        return jsonify({'error': 'Invalid parameter type', 'details': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
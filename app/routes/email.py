@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from app.services.email_service import EmailService
 from app.services.tracking_service import TrackingService
 from app.exceptions import NotFoundError, ValidationError, EmailTrackerException
+from app.utils import parse_datetime
 
 # Blueprint for email management
 email_bp = Blueprint('emails', __name__)
@@ -89,7 +90,8 @@ def create_email():
         "sender_email": "sender@example.com",
         "subject": "Email subject",
         "body": "Email body HTML",
-        "campaign_id": 1 (optional)
+        "campaign_id": 1 (optional),
+        "queue": true (optional, send it with `flask mail send`)
     }
     """
     try:
@@ -118,7 +120,8 @@ def create_email():
             sender_email=data['sender_email'],
             subject=data.get('subject'),
             body=data.get('body'),
-            campaign_id=data.get('campaign_id')
+            campaign_id=data.get('campaign_id'),
+            queue=bool(data.get('queue', False))
         )
 
         return jsonify({
@@ -199,13 +202,20 @@ def get_email_events(email_id):
     """
     GET /api/emails/<id>/events
     Get all tracking events for a specific email
-    Query params: event_type (open, click, bounce)
+    Query params: event_type (open, click, bounce), start_date, end_date (ISO 8601),
+                  include_archived (true to add events from the cold archive)
     """
     try:
         event_type = request.args.get('event_type')
+        start_date = parse_datetime(request.args.get('start_date'))
+        end_date = parse_datetime(request.args.get('end_date'))
+        include_archived = request.args.get('include_archived', 'false').lower() in ('1', 'true', 'yes')
 
         # Use tracking service to get events
-        events = tracking_service.get_events_for_email(email_id, event_type=event_type)
+        events = tracking_service.get_events_for_email(
+            email_id, event_type=event_type, start_date=start_date, end_date=end_date,
+            include_archived=include_archived
+        )
 
         return jsonify({
             'email_id': email_id,
@@ -217,5 +227,7 @@ def get_email_events(email_id):
         return jsonify({'error': str(e)}), 404
     except EmailTrackerException as e:
         return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except ValueError as e:
+        return jsonify({'error': 'Invalid parameter type', 'details': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
@@ -0,0 +1,14 @@
+from flask import Blueprint, Response
+from app.metrics import registry
+
+# Blueprint for Prometheus metrics
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/', methods=['GET'])
+def prometheus_metrics():
+    """
+    GET /metrics
+    Metrics in Prometheus text format, summed across all worker processes
+    """
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
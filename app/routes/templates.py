@@ -1,43 +1,255 @@
 from flask import Blueprint, request, jsonify
-from app.services import template_service
-from app.services.email_service import EmailService
-from app.exceptions import NotFoundError, ValidationError, EmailTrackerException
 from app.services.template_service import TemplateService
+from app.exceptions import NotFoundError, ValidationError, EmailTrackerException
 
+# Blueprint for template management
 template_bp = Blueprint('templates', __name__)
 
+# Initialize service
 template_service = TemplateService()
 
+# Recipients per render / email creation request
+MAX_RECIPIENTS = 10000
+
+
 @template_bp.route('/', methods=['GET'])
 def list_templates():
-    return jsonify({'goon'})
+    """
+    GET /api/emails/templates
+    List all templates
+    Query params: name, limit, offset
+    """
+    try:
+        name = request.args.get('name')
+        limit = request.args.get('limit', 50, type=int)
+        offset = request.args.get('offset', 0, type=int)
+
+        # Validate limit and offset
+        if limit < 1 or limit > 100:
+            return jsonify({'error': 'limit must be between 1 and 100'}), 400
+
+        if offset < 0:
+            return jsonify({'error': 'offset must be non-negative'}), 400
+
+        templates = template_service.list_templates(name=name, limit=limit, offset=offset)
+
+        return jsonify({
+            'templates': [template.to_dict() for template in templates],
+            'total': len(templates)
+        }), 200
+
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
 
 @template_bp.route('/', methods=['POST'])
 def create_template():
     """
-    POST api/emails/templates/
+    POST /api/emails/templates
+    Create a new template
+    Body: {
+        "name": "Welcome",
+        "subject": "Welcome, {{ first_name|friend }}!",
+        "body": "<p>Hi {{ first_name }}, your plan is {{ plan }}.</p>"
+    }
+    """
+    try:
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 415
 
-    args:
-    template_id, template_name, subject, body
+        data = request.get_json()
 
-    returns template
-    """
-    template_id = request.args.get('template_id', type=int)
-    template_name = request.args.get('template_id', type=str)
-    subject = request.args.get('template_id', type=str)
-    body = request.args.get('template_id', type=str)
+        if not data:
+            return jsonify({'error': 'Request body is required'}), 400
+
+        # Validate required fields
+        for field in ('name', 'subject', 'body'):
+            if not data.get(field):
+                return jsonify({'error': f'{field} is required'}), 400
+
+        template = template_service.create_template(
+            name=data['name'],
+            subject=data['subject'],
+            body=data['body']
+        )
+
+        return jsonify({
+            'message': 'Template created successfully',
+            'template': template.to_dict()
+        }), 201
+
+    except ValidationError as e:
+        return jsonify({'error': str(e), 'field': e.field}), 400
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
-    return jsonify({'goon'})
 
 @template_bp.route('/<int:template_id>', methods=['GET'])
-def get_template():
-    
-    return jsonify({'goon'})
+def get_template(template_id):
+    """
+    GET /api/emails/templates/<id>
+    Get a specific template
+    """
+    try:
+        template = template_service.get_template(template_id)
+
+        return jsonify(template.to_dict()), 200
+
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
-@template_bp.route('/<int:template_id>', methods=['DELETE'])
-def delete_template():
-    return jsonify({'goon'})
 
 @template_bp.route('/<int:template_id>', methods=['PUT'])
-def update_template():
-    return jsonify({'goon'})
\ No newline at end of file
+def update_template(template_id):
+    """
+    PUT /api/emails/templates/<id>
+    Update a template
+    Body: any of name, subject, body
+    """
+    try:
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 415
+
+        data = request.get_json()
+
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        template = template_service.update_template(
+            template_id=template_id,
+            name=data.get('name'),
+            subject=data.get('subject'),
+            body=data.get('body')
+        )
+
+        return jsonify({
+            'message': 'Template updated successfully',
+            'template': template.to_dict()
+        }), 200
+
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValidationError as e:
+        return jsonify({'error': str(e), 'field': e.field}), 400
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+@template_bp.route('/<int:template_id>', methods=['DELETE'])
+def delete_template(template_id):
+    """
+    DELETE /api/emails/templates/<id>
+    Delete a template (emails created from it will have template_id set to null)
+    """
+    try:
+        template_service.delete_template(template_id)
+
+        return jsonify({'message': 'Template deleted successfully'}), 200
+
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+@template_bp.route('/<int:template_id>/render', methods=['POST'])
+def render_template(template_id):
+    """
+    POST /api/emails/templates/<id>/render
+    Personalize a template for up to MAX_RECIPIENTS recipients
+    Body: {
+        "recipients": [{"first_name": "Ada", "plan": "Pro"}, ...]
+    }
+    """
+    try:
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 415
+
+        data = request.get_json()
+        recipients = data.get('recipients') if isinstance(data, dict) else None
+
+        if not isinstance(recipients, list) or not recipients:
+            return jsonify({'error': 'recipients must be a non-empty list'}), 400
+
+        if len(recipients) > MAX_RECIPIENTS:
+            return jsonify({'error': f'at most {MAX_RECIPIENTS} recipients per request'}), 400
+
+        rendered = template_service.render_bulk(template_id, recipients)
+
+        return jsonify({'rendered': rendered, 'total': len(rendered)}), 200
+
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValidationError as e:
+        return jsonify({'error': str(e), 'field': e.field}), 400
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+@template_bp.route('/<int:template_id>/emails', methods=['POST'])
+def create_template_emails(template_id):
+    """
+    POST /api/emails/templates/<id>/emails
+    Create one personalized email per recipient, queued for sending by default
+    Body: {
+        "sender_email": "news@example.com",
+        "campaign_id": 1 (optional),
+        "queue": true (optional),
+        "recipients": [{"recipient_email": "ada@example.com", "first_name": "Ada"}, ...]
+    }
+    """
+    try:
+        if not request.is_json:
+            return jsonify({'error': 'Content-Type must be application/json'}), 415
+
+        data = request.get_json()
+
+        if not data:
+            return jsonify({'error': 'Request body is required'}), 400
+
+        if not data.get('sender_email'):
+            return jsonify({'error': 'sender_email is required'}), 400
+
+        recipients = data.get('recipients')
+        if not isinstance(recipients, list) or not recipients:
+            return jsonify({'error': 'recipients must be a non-empty list'}), 400
+
+        if len(recipients) > MAX_RECIPIENTS:
+            return jsonify({'error': f'at most {MAX_RECIPIENTS} recipients per request'}), 400
+
+        emails = template_service.create_emails(
+            template_id,
+            sender_email=data['sender_email'],
+            recipients=recipients,
+            campaign_id=data.get('campaign_id'),
+            queue=bool(data.get('queue', True))
+        )
+
+        return jsonify({
+            'message': 'Emails created successfully',
+            'emails': emails,
+            'total': len(emails)
+        }), 201
+
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValidationError as e:
+        return jsonify({'error': str(e), 'field': e.field}), 400
+    except EmailTrackerException as e:
+        return jsonify({'error': str(e), 'field': e.field}), e.status_code
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
@@ -1,8 +1,14 @@
 from flask import Blueprint, request, jsonify, send_file, redirect
 from app.services.tracking_service import TrackingService
-from app.utils import create_tracking_pixel, validate_url, parse_user_agent
+from app.idempotency import ReplayedEvent, idempotency_keys
+from app.admission import admission_control
+from app.utils import create_tracking_pixel, validate_url
 from app.exceptions import NotFoundError, ValidationError, EmailTrackerException
+from app.metrics import tracking_events_dropped
 import io
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Blueprint for tracking (pixel/link tracking)
 tracking_bp = Blueprint('tracking', __name__)
@@ -22,21 +28,22 @@ def track_pixel(tracking_id):
         # Extract request metadata
         metadata = tracking_service.parse_request_metadata(request)
 
-        # Record open event using service
-        tracking_service.record_open(
-            tracking_id=tracking_id,
-            ip_address=metadata['ip_address'],
-            user_agent=metadata['user_agent'],
-            location=metadata['location']
-        )
+        # Record open event using service, unless the IP or tracking ID is over its rate limit
+        if admission_control.admit('open', metadata['ip_address'], tracking_id):
+            tracking_service.record_open(
+                tracking_id=tracking_id,
+                ip_address=metadata['ip_address'],
+                user_agent=metadata['user_agent'],
+                location=metadata['location']
+            )
 
     except NotFoundError:
         # Email not found - still return pixel but don't track
-        pass
-    except Exception as e:
+        tracking_events_dropped.inc('open', 'not_found')
+    except Exception:
         # Don't fail the pixel request even if tracking fails
-        # Just log the error (in production, use proper logging)
-        print(f"Tracking error: {e}")
+        tracking_events_dropped.inc('open', 'error')
+        logger.exception("Tracking error recording open for %s", tracking_id)
 
     # Always return the pixel, even if tracking failed
     pixel = create_tracking_pixel()
@@ -65,21 +72,23 @@ def track_click(tracking_id):
         # Extract request metadata
         metadata = tracking_service.parse_request_metadata(request)
 
-        # Record click event using service
-        tracking_service.record_click(
-            tracking_id=tracking_id,
-            clicked_url=destination_url,
-            ip_address=metadata['ip_address'],
-            user_agent=metadata['user_agent'],
-            location=metadata['location']
-        )
+        # Record click event using service, unless the IP or tracking ID is over its rate limit
+        if admission_control.admit('click', metadata['ip_address'], tracking_id):
+            tracking_service.record_click(
+                tracking_id=tracking_id,
+                clicked_url=destination_url,
+                ip_address=metadata['ip_address'],
+                user_agent=metadata['user_agent'],
+                location=metadata['location']
+            )
 
     except NotFoundError:
         # Email not found - still redirect but don't track
-        pass
-    except Exception as e:
+        tracking_events_dropped.inc('click', 'not_found')
+    except Exception:
         # Don't fail the redirect even if tracking fails
-        print(f"Tracking error: {e}")
+        tracking_events_dropped.inc('click', 'error')
+        logger.exception("Tracking error recording click for %s", tracking_id)
 
     # Always redirect, even if tracking failed
     return redirect(destination_url, code=302)
@@ -93,8 +102,12 @@ def track_custom_event():
     Body: {
         "tracking_id": "abc123",
         "event_type": "open|click|bounce|unsubscribe|etc",
-        "clicked_url": "https://example.com" (optional, for click events)
+        "clicked_url": "https://example.com" (optional, for click events),
+        "event_id": "esp-evt-123" (optional, same as an Idempotency-Key header)
     }
+
+    A request repeating an Idempotency-Key (or event_id) is not recorded
+    again: it gets the first response back, with Idempotent-Replayed: true.
     """
     try:
         if not request.is_json:
@@ -121,6 +134,12 @@ def track_custom_event():
         event_type = data['event_type']
         tracking_id = data['tracking_id']
         clicked_url = data.get('clicked_url')
+        idempotency_key = idempotency_keys.validate(request.headers.get('Idempotency-Key') or data.get('event_id'))
+
+        # A retry this worker has seen is answered from memory
+        replayed = tracking_service.replay(idempotency_key) if idempotency_key else None
+        if replayed is not None:
+            return _event_response(replayed)
 
         # Use the appropriate service method based on event type
         if event_type == 'open':
@@ -128,7 +147,8 @@ def track_custom_event():
                 tracking_id=tracking_id,
                 ip_address=metadata['ip_address'],
                 user_agent=metadata['user_agent'],
-                location=metadata['location']
+                location=metadata['location'],
+                idempotency_key=idempotency_key
             )
         elif event_type == 'click':
             if not clicked_url:
@@ -139,37 +159,22 @@ def track_custom_event():
                 clicked_url=clicked_url,
                 ip_address=metadata['ip_address'],
                 user_agent=metadata['user_agent'],
-                location=metadata['location']
+                location=metadata['location'],
+                idempotency_key=idempotency_key
             )
         else:
-            # For other event types (bounce, unsubscribe, etc.), use record_open logic
-            # but with the specified event_type
-            email = tracking_service.email_service.get_email_by_tracking_id(tracking_id)
-
-            device_type = None
-            if metadata['user_agent']:
-                parsed = parse_user_agent(metadata['user_agent'])
-                device_type = parsed['device_type']
-
-            from app.models import TrackingEvent
-            event = TrackingEvent(
-                email_id=email.id,
+            # Other event types (bounce, unsubscribe, etc.)
+            event = tracking_service.record_event(
+                tracking_id=tracking_id,
                 event_type=event_type,
                 ip_address=metadata['ip_address'],
                 user_agent=metadata['user_agent'],
                 location=metadata['location'],
-                device_type=device_type,
-                clicked_url=clicked_url
+                clicked_url=clicked_url,
+                idempotency_key=idempotency_key
             )
 
-            from app import db
-            db.session.add(event)
-            db.session.commit()
-
-        return jsonify({
-            'message': 'Event tracked successfully',
-            'event': event.to_dict()
-        }), 201
+        return _event_response(event)
 
     except NotFoundError as e:
         return jsonify({'error': str(e)}), 404
@@ -179,3 +184,12 @@ def track_custom_event():
         return jsonify({'error': str(e), 'field': e.field}), e.status_code
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+def _event_response(event):
+    """201 response of POST /track/event - flagged when it replays an earlier request's event"""
+    headers = {'Idempotent-Replayed': 'true'} if isinstance(event, ReplayedEvent) else {}
+    return jsonify({
+        'message': 'Event tracked successfully',
+        'event': event.to_dict()
+    }), 201, headers
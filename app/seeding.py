@@ -0,0 +1,243 @@
+"""
+Synthetic dataset generator behind `flask seed`
+
+Produces campaigns, emails and tracking events with production-like shape:
+
+- open-rate skew: a share of emails never opens, the rest get a Pareto
+  distributed share of the events (a few recipients open dozens of times)
+- user-agent mix: weighted list of real mail clients, proxies and browsers
+- IP reuse: events draw from a finite IP pool with Zipf weights, so image
+  proxies and office NATs show up as heavy hitters
+- click URL popularity: each campaign has a handful of links with Zipf weights
+- time decay: events land sent_at + an exponential delay
+
+Rows go in through executemany in batches (no ORM objects), and every
+random choice comes from one seeded generator, so the same seed and end
+date always produce the same rows.
+"""
+
+import bisect
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+
+from app import db
+from app.dimensions import EVENT_TYPE, DEVICE_TYPE, IP_ADDRESS, USER_AGENT, insert_ignore
+from app.models import Campaign, Email, TrackingEvent
+from app.partitions import event_partitions
+from app.utils import parse_user_agent
+
+USER_AGENT_MIX = [
+    # (weight, user agent)
+    (30, 'Mozilla/5.0 (Windows NT 5.1; rv:11.0) Gecko Firefox/11.0 (via ggpht.com GoogleImageProxy)'),
+    (22, 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148'),
+    (12, 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko)'),
+    (10, 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'),
+    (8, 'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36'),
+    (6, 'Microsoft Office/16.0 (Windows NT 10.0; Microsoft Outlook 16.0.17029; Pro)'),
+    (5, 'Mozilla/5.0 (iPad; CPU OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148'),
+    (4, 'Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0'),
+    (3, 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0'),
+]
+
+URL_PATHS = ['pricing', 'blog/launch', 'signup', 'docs', 'unsubscribe', 'webinar', 'features', 'case-study',
+             'careers', 'contact']
+
+
+EMAIL_COLUMNS = ('id', 'tracking_id', 'recipient_email', 'sender_email', 'subject', 'campaign_id',
+                 'sent_at', 'created_at', 'updated_at')
+EVENT_COLUMNS = ('id', 'email_id', 'event_type_id', 'ip_address_id', 'user_agent_id', 'device_type_id',
+                 'clicked_url', 'created_at')
+
+
+def _datetime_param(connection):
+    """
+    Bind value for DateTime columns in _bulk_insert rows
+
+    SQLite rows bypass SQLAlchemy's type processing, so datetimes are
+    pre-rendered in the format SQLAlchemy itself stores ("YYYY-MM-DD
+    HH:MM:SS.ffffff") and ORM reads see ordinary datetimes.
+    """
+    if connection.dialect.name == 'sqlite':
+        return lambda value: value.isoformat(' ', 'microseconds')
+    return lambda value: value
+
+
+def _bulk_insert(connection, table, columns, rows):
+    """
+    executemany a batch of tuples
+
+    On SQLite the rows go straight to the DBAPI cursor - per-row bind
+    processing in Core costs more than the insert itself.
+    """
+    if connection.dialect.name == 'sqlite':
+        placeholders = ', '.join('?' * len(columns))
+        connection.exec_driver_sql(f'INSERT INTO {table.name} ({", ".join(columns)}) VALUES ({placeholders})', rows)
+    else:
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+
+def _zipf_cum_weights(n, exponent):
+    """Cumulative weights for ranks 1..n with weight 1/rank^exponent"""
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def _pick(rng, population, cum_weights):
+    """Weighted choice with precomputed cumulative weights (random.choices without the per-call overhead)"""
+    return population[bisect.bisect(cum_weights, rng.random() * cum_weights[-1], 0, len(cum_weights) - 1)]
+
+
+def seed_database(campaigns=10, emails=10000, events=100000, seed=42, end_date=None, days=30,
+                  open_rate=0.45, open_skew=1.5, click_ratio=0.15, ip_pool=None, ip_skew=1.1,
+                  links_per_campaign=5, url_skew=1.2, decay_hours=12.0, batch_size=10000,
+                  progress=None):
+    """
+    Generate and bulk insert a synthetic dataset
+
+    Args:
+        campaigns: Number of campaigns
+        emails: Number of emails (spread across campaigns)
+        events: Number of tracking events
+        seed: Random seed - same seed and end_date give identical rows
+        end_date: Latest possible sent_at (defaults to today at midnight UTC)
+        days: Emails are sent over the `days` days before end_date
+        open_rate: Share of emails that ever produce an event
+        open_skew: Pareto shape for per-email event share (lower = more skewed)
+        click_ratio: Share of events that are clicks
+        ip_pool: Number of distinct IPs (defaults to events // 20)
+        ip_skew: Zipf exponent for IP reuse
+        links_per_campaign: Distinct click URLs per campaign
+        url_skew: Zipf exponent for URL popularity
+        decay_hours: Mean delay between sent_at and an event
+        batch_size: Rows per executemany batch
+        progress: Optional callable(table, rows_done, rows_total)
+
+    Returns:
+        dict: Row counts and elapsed seconds
+    """
+    rng = random.Random(seed)
+    end_date = end_date or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date = end_date - timedelta(days=days)
+    ip_pool = ip_pool or max(events // 20, 1)
+    started = time.perf_counter()
+
+    connection = db.session.connection()
+    as_datetime = _datetime_param(connection)
+    next_campaign_id = (connection.execute(select(func.max(Campaign.id))).scalar() or 0) + 1
+    next_email_id = (connection.execute(select(func.max(Email.id))).scalar() or 0) + 1
+    next_event_id = (connection.execute(select(func.max(TrackingEvent.id))).scalar() or 0) + 1
+
+    # Campaigns
+    campaign_ids = list(range(next_campaign_id, next_campaign_id + campaigns))
+    connection.execute(insert(Campaign), [{
+        'id': campaign_id,
+        'name': f'Synthetic campaign {campaign_id}',
+        'description': 'Generated by flask seed',
+        'created_by': 'seed@example.com',
+        'status': rng.choice(['active', 'active', 'completed', 'paused']),
+        'created_at': start_date,
+        'updated_at': start_date,
+    } for campaign_id in campaign_ids])
+
+    # Emails - campaign sizes are skewed too, so a few campaigns dominate
+    campaign_cum = _zipf_cum_weights(len(campaign_ids), 0.8) if campaign_ids else None
+    email_campaign = {}
+    email_sent_at = {}
+    email_weights = []
+    email_ids = list(range(next_email_id, next_email_id + emails))
+
+    for batch_start in range(0, emails, batch_size):
+        rows = []
+        for email_id in email_ids[batch_start:batch_start + batch_size]:
+            campaign_id = _pick(rng, campaign_ids, campaign_cum) if campaign_ids else None
+            sent_at = start_date + timedelta(seconds=rng.random() * days * 86400)
+            email_campaign[email_id] = campaign_id
+            email_sent_at[email_id] = sent_at
+            email_weights.append(rng.paretovariate(open_skew) if rng.random() < open_rate else 0.0)
+            rows.append((
+                email_id, '%032x' % rng.getrandbits(128), f'user{email_id}@example.com',
+                'newsletter@example.com', f'Synthetic email {email_id}', campaign_id, *(as_datetime(sent_at),) * 3,
+            ))
+        _bulk_insert(connection, Email.__table__, EMAIL_COLUMNS, rows)
+        db.session.commit()
+        connection = db.session.connection()
+        if progress:
+            progress('emails', min(batch_start + batch_size, emails), emails)
+
+    # Events
+    email_cum = list(itertools.accumulate(email_weights))
+    if events and (not email_cum or email_cum[-1] == 0):
+        raise ValueError("No email can receive events - increase emails or open_rate")
+
+    ip_addresses = [f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+                    for _ in range(ip_pool)]
+    ip_cum = _zipf_cum_weights(len(ip_addresses), ip_skew)
+
+    user_agents = [ua for _, ua in USER_AGENT_MIX]
+    ua_cum = list(itertools.accumulate(weight for weight, _ in USER_AGENT_MIX))
+    device_types = {ua: parse_user_agent(ua)['device_type'] for ua in user_agents}
+
+    # Events store dimension keys: write the IP and user agent rows once up front
+    for dimension, values in ((IP_ADDRESS, ip_addresses), (USER_AGENT, user_agents)):
+        for batch in range(0, len(values), batch_size):
+            insert_ignore(connection, dimension.table, [{'id': dimension.static_key(value), 'value': value}
+                                                        for value in values[batch:batch + batch_size]])
+    ip_keys = {ip: IP_ADDRESS.static_key(ip) for ip in ip_addresses}
+    ua_keys = {ua: USER_AGENT.static_key(ua) for ua in user_agents}
+    device_keys = {ua: DEVICE_TYPE.static_key(device_types[ua]) for ua in user_agents}
+    open_code, click_code = EVENT_TYPE.static_key('open'), EVENT_TYPE.static_key('click')
+
+    link_cum = _zipf_cum_weights(links_per_campaign, url_skew)
+    campaign_links = {
+        campaign_id: [f'https://example.com/{path}?utm_campaign={campaign_id}'
+                      for path in rng.sample(URL_PATHS, min(links_per_campaign, len(URL_PATHS)))]
+        for campaign_id in campaign_ids + [None]
+    }
+
+    partitioned = event_partitions.enabled
+    partition_of = []
+    for batch_start in range(0, events, batch_size):
+        rows = []
+        for event_id in range(next_event_id + batch_start, next_event_id + min(batch_start + batch_size, events)):
+            email_id = email_ids[bisect.bisect(email_cum, rng.random() * email_cum[-1], 0, len(email_cum) - 1)]
+            user_agent = _pick(rng, user_agents, ua_cum)
+            delay = timedelta(hours=rng.expovariate(1.0 / decay_hours))
+            is_click = rng.random() < click_ratio
+            links = campaign_links[email_campaign[email_id]]
+            created_at = email_sent_at[email_id] + delay
+            rows.append((
+                event_id, email_id, click_code if is_click else open_code, ip_keys[_pick(rng, ip_addresses, ip_cum)],
+                ua_keys[user_agent], device_keys[user_agent],
+                _pick(rng, links, link_cum[:len(links)]) if is_click else None,
+                as_datetime(created_at),
+            ))
+            if partitioned:
+                partition_of.append(created_at)
+
+        if partitioned:
+            # Partitions assign their own (partition-encoded) ids
+            by_partition = {}
+            for row, created_at in zip(rows, partition_of):
+                table = event_partitions.ensure_partition(connection, created_at)
+                by_partition.setdefault(table.name, (table, []))[1].append(row[1:])
+            for table, partition_rows in by_partition.values():
+                _bulk_insert(connection, table, EVENT_COLUMNS[1:], partition_rows)
+            partition_of = []
+        else:
+            _bulk_insert(connection, TrackingEvent.__table__, EVENT_COLUMNS, rows)
+        db.session.commit()
+        connection = db.session.connection()
+        if progress:
+            progress('tracking_events', min(batch_start + batch_size, events), events)
+
+    db.session.commit()
+
+    return {
+        'campaigns': campaigns,
+        'emails': emails,
+        'events': events,
+        'seconds': time.perf_counter() - started,
+    }
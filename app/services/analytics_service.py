@@ -1,6 +1,17 @@
-from app import db
-from app.models import Email, Campaign, TrackingEvent
-from app.exceptions import NotFoundError
+import json
+from collections import Counter
+from datetime import time, timedelta
+
+from app.db_routing import read_session
+from app.models import (Email, Campaign, TrackingEvent, EmailDailyStats, EmailUniqueIp, CampaignDailyStats,
+                        HeavyHitterSketch)
+from app.partitions import event_partitions
+from app.archive import event_archive
+from app.columnar import columnar_events
+from app.dimensions import EVENT_TYPE, DEVICE_TYPE, IP_ADDRESS, USER_AGENT, event_dimensions
+from app.exceptions import NotFoundError, ValidationError
+from app.heavy_hitters import ALL_CAMPAIGNS, DIMENSIONS, heavy_hitters, url_domain
+from app.machine_events import HUMAN
 from app.services.email_service import EmailService
 from app.services.campaign_service import CampaignService
 from sqlalchemy import func
@@ -14,7 +25,7 @@ class AnalyticsService:
         Initialize AnalyticsService
 
         Args:
-            db_session: Database session (defaults to db.session)
+            db_session: Database session (defaults to the routed read session)
             email_service: EmailService instance (optional)
             campaign_service: CampaignService instance (optional)
         """
@@ -24,29 +35,33 @@ class AnalyticsService:
 
     @property
     def db(self):
-        """Lazy database session property - only accesses db.session when used"""
-        return self._db_session if self._db_session is not None else db.session
+        """
+        Read session - analytics never writes, so every query goes to the
+        replica when one is configured (see app.db_routing)
+        """
+        return self._db_session if self._db_session is not None else read_session
 
     @property
     def email_service(self):
-        """Lazy email service property"""
+        """Lazy email service property (reads through the analytics session)"""
         if self._email_service is None:
-            self._email_service = EmailService(self._db_session)
+            self._email_service = EmailService(self.db)
         return self._email_service
 
     @property
     def campaign_service(self):
-        """Lazy campaign service property"""
+        """Lazy campaign service property (reads through the analytics session)"""
         if self._campaign_service is None:
-            self._campaign_service = CampaignService(self._db_session)
+            self._campaign_service = CampaignService(self.db)
         return self._campaign_service
 
-    def get_email_stats(self, email_id):
+    def get_email_stats(self, email_id, exclude_machine=False):
         """
         Get statistics for a specific email
 
         Args:
             email_id: Email ID
+            exclude_machine: Leave out machine opens and scanner clicks (see app.machine_events)
 
         Returns:
             dict: Statistics including total_opens, total_clicks, unique_opens, etc.
@@ -56,27 +71,82 @@ class AnalyticsService:
         """
         email = self.email_service.get_email(email_id)
 
-        # Get all events for this email
-        events = email.events.all()
+        if columnar_events.enabled:
+            activity = columnar_events.email_activity(self.db, email.id, exclude_machine)
+        else:
+            activity = self._email_activity(email.id, exclude_machine)
+
+        total_opens = activity['total_opens']
+        total_clicks = activity['total_clicks']
+        unique_open_ips = activity['open_ips']
+        unique_click_ips = activity['click_ips']
+        device_breakdown = activity['device_breakdown']
+        first_open = activity['first_open']
+        last_open = activity['last_open']
+        last_click = activity['last_click']
+
+        # Merge events the retention job has rolled into daily aggregates
+        for stats in email.daily_stats:
+            count = stats.event_count - stats.machine_count if exclude_machine else stats.event_count
+            if not count:
+                continue
+            if stats.event_type == 'open':
+                total_opens += count
+                first_open = min(first_open or stats.first_at, stats.first_at)
+                last_open = max(last_open or stats.last_at, stats.last_at)
+            elif stats.event_type == 'click':
+                total_clicks += count
+                last_click = max(last_click or stats.last_at, stats.last_at)
+            if stats.device_type:
+                device_breakdown[stats.device_type] = device_breakdown.get(stats.device_type, 0) + count
+
+        unique_ips = email.unique_ips.with_entities(EmailUniqueIp.event_type, EmailUniqueIp.ip_address)
+        if exclude_machine:
+            unique_ips = unique_ips.filter(EmailUniqueIp.machine_only.is_(False))
+        for event_type, ip_address in unique_ips:
+            if event_type == 'open':
+                unique_open_ips.add(ip_address)
+            elif event_type == 'click':
+                unique_click_ips.add(ip_address)
+
+        return {
+            'email_id': email_id,
+            'total_opens': total_opens,
+            'total_clicks': total_clicks,
+            'unique_opens': len(unique_open_ips),
+            'unique_clicks': len(unique_click_ips),
+            'device_breakdown': device_breakdown,
+            'first_opened_at': first_open.isoformat() if first_open else None,
+            'last_opened_at': last_open.isoformat() if last_open else None,
+            'last_click_at': last_click.isoformat() if last_click else None
+        }
+
+    def _email_activity(self, email_id, exclude_machine=False):
+        """Raw-event part of get_email_stats, from the email's tracking_events rows"""
+        # Get all events for this email - only the columns used below, as plain rows
+        events = self.db.query(
+            TrackingEvent.event_type, TrackingEvent.ip_address, TrackingEvent.device_type, TrackingEvent.created_at,
+            TrackingEvent.hits
+        ).filter(TrackingEvent.email_id == email_id)
+        if exclude_machine:
+            events = events.filter(TrackingEvent.machine_reason == HUMAN)
+        events = events.order_by(TrackingEvent.id).all()
 
         # Count total opens and clicks
-        # sum() iterates through events and adds 1 for each matching event
-        total_opens = sum(1 for e in events if e.event_type == 'open')
-        total_clicks = sum(1 for e in events if e.event_type == 'click')
+        # sum() iterates through events and adds the hits each row stands for (see app.repeat_opens)
+        total_opens = sum(e.hits for e in events if e.event_type == 'open')
+        total_clicks = sum(e.hits for e in events if e.event_type == 'click')
 
         # Count unique opens/clicks by IP address
         # set() automatically deduplicates - same IP counted only once
         unique_open_ips = set(e.ip_address for e in events if e.event_type == 'open' and e.ip_address)
         unique_click_ips = set(e.ip_address for e in events if e.event_type == 'click' and e.ip_address)
 
-        unique_opens = len(unique_open_ips)
-        unique_clicks = len(unique_click_ips)
-
         # Device breakdown - count events per device type
         device_breakdown = {}
         for event in events:
             if event.device_type:
-                device_breakdown[event.device_type] = device_breakdown.get(event.device_type, 0) + 1
+                device_breakdown[event.device_type] = device_breakdown.get(event.device_type, 0) + event.hits
 
         # Get timestamp of first and last open
         first_open = next((e.created_at for e in events if e.event_type == 'open'), None)
@@ -94,23 +164,23 @@ class AnalyticsService:
                 break
 
         return {
-            'email_id': email_id,
             'total_opens': total_opens,
             'total_clicks': total_clicks,
-            'unique_opens': unique_opens,
-            'unique_clicks': unique_clicks,
+            'open_ips': unique_open_ips,
+            'click_ips': unique_click_ips,
             'device_breakdown': device_breakdown,
-            'first_opened_at': first_open.isoformat() if first_open else None,
-            'last_opened_at': last_open.isoformat() if last_open else None,
-            'last_click_at': last_click.isoformat() if last_click else None
+            'first_open': first_open,
+            'last_open': last_open,
+            'last_click': last_click
         }
 
-    def get_campaign_stats(self, campaign_id):
+    def get_campaign_stats(self, campaign_id, exclude_machine=False):
         """
         Get statistics for a campaign
 
         Args:
             campaign_id: Campaign ID
+            exclude_machine: Leave out machine opens and scanner clicks (see app.machine_events)
 
         Returns:
             dict: Comprehensive campaign statistics
@@ -120,9 +190,9 @@ class AnalyticsService:
         """
         campaign = self.campaign_service.get_campaign(campaign_id)
 
-        # Get all emails in campaign
-        emails = campaign.emails.all()
-        total_emails = len(emails)
+        # Get the ids of all emails in campaign
+        email_ids = [row[0] for row in campaign.emails.with_entities(Email.id)]
+        total_emails = len(email_ids)
 
         if total_emails == 0:
             return {
@@ -140,35 +210,63 @@ class AnalyticsService:
             }
 
         # Aggregate stats across all emails
-        total_opens = 0
-        total_clicks = 0
-        emails_with_opens = set()  # Set to track which emails were opened
-        emails_with_clicks = set()  # Set to track which emails were clicked
-        device_breakdown = {}
-
-        for email in emails:
-            events = email.events.all()
-
-            email_has_open = False
-            email_has_click = False
-
-            for event in events:
-                if event.event_type == 'open':
-                    total_opens += 1
-                    email_has_open = True
-                elif event.event_type == 'click':
-                    total_clicks += 1
-                    email_has_click = True
+        if columnar_events.enabled:
+            activity = columnar_events.campaign_activity(self.db, email_ids, exclude_machine)
+            total_opens = activity['total_opens']
+            total_clicks = activity['total_clicks']
+            emails_with_opens = activity['emails_with_opens']
+            emails_with_clicks = activity['emails_with_clicks']
+            device_breakdown = activity['device_breakdown']
+        else:
+            total_opens = 0
+            total_clicks = 0
+            emails_with_opens = set()  # Set to track which emails were opened
+            emails_with_clicks = set()  # Set to track which emails were clicked
+            device_breakdown = {}
+
+            # One scan over the campaign's events, as plain rows of dimension keys
+            open_code, click_code = EVENT_TYPE.static_key('open'), EVENT_TYPE.static_key('click')
+            device_counts = {}
+            events = self.db.query(
+                TrackingEvent.email_id, TrackingEvent.event_type_id, TrackingEvent.device_type_id, TrackingEvent.hits
+            ).join(Email, Email.id == TrackingEvent.email_id).filter(Email.campaign_id == campaign_id)
+            if exclude_machine:
+                events = events.filter(TrackingEvent.machine_reason == HUMAN)
+
+            for email_id, event_type_id, device_type_id, hits in events:
+                if event_type_id == open_code:
+                    total_opens += hits
+                    emails_with_opens.add(email_id)
+                elif event_type_id == click_code:
+                    total_clicks += hits
+                    emails_with_clicks.add(email_id)
 
                 # Track device breakdown
-                if event.device_type:
-                    device_breakdown[event.device_type] = device_breakdown.get(event.device_type, 0) + 1
-
-            # Track unique emails (recipients) that opened/clicked
-            if email_has_open:
-                emails_with_opens.add(email.id)
-            if email_has_click:
-                emails_with_clicks.add(email.id)
+                if device_type_id is not None:
+                    device_counts[device_type_id] = device_counts.get(device_type_id, 0) + hits
+
+            device_breakdown = {event_dimensions.decode(self.db, DEVICE_TYPE, key): count
+                                for key, count in device_counts.items()}
+
+        # Merge compacted events of the campaign's emails
+        compacted = self.db.query(
+            EmailDailyStats.email_id, EmailDailyStats.event_type, EmailDailyStats.device_type,
+            func.sum(self._compacted_count(exclude_machine))
+        ).join(Email, Email.id == EmailDailyStats.email_id).filter(
+            Email.campaign_id == campaign_id
+        ).group_by(EmailDailyStats.email_id, EmailDailyStats.event_type, EmailDailyStats.device_type).all()
+
+        for email_id, event_type, device_type, count in compacted:
+            if not count:
+                continue
+            if event_type == 'open':
+                total_opens += count
+                emails_with_opens.add(email_id)
+            elif event_type == 'click':
+                total_clicks += count
+                emails_with_clicks.add(email_id)
+            if device_type:
+                device_breakdown[device_type] = device_breakdown.get(device_type, 0) + count
 
         unique_opens = len(emails_with_opens)
         unique_clicks = len(emails_with_clicks)
@@ -192,39 +290,107 @@ class AnalyticsService:
             'device_breakdown': device_breakdown
         }
 
-    def get_global_stats(self):
+    def get_global_stats(self, start_date=None, end_date=None, exclude_machine=False):
         """
         Get global statistics across all campaigns and emails
 
+        Args:
+            start_date: Only count events at or after this datetime (optional)
+            end_date: Only count events before this datetime (optional)
+            exclude_machine: Leave out machine opens and scanner clicks (see app.machine_events)
+
         Returns:
             dict: Global statistics
         """
-        total_campaigns = Campaign.query.count()
-        total_emails = Email.query.count()
-        total_events = TrackingEvent.query.count()
-        total_opens = TrackingEvent.query.filter_by(event_type='open').count()
-        total_clicks = TrackingEvent.query.filter_by(event_type='click').count()
-
-        # Count unique emails that have opens/clicks
-        unique_opens = self.db.query(TrackingEvent.email_id).filter(
-            TrackingEvent.event_type == 'open'
-        ).distinct().count()
-
-        unique_clicks = self.db.query(TrackingEvent.email_id).filter(
-            TrackingEvent.event_type == 'click'
-        ).distinct().count()
-
-        # Device breakdown across all events using SQL GROUP BY
-        device_breakdown = {}
-        devices = self.db.query(
-            TrackingEvent.device_type,
-            func.count(TrackingEvent.id)
+        total_campaigns = self.db.query(Campaign).count()
+        total_emails = self.db.query(Email).count()
+
+        # Only the partitions covering the range are scanned (see app.partitions)
+        events = event_partitions.events(self.db, start_date, end_date)
+
+        def event_query(*entities):
+            query = self.db.query(*entities)
+            if start_date is not None:
+                query = query.filter(events.created_at >= start_date)
+            if end_date is not None:
+                query = query.filter(events.created_at < end_date)
+            if exclude_machine:
+                query = query.filter(events.machine_reason == HUMAN)
+            return query
+
+        # Compacted events are counted by day (see _day_range)
+        first_day, end_day = self._day_range(start_date, end_date)
+
+        def compacted_query(*entities):
+            query = self.db.query(*entities)
+            if first_day is not None:
+                query = query.filter(EmailDailyStats.day >= first_day)
+            if end_day is not None:
+                query = query.filter(EmailDailyStats.day < end_day)
+            if exclude_machine:
+                query = query.filter(EmailDailyStats.event_count > EmailDailyStats.machine_count)
+            return query
+
+        compacted_count = self._compacted_count(exclude_machine)
+        compacted = dict(compacted_query(
+            EmailDailyStats.event_type, func.sum(compacted_count)
+        ).group_by(EmailDailyStats.event_type).all())
+
+        if columnar_events.enabled:
+            activity = columnar_events.global_activity(self.db, start_date, end_date, exclude_machine)
+            total_events = activity['total_events'] + sum(compacted.values())
+            total_opens = activity['total_opens'] + compacted.get('open', 0)
+            total_clicks = activity['total_clicks'] + compacted.get('click', 0)
+
+            def compacted_emails(event_type):
+                return {row[0] for row in compacted_query(EmailDailyStats.email_id).filter(
+                    EmailDailyStats.event_type == event_type).distinct()}
+
+            unique_opens = len(activity['emails_with_opens'] | compacted_emails('open'))
+            unique_clicks = len(activity['emails_with_clicks'] | compacted_emails('click'))
+            device_breakdown = dict(activity['device_breakdown'])
+        else:
+            # Rows stand for 1 + repeat_count hits (see app.repeat_opens)
+            raw_hits = func.coalesce(func.sum(events.hits), 0)
+            total_events = event_query(raw_hits).scalar() + sum(compacted.values())
+            total_opens = event_query(raw_hits).filter(events.event_type == 'open').scalar() + compacted.get('open', 0)
+            total_clicks = event_query(raw_hits).filter(
+                events.event_type == 'click').scalar() + compacted.get('click', 0)
+
+            # Count unique emails that have opens/clicks, in raw or compacted events
+            unique_opens = event_query(events.email_id).filter(
+                events.event_type == 'open'
+            ).union(
+                compacted_query(EmailDailyStats.email_id).filter(EmailDailyStats.event_type == 'open')
+            ).count()
+
+            unique_clicks = event_query(events.email_id).filter(
+                events.event_type == 'click'
+            ).union(
+                compacted_query(EmailDailyStats.email_id).filter(EmailDailyStats.event_type == 'click')
+            ).count()
+
+            # Device breakdown across all events using SQL GROUP BY
+            device_breakdown = {}
+            devices = event_query(
+                events.device_type_id,
+                func.sum(events.hits)
+            ).filter(
+                events.device_type_id.isnot(None)
+            ).group_by(events.device_type_id).all()
+
+            for device_type_id, count in devices:
+                device_breakdown[event_dimensions.decode(self.db, DEVICE_TYPE, device_type_id)] = count
+
+        compacted_devices = compacted_query(
+            EmailDailyStats.device_type,
+            func.sum(compacted_count)
         ).filter(
-            TrackingEvent.device_type.isnot(None)
-        ).group_by(TrackingEvent.device_type).all()
+            EmailDailyStats.device_type.isnot(None)
+        ).group_by(EmailDailyStats.device_type).all()
 
-        for device_type, count in devices:
-            device_breakdown[device_type] = count
+        for device_type, count in compacted_devices:
+            device_breakdown[device_type] = device_breakdown.get(device_type, 0) + count
 
         return {
             'total_campaigns': total_campaigns,
@@ -239,6 +405,158 @@ class AnalyticsService:
             'device_breakdown': device_breakdown
         }
 
+    def get_campaign_daily_stats(self, campaign_id, start_date=None, end_date=None):
+        """
+        Get per-day event counts for a campaign
+
+        Days older than the retention window come from CampaignDailyStats,
+        newer days from the raw events; both have the same shape.
+
+        Args:
+            campaign_id: Campaign ID
+            start_date: Only include events at or after this datetime (optional)
+            end_date: Only include events before this datetime (optional)
+
+        Returns:
+            list: One dict per day (oldest first) with opens, clicks and the
+                  number of emails opened/clicked that day
+
+        Raises:
+            NotFoundError: If campaign doesn't exist
+        """
+        self.campaign_service.get_campaign(campaign_id)
+
+        days = {}
+
+        def bucket(day):
+            return days.setdefault(day, {'day': day, 'opens': 0, 'clicks': 0,
+                                         'emails_opened': 0, 'emails_clicked': 0})
+
+        counters = {'open': ('opens', 'emails_opened'), 'click': ('clicks', 'emails_clicked')}
+
+        events = event_partitions.events(self.db, start_date, end_date)
+        event_day = func.date(events.created_at)
+        raw = self.db.query(
+            event_day, events.event_type, func.sum(events.hits), func.count(func.distinct(events.email_id))
+        ).join(Email, Email.id == events.email_id).filter(
+            Email.campaign_id == campaign_id,
+            events.event_type.in_(counters)
+        )
+        if start_date is not None:
+            raw = raw.filter(events.created_at >= start_date)
+        if end_date is not None:
+            raw = raw.filter(events.created_at < end_date)
+
+        for day, event_type, count, emails in raw.group_by(event_day, events.event_type):
+            total_key, emails_key = counters[event_type]
+            row = bucket(day if isinstance(day, str) else day.isoformat())
+            row[total_key] += count
+            row[emails_key] += emails
+
+        first_day, end_day = self._day_range(start_date, end_date)
+        compacted = self.db.query(CampaignDailyStats).filter(
+            CampaignDailyStats.campaign_id == campaign_id,
+            CampaignDailyStats.event_type.in_(counters)
+        )
+        if first_day is not None:
+            compacted = compacted.filter(CampaignDailyStats.day >= first_day)
+        if end_day is not None:
+            compacted = compacted.filter(CampaignDailyStats.day < end_day)
+
+        for stats in compacted:
+            total_key, emails_key = counters[stats.event_type]
+            row = bucket(stats.day.isoformat())
+            row[total_key] += stats.event_count
+            row[emails_key] += stats.email_count
+
+        return [days[day] for day in sorted(days)]
+
+    def get_archive_stats(self, start_date=None, end_date=None, email_id=None, campaign_id=None,
+                          exclude_machine=False):
+        """
+        Recompute event statistics from the raw events in the cold archive
+
+        For audits and re-analysis of periods the hot table no longer holds;
+        only segments whose min/max ranges overlap the filters are read.
+
+        Args:
+            start_date: Only events at or after this datetime (optional)
+            end_date: Only events before this datetime (optional)
+            email_id: Only events of this email (optional)
+            campaign_id: Only events of this campaign's emails (optional)
+            exclude_machine: Leave out machine opens and scanner clicks (see app.machine_events)
+
+        Returns:
+            dict: Segment counts, event totals by type, unique emails per type
+                  and device breakdown
+
+        Raises:
+            ValidationError: If no archive directory is configured
+            NotFoundError: If the email or campaign doesn't exist
+        """
+        if not event_archive.enabled:
+            raise ValidationError("Event archive is disabled - set ARCHIVE_DIR", field='ARCHIVE_DIR')
+
+        email_ids = None
+        if email_id is not None:
+            email_ids = {self.email_service.get_email(email_id).id}
+        if campaign_id is not None:
+            campaign = self.campaign_service.get_campaign(campaign_id)
+            campaign_emails = {row[0] for row in campaign.emails.with_entities(Email.id)}
+            email_ids = campaign_emails if email_ids is None else email_ids & campaign_emails
+
+        segments = event_archive.segments(email_ids, start_date, end_date)
+        events_by_type = {}
+        emails_by_type = {}
+        device_breakdown = {}
+        total_events = 0
+
+        for event in event_archive.scan(email_ids, start_date, end_date):
+            if exclude_machine and event['machine_reason']:
+                continue
+            hits = 1 + event['repeat_count']
+            total_events += hits
+            event_type = event['event_type']
+            events_by_type[event_type] = events_by_type.get(event_type, 0) + hits
+            emails_by_type.setdefault(event_type, set()).add(event['email_id'])
+            if event['device_type']:
+                device_breakdown[event['device_type']] = device_breakdown.get(event['device_type'], 0) + hits
+
+        archived_before = event_archive.archived_before
+        return {
+            'segments_total': len(event_archive.segments()),
+            'segments_scanned': len(segments),
+            'archived_before': archived_before.isoformat() if archived_before else None,
+            'total_events': total_events,
+            'events_by_type': events_by_type,
+            'unique_emails_by_type': {key: len(value) for key, value in emails_by_type.items()},
+            'device_breakdown': device_breakdown
+        }
+
+    @staticmethod
+    def _compacted_count(exclude_machine):
+        """Events an EmailDailyStats row stands for - without its machine events when excluding them"""
+        if exclude_machine:
+            return EmailDailyStats.event_count - EmailDailyStats.machine_count
+        return EmailDailyStats.event_count
+
+    @staticmethod
+    def _day_range(start_date, end_date):
+        """
+        Daily aggregates to include for a datetime range
+
+        Returns:
+            tuple: (first_day, end_day) - a day counts when its midnight falls in
+                   [start_date, end_date); None for an open bound
+        """
+        def first_midnight(value):
+            if value is None:
+                return None
+            day = value.date()
+            return day if value.time() == time.min else day + timedelta(days=1)
+
+        return first_midnight(start_date), first_midnight(end_date)
+
     def get_top_performing_campaigns(self, limit=10, metric='open_rate'):
         """
         Get top performing campaigns
@@ -250,7 +568,7 @@ class AnalyticsService:
         Returns:
             list: List of campaign stats sorted by metric
         """
-        campaigns = Campaign.query.all()
+        campaigns = self.db.query(Campaign).all()
         campaign_stats = []
 
         for campaign in campaigns:
@@ -265,3 +583,110 @@ class AnalyticsService:
         sorted_campaigns = sorted(campaign_stats, key=lambda x: x.get(metric, 0), reverse=True)
 
         return sorted_campaigns[:limit]
+
+    def get_top_values(self, dimension, campaign_id=None, limit=10, exact=False, exclude_machine=False):
+        """
+        Most frequent clicked links, link domains, IPs or user agents
+
+        Answered from the heavy-hitter sketch of the scope (see
+        app.heavy_hitters) - one row, whatever the event volume - or exactly
+        by grouping the raw events when asked to, when excluding machine
+        events, or when there is no sketch (sketches off or not flushed yet).
+
+        Args:
+            dimension: 'links', 'domains', 'ips' or 'user_agents'
+            campaign_id: Only this campaign's events (optional)
+            limit: Number of values to return
+            exact: Group the raw events instead of reading the sketch
+            exclude_machine: Leave out machine opens and scanner clicks (answered exactly)
+
+        Returns:
+            dict: Top values, most hits first - each with a count (upper bound)
+                  and error (count - error is a lower bound; 0 when exact) -
+                  and unlisted_max, the most hits any value not listed can have
+
+        Raises:
+            NotFoundError: If the campaign doesn't exist
+            ValidationError: If the dimension or limit is invalid
+        """
+        if dimension not in DIMENSIONS:
+            raise ValidationError(f"Unknown dimension: {dimension} (expected one of {', '.join(DIMENSIONS)})",
+                                  field='dimension')
+        if limit < 1 or limit > 100:
+            raise ValidationError("limit must be between 1 and 100", field='limit')
+        if campaign_id is not None:
+            self.campaign_service.get_campaign(campaign_id)
+
+        sketch = None
+        if not exact and not exclude_machine and heavy_hitters.enabled:
+            sketch = self.db.get(HeavyHitterSketch, (dimension, ALL_CAMPAIGNS if campaign_id is None else campaign_id))
+
+        if sketch is not None:
+            entries = json.loads(sketch.entries)
+            items = [{'value': value, 'count': count, 'error': error} for value, count, error in entries[:limit]]
+            unlisted_max = max([sketch.floor] + [count for _, count, _ in entries[limit:limit + 1]])
+            total = sketch.total
+        else:
+            ranked, total = self.exact_top_values(dimension, campaign_id, limit + 1, exclude_machine)
+            items = [{'value': value, 'count': hits, 'error': 0} for value, hits in ranked[:limit]]
+            unlisted_max = ranked[limit][1] if len(ranked) > limit else 0
+
+        return {
+            'dimension': dimension,
+            'campaign_id': campaign_id,
+            'exact': sketch is None,
+            'total': total,
+            'unlisted_max': unlisted_max,
+            'items': items
+        }
+
+    def exact_top_values(self, dimension, campaign_id=None, limit=None, exclude_machine=False):
+        """
+        Most frequent values of a sketch dimension, by grouping the raw events
+        (compacted and archived events carry no values, so they are not counted)
+
+        Args:
+            dimension: 'links', 'domains', 'ips' or 'user_agents'
+            campaign_id: Only this campaign's events (optional)
+            limit: Number of values to return (optional, all by default)
+            exclude_machine: Leave out machine opens and scanner clicks
+
+        Returns:
+            tuple: (list of (value, hits), most first; total hits of the dimension)
+        """
+        column = {
+            'links': TrackingEvent.clicked_url,
+            'domains': TrackingEvent.clicked_url,
+            'ips': TrackingEvent.ip_address_id,
+            'user_agents': TrackingEvent.user_agent_id,
+        }[dimension]
+        hits = func.sum(TrackingEvent.hits)
+
+        def event_query(*entities):
+            query = self.db.query(*entities).filter(
+                column.isnot(None),
+                TrackingEvent.event_type_id.in_([EVENT_TYPE.static_key(name) for name in DIMENSIONS[dimension]]))
+            if campaign_id is not None:
+                query = query.join(Email, Email.id == TrackingEvent.email_id).filter(Email.campaign_id == campaign_id)
+            if exclude_machine:
+                query = query.filter(TrackingEvent.machine_reason == HUMAN)
+            return query
+
+        if dimension == 'domains':
+            # Hosts are not stored, so fold the grouped URLs
+            domains = Counter()
+            for url, count in event_query(column, hits).group_by(column):
+                domain = url_domain(url)
+                if domain is not None:
+                    domains[domain] += count
+            return domains.most_common(limit), sum(domains.values())
+
+        query = event_query(column, hits).group_by(column).order_by(hits.desc(), column)
+        if limit is not None:
+            query = query.limit(limit)
+        ranked = query.all()
+        if dimension != 'links':
+            values = IP_ADDRESS if dimension == 'ips' else USER_AGENT
+            ranked = [(event_dimensions.decode(self.db, values, key), count) for key, count in ranked]
+
+        return [(value, count) for value, count in ranked], event_query(hits).scalar() or 0
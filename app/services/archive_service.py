@@ -0,0 +1,82 @@
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from app import db
+from app.archive import event_archive, COLUMNS
+from app.exceptions import ValidationError
+from app.models import TrackingEvent
+
+
+class ArchiveService:
+    """Service for copying old tracking events into the cold archive"""
+
+    def __init__(self, db_session=None):
+        """
+        Initialize ArchiveService
+
+        Args:
+            db_session: Database session (defaults to db.session)
+        """
+        self._db_session = db_session
+
+    @property
+    def db(self):
+        """Lazy database session property - only accesses db.session when used"""
+        return self._db_session if self._db_session is not None else db.session
+
+    def archive(self, cutoff, segment_rows=None):
+        """
+        Copy every not yet archived event created before the cutoff into segments
+
+        Events are read in (created_at, id) order after the manifest position,
+        one segment per page, so an interrupted run resumes where it stopped.
+        Nothing is deleted here - RetentionService removes events once they
+        are archived.
+
+        Args:
+            cutoff: Archive events created before this datetime
+            segment_rows: Events per segment (defaults to ARCHIVE_SEGMENT_ROWS)
+
+        Returns:
+            dict: events and segments written, and the archived_before mark
+
+        Raises:
+            ValidationError: If no archive directory is configured or segment_rows < 1
+        """
+        if not event_archive.enabled:
+            raise ValidationError("Event archive is disabled - set ARCHIVE_DIR", field='ARCHIVE_DIR')
+        if segment_rows is None:
+            segment_rows = current_app.config['ARCHIVE_SEGMENT_ROWS']
+        if segment_rows < 1:
+            raise ValidationError(f"Segment size must be positive: {segment_rows}", field='segment_rows')
+
+        columns = [getattr(TrackingEvent, name) for name in COLUMNS]
+        position = event_archive.position()
+        events = 0
+        segments = 0
+
+        while True:
+            query = self.db.query(*columns).filter(TrackingEvent.created_at < cutoff)
+            if position is not None:
+                created_at, event_id = position
+                query = query.filter(or_(
+                    TrackingEvent.created_at > created_at,
+                    and_(TrackingEvent.created_at == created_at, TrackingEvent.id > event_id)
+                ))
+            rows = [row._asdict() for row in query.order_by(
+                TrackingEvent.created_at, TrackingEvent.id).limit(segment_rows)]
+            if not rows:
+                break
+
+            event_archive.append(rows)
+            position = (rows[-1]['created_at'], rows[-1]['id'])
+            events += len(rows)
+            segments += 1
+
+        event_archive.mark_archived_before(cutoff)
+
+        return {
+            'events': events,
+            'segments': segments,
+            'archived_before': cutoff.isoformat()
+        }
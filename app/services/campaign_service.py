@@ -1,6 +1,8 @@
 from app import db
-from app.models import Campaign
+from app.db_routing import read_session
+from app.models import Campaign, Email, EmailDailyStats, HeavyHitterSketch
 from app.exceptions import NotFoundError, ValidationError
+from sqlalchemy import func
 
 
 class CampaignService:
@@ -20,6 +22,11 @@ class CampaignService:
         """Lazy database session property - only accesses db.session when used"""
         return self._db_session if self._db_session is not None else db.session
 
+    @property
+    def read_db(self):
+        """Session for read-only listing queries - routed to the replica when one is configured"""
+        return self._db_session if self._db_session is not None else read_session
+
     def create_campaign(self, name, description=None, created_by=None, status='draft'):
         """
         Create a new campaign
@@ -69,7 +76,7 @@ class CampaignService:
         Raises:
             NotFoundError: If campaign doesn't exist
         """
-        campaign = Campaign.query.get(campaign_id)
+        campaign = self.db.get(Campaign, campaign_id)
         if not campaign:
             raise NotFoundError(f"Campaign with id {campaign_id} not found")
 
@@ -88,7 +95,7 @@ class CampaignService:
         Returns:
             list: List of Campaign instances
         """
-        query = Campaign.query
+        query = self.read_db.query(Campaign)
 
         # Apply filters
         if status:
@@ -156,6 +163,9 @@ class CampaignService:
         """
         campaign = self.get_campaign(campaign_id)
 
+        # Sketch rows carry no foreign key (campaign_id 0 stands for all campaigns)
+        self.db.query(HeavyHitterSketch).filter(HeavyHitterSketch.campaign_id == campaign.id).delete(
+            synchronize_session=False)
         self.db.delete(campaign)
         self.db.commit()
 
@@ -182,8 +192,17 @@ class CampaignService:
         total_clicks = 0
 
         for email in campaign.emails:
-            total_opens += email.events.filter_by(event_type='open').count()
-            total_clicks += email.events.filter_by(event_type='click').count()
+            total_opens += email.event_hits('open')
+            total_clicks += email.event_hits('click')
+
+        # Events rolled into daily aggregates by the retention job
+        compacted = dict(self.db.query(
+            EmailDailyStats.event_type, func.sum(EmailDailyStats.event_count)
+        ).join(Email, Email.id == EmailDailyStats.email_id).filter(
+            Email.campaign_id == campaign_id
+        ).group_by(EmailDailyStats.event_type).all())
+        total_opens += compacted.get('open', 0)
+        total_clicks += compacted.get('click', 0)
 
         return {
             'campaign_id': campaign_id,
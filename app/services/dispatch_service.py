@@ -0,0 +1,128 @@
+import asyncio
+import time
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.dispatcher import ACTIVE, COMPLETED, PAUSED, AsyncSmtpPool, Dispatcher
+from app.exceptions import DatabaseError, NotFoundError, ValidationError
+from app.mailer import PENDING
+from app.metrics import emails_sent
+from app.models import Campaign, Email
+from app.services.send_service import SEND_COLUMNS, SendService
+
+# A recipient held in the dispatcher's buffer
+Recipient = namedtuple('Recipient', 'id tracking_id recipient_email sender_email subject body')
+
+
+class DispatchService:
+    """
+    Dispatching a campaign's queued emails on an asyncio event loop (see app.dispatcher)
+
+    Provides the dispatcher's database side: the keyset reader, the
+    checkpoint writer and the Campaign.status poll.
+    """
+
+    def __init__(self, db_session=None):
+        """
+        Initialize DispatchService
+
+        Args:
+            db_session: Database session (defaults to db.session)
+        """
+        self._db_session = db_session
+
+    @property
+    def db(self):
+        """Lazy database session property - only accesses db.session when used"""
+        return self._db_session if self._db_session is not None else db.session
+
+    def dispatch(self, campaign_id, limit=None):
+        """
+        Send a campaign's queued emails, and retry its deferred ones
+
+        Runs until every email was tried, the campaign is set to anything
+        but active or paused, or limit emails were tried. Blocks while the
+        campaign is paused.
+
+        Args:
+            campaign_id: Campaign ID
+            limit: Stop after this many emails (optional)
+
+        Returns:
+            dict: sent, deferred and failed counts, the seconds taken and the
+                campaign's status at the end ('completed' once nothing is
+                left queued or deferred)
+
+        Raises:
+            NotFoundError: If the campaign doesn't exist
+            ValidationError: If the campaign is not active or paused, or limit is less than 1
+            DatabaseError: If a checkpoint fails (earlier checkpoints stay committed)
+        """
+        campaign = self.db.get(Campaign, campaign_id)
+        if campaign is None:
+            raise NotFoundError(f"Campaign with ID {campaign_id} not found")
+        if campaign.status not in (ACTIVE, PAUSED):
+            raise ValidationError(f"Campaign {campaign_id} is {campaign.status}; set it to active to send it",
+                                  field='status')
+        if limit is not None and limit < 1:
+            raise ValidationError(f"Limit must be positive: {limit}", field='limit')
+
+        config = current_app.config
+        pool = AsyncSmtpPool(config['MAIL_SERVER'], config['MAIL_PORT'], use_tls=config['MAIL_USE_TLS'],
+                             username=config['MAIL_USERNAME'], password=config['MAIL_PASSWORD'],
+                             timeout=config['MAIL_TIMEOUT'], max_messages=config['MAIL_MAX_MESSAGES_PER_CONNECTION'])
+        query = self.db.query(*SEND_COLUMNS).filter(Email.campaign_id == campaign_id,
+                                                    Email.delivery_status.in_(PENDING))
+
+        def fetch(after_id, size):
+            rows = query.filter(Email.id > after_id).order_by(Email.id).limit(size).all()
+            bodies = {}  # one copy of each distinct body, not one per row
+            return [Recipient(*row[:5], bodies.setdefault(row.body, row.body)) for row in rows]
+
+        dispatcher = Dispatcher(
+            pool, fetch, self._record, lambda: self._status(campaign_id),
+            connections=config['DISPATCH_CONNECTIONS'],
+            domain_concurrency=config['DISPATCH_DOMAIN_CONCURRENCY'],
+            domain_rate=config['DISPATCH_DOMAIN_RATE'],
+            rate_window=config['DISPATCH_RATE_WINDOW'],
+            buffer_size=config['DISPATCH_BUFFER_SIZE'],
+            batch_size=config['MAIL_SEND_BATCH_SIZE'],
+            checkpoint_seconds=config['DISPATCH_CHECKPOINT_SECONDS'],
+            status_seconds=config['DISPATCH_STATUS_SECONDS'],
+            tracking_base_url=config['MAIL_TRACKING_BASE_URL'],
+            limit=limit)
+        started = time.perf_counter()
+        result = asyncio.run(dispatcher.run())
+        seconds = time.perf_counter() - started
+
+        status = dispatcher.last_status
+        if status == ACTIVE and not query.limit(1).count():
+            status = self._complete(campaign_id)
+        return dict(result, seconds=seconds, status=status)
+
+    def _record(self, outcomes):
+        """Checkpoint outcomes (see SendService.record)"""
+        SendService(self._db_session).record(outcomes)
+        for outcome in outcomes:
+            emails_sent.inc(outcome['delivery_status'])
+
+    def _status(self, campaign_id):
+        """Current Campaign.status, as committed by any process"""
+        status = self.db.execute(select(Campaign.status).where(Campaign.id == campaign_id)).scalar()
+        self.db.commit()  # end the read, so the next poll sees later changes
+        return status
+
+    def _complete(self, campaign_id):
+        """Mark the campaign completed, unless it was paused or changed meanwhile; returns its status"""
+        try:
+            self.db.execute(update(Campaign).where(Campaign.id == campaign_id, Campaign.status == ACTIVE)
+                            .values(status=COMPLETED))
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to complete campaign: {str(e)}")
+        return self._status(campaign_id)
@@ -1,8 +1,12 @@
 from typing import List, Tuple
 from app import db
+from app.db_routing import read_session
+from app.enrichment import bump_generation
 from app.models import Email, Campaign
+from app.read_models import EmailRow, email_rows
 from app.utils import validate_email, generate_tracking_id
 from app.exceptions import ValidationError, NotFoundError
+from app.mailer import QUEUED
 
 class EmailService:
     def __init__(self, db_session=None):
@@ -13,7 +17,19 @@ class EmailService:
         """Lazy database session property - only accesses db.session when used"""
         return self._db_session if self._db_session is not None else db.session
 
-    def create_email(self, recipient_email, sender_email, subject=None, body=None, campaign_id=None):
+    @property
+    def read_db(self):
+        """Session for read-only listing queries - routed to the replica when one is configured"""
+        return self._db_session if self._db_session is not None else read_session
+
+    def create_email(self, recipient_email, sender_email, subject=None, body=None, campaign_id=None, queue=False):
+        """
+        Create an email record
+
+        By default the email counts as sent by the caller and sent_at is now.
+        With queue=True it waits for `flask mail send` (app.mailer), which
+        sets sent_at to the time the SMTP server accepted it.
+        """
         if not validate_email(recipient_email):
             raise ValidationError(f"Incorrect Recipient Email: {recipient_email}")
         
@@ -21,7 +37,7 @@ class EmailService:
             raise ValidationError(f"Incorrect Sender Email: {sender_email}")
         
         if campaign_id is not None:
-            campaign = Campaign.query.get(campaign_id)
+            campaign = self.db.get(Campaign, campaign_id)
             if not campaign:
                 raise NotFoundError(f"Campaign with id {campaign_id} not found")
             
@@ -33,7 +49,8 @@ class EmailService:
             sender_email=sender_email,
             subject=subject,
             body=body,
-            campaign_id=campaign_id
+            campaign_id=campaign_id,
+            delivery_status=QUEUED if queue else None
         )
 
         self.db.add(email)
@@ -43,7 +60,7 @@ class EmailService:
 
 
     def get_email(self, email_id):
-        email = Email.query.get(email_id)
+        email = self.db.get(Email, email_id)
 
         if not email:
             raise NotFoundError(f"Email not found: {email_id}")
@@ -51,7 +68,7 @@ class EmailService:
         return email
 
     def get_email_by_tracking_id(self, tracking_id):
-        email = Email.query.filter_by(tracking_id=tracking_id).first()
+        email = self.db.query(Email).filter_by(tracking_id=tracking_id).first()
 
         if not email:
             raise NotFoundError(f"Tracking Event not found: {tracking_id}")
@@ -59,14 +76,17 @@ class EmailService:
         return email
 
         
-    def list_emails(self, campaign_id=None, recipient_email=None, sender_email=None, limit=50, offset=0) -> Tuple[List[Email], int]:
+    def list_emails(self, campaign_id=None, recipient_email=None, sender_email=None, limit=50, offset=0) -> Tuple[List[EmailRow], int]:
         """
         List emails with optional filters
 
+        Emails are returned as read-only EmailRow tuples (same to_dict() as
+        Email), with open/click totals loaded for the whole page at once.
+
         Returns:
             tuple: (emails, total_count) where emails is the paginated list and total_count is the total matching records
         """
-        query = Email.query
+        query = self.read_db.query(Email)
         if campaign_id is not None:
             query = query.filter_by(campaign_id=campaign_id)
         if recipient_email is not None:
@@ -78,7 +98,7 @@ class EmailService:
         total_count = query.count()
 
         # Apply pagination
-        emails = query.limit(limit).offset(offset).all()
+        emails = email_rows(self.read_db, query, limit=limit, offset=offset)
 
         return emails, total_count
 
@@ -90,7 +110,7 @@ class EmailService:
                 raise ValidationError(f"Campaign ID is incorrect type: {campaign_id}")
 
             # TODO: use Campaign Service function
-            campaign = Campaign.query.get(campaign_id)
+            campaign = self.db.get(Campaign, campaign_id)
 
             if not campaign:
                 raise NotFoundError(f"Campaign not found: {campaign_id}")
@@ -111,6 +131,8 @@ class EmailService:
         email = self.get_email(email_id)
 
         self.db.delete(email)
+        # The email's events go with it
+        bump_generation(self.db)
         self.db.commit()
 
     def get_email_events(self, email_id, event_type):
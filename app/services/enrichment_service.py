@@ -0,0 +1,264 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.dimensions import DEVICE_TYPE, event_dimensions
+from app.enrichment import PIPELINE, event_enrichment
+from app.exceptions import DatabaseError, ValidationError
+from app.models import TrackingEvent, UserAgent, IpAddress, EnrichmentState
+from app.partitions import event_partitions
+from app.utils import parse_user_agent, is_bot_user_agent
+
+
+class EnrichmentService:
+    """
+    Staged enrichment of tracking events (see app.enrichment)
+
+    Dimension stages classify each pending user agent / IP once; the event
+    stage then copies the results onto events above the high-water mark,
+    one batch per transaction. A failed batch rolls back without moving the
+    mark, so the next run picks up where this one stopped.
+    """
+
+    def __init__(self, db_session=None):
+        """
+        Initialize EnrichmentService
+
+        Args:
+            db_session: Database session (defaults to db.session)
+        """
+        self._db_session = db_session
+
+    @property
+    def db(self):
+        """Lazy database session property - only accesses db.session when used"""
+        return self._db_session if self._db_session is not None else db.session
+
+    def state(self):
+        """EnrichmentState of the event pipeline, created at high-water mark 0"""
+        state = self.db.get(EnrichmentState, PIPELINE)
+        if state is None:
+            state = EnrichmentState(name=PIPELINE, high_water_mark=0, generation=0)
+            self.db.add(state)
+            self.db.flush()
+        return state
+
+    def run(self, batch_size=None, max_batches=None):
+        """
+        Enrich pending user agents and IPs, then events above the high-water mark
+
+        Events written while the run is in progress are left for the next one,
+        so every event it enriches already has its user agent classified.
+
+        Args:
+            batch_size: Events per transaction (defaults to ENRICHMENT_BATCH_SIZE)
+            max_batches: Stop after this many event batches (optional)
+
+        Returns:
+            dict: user_agents, ip_addresses and events enriched, batches and
+                  the new high_water_mark
+
+        Raises:
+            ValidationError: If batch_size is less than 1
+            DatabaseError: If a batch fails (earlier batches stay committed)
+        """
+        batch_size = self._batch_size(batch_size)
+        target = self.db.query(func.max(TrackingEvent.id)).scalar() or 0
+
+        user_agents = self._enrich_user_agents(batch_size, pending_only=True)
+        ip_addresses = self._enrich_ip_addresses(batch_size, pending_only=True)
+
+        state = self.state()
+        events = batches = 0
+        while state.high_water_mark < target and (max_batches is None or batches < max_batches):
+            lower = state.high_water_mark
+            upper = self._batch_end(lower, target, batch_size)
+            try:
+                events += self._enrich_events(lower, upper)
+                state.high_water_mark = upper
+                self.db.commit()
+            except SQLAlchemyError as e:
+                self.db.rollback()
+                raise DatabaseError(f"Enrichment failed after {events} events: {e}")
+            batches += 1
+        self.db.commit()
+
+        return {
+            'user_agents': user_agents,
+            'ip_addresses': ip_addresses,
+            'events': events,
+            'batches': batches,
+            'high_water_mark': state.high_water_mark
+        }
+
+    def rerun(self, since=None, batch_size=None):
+        """
+        Re-classify every user agent and IP and re-apply them to already enriched events
+
+        Events above the high-water mark are left to run(). Bumps the state's
+        generation so in-process caches of event rows reload.
+
+        Args:
+            since: Only re-apply to events created at or after this datetime (optional)
+            batch_size: Rows per transaction (defaults to ENRICHMENT_BATCH_SIZE)
+
+        Returns:
+            dict: user_agents, ip_addresses and events re-enriched
+
+        Raises:
+            ValidationError: If batch_size is less than 1
+            DatabaseError: If a batch fails (earlier batches stay committed)
+        """
+        batch_size = self._batch_size(batch_size)
+        user_agents = self._enrich_user_agents(batch_size, pending_only=False)
+        ip_addresses = self._enrich_ip_addresses(batch_size, pending_only=False)
+
+        state = self.state()
+        target = state.high_water_mark
+        query = self.db.query(func.min(TrackingEvent.id))
+        if since is not None:
+            query = query.filter(TrackingEvent.created_at >= since)
+        first = query.scalar()
+
+        events = 0
+        lower = first - 1 if first is not None else target
+        while lower < target:
+            upper = self._batch_end(lower, target, batch_size)
+            try:
+                events += self._enrich_events(lower, upper)
+                self.db.commit()
+            except SQLAlchemyError as e:
+                self.db.rollback()
+                raise DatabaseError(f"Re-enrichment failed after {events} events: {e}")
+            lower = upper
+
+        state.generation += 1
+        self.db.commit()
+
+        return {'user_agents': user_agents, 'ip_addresses': ip_addresses, 'events': events}
+
+    def status(self):
+        """
+        Pipeline progress
+
+        Returns:
+            dict: mode, high_water_mark, latest_event_id, generation and the
+                  pending events, user agents and IPs
+        """
+        state = self.db.get(EnrichmentState, PIPELINE)
+        high_water_mark = state.high_water_mark if state else 0
+        pending_ips = 0
+        if event_enrichment.geo_enabled:
+            pending_ips = self.db.query(func.count(IpAddress.id)).filter(IpAddress.enriched_at.is_(None)).scalar()
+
+        return {
+            'mode': current_app.config['TRACKING_ENRICHMENT'],
+            'high_water_mark': high_water_mark,
+            'latest_event_id': self.db.query(func.max(TrackingEvent.id)).scalar() or 0,
+            'generation': state.generation if state else 0,
+            'pending_events': self.db.query(func.count(TrackingEvent.id)).filter(
+                TrackingEvent.id > high_water_mark).scalar(),
+            'pending_user_agents': self.db.query(func.count(UserAgent.id)).filter(
+                UserAgent.enriched_at.is_(None)).scalar(),
+            'pending_ip_addresses': pending_ips
+        }
+
+    @staticmethod
+    def _batch_size(batch_size):
+        if batch_size is None:
+            batch_size = current_app.config['ENRICHMENT_BATCH_SIZE']
+        if batch_size < 1:
+            raise ValidationError(f"Batch size must be positive: {batch_size}", field='batch_size')
+        return batch_size
+
+    def _batch_end(self, lower, target, batch_size):
+        """Id of the batch_size-th event above lower (or target, if fewer are left)"""
+        upper = self.db.query(TrackingEvent.id).filter(
+            TrackingEvent.id > lower, TrackingEvent.id <= target
+        ).order_by(TrackingEvent.id).offset(batch_size - 1).limit(1).scalar()
+        return upper if upper is not None else target
+
+    # Stages
+
+    def _dimension_batches(self, model, batch_size, pending_only):
+        """(id, value) rows of a dimension table in id order, batch_size at a time"""
+        last_id = None
+        while True:
+            query = self.db.query(model.id, model.value)
+            if pending_only:
+                query = query.filter(model.enriched_at.is_(None))
+            if last_id is not None:
+                query = query.filter(model.id > last_id)
+            rows = query.order_by(model.id).limit(batch_size).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1].id
+
+    def _update_dimension(self, model, values):
+        try:
+            self.db.execute(update(model), values)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Enriching {model.__tablename__} failed: {e}")
+
+    def _enrich_user_agents(self, batch_size, pending_only):
+        """Stage 1: device type, browser, OS and bot flag of each user agent"""
+        enriched = 0
+        for rows in self._dimension_batches(UserAgent, batch_size, pending_only):
+            now = datetime.utcnow()
+            values = []
+            for row in rows:
+                parsed = parse_user_agent(row.value)
+                values.append({
+                    'id': row.id,
+                    'device_type_id': event_dimensions.key(self.db, DEVICE_TYPE, parsed['device_type']),
+                    'browser': parsed['browser'],
+                    'os': parsed['os'],
+                    'is_bot': is_bot_user_agent(row.value),
+                    'enriched_at': now
+                })
+            self._update_dimension(UserAgent, values)
+            enriched += len(rows)
+        return enriched
+
+    def _enrich_ip_addresses(self, batch_size, pending_only):
+        """Stage 2: location of each IP address (only with GEOIP_DATABASE)"""
+        if not event_enrichment.geo_enabled:
+            return 0
+
+        enriched = 0
+        for rows in self._dimension_batches(IpAddress, batch_size, pending_only):
+            now = datetime.utcnow()
+            self._update_dimension(IpAddress, [
+                {'id': row.id, 'location': event_enrichment.locate(row.value), 'enriched_at': now}
+                for row in rows
+            ])
+            enriched += len(rows)
+        return enriched
+
+    def _enrich_events(self, lower, upper):
+        """
+        Stage 3: copy dimension results onto the events with lower < id <= upper
+
+        One UPDATE per storage table; correlated lookups by primary key keep it
+        a single pass over the id range. A device type is only replaced by a
+        classified one, and a location only filled in where it is missing.
+        """
+        user_agents, ip_addresses = UserAgent.__table__, IpAddress.__table__
+        updated = 0
+        for table in event_partitions.storage_tables(self.db.connection()):
+            device = select(user_agents.c.device_type_id).where(
+                user_agents.c.id == table.c.user_agent_id).scalar_subquery()
+            location = select(ip_addresses.c.location).where(
+                ip_addresses.c.id == table.c.ip_address_id).scalar_subquery()
+            result = self.db.execute(
+                table.update().where(table.c.id > lower, table.c.id <= upper).values(
+                    device_type_id=func.coalesce(device, table.c.device_type_id),
+                    location=func.coalesce(table.c.location, location)))
+            updated += result.rowcount
+        return updated
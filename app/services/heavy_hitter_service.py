@@ -0,0 +1,109 @@
+import json
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.db_routing import session_router
+from app.exceptions import DatabaseError, ValidationError
+from app.heavy_hitters import ALL_CAMPAIGNS, DIMENSIONS, heavy_hitters, merge_counts
+from app.models import Email, HeavyHitterSketch
+
+
+class HeavyHitterService:
+    """
+    Persistence of the heavy-hitter sketches (see app.heavy_hitters)
+
+    Ingest counts hits in memory; flush folds them into the stored sketches
+    in one transaction. A failed flush rolls back and keeps the hits for the
+    next one, so none are lost to a transient error.
+    """
+
+    def __init__(self, db_session=None):
+        """
+        Initialize HeavyHitterService
+
+        Args:
+            db_session: Database session (defaults to db.session)
+        """
+        self._db_session = db_session
+
+    @property
+    def db(self):
+        """Lazy database session property - only accesses db.session when used"""
+        return self._db_session if self._db_session is not None else db.session
+
+    def flush(self):
+        """
+        Fold this worker's pending hits into the stored sketches and commit
+
+        Returns:
+            int: Number of sketches updated (0 if the flush failed - the hits
+                 stay pending)
+        """
+        pending = heavy_hitters.take_pending()
+        if not pending:
+            return 0
+
+        try:
+            for (dimension, campaign_id), counts in pending.items():
+                sketch = self.db.get(HeavyHitterSketch, (dimension, campaign_id), with_for_update=True)
+                if sketch is None:
+                    sketch = HeavyHitterSketch(dimension=dimension, campaign_id=campaign_id, total=0, floor=0,
+                                               entries='[]')
+                    self.db.add(sketch)
+                entries, sketch.floor = merge_counts(
+                    {value: (count, error) for value, count, error in json.loads(sketch.entries)},
+                    sketch.floor, counts, heavy_hitters.capacity)
+                sketch.entries = json.dumps(entries)
+                sketch.total += sum(counts.values())
+            session_router.commit_ingest(self.db)
+        except SQLAlchemyError:
+            # e.g. another worker created the same sketch first - retry with the next flush
+            self.db.rollback()
+            heavy_hitters.restore_pending(pending)
+            return 0
+        return len(pending)
+
+    def rebuild(self):
+        """
+        Recompute every sketch exactly from the raw events
+
+        Hits pending in workers at the time are counted again when they
+        flush, so run it while ingest is quiet.
+
+        Returns:
+            int: Number of sketches written
+
+        Raises:
+            ValidationError: If sketches are off (HEAVY_HITTERS_CAPACITY = 0)
+            DatabaseError: If writing the sketches fails
+        """
+        from app.services.analytics_service import AnalyticsService
+
+        if not heavy_hitters.enabled:
+            raise ValidationError("Heavy-hitter sketches are off", field='HEAVY_HITTERS_CAPACITY')
+
+        analytics = AnalyticsService(self.db)
+        capacity = heavy_hitters.capacity
+        campaign_ids = [ALL_CAMPAIGNS] + [row[0] for row in self.db.query(Email.campaign_id).filter(
+            Email.campaign_id.isnot(None)).distinct().order_by(Email.campaign_id)]
+
+        try:
+            self.db.query(HeavyHitterSketch).delete(synchronize_session=False)
+            written = 0
+            for campaign_id in campaign_ids:
+                scope = None if campaign_id == ALL_CAMPAIGNS else campaign_id
+                for dimension in DIMENSIONS:
+                    ranked, total = analytics.exact_top_values(dimension, scope, limit=capacity + 1)
+                    if not total:
+                        continue
+                    floor = ranked[capacity][1] if len(ranked) > capacity else 0
+                    self.db.add(HeavyHitterSketch(
+                        dimension=dimension, campaign_id=campaign_id, total=total, floor=floor,
+                        entries=json.dumps([[value, hits, 0] for value, hits in ranked[:capacity]])))
+                    written += 1
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to rebuild heavy-hitter sketches: {str(e)}")
+        return written
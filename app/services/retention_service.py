@@ -0,0 +1,236 @@
+import time as _time
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.exceptions import DatabaseError, ValidationError
+from app.models import TrackingEvent, Email, EmailDailyStats, EmailUniqueIp, CampaignDailyStats
+from app.partitions import event_partitions
+from app.archive import event_archive
+from app.enrichment import bump_generation, event_enrichment
+from app.services.archive_service import ArchiveService
+from app.services.enrichment_service import EnrichmentService
+
+
+class RetentionService:
+    """
+    Rolls raw tracking events past the retention window into daily aggregates
+
+    Each chunk of old events is folded into EmailDailyStats (per email, day,
+    type and device), CampaignDailyStats (per campaign, day and type) and
+    EmailUniqueIp, then deleted - aggregation and delete share one short
+    transaction, so a chunk is either fully compacted or untouched and ingest
+    only ever waits for one chunk. AnalyticsService adds the aggregates back
+    in, so totals are unchanged by compaction. With ARCHIVE_DIR set, events
+    are copied to the cold archive before any of them is deleted.
+    """
+
+    def __init__(self, db_session=None):
+        """
+        Initialize RetentionService
+
+        Args:
+            db_session: Database session (defaults to db.session)
+        """
+        self._db_session = db_session
+
+    @property
+    def db(self):
+        """Lazy database session property - only accesses db.session when used"""
+        return self._db_session if self._db_session is not None else db.session
+
+    def cutoff(self, days=None, now=None):
+        """
+        Start of the oldest day whose raw events are kept
+
+        Aligned to midnight so a day is either fully raw or fully compacted.
+
+        Args:
+            days: Days of raw events to keep (defaults to RETENTION_DAYS)
+            now: Reference time (defaults to utcnow)
+
+        Raises:
+            ValidationError: If days is less than 1
+        """
+        days = current_app.config['RETENTION_DAYS'] if days is None else days
+        if days < 1:
+            raise ValidationError(f"Retention must be at least 1 day: {days}", field='days')
+
+        now = now or datetime.utcnow()
+        return datetime.combine((now - timedelta(days=days)).date(), time.min)
+
+    def compact(self, days=None, cutoff=None, chunk_size=None, pause=0.0, max_chunks=None):
+        """
+        Compact every raw event created before the cutoff
+
+        Args:
+            days: Retention in days (ignored when cutoff is given)
+            cutoff: Compact events created before this datetime
+            chunk_size: Events per transaction (defaults to RETENTION_CHUNK_SIZE)
+            pause: Seconds to sleep between chunks, leaving the write lock to ingest
+            max_chunks: Stop after this many chunks (optional)
+
+        Returns:
+            dict: cutoff, events and chunks compacted, archive result (None
+                  without an archive) and dropped partitions
+
+        Raises:
+            ValidationError: If chunk_size is less than 1
+            DatabaseError: If a chunk fails (earlier chunks stay committed)
+        """
+        cutoff = cutoff or self.cutoff(days)
+        if chunk_size is None:
+            chunk_size = current_app.config['RETENTION_CHUNK_SIZE']
+        if chunk_size < 1:
+            raise ValidationError(f"Chunk size must be positive: {chunk_size}", field='chunk_size')
+
+        # Aggregates and archive segments keep the derived columns, so fill them in first
+        if event_enrichment.background:
+            EnrichmentService(self._db_session).run()
+
+        archived = None
+        if event_archive.enabled:
+            archived = ArchiveService(self._db_session).archive(cutoff)
+
+        compacted = 0
+        chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            # created_at order walks the created_at index, so each chunk reads only its own rows
+            rows = self.db.query(
+                TrackingEvent.id, TrackingEvent.email_id, Email.campaign_id, TrackingEvent.event_type,
+                TrackingEvent.device_type, TrackingEvent.ip_address, TrackingEvent.created_at,
+                TrackingEvent.machine_reason, TrackingEvent.hits
+            ).join(Email, Email.id == TrackingEvent.email_id).filter(
+                TrackingEvent.created_at < cutoff
+            ).order_by(TrackingEvent.created_at).limit(chunk_size).all()
+
+            if not rows:
+                break
+
+            try:
+                self._compact_chunk(rows)
+                self.db.commit()
+            except SQLAlchemyError as e:
+                self.db.rollback()
+                raise DatabaseError(f"Compaction failed after {compacted} events: {e}")
+
+            compacted += len(rows)
+            chunks += 1
+            if pause:
+                _time.sleep(pause)
+
+        return {
+            'cutoff': cutoff.isoformat(),
+            'events': compacted,
+            'chunks': chunks,
+            'archived': archived,
+            'partitions_dropped': self._drop_empty_partitions(cutoff)
+        }
+
+    def _compact_chunk(self, rows):
+        """Fold one chunk of event rows into the aggregate tables and delete them"""
+        email_groups = {}  # (email_id, day, event_type, device_type) -> [count, machine count, first_at, last_at]
+        campaign_groups = {}  # (campaign_id, day, event_type) -> [count, email ids]
+        ips = {}  # (email_id, event_type, ip_address) -> whether every event from it was a machine one
+
+        for row in rows:
+            day = row.created_at.date()
+
+            key = (row.email_id, day, row.event_type, row.device_type)
+            machine_hits = row.hits if row.machine_reason else 0
+            group = email_groups.get(key)
+            if group is None:
+                email_groups[key] = [row.hits, machine_hits, row.created_at, row.created_at]
+            else:
+                group[0] += row.hits
+                group[1] += machine_hits
+                group[2] = min(group[2], row.created_at)
+                group[3] = max(group[3], row.created_at)
+
+            if row.campaign_id is not None:
+                group = campaign_groups.setdefault((row.campaign_id, day, row.event_type), [0, set()])
+                group[0] += row.hits
+                group[1].add(row.email_id)
+
+            if row.ip_address:
+                key = (row.email_id, row.event_type, row.ip_address)
+                ips[key] = ips.get(key, True) and bool(row.machine_reason)
+
+        email_ids = {key[0] for key in email_groups}
+        days = {key[1] for key in email_groups}
+        existing = {
+            (stats.email_id, stats.day, stats.event_type, stats.device_type): stats
+            for stats in self.db.query(EmailDailyStats).filter(
+                EmailDailyStats.email_id.in_(email_ids), EmailDailyStats.day.in_(days))
+        }
+        # An email only adds to a campaign's email_count the first time it has that event on that day
+        seen = {(email_id, day, event_type) for email_id, day, event_type, _ in existing}
+
+        for key, (count, machine_count, first_at, last_at) in email_groups.items():
+            stats = existing.get(key)
+            if stats is None:
+                email_id, day, event_type, device_type = key
+                self.db.add(EmailDailyStats(email_id=email_id, day=day, event_type=event_type,
+                                            device_type=device_type, event_count=count, machine_count=machine_count,
+                                            first_at=first_at, last_at=last_at))
+            else:
+                stats.event_count += count
+                stats.machine_count += machine_count
+                stats.first_at = min(stats.first_at, first_at)
+                stats.last_at = max(stats.last_at, last_at)
+
+        if campaign_groups:
+            existing = {
+                (stats.campaign_id, stats.day, stats.event_type): stats
+                for stats in self.db.query(CampaignDailyStats).filter(
+                    CampaignDailyStats.campaign_id.in_({key[0] for key in campaign_groups}),
+                    CampaignDailyStats.day.in_(days))
+            }
+            for key, (count, group_emails) in campaign_groups.items():
+                campaign_id, day, event_type = key
+                new_emails = sum(1 for email_id in group_emails if (email_id, day, event_type) not in seen)
+                stats = existing.get(key)
+                if stats is None:
+                    self.db.add(CampaignDailyStats(campaign_id=campaign_id, day=day, event_type=event_type,
+                                                   event_count=count, email_count=new_emails))
+                else:
+                    stats.event_count += count
+                    stats.email_count += new_emails
+
+        if ips:
+            known = {
+                (unique_ip.email_id, unique_ip.event_type, unique_ip.ip_address): unique_ip
+                for unique_ip in self.db.query(EmailUniqueIp).filter(
+                    EmailUniqueIp.email_id.in_({key[0] for key in ips}))
+            }
+            for key, machine_only in ips.items():
+                unique_ip = known.get(key)
+                if unique_ip is None:
+                    email_id, event_type, ip_address = key
+                    self.db.add(EmailUniqueIp(email_id=email_id, event_type=event_type, ip_address=ip_address,
+                                              machine_only=machine_only))
+                elif not machine_only:
+                    # A person used an IP only machines had been seen from
+                    unique_ip.machine_only = False
+
+        self.db.query(TrackingEvent).filter(
+            TrackingEvent.id.in_([row.id for row in rows])
+        ).delete(synchronize_session=False)
+        bump_generation(self.db)
+
+    def _drop_empty_partitions(self, cutoff):
+        """With time partitioning, drop partitions left empty by compaction (no DELETE needed later)"""
+        if not event_partitions.enabled:
+            return []
+
+        dropped = []
+        connection = self.db.connection()
+        partitions = event_partitions.partitions(connection)
+        for name, _, end in partitions[:-1]:  # always keep the newest partition
+            if end <= cutoff and connection.exec_driver_sql(f"SELECT 1 FROM {name} LIMIT 1").first() is None:
+                event_partitions.drop_partition(connection, name)
+                dropped.append(name)
+        self.db.commit()
+        return dropped
@@ -0,0 +1,158 @@
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import func, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.exceptions import DatabaseError, NotFoundError, ValidationError
+from app.mailer import (DELIVERY_STATUSES, DEFERRED, FAILED, PENDING, SENT, DomainThrottle, build_message,
+                        error_outcome, mailer, recipient_domain, reply_outcome)
+from app.metrics import emails_sent
+from app.models import Campaign, Email
+
+# What a send needs of an email - plain rows, safe to hand to worker threads
+SEND_COLUMNS = (Email.id, Email.tracking_id, Email.recipient_email, Email.sender_email, Email.subject, Email.body)
+
+
+class SendService:
+    """
+    Sending queued emails over SMTP (see app.mailer)
+
+    Emails are read by keyset, a chunk at a time, sent by a thread pool over
+    the app's pooled SMTP connections, and each chunk's outcomes are written
+    in one transaction - so an interrupted run resends at most the chunk in
+    flight.
+    """
+
+    def __init__(self, db_session=None):
+        """
+        Initialize SendService
+
+        Args:
+            db_session: Database session (defaults to db.session)
+        """
+        self._db_session = db_session
+
+    @property
+    def db(self):
+        """Lazy database session property - only accesses db.session when used"""
+        return self._db_session if self._db_session is not None else db.session
+
+    def send_queued(self, campaign_id=None, limit=None, batch_size=None):
+        """
+        Send every queued email, and retry the deferred ones
+
+        Args:
+            campaign_id: Only this campaign's emails (optional)
+            limit: Stop after this many emails (optional)
+            batch_size: Emails per chunk (defaults to MAIL_SEND_BATCH_SIZE)
+
+        Returns:
+            dict: sent, deferred and failed counts and the seconds taken
+
+        Raises:
+            ValidationError: If batch_size or limit is less than 1
+            NotFoundError: If the campaign doesn't exist
+            DatabaseError: If recording a chunk fails (earlier chunks stay committed)
+        """
+        config = current_app.config
+        batch_size = config['MAIL_SEND_BATCH_SIZE'] if batch_size is None else batch_size
+        if batch_size < 1:
+            raise ValidationError(f"Batch size must be positive: {batch_size}", field='batch_size')
+        if limit is not None and limit < 1:
+            raise ValidationError(f"Limit must be positive: {limit}", field='limit')
+
+        query = self.db.query(*SEND_COLUMNS).filter(Email.delivery_status.in_(PENDING))
+        if campaign_id is not None:
+            if self.db.get(Campaign, campaign_id) is None:
+                raise NotFoundError(f"Campaign with ID {campaign_id} not found")
+            query = query.filter(Email.campaign_id == campaign_id)
+
+        pool = mailer.pool
+        throttle = DomainThrottle(config['MAIL_DOMAIN_RATE'])
+        tracking_base_url = config['MAIL_TRACKING_BASE_URL']
+
+        def send(email):
+            return self._send(pool, throttle, tracking_base_url, email)
+
+        result = dict.fromkeys((SENT, DEFERRED, FAILED), 0)
+        started = time.perf_counter()
+        last_id, done = 0, 0
+        with ThreadPoolExecutor(max_workers=config['MAIL_SEND_WORKERS'], thread_name_prefix='mail-send') as executor:
+            while limit is None or done < limit:
+                size = batch_size if limit is None else min(batch_size, limit - done)
+                # Deferrals of this run sort before last_id, so they wait for the next run
+                emails = query.filter(Email.id > last_id).order_by(Email.id).limit(size).all()
+                if not emails:
+                    break
+                last_id = emails[-1].id
+                outcomes = list(executor.map(send, emails))
+                self.record(outcomes)
+                for outcome in outcomes:
+                    result[outcome['delivery_status']] += 1
+                    emails_sent.inc(outcome['delivery_status'])
+                done += len(emails)
+
+        return dict(result, seconds=time.perf_counter() - started)
+
+    def delivery_counts(self, campaign_id=None):
+        """
+        Emails per delivery status
+
+        Args:
+            campaign_id: Only this campaign's emails (optional)
+
+        Returns:
+            dict: Count per status in DELIVERY_STATUSES
+
+        Raises:
+            NotFoundError: If the campaign doesn't exist
+        """
+        query = self.db.query(Email.delivery_status, func.count(Email.id)).filter(Email.delivery_status.isnot(None))
+        if campaign_id is not None:
+            if self.db.get(Campaign, campaign_id) is None:
+                raise NotFoundError(f"Campaign with ID {campaign_id} not found")
+            query = query.filter(Email.campaign_id == campaign_id)
+        counts = dict.fromkeys(DELIVERY_STATUSES, 0)
+        counts.update(query.group_by(Email.delivery_status).all())
+        return counts
+
+    @staticmethod
+    def _send(pool, throttle, tracking_base_url, email):
+        """
+        Build and send one email (runs on a worker thread, without the session)
+
+        Returns:
+            dict: Column values recording the outcome, by email id
+        """
+        try:
+            data = build_message(email, tracking_base_url)
+            throttle.wait(recipient_domain(email.recipient_email))
+            code, text = pool.send(email.sender_email, email.recipient_email, data)
+        except (ValueError, smtplib.SMTPException, OSError) as e:
+            return error_outcome(email, e)
+        return reply_outcome(email, code, text)
+
+    def record(self, outcomes):
+        """
+        Write send outcomes in one transaction (bulk UPDATE by primary key)
+
+        Args:
+            outcomes: Column values per email, as returned by reply_outcome / error_outcome
+
+        Raises:
+            DatabaseError: If the update fails
+        """
+        sent = [outcome for outcome in outcomes if outcome['delivery_status'] == SENT]
+        unsent = [outcome for outcome in outcomes if outcome['delivery_status'] != SENT]
+        try:
+            for rows in (sent, unsent):
+                if rows:
+                    self.db.execute(update(Email), rows)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to record send results: {str(e)}")
@@ -1,13 +1,272 @@
+from sqlalchemy import insert, update
+from sqlalchemy.exc import SQLAlchemyError
+
 from app import db
+from app.exceptions import DatabaseError, NotFoundError, ValidationError
+from app.mailer import QUEUED
+from app.models import Campaign, Email, Template
+from app.templating import compile_template, template_engine
+from app.utils import generate_tracking_id, validate_email
+
 
 class TemplateService:
+    """
+    Service for managing email templates and personalizing them (see app.templating)
+
+    Subject and body are compiled once per template version and cached, so
+    rendering a recipient costs no parsing.
+    """
+
     def __init__(self, db_session=None):
+        """
+        Initialize TemplateService
+
+        Args:
+            db_session: Database session (defaults to db.session)
+        """
         self._db_session = db_session
 
     @property
     def db(self):
+        """Lazy database session property - only accesses db.session when used"""
         return self._db_session if self._db_session is not None else db.session
-    
-    def create_template(self, template_id, template_name, subject, body):
-        
-        
\ No newline at end of file
+
+    def create_template(self, name, subject, body):
+        """
+        Create a new template
+
+        Args:
+            name: Template name (required)
+            subject: Subject, with {{ placeholders }} (required)
+            body: HTML body, with {{ placeholders }} (required)
+
+        Returns:
+            Template: Created template instance
+
+        Raises:
+            ValidationError: If a field is missing or has an invalid placeholder
+        """
+        name = self._validate(name, subject, body)
+
+        template = Template(name=name, subject=subject, body=body)
+        try:
+            self.db.add(template)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to create template: {str(e)}")
+
+        return template
+
+    def get_template(self, template_id):
+        """
+        Get template by ID
+
+        Args:
+            template_id: Template ID
+
+        Returns:
+            Template: Template instance
+
+        Raises:
+            NotFoundError: If template doesn't exist
+        """
+        template = self.db.get(Template, template_id)
+        if not template:
+            raise NotFoundError(f"Template with id {template_id} not found")
+
+        return template
+
+    def list_templates(self, name=None, limit=50, offset=0):
+        """
+        List templates with pagination
+
+        Args:
+            name: Filter by exact name (optional)
+            limit: Maximum number of results (default: 50)
+            offset: Number of results to skip (default: 0)
+
+        Returns:
+            list: List of Template instances, by id
+        """
+        query = self.db.query(Template)
+        if name:
+            query = query.filter_by(name=name)
+
+        return query.order_by(Template.id).limit(limit).offset(offset).all()
+
+    def update_template(self, template_id, name=None, subject=None, body=None):
+        """
+        Update template fields
+
+        The new version gets a new updated_at, so its compiled form is cached
+        separately from the old one.
+
+        Args:
+            template_id: Template ID
+            name: New name (optional)
+            subject: New subject (optional)
+            body: New body (optional)
+
+        Returns:
+            Template: Updated template instance
+
+        Raises:
+            NotFoundError: If template doesn't exist
+            ValidationError: If a field is empty or has an invalid placeholder
+        """
+        template = self.get_template(template_id)
+
+        name = self._validate(template.name if name is None else name,
+                              template.subject if subject is None else subject,
+                              template.body if body is None else body)
+        template.name = name
+        if subject is not None:
+            template.subject = subject
+        if body is not None:
+            template.body = body
+
+        try:
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to update template: {str(e)}")
+
+        return template
+
+    def delete_template(self, template_id):
+        """
+        Delete template (emails created from it keep their subject and body, template_id is set to null)
+
+        Args:
+            template_id: Template ID
+
+        Raises:
+            NotFoundError: If template doesn't exist
+        """
+        template = self.get_template(template_id)
+
+        try:
+            self.db.execute(update(Email).where(Email.template_id == template.id).values(template_id=None))
+            self.db.delete(template)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to delete template: {str(e)}")
+
+    def render(self, template_id, variables=None):
+        """
+        Personalize a template for one recipient
+
+        Args:
+            template_id: Template ID
+            variables: dict of placeholder values (optional)
+
+        Returns:
+            dict: subject and body
+
+        Raises:
+            NotFoundError: If template doesn't exist
+            ValidationError: If variables is not a dict
+        """
+        return self.render_bulk(template_id, [variables or {}])[0]
+
+    def render_bulk(self, template_id, recipients):
+        """
+        Personalize a template for many recipients
+
+        Args:
+            template_id: Template ID
+            recipients: List of placeholder value dicts
+
+        Returns:
+            list: dict with subject and body per recipient, in order
+
+        Raises:
+            NotFoundError: If template doesn't exist
+            ValidationError: If a recipient's variables are not a dict
+        """
+        self._check_variables(recipients)
+        compiled = template_engine.compiled(self.get_template(template_id))
+
+        return [{'subject': subject, 'body': body} for subject, body in compiled.render_many(recipients)]
+
+    def create_emails(self, template_id, sender_email, recipients, campaign_id=None, queue=True):
+        """
+        Create one personalized email per recipient, for a campaign send
+
+        Each recipient's variables also get recipient_email and tracking_id,
+        so templates can use {{ recipient_email }} and build tracked links with
+        {{ tracking_id }}. The emails are inserted in one statement and, by
+        default, queued for `flask mail send` / `flask mail dispatch`.
+
+        Args:
+            template_id: Template ID
+            sender_email: Sender of every email
+            recipients: List of dicts with recipient_email plus placeholder values
+            campaign_id: Campaign of the emails (optional)
+            queue: Queue the emails for the send engine (default: True)
+
+        Returns:
+            list: dict with id, tracking_id and recipient_email per created email, in order
+
+        Raises:
+            NotFoundError: If the template or campaign doesn't exist
+            ValidationError: If an address is invalid or a recipient is not a dict
+            DatabaseError: If inserting fails (no email is created)
+        """
+        template = self.get_template(template_id)
+        if not validate_email(sender_email):
+            raise ValidationError(f"Incorrect Sender Email: {sender_email}", field='sender_email')
+        if campaign_id is not None and self.db.get(Campaign, campaign_id) is None:
+            raise NotFoundError(f"Campaign with id {campaign_id} not found")
+        self._check_variables(recipients)
+
+        personalized = []
+        for index, variables in enumerate(recipients):
+            if not validate_email(variables.get('recipient_email')):
+                raise ValidationError(f"Incorrect Recipient Email at {index}: {variables.get('recipient_email')}",
+                                      field='recipients')
+            personalized.append(dict(variables, tracking_id=generate_tracking_id()))
+
+        rendered = template_engine.compiled(template).render_many(personalized)
+        rows = [{
+            'tracking_id': variables['tracking_id'],
+            'recipient_email': variables['recipient_email'],
+            'sender_email': sender_email,
+            'subject': subject,
+            'body': body,
+            'campaign_id': campaign_id,
+            'template_id': template.id,
+            'delivery_status': QUEUED if queue else None,
+        } for variables, (subject, body) in zip(personalized, rendered)]
+
+        try:
+            ids = self.db.scalars(insert(Email).returning(Email.id, sort_by_parameter_order=True), rows).all() \
+                if rows else []
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to create emails: {str(e)}")
+
+        return [{'id': email_id, 'tracking_id': row['tracking_id'], 'recipient_email': row['recipient_email']}
+                for email_id, row in zip(ids, rows)]
+
+    @staticmethod
+    def _validate(name, subject, body):
+        """Check a template's fields and that it compiles; returns the stripped name"""
+        if not name or not isinstance(name, str) or not name.strip():
+            raise ValidationError("Template name is required", field='name')
+        for field, value in (('subject', subject), ('body', body)):
+            if not isinstance(value, str) or not value.strip():
+                raise ValidationError(f"Template {field} is required", field=field)
+        compile_template(subject, body)
+        return name.strip()
+
+    @staticmethod
+    def _check_variables(recipients):
+        if not isinstance(recipients, list):
+            raise ValidationError("recipients must be a list", field='recipients')
+        for index, variables in enumerate(recipients):
+            if not isinstance(variables, dict):
+                raise ValidationError(f"Recipient {index} must be an object of variables", field='recipients')
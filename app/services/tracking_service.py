@@ -1,7 +1,22 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
 from app import db
-from app.models import TrackingEvent, Email
-from app.exceptions import NotFoundError, ValidationError
-from app.utils import parse_user_agent
+from app.db_routing import session_router, read_session
+from app.metrics import tracking_events_recorded, tracking_events_dropped, tracking_events_collapsed
+from app.partitions import event_partitions
+from app.archive import event_archive
+from app.enrichment import event_enrichment
+from app.machine_events import BURST, HUMAN, machine_events, machine_reason_name
+from app.repeat_opens import repeat_opens
+from app.idempotency import ReplayedEvent, idempotency_keys
+from app.heavy_hitters import heavy_hitters
+from app.event_stream import event_stream
+from app.models import TrackingEvent, Email, IdempotencyKey
+from app.read_models import EventRow, event_columns
+from app.exceptions import DatabaseError, NotFoundError, ValidationError
 from app.services.email_service import EmailService
 
 
@@ -24,6 +39,11 @@ class TrackingService:
         """Lazy database session property - only accesses db.session when used"""
         return self._db_session if self._db_session is not None else db.session
 
+    @property
+    def read_db(self):
+        """Session for read-only event listings - routed to the replica when one is configured"""
+        return self._db_session if self._db_session is not None else read_session
+
     @property
     def email_service(self):
         """Lazy email service property"""
@@ -31,7 +51,7 @@ class TrackingService:
             self._email_service = EmailService(self._db_session)
         return self._email_service
 
-    def record_open(self, tracking_id, ip_address=None, user_agent=None, location=None):
+    def record_open(self, tracking_id, ip_address=None, user_agent=None, location=None, idempotency_key=None):
         """
         Record an email open event
 
@@ -40,9 +60,10 @@ class TrackingService:
             ip_address: IP address of the user
             user_agent: User agent string
             location: Geographic location (optional)
+            idempotency_key: Record the event at most once per key (optional)
 
         Returns:
-            TrackingEvent: Created tracking event
+            TrackingEvent: Created tracking event, or a ReplayedEvent if the key was already recorded
 
         Raises:
             NotFoundError: If email with tracking_id doesn't exist
@@ -50,12 +71,6 @@ class TrackingService:
         # Use email service to get email (handles NotFoundError)
         email = self.email_service.get_email_by_tracking_id(tracking_id)
 
-        # Parse device type from user agent
-        device_type = None
-        if user_agent:
-            parsed = parse_user_agent(user_agent)
-            device_type = parsed['device_type']
-
         # Create tracking event
         event = TrackingEvent(
             email_id=email.id,
@@ -63,15 +78,13 @@ class TrackingService:
             ip_address=ip_address,
             user_agent=user_agent,
             location=location,
-            device_type=device_type
+            device_type=event_enrichment.device_type(user_agent)
         )
 
-        self.db.add(event)
-        self.db.commit()
-
-        return event
+        return self._save_event(event, email, idempotency_key)
 
-    def record_click(self, tracking_id, clicked_url, ip_address=None, user_agent=None, location=None):
+    def record_click(self, tracking_id, clicked_url, ip_address=None, user_agent=None, location=None,
+                     idempotency_key=None):
         """
         Record a link click event
 
@@ -81,9 +94,10 @@ class TrackingService:
             ip_address: IP address of the user
             user_agent: User agent string
             location: Geographic location (optional)
+            idempotency_key: Record the event at most once per key (optional)
 
         Returns:
-            TrackingEvent: Created tracking event
+            TrackingEvent: Created tracking event, or a ReplayedEvent if the key was already recorded
 
         Raises:
             NotFoundError: If email with tracking_id doesn't exist
@@ -95,12 +109,6 @@ class TrackingService:
         # Use email service to get email (handles NotFoundError)
         email = self.email_service.get_email_by_tracking_id(tracking_id)
 
-        # Parse device type from user agent
-        device_type = None
-        if user_agent:
-            parsed = parse_user_agent(user_agent)
-            device_type = parsed['device_type']
-
         # Create tracking event
         event = TrackingEvent(
             email_id=email.id,
@@ -108,15 +116,212 @@ class TrackingService:
             ip_address=ip_address,
             user_agent=user_agent,
             location=location,
-            device_type=device_type,
+            device_type=event_enrichment.device_type(user_agent),
             clicked_url=clicked_url
         )
 
-        self.db.add(event)
-        self.db.commit()
+        return self._save_event(event, email, idempotency_key)
+
+    def record_event(self, tracking_id, event_type, ip_address=None, user_agent=None, location=None,
+                     clicked_url=None, idempotency_key=None):
+        """
+        Record any other event type (bounce, unsubscribe, ...)
+
+        Args:
+            tracking_id: Email tracking ID
+            event_type: Event type
+            ip_address: IP address of the user
+            user_agent: User agent string
+            location: Geographic location (optional)
+            clicked_url: URL (optional)
+            idempotency_key: Record the event at most once per key (optional)
+
+        Returns:
+            TrackingEvent: Created tracking event, or a ReplayedEvent if the key was already recorded
+
+        Raises:
+            NotFoundError: If email with tracking_id doesn't exist
+        """
+        email = self.email_service.get_email_by_tracking_id(tracking_id)
+
+        event = TrackingEvent(
+            email_id=email.id,
+            event_type=event_type,
+            ip_address=ip_address,
+            user_agent=user_agent,
+            location=location,
+            device_type=event_enrichment.device_type(user_agent),
+            clicked_url=clicked_url
+        )
+
+        return self._save_event(event, email, idempotency_key)
+
+    def replay(self, idempotency_key):
+        """
+        Response of an idempotency key this worker recently recorded, from
+        its in-memory cache (no query)
+
+        Args:
+            idempotency_key: Idempotency key of the request
+
+        Returns:
+            ReplayedEvent: The event as first returned, or None if the key is
+                           not cached (it may still be recorded - recording it
+                           again then returns the stored response)
+        """
+        response = idempotency_keys.cached(idempotency_key)
+        if response is None:
+            return None
+        tracking_events_dropped.inc(response['event_type'], 'duplicate')
+        return ReplayedEvent(response)
+
+    def purge_idempotency_keys(self):
+        """
+        Delete idempotency keys older than IDEMPOTENCY_TTL_SECONDS
+
+        Returns:
+            int: Number of keys deleted
+
+        Raises:
+            DatabaseError: If the delete fails
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=idempotency_keys.ttl)
+        try:
+            purged = self.db.query(IdempotencyKey).filter(IdempotencyKey.created_at < cutoff).delete(
+                synchronize_session=False)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to purge idempotency keys: {str(e)}")
+        return purged
+
+    def _save_event(self, event, email, idempotency_key=None):
+        """
+        Classify a new event, then write it (into its time partition when
+        partitioning is enabled) and commit
+
+        Machine events are stored with their machine_reason, or not at all
+        with MACHINE_EVENTS = 'drop' - the unsaved event is still returned.
+        An open repeating a recent one is folded into that row's repeat_count
+        (see app.repeat_opens); the returned event then carries the row's id
+        and new repeat_count but is not added to the session. With an
+        idempotency key the key is stored in the same transaction, and a key
+        that was already recorded rolls it all back and returns the stored
+        response instead (see app.idempotency).
+        """
+        if event.created_at is None:
+            event.created_at = datetime.utcnow()
+        event.machine_reason = machine_events.classify(event, email.sent_at)
+
+        if event.machine_reason and machine_events.drop:
+            if event.event_type == 'click':
+                self._flag_burst(machine_events.observe_click(email.id, event))
+            if event.event_type == 'click' or idempotency_key is not None:
+                replayed = self._commit(event, idempotency_key)
+                if replayed is not None:
+                    return replayed
+            tracking_events_dropped.inc(event.event_type, 'machine_' + machine_reason_name(event.machine_reason))
+            return event
+
+        collapse = event.event_type == 'open' and repeat_opens.enabled
+        if collapse and self._collapse_repeat(event):
+            replayed = self._commit(event, idempotency_key)
+            if replayed is not None:
+                # The UPDATE was rolled back - stop collapsing into the row rather than miscount it
+                repeat_opens.forget(event)
+                return replayed
+            tracking_events_collapsed.inc(event.event_type)
+            self._publish(event, email)
+            return event
+
+        if event_partitions.enabled:
+            event_partitions.add(self.db, event)
+        else:
+            self.db.add(event)
+        if collapse:
+            self.db.flush()
+            table = TrackingEvent.__table__
+            if event_partitions.enabled:
+                table = event_partitions.ensure_partition(self.db.connection(), event.created_at)
+            repeat_opens.remember(event, table)
+        if event.event_type == 'click':
+            self.db.flush()
+            self._flag_burst(machine_events.observe_click(email.id, event))
+        replayed = self._commit(event, idempotency_key)
+        if replayed is not None:
+            if collapse:
+                repeat_opens.forget(event)
+            return replayed
+        tracking_events_recorded.inc(event.event_type)
+        self._publish(event, email)
 
         return event
 
+    def _commit(self, event, idempotency_key):
+        """
+        Commit an ingest, storing its idempotency key (if any) with the event's response
+
+        Returns:
+            ReplayedEvent: The stored response if the key was already
+                           recorded (the transaction is rolled back), else None
+        """
+        if idempotency_key is None:
+            session_router.commit_ingest(self.db)
+            return None
+
+        self.db.flush()
+        response = event.to_dict()
+        self.db.add(IdempotencyKey(key=idempotency_key, response=json.dumps(response)))
+        try:
+            session_router.commit_ingest(self.db)
+        except IntegrityError:
+            # Not looked up beforehand: a conflicting insert is how a retry is detected
+            self.db.rollback()
+            stored = self.db.get(IdempotencyKey, idempotency_key)
+            if stored is None:
+                raise
+            response = json.loads(stored.response)
+            idempotency_keys.remember(idempotency_key, response)
+            tracking_events_dropped.inc(event.event_type, 'duplicate')
+            return ReplayedEvent(response)
+
+        idempotency_keys.remember(idempotency_key, response)
+        return None
+
+    def _publish(self, event, email):
+        """Pass a committed event to live streams and the heavy-hitter sketches (flushed in the background)"""
+        event_stream.publish(event, email.campaign_id)
+        if not heavy_hitters.enabled:
+            return
+        heavy_hitters.observe(event, email.campaign_id)
+        if heavy_hitters.flush_due():
+            heavy_hitters.request_flush()
+
+    def _collapse_repeat(self, event):
+        """Add an open to the row it repeats, if any (uncommitted) - returns whether it was collapsed"""
+        found = repeat_opens.find(event)
+        if found is None:
+            return False
+
+        table, event_id = found
+        result = self.db.execute(table.update().where(table.c.id == event_id).values(
+            repeat_count=table.c.repeat_count + 1))
+        if not result.rowcount:
+            # The row is gone (deleted with its email, or compacted) - write a new one
+            repeat_opens.forget(event)
+            return False
+
+        event.id, event.repeat_count = event_id, repeat_opens.repeated(event)
+        return True
+
+    def _flag_burst(self, event_ids):
+        """Flag the earlier clicks of a scanner burst (in the caller's transaction)"""
+        if not event_ids:
+            return
+        for table in event_partitions.storage_tables(self.db.connection()):
+            self.db.execute(table.update().where(table.c.id.in_(event_ids), table.c.machine_reason == HUMAN)
+                            .values(machine_reason=BURST))
+
     def get_event(self, event_id):
         """
         Get a tracking event by ID
@@ -130,22 +335,26 @@ class TrackingService:
         Raises:
             NotFoundError: If event doesn't exist
         """
-        event = TrackingEvent.query.get(event_id)
+        event = self.db.get(TrackingEvent, event_id)
         if not event:
             raise NotFoundError(f"Tracking event with id {event_id} not found")
 
         return event
 
-    def get_events_for_email(self, email_id, event_type=None):
+    def get_events_for_email(self, email_id, event_type=None, start_date=None, end_date=None,
+                             include_archived=False):
         """
         Get all tracking events for an email
 
         Args:
             email_id: Email ID
             event_type: Filter by event type (optional: 'open', 'click', etc.)
+            start_date: Only events at or after this datetime (optional)
+            end_date: Only events before this datetime (optional)
+            include_archived: Also return events from the cold archive (oldest first)
 
         Returns:
-            list: List of TrackingEvent instances
+            list: Read-only EventRow tuples (same to_dict() as TrackingEvent)
 
         Raises:
             NotFoundError: If email doesn't exist
@@ -153,31 +362,52 @@ class TrackingService:
         # Verify email exists using email service
         email = self.email_service.get_email(email_id)
 
-        query = TrackingEvent.query.filter_by(email_id=email.id)
+        events = event_partitions.events(self.read_db, start_date, end_date)
+        query = self._filter_dates(self.read_db.query(*event_columns(events)).filter(events.email_id == email.id),
+                                   events, start_date, end_date)
 
         if event_type:
-            query = query.filter_by(event_type=event_type)
+            query = query.filter(events.event_type == event_type)
+
+        archived = []
+        if include_archived:
+            archived = [EventRow(**row) for row in event_archive.scan({email.id}, start_date, end_date)
+                        if not event_type or row['event_type'] == event_type]
 
-        return query.all()
+        return archived + [EventRow(*row) for row in query]
 
-    def get_events_for_campaign(self, campaign_id, event_type=None):
+    def get_events_for_campaign(self, campaign_id, event_type=None, start_date=None, end_date=None):
         """
         Get all tracking events for a campaign
 
         Args:
             campaign_id: Campaign ID
             event_type: Filter by event type (optional: 'open', 'click', etc.)
+            start_date: Only events at or after this datetime (optional)
+            end_date: Only events before this datetime (optional)
 
         Returns:
-            list: List of TrackingEvent instances
+            list: Read-only EventRow tuples (same to_dict() as TrackingEvent)
         """
         # Join with Email to filter by campaign
-        query = TrackingEvent.query.join(Email).filter(Email.campaign_id == campaign_id)
+        events = event_partitions.events(self.read_db, start_date, end_date)
+        query = self.read_db.query(*event_columns(events)).join(Email, events.email_id == Email.id).filter(
+            Email.campaign_id == campaign_id)
+        query = self._filter_dates(query, events, start_date, end_date)
 
         if event_type:
-            query = query.filter(TrackingEvent.event_type == event_type)
-
-        return query.all()
+            query = query.filter(events.event_type == event_type)
+
+        return [EventRow(*row) for row in query]
+
+    @staticmethod
+    def _filter_dates(query, events, start_date, end_date):
+        """Apply an optional [start_date, end_date) created_at range"""
+        if start_date is not None:
+            query = query.filter(events.created_at >= start_date)
+        if end_date is not None:
+            query = query.filter(events.created_at < end_date)
+        return query
 
     def parse_request_metadata(self, request):
         """
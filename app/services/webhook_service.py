@@ -0,0 +1,278 @@
+import http.client
+import json
+import secrets
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.exceptions import DatabaseError, NotFoundError, ValidationError
+from app.metrics import webhook_deliveries
+from app.models import Campaign, Email, TrackingEvent, WebhookDelivery, WebhookEndpoint
+from app.utils import validate_url
+from app.webhooks import sign, webhooks
+
+
+class WebhookService:
+    """
+    Outbox of webhook batches (see app.webhooks)
+
+    enqueue() cuts events above each endpoint's high-water mark into outbox
+    rows, moving the mark in the same transaction; deliver() POSTs the due
+    rows and deletes them on success or schedules the retry.
+    """
+
+    def __init__(self, db_session=None):
+        """
+        Initialize WebhookService
+
+        Args:
+            db_session: Database session (defaults to db.session)
+        """
+        self._db_session = db_session
+
+    @property
+    def db(self):
+        """Lazy database session property - only accesses db.session when used"""
+        return self._db_session if self._db_session is not None else db.session
+
+    def add_endpoint(self, url, event_types=None, campaign_id=None):
+        """
+        Register an endpoint for the events recorded from now on
+
+        Args:
+            url: http(s) URL to POST batches to
+            event_types: Only send these event types (optional, all by default)
+            campaign_id: Only send this campaign's events (optional)
+
+        Returns:
+            WebhookEndpoint: The endpoint, with a new signing secret
+
+        Raises:
+            ValidationError: If the URL or an event type is invalid
+            NotFoundError: If the campaign doesn't exist
+            DatabaseError: If the endpoint cannot be saved
+        """
+        if not validate_url(url):
+            raise ValidationError(f"Invalid webhook URL: {url}", field='url')
+        if event_types is not None:
+            if not event_types or not all(event_types) or any(',' in value for value in event_types):
+                raise ValidationError("Event types must be non-empty names without commas", field='event_types')
+            event_types = ','.join(event_types)
+            if len(event_types) > 255:
+                raise ValidationError("Too many event types", field='event_types')
+        if campaign_id is not None and self.db.get(Campaign, campaign_id) is None:
+            raise NotFoundError(f"Campaign with ID {campaign_id} not found")
+
+        endpoint = WebhookEndpoint(
+            url=url, secret=secrets.token_hex(32), event_types=event_types, campaign_id=campaign_id, active=True,
+            high_water_mark=self.db.query(func.max(TrackingEvent.id)).scalar() or 0)
+        try:
+            self.db.add(endpoint)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to add webhook endpoint: {str(e)}")
+        return endpoint
+
+    def remove_endpoint(self, endpoint_id):
+        """
+        Delete an endpoint and its undelivered batches
+
+        Raises:
+            NotFoundError: If the endpoint doesn't exist
+            DatabaseError: If the delete fails
+        """
+        endpoint = self.db.get(WebhookEndpoint, endpoint_id)
+        if endpoint is None:
+            raise NotFoundError(f"Webhook endpoint with ID {endpoint_id} not found")
+        try:
+            self.db.delete(endpoint)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to remove webhook endpoint: {str(e)}")
+
+    def list_endpoints(self):
+        """
+        Every endpoint with its outbox backlog
+
+        Returns:
+            list: Endpoint dicts with pending and failed batch counts
+        """
+        counts = {}
+        for endpoint_id, status, count in self.db.query(
+                WebhookDelivery.endpoint_id, WebhookDelivery.status, func.count(WebhookDelivery.id)
+        ).group_by(WebhookDelivery.endpoint_id, WebhookDelivery.status):
+            counts[endpoint_id, status] = count
+
+        return [dict(endpoint.to_dict(), pending=counts.get((endpoint.id, 'pending'), 0),
+                     failed=counts.get((endpoint.id, 'failed'), 0))
+                for endpoint in self.db.query(WebhookEndpoint).order_by(WebhookEndpoint.id)]
+
+    def run(self, max_batches=None):
+        """
+        Batch new events, then deliver every due batch
+
+        Returns:
+            dict: batched, delivered, retried and failed batch counts
+        """
+        batched = self.enqueue()
+        return dict(self.deliver(max_batches=max_batches), batched=batched)
+
+    def enqueue(self, now=None):
+        """
+        Cut the events above each active endpoint's mark into outbox batches
+
+        A full batch (WEBHOOK_BATCH_SIZE events) is cut right away, a smaller
+        one only once its oldest event is WEBHOOK_BATCH_SECONDS old.
+
+        Args:
+            now: Time to age pending events against (defaults to now)
+
+        Returns:
+            int: Batches written
+
+        Raises:
+            DatabaseError: If writing a batch fails (earlier ones stay committed)
+        """
+        now = now or datetime.utcnow()
+        config = current_app.config
+        batch_size = config['WEBHOOK_BATCH_SIZE']
+        oldest_allowed = now - timedelta(seconds=config['WEBHOOK_BATCH_SECONDS'])
+        target = self.db.query(func.max(TrackingEvent.id)).scalar() or 0
+
+        batched = 0
+        for endpoint in self.db.query(WebhookEndpoint).filter(WebhookEndpoint.active.is_(True)).order_by(
+                WebhookEndpoint.id).all():
+            while endpoint.high_water_mark < target:
+                rows = self._events(endpoint, target).limit(batch_size).all()
+                full = len(rows) == batch_size
+                if rows and not full and rows[0][0].created_at > oldest_allowed:
+                    break  # a partial batch that may still fill up
+                try:
+                    if rows:
+                        self.db.add(WebhookDelivery(
+                            endpoint_id=endpoint.id, event_count=len(rows), status='pending', attempts=0,
+                            next_attempt_at=datetime.utcnow(), payload=self._payload(endpoint, rows)))
+                        batched += 1
+                    # Events between the last row and target did not match the filters
+                    endpoint.high_water_mark = rows[-1][0].id if full else target
+                    self.db.commit()
+                except SQLAlchemyError as e:
+                    self.db.rollback()
+                    raise DatabaseError(f"Failed to batch webhook events after {batched} batches: {str(e)}")
+        return batched
+
+    def deliver(self, max_batches=None, now=None):
+        """
+        POST each active endpoint's due batches, oldest first
+
+        An endpoint's batches go out in order: one that fails is retried
+        after a backoff and holds back those behind it, until it has used up
+        WEBHOOK_MAX_ATTEMPTS and is marked failed.
+
+        Args:
+            max_batches: Stop after this many POSTs (optional)
+            now: Time to compare retry schedules against (defaults to now)
+
+        Returns:
+            dict: delivered, retried and failed batch counts
+
+        Raises:
+            DatabaseError: If recording a result fails
+        """
+        now = now or datetime.utcnow()
+        max_attempts = current_app.config['WEBHOOK_MAX_ATTEMPTS']
+        result = {'delivered': 0, 'retried': 0, 'failed': 0}
+
+        for endpoint in self.db.query(WebhookEndpoint).filter(WebhookEndpoint.active.is_(True)).order_by(
+                WebhookEndpoint.id).all():
+            while max_batches is None or sum(result.values()) < max_batches:
+                delivery = endpoint.deliveries.filter(WebhookDelivery.status == 'pending').order_by(
+                    WebhookDelivery.id).first()
+                if delivery is None or delivery.next_attempt_at > now:
+                    break
+                error = self._post(endpoint, delivery)
+                if error is None:
+                    self.db.delete(delivery)
+                    outcome = 'delivered'
+                else:
+                    delivery.attempts += 1
+                    delivery.last_error = error[:255]
+                    if delivery.attempts >= max_attempts:
+                        delivery.status = outcome = 'failed'
+                    else:
+                        delivery.next_attempt_at = datetime.utcnow() + timedelta(
+                            seconds=webhooks.retry_delay(delivery.attempts))
+                        outcome = 'retried'
+                try:
+                    self.db.commit()
+                except SQLAlchemyError as e:
+                    self.db.rollback()
+                    raise DatabaseError(f"Failed to record webhook delivery: {str(e)}")
+                webhook_deliveries.inc(outcome)
+                result[outcome] += 1
+                if outcome == 'retried':
+                    break
+        return result
+
+    def retry_failed(self, endpoint_id=None):
+        """
+        Queue batches that used up their attempts again, starting from attempt 1
+
+        Args:
+            endpoint_id: Only this endpoint's batches (optional)
+
+        Returns:
+            int: Batches queued
+        """
+        query = self.db.query(WebhookDelivery).filter(WebhookDelivery.status == 'failed')
+        if endpoint_id is not None:
+            query = query.filter(WebhookDelivery.endpoint_id == endpoint_id)
+        try:
+            count = query.update({'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.utcnow()},
+                                 synchronize_session=False)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            raise DatabaseError(f"Failed to queue webhook batches again: {str(e)}")
+        return count
+
+    def _events(self, endpoint, target):
+        """(event, campaign_id) rows above the endpoint's mark that match its filters, in id order"""
+        query = self.db.query(TrackingEvent, Email.campaign_id).join(Email, Email.id == TrackingEvent.email_id).filter(
+            TrackingEvent.id > endpoint.high_water_mark, TrackingEvent.id <= target)
+        if endpoint.event_types:
+            query = query.filter(TrackingEvent.event_type.in_(endpoint.event_types.split(',')))
+        if endpoint.campaign_id is not None:
+            query = query.filter(Email.campaign_id == endpoint.campaign_id)
+        return query.order_by(TrackingEvent.id)
+
+    @staticmethod
+    def _payload(endpoint, rows):
+        events = [dict(event.to_dict(), campaign_id=campaign_id) for event, campaign_id in rows]
+        return json.dumps({'endpoint_id': endpoint.id, 'events': events})
+
+    @staticmethod
+    def _post(endpoint, delivery):
+        """
+        POST one batch
+
+        Returns:
+            str: Why it failed, or None if the endpoint answered 2xx
+        """
+        body = delivery.payload.encode()
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'email-tracker-webhooks',
+            'X-Webhook-Delivery': str(delivery.id),
+            'X-Webhook-Signature': sign(endpoint.secret, body),
+        }
+        try:
+            status = webhooks.pool.post(endpoint.url, body, headers)
+        except (http.client.HTTPException, OSError) as e:
+            return f"{type(e).__name__}: {e}"
+        return None if 200 <= status < 300 else f"HTTP {status}"
@@ -0,0 +1,168 @@
+"""
+Email templates compiled once and rendered per recipient
+
+A template's subject and body take placeholders:
+
+    {{ first_name }}            the recipient's value, '' when missing
+    {{ first_name|there }}      ... or the fallback text after the bar
+
+Names are identifiers (letters, digits, underscores). Values are
+HTML-escaped in the body and have line breaks flattened in the subject, so
+a recipient's data can neither inject markup nor add a header.
+
+compile_template turns a subject and body into a CompiledTemplate: each part
+becomes a positional str.format string plus the (name, fallback) of each
+distinct placeholder, so rendering a recipient is one lookup (and escape)
+per distinct placeholder and one format call - no parsing, no regex.
+
+Compiled templates are cached per application, keyed by (template id,
+updated_at): an edit changes updated_at, so the next render compiles the new
+version and the old entry ages out of the LRU. TEMPLATE_CACHE_SIZE bounds the
+number of entries.
+"""
+
+import html
+import re
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+from app.exceptions import ValidationError
+from app.metrics import record_cache_lookup
+
+_PLACEHOLDER = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\|([^{}]*?))?\s*\}\}')
+_LINE_BREAKS = re.compile(r'[\r\n]+')
+
+
+def _compile_part(text, field):
+    """
+    (format string, ((name, fallback), ...)) of one template part
+
+    Raises:
+        ValidationError: If a '{{' doesn't start a valid placeholder
+    """
+    pieces, fields, position = [], {}, 0  # fields: (name, fallback) -> its format index
+    for match in _PLACEHOLDER.finditer(text):
+        literal = text[position:match.start()]
+        if '{{' in literal:
+            raise ValidationError(f"Invalid placeholder in {field} near {literal[literal.index('{{'):][:30]!r}",
+                                  field=field)
+        pieces.append(literal.replace('{', '{{').replace('}', '}}'))
+        # A placeholder used many times is one field, looked up and escaped once per render
+        index = fields.setdefault((match.group(1), match.group(2) or ''), len(fields))
+        pieces.append(f'{{{index}}}')
+        position = match.end()
+    literal = text[position:]
+    if '{{' in literal:
+        raise ValidationError(f"Invalid placeholder in {field} near {literal[literal.index('{{'):][:30]!r}",
+                              field=field)
+    pieces.append(literal.replace('{', '{{').replace('}', '}}'))
+    return ''.join(pieces), tuple(fields)  # dicts keep insertion order, so position == index
+
+
+class CompiledTemplate:
+    """A template's subject and body, ready to render (see module docstring)"""
+
+    __slots__ = ('subject_format', 'subject_fields', 'body_format', 'body_fields')
+
+    def __init__(self, subject, body):
+        """
+        Raises:
+            ValidationError: If the subject or body has an invalid placeholder
+        """
+        self.subject_format, self.subject_fields = _compile_part(subject, 'subject')
+        self.body_format, self.body_fields = _compile_part(body, 'body')
+
+    @property
+    def variables(self):
+        """Placeholder names, in order of first use"""
+        return tuple(dict.fromkeys(name for name, _ in self.subject_fields + self.body_fields))
+
+    def render(self, variables):
+        """
+        Personalize the template for one recipient
+
+        Args:
+            variables: dict of placeholder values (any type, converted with str)
+
+        Returns:
+            tuple: (subject, body)
+        """
+        subject = self.subject_format.format(*[
+            _LINE_BREAKS.sub(' ', str(value)) if (value := variables.get(name)) not in (None, '') else fallback
+            for name, fallback in self.subject_fields])
+        body = self.body_format.format(*[
+            html.escape(str(value)) if (value := variables.get(name)) not in (None, '') else fallback
+            for name, fallback in self.body_fields])
+        return subject, body
+
+    def render_many(self, recipients):
+        """
+        Personalize the template for many recipients
+
+        Args:
+            recipients: Iterable of variable dicts
+
+        Returns:
+            list: (subject, body) per recipient, in order
+        """
+        render = self.render
+        return [render(variables) for variables in recipients]
+
+
+def compile_template(subject, body):
+    """Compile a subject and body (see CompiledTemplate)"""
+    return CompiledTemplate(subject or '', body or '')
+
+
+class TemplateEngine:
+    """Per-application LRU of compiled templates (see module docstring)"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TEMPLATE_CACHE_SIZE', 256)
+
+        if app.config['TEMPLATE_CACHE_SIZE'] < 1:
+            raise ValidationError("Template cache needs room for at least one template", field='TEMPLATE_CACHE_SIZE')
+
+        app.extensions['template_engine'] = OrderedDict()  # (template id, updated_at) -> CompiledTemplate
+
+    def compiled(self, template):
+        """
+        Compiled version of a Template row, compiling it on first use
+
+        Args:
+            template: Template (or any row with id, updated_at, subject and body)
+
+        Returns:
+            CompiledTemplate
+        """
+        cache = current_app.extensions['template_engine']
+        key = (template.id, template.updated_at)
+        with self._lock:
+            compiled = cache.get(key)
+            if compiled is not None:
+                cache.move_to_end(key)
+        record_cache_lookup('templates', compiled is not None)
+        if compiled is not None:
+            return compiled
+
+        compiled = compile_template(template.subject, template.body)
+        with self._lock:
+            cache[key] = compiled
+            while len(cache) > current_app.config['TEMPLATE_CACHE_SIZE']:
+                cache.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        """Drop every compiled template of this app"""
+        with self._lock:
+            current_app.extensions['template_engine'].clear()
+
+
+template_engine = TemplateEngine()
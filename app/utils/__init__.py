@@ -1,12 +1,14 @@
-from .validation import validate_email, validate_url
+from .validation import validate_email, validate_url, parse_datetime
 from .tracking import create_tracking_pixel, generate_tracking_id
-from .user_agent import parse_user_agent
+from .user_agent import parse_user_agent, is_bot_user_agent
 
 __all__ = [
     'generate_tracking_id',
     'create_tracking_pixel',
     'parse_user_agent',
+    'is_bot_user_agent',
     'validate_email',
-    'validate_url'
+    'validate_url',
+    'parse_datetime'
 ]
 
@@ -55,4 +55,28 @@ def parse_user_agent(user_agent_string):
         'device_type': device_type,
         'browser': browser,
         'os': os_name
-    }
\ No newline at end of file
+    }
+
+# Substrings of automated clients: crawlers, link checkers, HTTP libraries, headless browsers
+BOT_SIGNATURES = (
+    'bot', 'crawler', 'spider', 'slurp', 'scanner', 'headlesschrome', 'phantomjs', 'curl/', 'wget/',
+    'python-requests', 'python-urllib', 'go-http-client', 'okhttp', 'java/', 'libwww-perl', 'scrapy',
+    'httpclient',
+)
+
+
+def is_bot_user_agent(user_agent_string):
+    """
+    Whether a user agent belongs to an automated client rather than a person's mail client
+
+    Args:
+        user_agent_string: HTTP User-Agent header value
+
+    Returns:
+        bool: True for known bot, crawler and HTTP library signatures
+    """
+    if not isinstance(user_agent_string, str) or not user_agent_string:
+        return False
+
+    user_agent_lower = user_agent_string.lower()
+    return any(signature in user_agent_lower for signature in BOT_SIGNATURES)
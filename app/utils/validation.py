@@ -1,4 +1,6 @@
 import re
+from datetime import datetime
+from typing import Optional
 
 def validate_email(email) -> bool:
     """
@@ -38,5 +40,27 @@ def validate_url(url) -> bool:
 
     return re.match(url_regex, url) is not None
 
+def parse_datetime(value) -> Optional[datetime]:
+    """
+    Parse an optional ISO 8601 date or datetime (e.g. a query parameter)
+
+    Args:
+        value: String such as '2024-01-31' or '2024-01-31T12:00:00', or None/''
+
+    Returns:
+        datetime: Parsed value, or None when value is empty
+
+    Raises:
+        ValueError: If value is not ISO 8601
+    """
+    if not value:
+        return None
+
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid ISO 8601 date: {value!r}")
+
+
 def validate_template(template) -> bool:
     return False
\ No newline at end of file
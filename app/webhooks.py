@@ -0,0 +1,269 @@
+"""
+Batched outbound webhooks of recorded tracking events
+
+Downstream systems (CRM, data warehouse) register an endpoint with `flask
+webhooks add URL` instead of polling the list endpoints. Delivery happens in
+a worker, `flask webhooks run --follow`, never on the pixel path: ingest
+writes nothing extra, and the worker reads committed events the way the
+enrichment pipeline does.
+
+1. batching   each endpoint has a high-water mark over tracking_events. Events
+              above it that match the endpoint's filters (event types,
+              campaign) are cut into batches of WEBHOOK_BATCH_SIZE; a smaller
+              batch is cut once its oldest event has waited
+              WEBHOOK_BATCH_SECONDS. Each batch is written to the outbox
+              (webhook_deliveries) in the same transaction that moves the
+              mark, so a crash neither loses nor repeats a batch.
+2. delivery   outbox rows are POSTed as JSON over keep-alive connections
+              pooled per origin, signed with the endpoint's secret
+              (X-Webhook-Signature: sha256=<hex HMAC of the body>). A 2xx
+              deletes the row. Anything else is retried after an exponential
+              backoff with jitter (WEBHOOK_RETRY_BASE_SECONDS doubling up to
+              WEBHOOK_RETRY_MAX_SECONDS). After WEBHOOK_MAX_ATTEMPTS the row is
+              marked failed and kept for `flask webhooks retry`.
+
+An endpoint's batches go out in order, and a batch waiting on a retry holds
+back the ones behind it. Delivery is at least once: a batch whose response was
+lost is sent again, so receivers should dedupe on X-Webhook-Delivery (the
+outbox row id).
+
+Repeat opens collapsed into an earlier row (app.repeat_opens) are not sent
+again. Like enrichment, the mark assumes event ids become visible in
+increasing order, which holds for SQLite.
+"""
+
+import hashlib
+import hmac
+import http.client
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.exceptions import DatabaseError, NotFoundError, ValidationError
+
+
+def sign(secret, body):
+    """X-Webhook-Signature value of a request body"""
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def backoff(attempts, base, cap, rng=random):
+    """
+    Seconds to wait before the next attempt
+
+    Doubles from base with each failed attempt up to cap, then takes a random
+    half to full of it, so endpoints coming back up are not hit by every
+    retry at once.
+    """
+    delay = min(base * 2 ** (attempts - 1), cap)
+    return delay * rng.uniform(0.5, 1.0)
+
+
+class _ConnectionPool:
+    """Idle keep-alive HTTP connections per origin"""
+
+    def __init__(self, timeout, max_idle):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}  # (scheme, host, port) -> list of connections
+        self.opened = 0
+
+    def post(self, url, body, headers):
+        """
+        POST a body, reusing an idle connection to the URL's origin if there is one
+
+        Returns:
+            int: Response status
+
+        Raises:
+            OSError, http.client.HTTPException: If the request fails
+        """
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+        connection, reused = self._checkout(origin)
+        try:
+            try:
+                response = self._send(connection, path, body, headers)
+            except (http.client.HTTPException, OSError):
+                if not reused:
+                    raise
+                # The server may have closed the idle connection - retry once on a new one
+                connection.close()
+                connection = self._connect(origin)
+                response = self._send(connection, path, body, headers)
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(origin, connection)
+        return response.status
+
+    @staticmethod
+    def _send(connection, path, body, headers):
+        connection.request('POST', path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response
+
+    def _checkout(self, origin):
+        with self._lock:
+            idle = self._idle.get(origin)
+            if idle:
+                return idle.pop(), True
+        return self._connect(origin), False
+
+    def _checkin(self, origin, connection):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _connect(self, origin):
+        scheme, host, port = origin
+        factory = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        with self._lock:
+            self.opened += 1
+        return factory(host, port, timeout=self.timeout)
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class Webhooks:
+    """Webhook settings and the worker's connection pool (see module docstring)"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('WEBHOOK_BATCH_SIZE', 100)
+        app.config.setdefault('WEBHOOK_BATCH_SECONDS', 5.0)
+        app.config.setdefault('WEBHOOK_TIMEOUT', 10.0)
+        app.config.setdefault('WEBHOOK_MAX_ATTEMPTS', 10)
+        app.config.setdefault('WEBHOOK_RETRY_BASE_SECONDS', 10.0)
+        app.config.setdefault('WEBHOOK_RETRY_MAX_SECONDS', 3600.0)
+        app.config.setdefault('WEBHOOK_POOL_SIZE', 4)
+
+        for key in ('WEBHOOK_BATCH_SIZE', 'WEBHOOK_MAX_ATTEMPTS'):
+            if app.config[key] < 1:
+                raise ValidationError(f"{key} must be at least 1", field=key)
+        if app.config['WEBHOOK_TIMEOUT'] <= 0:
+            raise ValidationError("Webhook timeout must be positive", field='WEBHOOK_TIMEOUT')
+
+        app.extensions['webhooks'] = _ConnectionPool(app.config['WEBHOOK_TIMEOUT'], app.config['WEBHOOK_POOL_SIZE'])
+
+    @property
+    def pool(self):
+        """Connection pool of this app"""
+        return current_app.extensions['webhooks']
+
+    def retry_delay(self, attempts):
+        """Backoff in seconds after the given number of failed attempts"""
+        config = current_app.config
+        return backoff(attempts, config['WEBHOOK_RETRY_BASE_SECONDS'], config['WEBHOOK_RETRY_MAX_SECONDS'])
+
+
+webhooks = Webhooks()
+
+
+webhooks_cli = AppGroup('webhooks', help='Push recorded tracking events to downstream endpoints')
+
+
+@webhooks_cli.command('add')
+@click.argument('url')
+@click.option('--event-type', 'event_types', multiple=True, help='Only send this event type (repeatable)')
+@click.option('--campaign-id', default=None, type=int, help="Only send this campaign's events")
+def add_command(url, event_types, campaign_id):
+    """Register an endpoint; it gets events recorded from now on"""
+    from app.services.webhook_service import WebhookService
+
+    try:
+        endpoint = WebhookService().add_endpoint(url, event_types=list(event_types) or None, campaign_id=campaign_id)
+    except (ValidationError, NotFoundError, DatabaseError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Added endpoint {endpoint.id}, signing secret {endpoint.secret}")
+
+
+@webhooks_cli.command('remove')
+@click.argument('endpoint_id', type=int)
+def remove_command(endpoint_id):
+    """Delete an endpoint and its undelivered batches"""
+    from app.services.webhook_service import WebhookService
+
+    try:
+        WebhookService().remove_endpoint(endpoint_id)
+    except (NotFoundError, DatabaseError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Removed endpoint {endpoint_id}")
+
+
+@webhooks_cli.command('list')
+def list_command():
+    """Show endpoints with their pending and failed batches"""
+    from app.services.webhook_service import WebhookService
+
+    for endpoint in WebhookService().list_endpoints():
+        filters = ', '.join(filter(None, [
+            ' '.join(endpoint['event_types'] or []),
+            f"campaign {endpoint['campaign_id']}" if endpoint['campaign_id'] is not None else None]))
+        click.echo(f"{endpoint['id']}\t{endpoint['url']}\t{filters or 'all events'}\t"
+                   f"{endpoint['pending']} pending, {endpoint['failed']} failed")
+
+
+@webhooks_cli.command('run')
+@click.option('--max-batches', default=None, type=int, help='Stop delivering after this many batches per run')
+@click.option('--follow', is_flag=True, help='Keep running, polling for new events and due retries')
+@click.option('--interval', default=1.0, show_default=True, help='Seconds between polls with --follow')
+def run_command(max_batches, follow, interval):
+    """Batch new events into the outbox and deliver every due batch"""
+    from app import db
+    from app.services.webhook_service import WebhookService
+
+    try:
+        while True:
+            try:
+                result = WebhookService().run(max_batches=max_batches)
+            except (ValidationError, DatabaseError) as e:
+                raise click.ClickException(str(e))
+            db.session.remove()
+
+            if result['batched'] or result['delivered'] or result['retried'] or result['failed'] or not follow:
+                click.echo(f"Batched {result['batched']}, delivered {result['delivered']}, "
+                           f"retrying {result['retried']}, gave up on {result['failed']}")
+            if not follow:
+                return
+            time.sleep(interval)
+    finally:
+        webhooks.pool.close()
+
+
+@webhooks_cli.command('retry')
+@click.option('--endpoint-id', default=None, type=int, help="Only this endpoint's batches")
+def retry_command(endpoint_id):
+    """Queue the batches that ran out of attempts again"""
+    from app.services.webhook_service import WebhookService
+
+    try:
+        count = WebhookService().retry_failed(endpoint_id)
+    except DatabaseError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Queued {count} failed batches again")
@@ -0,0 +1,6 @@
+"""
+Performance benchmarks
+
+These are not part of the test suite. Run them from the repository root, e.g.:
+    python -m benchmarks.bench_engine_profiles
+"""
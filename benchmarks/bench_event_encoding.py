@@ -0,0 +1,130 @@
+"""
+Size and scan speed of tracking_events: string columns vs dimension keys
+
+Usage:
+    python -m benchmarks.bench_event_encoding [--events 200000] [--repeat 5]
+
+Seeds a fresh SQLite file with `flask seed` data, then rebuilds the events
+as they were stored before app.dimensions - event_type, device_type,
+user_agent and ip_address as strings, with the same indexes - in a
+`legacy_events` table. Reports the on-disk size of both (table plus indexes,
+from the dbstat virtual table) and best-of-`repeat` timings of typical scans
+run through the raw DB-API connection, so only storage differs.
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+from app import create_app, db
+from app.dimensions import EVENT_TYPE
+from app.seeding import seed_database
+from config import ProductionSQLiteConfig
+
+# Events with their attributes decoded, as the string columns held them
+DECODED_EVENTS = """
+SELECT e.id, e.email_id, t.value AS event_type, i.value AS ip_address, u.value AS user_agent,
+       e.location, d.value AS device_type, e.clicked_url, e.created_at
+FROM tracking_events e
+JOIN event_types t ON t.id = e.event_type_id
+LEFT JOIN device_types d ON d.id = e.device_type_id
+LEFT JOIN user_agents u ON u.id = e.user_agent_id
+LEFT JOIN ip_addresses i ON i.id = e.ip_address_id
+"""
+
+OPEN = EVENT_TYPE.static_key('open')
+
+# Scenario -> (legacy SQL, encoded SQL)
+SCENARIOS = {
+    'count opens': (
+        "SELECT count(*) FROM legacy_events WHERE event_type = 'open'",
+        f"SELECT count(*) FROM tracking_events WHERE event_type_id = {OPEN}",
+    ),
+    'device breakdown': (
+        "SELECT device_type, count(*) FROM legacy_events WHERE device_type IS NOT NULL GROUP BY device_type",
+        "SELECT device_type_id, count(*) FROM tracking_events WHERE device_type_id IS NOT NULL "
+        "GROUP BY device_type_id",
+    ),
+    'distinct IPs': (
+        "SELECT count(DISTINCT ip_address) FROM legacy_events",
+        "SELECT count(DISTINCT ip_address_id) FROM tracking_events",
+    ),
+    'row read (keys)': (
+        "SELECT * FROM legacy_events",
+        "SELECT * FROM tracking_events",
+    ),
+    'row read (decoded)': (
+        "SELECT * FROM legacy_events",
+        DECODED_EVENTS,
+    ),
+}
+
+
+def table_bytes(connection, table):
+    """Pages of a table and its indexes, in bytes"""
+    names = [table] + [row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table,))]
+    placeholders = ', '.join('?' * len(names))
+    return connection.execute(f"SELECT sum(pgsize) FROM dbstat WHERE name IN ({placeholders})", names).fetchone()[0]
+
+
+def best_of(connection, sql, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        connection.execute(sql).fetchall()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=200000, help='events to seed')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per scan (best is reported)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='email-tracker-bench-')
+    try:
+        db_path = os.path.join(workdir, 'bench.db')
+        config = type('BenchConfig', (ProductionSQLiteConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+            'SQL_QUERY_STATS': False,
+        })
+        app = create_app(config)
+        with app.app_context():
+            db.create_all()
+            seed_database(emails=max(args.events // 10, 100), events=args.events, end_date=datetime(2024, 1, 31))
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+        connection = sqlite3.connect(db_path)
+        connection.execute(f"CREATE TABLE legacy_events AS {DECODED_EVENTS} ORDER BY e.id")
+        connection.execute("CREATE INDEX ix_legacy_events_email_id ON legacy_events (email_id)")
+        connection.execute("CREATE INDEX ix_legacy_events_created_at ON legacy_events (created_at)")
+        connection.commit()
+        connection.execute("VACUUM")
+
+        legacy, encoded = table_bytes(connection, 'legacy_events'), table_bytes(connection, 'tracking_events')
+        dimensions = sum(table_bytes(connection, table)
+                         for table in ('event_types', 'device_types', 'user_agents', 'ip_addresses'))
+        print(f"{args.events} events")
+        print(f"{'size':<22}{'strings KiB':>13}{'keys KiB':>13}{'+ dims KiB':>13}")
+        print(f"{'table + indexes':<22}{legacy / 1024:>13.0f}{encoded / 1024:>13.0f}{dimensions / 1024:>13.0f}")
+        print()
+        print(f"{'scan':<22}{'strings ms':>13}{'keys ms':>13}")
+        for name, (legacy_sql, encoded_sql) in SCENARIOS.items():
+            legacy_time = best_of(connection, legacy_sql, args.repeat)
+            encoded_time = best_of(connection, encoded_sql, args.repeat)
+            print(f"{name:<22}{legacy_time * 1000:>13.1f}{encoded_time * 1000:>13.1f}")
+        connection.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Requests/sec per core for /track/pixel and /track/click, with and without the WSGI fast path
+
+Usage:
+    python -m benchmarks.bench_fast_path [--requests 5000]
+
+Each scenario calls the WSGI app directly on one thread (no HTTP server, no
+test client), so the numbers are the per-core cost of framework dispatch plus
+the tracking write. The "unknown id" rows skip the insert and isolate the
+dispatch overhead.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from werkzeug.test import EnvironBuilder
+
+from app import create_app, db
+from app.models import Email
+from app.utils import generate_tracking_id
+from config import ProductionSQLiteConfig
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+
+
+def make_app(db_path, fast_path):
+    config = type('BenchConfig', (ProductionSQLiteConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+        'TRACKING_FAST_PATH': fast_path,
+    })
+    return create_app(config)
+
+
+def seed(app, emails):
+    with app.app_context():
+        db.create_all()
+        tracking_ids = [generate_tracking_id() for _ in range(emails)]
+        db.session.add_all(Email(
+            tracking_id=tracking_id,
+            recipient_email='user@example.com',
+            sender_email='sender@example.com'
+        ) for tracking_id in tracking_ids)
+        db.session.commit()
+    return tracking_ids
+
+
+def build_environs(paths):
+    environs = []
+    for path, query in paths:
+        builder = EnvironBuilder(path=path, query_string=query, headers={'User-Agent': USER_AGENT},
+                                 environ_base={'REMOTE_ADDR': '203.0.113.7'})
+        environs.append(builder.get_environ())
+    return environs
+
+
+def run(app, environs, requests):
+    def start_response(status, headers, exc_info=None):
+        return None
+
+    start = time.perf_counter()
+    for i in range(requests):
+        environ = dict(environs[i % len(environs)])
+        body = app(environ, start_response)
+        for _ in body:
+            pass
+        if hasattr(body, 'close'):
+            body.close()
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000, help='requests per scenario')
+    parser.add_argument('--emails', type=int, default=500, help='emails to seed')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='email-tracker-bench-')
+    try:
+        db_path = os.path.join(workdir, 'bench.db')
+        tracking_ids = seed(make_app(db_path, False), args.emails)
+
+        scenarios = {
+            'pixel': [(f'/track/pixel/{t}.png', None) for t in tracking_ids],
+            'click': [(f'/track/click/{t}', {'url': 'https://example.com/landing'}) for t in tracking_ids],
+            'pixel unknown id': [('/track/pixel/unknown.png', None)],
+            'click unknown id': [('/track/click/unknown', {'url': 'https://example.com/landing'})],
+        }
+
+        apps = {'flask': make_app(db_path, False), 'fast path': make_app(db_path, True)}
+
+        print(f"{'scenario':<20}{'flask req/s':>14}{'fast path req/s':>18}{'speedup':>10}")
+        for name, paths in scenarios.items():
+            environs = build_environs(paths)
+            for app in apps.values():
+                run(app, environs, min(args.requests, 200))  # warm up
+            rates = {label: run(app, environs, args.requests) for label, app in apps.items()}
+            print(f"{name:<20}{rates['flask']:>14.0f}{rates['fast path']:>18.0f}"
+                  f"{rates['fast path'] / rates['flask']:>9.2f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
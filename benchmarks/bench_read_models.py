@@ -0,0 +1,135 @@
+"""
+Time and peak memory of listing endpoints: mapped ORM objects vs read models
+
+Usage:
+    python -m benchmarks.bench_read_models [--events 100000] [--repeat 5]
+
+Seeds a fresh SQLite file with `flask seed` data, then runs each listing both
+ways - full TrackingEvent/Email objects serialized with to_dict() (as before),
+and the NamedTuple rows the services now return. Every call gets a fresh
+session; peak memory is measured with tracemalloc on a separate call so its
+tracing overhead does not inflate the timings.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from sqlalchemy import func
+
+from app import create_app, db
+from app.models import Email, TrackingEvent
+from app.seeding import seed_database
+from app.services.analytics_service import AnalyticsService
+from app.services.email_service import EmailService
+from app.services.tracking_service import TrackingService
+from config import ProductionSQLiteConfig
+
+
+def make_app(db_path):
+    config = type('BenchConfig', (ProductionSQLiteConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+        'SQL_QUERY_STATS': False,
+    })
+    return create_app(config)
+
+
+def pick_targets():
+    """The campaign and the email with the most events"""
+    campaign_id = db.session.query(Email.campaign_id).join(TrackingEvent).group_by(
+        Email.campaign_id).order_by(func.count(TrackingEvent.id).desc()).first()[0]
+    email_id = db.session.query(TrackingEvent.email_id).group_by(
+        TrackingEvent.email_id).order_by(func.count(TrackingEvent.id).desc()).first()[0]
+    return campaign_id, email_id
+
+
+def orm_campaign_stats(campaign_id):
+    """get_campaign_stats' raw-event scan as it was: every email's events as mapped objects"""
+    opens = 0
+    for email in db.session.query(Email).filter_by(campaign_id=campaign_id):
+        opens += sum(1 for event in email.events.all() if event.event_type == 'open')
+    return opens
+
+
+def build_scenarios(campaign_id, email_id):
+    """Scenario name -> (ORM call, read model call)"""
+    emails = EmailService()
+    tracking = TrackingService()
+    analytics = AnalyticsService()
+
+    def orm_events(query):
+        return [event.to_dict() for event in query.all()]
+
+    return {
+        'list_emails (50)': (
+            lambda: [email.to_dict() for email in db.session.query(Email).limit(50).all()],
+            lambda: [email.to_dict() for email in emails.list_emails(limit=50)[0]],
+        ),
+        'events_for_email': (
+            lambda: orm_events(db.session.query(TrackingEvent).filter_by(email_id=email_id)),
+            lambda: [event.to_dict() for event in tracking.get_events_for_email(email_id)],
+        ),
+        'events_for_campaign': (
+            lambda: orm_events(db.session.query(TrackingEvent).join(Email).filter(
+                Email.campaign_id == campaign_id)),
+            lambda: [event.to_dict() for event in tracking.get_events_for_campaign(campaign_id)],
+        ),
+        'campaign_stats scan': (
+            lambda: orm_campaign_stats(campaign_id),
+            lambda: analytics.get_campaign_stats(campaign_id),
+        ),
+    }
+
+
+def measure(call, repeat):
+    """Best-of-`repeat` seconds and peak traced bytes of one call"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+        db.session.remove()
+
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--emails', type=int, default=10000, help='emails to seed')
+    parser.add_argument('--events', type=int, default=100000, help='events to seed')
+    parser.add_argument('--repeat', type=int, default=5, help='timed calls per scenario (best is reported)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='email-tracker-bench-')
+    try:
+        app = make_app(os.path.join(workdir, 'bench.db'))
+        with app.app_context():
+            db.create_all()
+            seed_database(emails=args.emails, events=args.events, end_date=datetime(2024, 1, 31))
+            campaign_id, email_id = pick_targets()
+            scenarios = build_scenarios(campaign_id, email_id)
+            db.session.remove()
+
+            print(f"{'scenario':<22}{'orm ms':>10}{'rows ms':>10}{'orm KiB':>11}{'rows KiB':>11}")
+            for name, (orm_call, rows_call) in scenarios.items():
+                orm_call(), rows_call()  # warm up
+                db.session.remove()
+                orm_time, orm_peak = measure(orm_call, args.repeat)
+                rows_time, rows_peak = measure(rows_call, args.repeat)
+                print(f"{name:<22}{orm_time * 1000:>10.1f}{rows_time * 1000:>10.1f}"
+                      f"{orm_peak / 1024:>11.0f}{rows_peak / 1024:>11.0f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
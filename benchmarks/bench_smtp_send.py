@@ -0,0 +1,118 @@
+"""
+Emails/sec of the SMTP send engine against a local SMTP sink
+
+Usage:
+    python -m benchmarks.bench_smtp_send [--emails 2000] [--latency 0.002] [--workers 8] [--connections 50]
+
+Every scenario sends the same queued campaign to benchmarks.smtp_sink, which
+adds --latency seconds per round trip to stand in for the network. The rows
+go from one connection per message, sequential SMTP commands and one worker
+up to the pooled, pipelined, concurrent engine (SendService.send_queued), and
+last the asyncio dispatcher (DispatchService.dispatch) with --connections
+sessions. The sink runs in the same process, so it shares the CPU.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import insert, update
+
+from app import create_app, db
+from app.mailer import QUEUED, mailer
+from app.models import Campaign, Email
+from app.services.dispatch_service import DispatchService
+from app.services.send_service import SendService
+from app.utils import generate_tracking_id
+from benchmarks.smtp_sink import SmtpSink
+from config import ProductionSQLiteConfig
+
+BODY = '<html><body><h1>Spring launch</h1><p>Hello &amp; welcome to our new release.</p>' + \
+       '<p><a href="https://example.com/pricing">See pricing</a></p></body></html>'
+
+# name, messages per connection, server offers PIPELINING, workers (None = --workers, 'dispatch' = dispatcher)
+SCENARIOS = [
+    ('connection per message', 1, False, 1),
+    ('pooled', 1000000, False, 1),
+    ('pooled + pipelining', 1000000, True, 1),
+    ('pooled + pipelining + workers', 1000000, True, None),
+    ('asyncio dispatcher', 1000000, True, 'dispatch'),
+]
+
+
+def make_app(db_path, port, workers, max_messages, connections=50):
+    config = type('BenchConfig', (ProductionSQLiteConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': port,
+        'MAIL_SEND_WORKERS': workers,
+        'MAIL_MAX_MESSAGES_PER_CONNECTION': max_messages,
+        'MAIL_TRACKING_BASE_URL': 'https://track.example.com',
+        'DISPATCH_CONNECTIONS': connections,
+    })
+    return create_app(config)
+
+
+def seed(app, emails):
+    with app.app_context():
+        db.create_all()
+        campaign = Campaign(name='Spring launch', status='active')
+        db.session.add(campaign)
+        db.session.flush()
+        db.session.execute(insert(Email), [{
+            'campaign_id': campaign.id,
+            'tracking_id': generate_tracking_id(),
+            'recipient_email': f'user{i}@example{i % 50}.com',
+            'sender_email': 'news@sender.example.com',
+            'subject': 'Spring launch',
+            'body': BODY,
+            'delivery_status': QUEUED,
+        } for i in range(emails)])
+        db.session.commit()
+
+
+def run(db_path, emails, latency, pipelining, workers, max_messages, connections):
+    with SmtpSink(pipelining=pipelining, latency=latency, keep=False) as sink:
+        app = make_app(db_path, sink.port, 1 if workers == 'dispatch' else workers, max_messages, connections)
+        with app.app_context():
+            db.session.execute(update(Email).values(delivery_status=QUEUED))
+            db.session.execute(update(Campaign).values(status='active'))
+            db.session.commit()
+            try:
+                if workers == 'dispatch':
+                    result = DispatchService().dispatch(db.session.query(Campaign.id).scalar())
+                else:
+                    result = SendService().send_queued()
+            finally:
+                mailer.close()
+        assert result['sent'] == emails == sink.received, result
+        return result['sent'] / result['seconds'], sink.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--emails', type=int, default=2000, help='queued emails per scenario')
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds per SMTP round trip')
+    parser.add_argument('--workers', type=int, default=8, help='MAIL_SEND_WORKERS of the thread pool scenario')
+    parser.add_argument('--connections', type=int, default=50, help='DISPATCH_CONNECTIONS of the dispatcher')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='email-tracker-bench-')
+    try:
+        db_path = os.path.join(workdir, 'bench.db')
+        seed(make_app(db_path, 25, 1, 1), args.emails)
+
+        print(f"{'scenario':<32}{'emails/s':>10}{'connections':>13}{'speedup':>10}")
+        baseline = None
+        for name, max_messages, pipelining, workers in SCENARIOS:
+            rate, connections = run(db_path, args.emails, args.latency, pipelining, workers or args.workers,
+                                    max_messages, args.connections)
+            baseline = baseline or rate
+            print(f"{name:<32}{rate:>10.0f}{connections:>13}{rate / baseline:>9.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
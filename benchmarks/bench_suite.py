@@ -0,0 +1,310 @@
+"""
+Latency and query-count benchmarks for ingest, analytics and listings at 10k/100k/1M events
+
+Usage:
+    python -m benchmarks.bench_suite [--scales 10k,100k] [--output bench_results.json]
+    python -m benchmarks.bench_suite --scales 10k,100k --update-baseline
+
+Each scale is seeded once with `flask seed` data (cached in --data-dir) and
+every run works on a fresh copy, so ingest scenarios never drift the data.
+Scenarios run both directly against the services and through the Flask test
+client; each records p50/p95/p99 latency, throughput and SQL statements per
+call. Results are written as JSON and compared with the stored baseline:
+a p50 slower than baseline * (1 + tolerance) or more queries per call than
+the baseline is a regression, and the exit status is 1.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import sqlalchemy
+from sqlalchemy import func
+
+from app import create_app, db
+from app.models import Email, TrackingEvent
+from app.query_stats import count_queries
+from app.seeding import seed_database
+from app.services.analytics_service import AnalyticsService
+from app.services.email_service import EmailService
+from config import ProductionSQLiteConfig
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+SEED = 42
+# Bump when the schema changes, so cached seed databases are regenerated
+SCHEMA_VERSION = 4
+END_DATE = datetime(2024, 1, 31)
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+CLICK_URL = 'https://example.com/landing'
+
+
+def parse_scale(value):
+    """'10k' -> 10000, '1m' -> 1000000"""
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+
+def percentile(sorted_samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return None
+    rank = max(math.ceil(pct / 100.0 * len(sorted_samples)), 1)
+    return sorted_samples[rank - 1]
+
+
+def summarize(durations, query_counts):
+    """
+    Reduce per-call samples to the reported numbers
+
+    Args:
+        durations: Seconds per call
+        query_counts: SQL statements per call
+
+    Returns:
+        dict: samples, p50/p95/p99/mean in ms, calls per second and queries per call
+    """
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        'samples': len(ordered),
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        'mean_ms': round(total / len(ordered) * 1000, 3),
+        'throughput_per_s': round(len(ordered) / total, 1) if total else None,
+        'queries': sorted(query_counts)[len(query_counts) // 2],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline
+
+    Args:
+        results: {scale: {scenario: summary}} from this run
+        baseline: Same shape, from the stored baseline
+        tolerance: Allowed p50 slowdown as a fraction (0.25 = 25%)
+
+    Returns:
+        list: (scale, scenario, reason) for every regression
+    """
+    regressions = []
+    for scale, scenarios in results.items():
+        for name, current in scenarios.items():
+            previous = baseline.get(scale, {}).get(name)
+            if previous is None:
+                continue
+            if current['queries'] > previous['queries']:
+                regressions.append((scale, name, f"queries {previous['queries']} -> {current['queries']}"))
+            if current['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+                regressions.append((scale, name, f"p50 {previous['p50_ms']:.2f}ms -> {current['p50_ms']:.2f}ms"))
+    return regressions
+
+
+def make_app(db_path):
+    config = type('BenchConfig', (ProductionSQLiteConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(db_path),
+        'SQL_N_PLUS_ONE_RAISE': False,
+        'METRICS_MULTIPROC_DIR': None,
+    })
+    return create_app(config)
+
+
+def seeded_database(data_dir, events):
+    """Path of the cached seed database for a scale, generating it on first use"""
+    path = os.path.join(data_dir, f'seed-{events}-{SEED}-v{SCHEMA_VERSION}.db')
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(data_dir, exist_ok=True)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    app = make_app(tmp_path)
+    with app.app_context():
+        db.create_all()
+        print(f"seeding {events} events into {path} ...", file=sys.stderr)
+        seed_database(campaigns=max(events // 10000, 10), emails=max(events // 10, 100), events=events,
+                      seed=SEED, end_date=END_DATE)
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    os.replace(tmp_path, path)
+    return path
+
+
+def pick_targets(app):
+    """Ids the scenarios cycle through: busiest emails, largest campaign, tracking ids"""
+    with app.app_context():
+        email_ids = [row[0] for row in db.session.query(TrackingEvent.email_id).group_by(
+            TrackingEvent.email_id).order_by(func.count(TrackingEvent.id).desc()).limit(50)]
+        campaign_id = db.session.query(Email.campaign_id).filter(Email.campaign_id.isnot(None)).group_by(
+            Email.campaign_id).order_by(func.count(Email.id).desc()).limit(1).scalar()
+        tracking_ids = [row[0] for row in db.session.query(Email.tracking_id).order_by(Email.id).limit(500)]
+        total_emails = db.session.query(Email).count()
+        db.session.remove()
+    return {
+        'email_ids': email_ids,
+        'campaign_id': campaign_id,
+        'tracking_ids': tracking_ids,
+        'deep_offset': max(total_emails // 2, 0),
+    }
+
+
+def build_scenarios(app, client, targets):
+    """
+    Scenario name -> callable taking the iteration number
+
+    Service scenarios need an app context (pushed by the runner); client
+    scenarios go through the full request cycle.
+    """
+    analytics = AnalyticsService()
+    emails = EmailService()
+    email_ids = targets['email_ids']
+    tracking_ids = targets['tracking_ids']
+    campaign_id = targets['campaign_id']
+    deep_offset = targets['deep_offset']
+
+    def get(url, **kwargs):
+        response = client.get(url, headers={'User-Agent': USER_AGENT}, **kwargs)
+        response.close()
+
+    return {
+        'service.get_email_stats': lambda i: analytics.get_email_stats(email_ids[i % len(email_ids)]),
+        'service.get_campaign_stats': lambda i: analytics.get_campaign_stats(campaign_id),
+        'service.get_global_stats': lambda i: analytics.get_global_stats(),
+        'service.top_campaigns': lambda i: analytics.get_top_performing_campaigns(limit=10),
+        'service.list_emails.first_page': lambda i: emails.list_emails(limit=50, offset=0),
+        'service.list_emails.deep_page': lambda i: emails.list_emails(limit=50, offset=deep_offset),
+        'client.analytics.email': lambda i: get(f'/api/analytics/email/{email_ids[i % len(email_ids)]}'),
+        'client.analytics.campaign': lambda i: get(f'/api/analytics/campaign/{campaign_id}'),
+        'client.analytics.overview': lambda i: get('/api/analytics/overview'),
+        'client.analytics.top_campaigns': lambda i: get('/api/analytics/top-campaigns'),
+        'client.emails.first_page': lambda i: get('/api/emails', query_string={'limit': 50}),
+        'client.emails.deep_page': lambda i: get('/api/emails', query_string={'limit': 50, 'offset': deep_offset}),
+        'client.ingest.pixel': lambda i: get(f'/track/pixel/{tracking_ids[i % len(tracking_ids)]}.png'),
+        'client.ingest.click': lambda i: get(f'/track/click/{tracking_ids[i % len(tracking_ids)]}',
+                                             query_string={'url': CLICK_URL}),
+    }
+
+
+def run_scenario(app, call, repeat, max_seconds, warmup=1):
+    """Call a scenario up to `repeat` times (or until max_seconds), timing each call and counting its queries"""
+    durations = []
+    query_counts = []
+    with app.app_context():
+        for i in range(warmup):
+            call(i)
+        db.session.remove()
+
+        deadline = time.perf_counter() + max_seconds
+        for i in range(repeat):
+            with count_queries() as stats:
+                start = time.perf_counter()
+                call(i)
+                durations.append(time.perf_counter() - start)
+            query_counts.append(stats.count)
+            # Fresh identity map per call, as each request would get
+            db.session.remove()
+            if time.perf_counter() > deadline:
+                break
+    return summarize(durations, query_counts)
+
+
+def run_scale(events, args):
+    workdir = os.path.join(args.data_dir, 'run')
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, f'bench-{events}.db')
+    shutil.copyfile(seeded_database(args.data_dir, events), db_path)
+
+    try:
+        app = make_app(db_path)
+        with app.app_context():
+            # Cached seeds may predate newer tables
+            db.create_all()
+        targets = pick_targets(app)
+        scenarios = build_scenarios(app, app.test_client(), targets)
+
+        results = {}
+        for name, call in scenarios.items():
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            results[name] = run_scenario(app, call, args.repeat, args.max_seconds)
+            summary = results[name]
+            print(f"{events:>9} {name:<36}{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}"
+                  f"{summary['p99_ms']:>10.2f}{summary['queries']:>9}{summary['samples']:>9}")
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        return results
+    finally:
+        os.remove(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', default='10k,100k', help='comma separated event counts (e.g. 10k,100k,1m)')
+    parser.add_argument('--repeat', type=int, default=50, help='max calls per scenario')
+    parser.add_argument('--max-seconds', type=float, default=10.0, help='time budget per scenario')
+    parser.add_argument('--only', action='append', help='run scenarios whose name contains this (repeatable)')
+    parser.add_argument('--data-dir', default='.bench-data', help='cache for seeded databases')
+    parser.add_argument('--output', default='bench_results.json', help='where to write the JSON results')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed p50 slowdown (0.5 = 50%%)')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results as the new baseline')
+    args = parser.parse_args()
+
+    # Known N+1s would print a warning per call - the query counts are in the report instead
+    logging.getLogger('app.sql').setLevel(logging.ERROR)
+
+    print(f"{'events':>9} {'scenario':<36}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'samples':>9}")
+    results = {}
+    for scale in args.scales.split(','):
+        results[scale.strip().lower()] = run_scale(parse_scale(scale), args)
+
+    report = {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'platform': platform.platform(),
+            'seed': SEED,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline} (run with --update-baseline to create one)")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    for scale, name, reason in regressions:
+        print(f"REGRESSION {scale} {name}: {reason}")
+    if not regressions:
+        print(f"no regressions against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Recipients/sec of template personalization
+
+Usage:
+    python -m benchmarks.bench_templates [--recipients 20000]
+
+Renders a newsletter-sized template for --recipients variable dicts three
+ways: parsing the template with a regex for every recipient (what rendering
+without a compile step costs), the compiled template (app.templating), and
+TemplateService.create_emails, which also writes the queued emails to a temp
+SQLite database.
+"""
+
+import argparse
+import html
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from app import create_app, db
+from app.services.template_service import TemplateService
+from app.templating import compile_template
+from config import ProductionSQLiteConfig
+
+SUBJECT = '{{ first_name|Hello }}, your {{ plan }} plan renews soon'
+BODY = ''.join(
+    f'<tr><td style="padding: 8px">{{{{ first_name|there }}}}, item {i}: {{{{ item_{i % 4} }}}} '
+    f'for {{{{ company }}}}</td><td><a href="https://example.com/p/{i}?t={{{{ tracking_id }}}}">View</a></td></tr>\n'
+    for i in range(40))
+BODY = f'<html><body><h1>Hi {{{{ first_name }}}}</h1><table>\n{BODY}</table></body></html>'
+
+_PLACEHOLDER = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\|([^{}]*?))?\s*\}\}')
+
+
+def recipients(count):
+    return [{
+        'recipient_email': f'user{i}@example{i % 50}.com',
+        'first_name': f'User {i}',
+        'plan': ('Free', 'Pro', 'Team')[i % 3],
+        'company': f'Company & Sons {i % 100}',
+        **{f'item_{k}': f'Widget {i + k}' for k in range(4)},
+        'tracking_id': f'{i:032x}',
+    } for i in range(count)]
+
+
+def render_uncompiled(variables):
+    def value(match, escape):
+        found = variables.get(match.group(1))
+        if found in (None, ''):
+            return match.group(2) or ''
+        return html.escape(str(found)) if escape else str(found)
+    return (_PLACEHOLDER.sub(lambda match: value(match, False), SUBJECT),
+            _PLACEHOLDER.sub(lambda match: value(match, True), BODY))
+
+
+def timed(function, count):
+    started = time.perf_counter()
+    function()
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=20000, help='variable dicts to render')
+    args = parser.parse_args()
+    people = recipients(args.recipients)
+
+    compiled = compile_template(SUBJECT, BODY)
+    assert [render_uncompiled(person) for person in people[:10]] == compiled.render_many(people[:10])
+
+    rows = [
+        ('regex per recipient', timed(lambda: [render_uncompiled(person) for person in people], len(people))),
+        ('compiled', timed(lambda: compiled.render_many(people), len(people))),
+    ]
+
+    workdir = tempfile.mkdtemp(prefix='email-tracker-bench-')
+    try:
+        app = create_app(type('BenchConfig', (ProductionSQLiteConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db')}))
+        with app.app_context():
+            db.create_all()
+            service = TemplateService()
+            template = service.create_template('Newsletter', SUBJECT, BODY)
+            rows.append(('create_emails (render + insert)', timed(
+                lambda: service.create_emails(template.id, 'news@example.com', people), len(people))))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = rows[0][1]
+    print(f"{'renderer':<34}{'recipients/s':>14}{'speedup':>10}")
+    for name, rate in rows:
+        print(f"{name:<34}{rate:>14,.0f}{rate / baseline:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
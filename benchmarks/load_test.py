@@ -0,0 +1,297 @@
+"""
+HTTP load test for /track/pixel and /track/click under a real WSGI server
+
+Usage:
+    python -m benchmarks.load_test [--concurrency 16,64,256] [--duration 15] [--workers 4]
+    python -m benchmarks.load_test --server werkzeug       # when gunicorn is not installed
+    python -m benchmarks.load_test --fast-path --worker-class gthread --threads 8
+
+Starts the app under gunicorn (the production server, see README) against
+a fresh SQLite file using the production_sqlite profile, then drives it from
+an asyncio client holding `concurrency` keep-alive connections. Each step
+runs for --duration seconds; the report shows requests/s, latency
+percentiles, non-2xx/3xx and transport errors, and event loss - hits on
+valid tracking IDs that were answered successfully but have no row in
+tracking_events when the database is checked afterwards.
+
+Traffic mimics a campaign send: a few hot campaigns get most hits
+(Zipf over campaigns), a share of hits are clicks, and a share carry
+unknown tracking IDs (old links, scanners, typos) that must not be recorded.
+"""
+
+import argparse
+import asyncio
+import bisect
+import itertools
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+from app import create_app, db
+from app.seeding import seed_database
+from benchmarks.bench_suite import percentile
+from config import ProductionSQLiteConfig
+
+USER_AGENT = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148'
+CLICK_URLS = ['https://example.com/pricing', 'https://example.com/signup', 'https://example.com/blog/launch']
+
+
+class TargetMix:
+    """Picks the next request path: hot-campaign skew, clicks vs opens, unknown IDs"""
+
+    def __init__(self, campaigns, seed=1, campaign_skew=1.2, click_ratio=0.2, invalid_ratio=0.05):
+        """
+        Args:
+            campaigns: List of tracking-ID lists, one per campaign
+            seed: Random seed for the request sequence
+            campaign_skew: Zipf exponent over campaigns (higher = hotter top campaigns)
+            click_ratio: Share of requests that are clicks
+            invalid_ratio: Share of requests with an unknown tracking ID
+        """
+        self.campaigns = [ids for ids in campaigns if ids]
+        self.rng = random.Random(seed)
+        self.cum_weights = list(itertools.accumulate(
+            1.0 / rank ** campaign_skew for rank in range(1, len(self.campaigns) + 1)))
+        self.click_ratio = click_ratio
+        self.invalid_ratio = invalid_ratio
+
+    def next(self):
+        """
+        Returns:
+            tuple: (path, event_type, valid)
+        """
+        rng = self.rng
+        if rng.random() < self.invalid_ratio:
+            tracking_id, valid = '%032x' % rng.getrandbits(128), False
+        else:
+            index = bisect.bisect(self.cum_weights, rng.random() * self.cum_weights[-1], 0, len(self.campaigns) - 1)
+            tracking_id, valid = rng.choice(self.campaigns[index]), True
+
+        if rng.random() < self.click_ratio:
+            return f'/track/click/{tracking_id}?url={quote(rng.choice(CLICK_URLS), safe="")}', 'click', valid
+        return f'/track/pixel/{tracking_id}.png', 'open', valid
+
+
+class StepResult:
+    """Counters and latencies for one concurrency step"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.transport_errors = 0
+        self.expected = {'open': 0, 'click': 0}
+
+    def record(self, status, latency, event_type, valid):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if valid and status in (200, 302):
+            self.expected[event_type] += 1
+
+
+async def _read_response(reader):
+    """Read one HTTP/1.1 response; returns (status, keep_alive)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+
+    length = 0
+    keep_alive = status_line.startswith(b'HTTP/1.1')
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection':
+            keep_alive = value.strip().lower() == 'keep-alive'
+
+    if length:
+        await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def _connection(host, port, mix, result, deadline):
+    """One client connection sending requests back to back until the deadline"""
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        path, event_type, valid = mix.next()
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUser-Agent: {USER_AGENT}\r\n'
+                         f'Connection: keep-alive\r\n\r\n'.encode())
+            status, keep_alive = await _read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            result.transport_errors += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+            continue
+
+        result.record(status, time.perf_counter() - start, event_type, valid)
+        if not keep_alive:
+            writer.close()
+            writer = None
+
+    if writer is not None:
+        writer.close()
+
+
+async def run_step(host, port, mix, concurrency, duration):
+    result = StepResult()
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(_connection(host, port, mix, result, deadline) for _ in range(concurrency)))
+    return result, time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(db_path, campaigns, emails):
+    """Create and seed the database the server will use; returns tracking IDs grouped by campaign"""
+    config = type('LoadTestConfig', (ProductionSQLiteConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+        'METRICS_MULTIPROC_DIR': None,
+    })
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        seed_database(campaigns=campaigns, emails=emails, events=0)
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+    with sqlite3.connect(db_path) as conn:
+        by_campaign = {}
+        for campaign_id, tracking_id in conn.execute('SELECT campaign_id, tracking_id FROM emails ORDER BY id'):
+            by_campaign.setdefault(campaign_id, []).append(tracking_id)
+    # Campaign 1 is the hottest (rank 1 in the Zipf mix)
+    return [by_campaign[key] for key in sorted(by_campaign, key=lambda k: (k is None, k))]
+
+
+def count_events(db_path):
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        counts = dict(conn.execute('SELECT event_type, COUNT(*) FROM tracking_events GROUP BY event_type'))
+    return {'open': counts.get('open', 0), 'click': counts.get('click', 0)}
+
+
+def start_server(args, db_path, port, workdir):
+    env = dict(os.environ,
+               FLASK_CONFIG='production_sqlite',
+               DATABASE_URL='sqlite:///' + db_path,
+               TRACKING_FAST_PATH=str(args.fast_path),
+               METRICS_MULTIPROC_DIR=os.path.join(workdir, 'metrics'))
+
+    if args.server == 'gunicorn':
+        if shutil.which('gunicorn') is None:
+            sys.exit('gunicorn is not installed (pip install gunicorn) - or use --server werkzeug')
+        command = ['gunicorn', '-w', str(args.workers), '-b', f'127.0.0.1:{port}',
+                   '--worker-class', args.worker_class, '--threads', str(args.threads),
+                   '--backlog', '2048', '--log-level', 'warning', 'app:create_app()']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app:create_app', 'run',
+                   '--port', str(port), '--with-threads', '--no-reload', '--no-debugger']
+
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, 'server.log'), 'w'))
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'server exited early, see {workdir}/server.log')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as sock:
+                sock.sendall(b'GET /health HTTP/1.0\r\n\r\n')
+                if b' 200 ' in sock.recv(64):
+                    return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit('server did not become healthy within 30s')
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def report_step(concurrency, result, elapsed, recorded):
+    latencies = sorted(result.latencies)
+    requests = len(latencies)
+    errors = sum(count for status, count in result.statuses.items() if status >= 400) + result.transport_errors
+    expected = result.expected['open'] + result.expected['click']
+    lost = expected - (recorded['open'] + recorded['click'])
+
+    def ms(pct):
+        value = percentile(latencies, pct)
+        return value * 1000 if value is not None else float('nan')
+
+    print(f"{concurrency:>6}{requests / elapsed:>11.0f}{ms(50):>9.1f}{ms(95):>9.1f}{ms(99):>9.1f}"
+          f"{errors:>8}{errors / max(requests, 1) * 100:>7.2f}%{expected:>10}{lost:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', default='16,64,256', help='comma separated connection counts, one step each')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds per step')
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'], default='gunicorn')
+    parser.add_argument('--workers', type=int, default=2 * (os.cpu_count() or 1) + 1, help='gunicorn workers')
+    parser.add_argument('--worker-class', default='sync', help='gunicorn worker class (sync, gthread, ...)')
+    parser.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker (gthread)')
+    parser.add_argument('--fast-path', action='store_true', help='enable the WSGI tracking fast path')
+    parser.add_argument('--campaigns', type=int, default=20)
+    parser.add_argument('--emails', type=int, default=20000)
+    parser.add_argument('--campaign-skew', type=float, default=1.2, help='Zipf exponent over campaigns')
+    parser.add_argument('--click-ratio', type=float, default=0.2)
+    parser.add_argument('--invalid-ratio', type=float, default=0.05, help='share of unknown tracking IDs')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='email-tracker-load-')
+    db_path = os.path.join(workdir, 'load.db')
+    try:
+        campaigns = prepare_database(db_path, args.campaigns, args.emails)
+        mix = TargetMix(campaigns, seed=args.seed, campaign_skew=args.campaign_skew,
+                        click_ratio=args.click_ratio, invalid_ratio=args.invalid_ratio)
+
+        port = free_port()
+        process = start_server(args, db_path, port, workdir)
+        label = f"{args.server}" + (f" -w {args.workers} {args.worker_class}" if args.server == 'gunicorn' else '')
+        print(f"server: {label}{' +fast path' if args.fast_path else ''}, {args.duration:.0f}s per step")
+        print(f"{'conns':>6}{'req/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'rate':>8}"
+              f"{'expected':>10}{'lost':>7}")
+        try:
+            for concurrency in (int(value) for value in args.concurrency.split(',')):
+                before = count_events(db_path)
+                result, elapsed = asyncio.run(run_step('127.0.0.1', port, mix, concurrency, args.duration))
+                after = count_events(db_path)
+                recorded = {kind: after[kind] - before[kind] for kind in after}
+                report_step(concurrency, result, elapsed, recorded)
+        finally:
+            stop_server(process)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Local SMTP sink for the send engine's benchmark and tests
+
+Accepts every message (unless the recipient is listed in reject/defer) and
+throws it away, optionally keeping it in memory. Runs an asyncio server on a
+background thread:
+
+    with SmtpSink(latency=0.002) as sink:
+        ... send to 127.0.0.1:sink.port ...
+
+latency is added once per batch of commands read from the socket, which is
+how a network round trip behaves: pipelined commands that arrive together
+share one delay, commands sent one by one pay it each.
+"""
+
+import asyncio
+import threading
+
+
+class SmtpSink:
+    """Minimal ESMTP server (EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT)"""
+
+    def __init__(self, host='127.0.0.1', port=0, pipelining=True, latency=0.0, reject=(), defer=(), keep=True):
+        self.host = host
+        self.port = port
+        self.pipelining = pipelining
+        self.latency = latency
+        self.reject = set(reject)
+        self.defer = set(defer)
+        self.keep = keep
+        self.messages = []  # (sender, recipients, data) with keep=True
+        self.received = 0
+        self.connections = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._session, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+            # End the sessions clients left open before the loop goes away
+            sessions = asyncio.all_tasks(self._loop)
+            for session in sessions:
+                session.cancel()
+            self._loop.run_until_complete(asyncio.gather(*sessions, return_exceptions=True))
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, name='smtp-sink', daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _session(self, reader, writer):
+        self.connections += 1
+        writer.write(b'220 sink ESMTP\r\n')
+        buffer = b''
+        state = {'sender': None, 'recipients': [], 'data': False, 'quit': False}
+        try:
+            while not state['quit']:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                replies = []
+                while True:
+                    if state['data']:
+                        if buffer.startswith(b'.\r\n'):
+                            end, rest = 0, 3
+                        else:
+                            end = buffer.find(b'\r\n.\r\n')
+                            if end < 0:
+                                break
+                            rest = end + 5
+                        self._receive(state, buffer[:end])
+                        buffer = buffer[rest:]
+                        replies.append(b'250 2.0.0 Ok: queued\r\n')
+                        continue
+                    end = buffer.find(b'\r\n')
+                    if end < 0:
+                        break
+                    line, buffer = buffer[:end].decode('ascii', 'replace'), buffer[end + 2:]
+                    replies.append(self._command(state, line))
+                    if state['quit']:
+                        break
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(b''.join(replies))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _receive(self, state, data):
+        self.received += 1
+        if self.keep:
+            data = data[1:] if data.startswith(b'..') else data
+            self.messages.append((state['sender'], list(state['recipients']), data.replace(b'\r\n..', b'\r\n.')))
+        state.update(sender=None, recipients=[], data=False)
+
+    def _command(self, state, line):
+        verb, _, argument = line.partition(' ')
+        verb = verb.upper()
+        if verb == 'EHLO':
+            extensions = ['PIPELINING'] if self.pipelining else []
+            lines = ['sink'] + extensions + ['8BITMIME']
+            return ''.join(f"250{'-' if i < len(lines) - 1 else ' '}{text}\r\n"
+                           for i, text in enumerate(lines)).encode()
+        if verb in ('HELO', 'NOOP'):
+            return b'250 Ok\r\n'
+        if verb == 'MAIL':
+            state.update(sender=_address(argument), recipients=[])
+            return b'250 2.1.0 Ok\r\n'
+        if verb == 'RCPT':
+            recipient = _address(argument)
+            if recipient in self.reject:
+                return b'550 5.1.1 No such user\r\n'
+            if recipient in self.defer:
+                return b'451 4.7.1 Try again later\r\n'
+            state['recipients'].append(recipient)
+            return b'250 2.1.5 Ok\r\n'
+        if verb == 'DATA':
+            if not state['recipients']:
+                return b'554 5.5.1 No valid recipients\r\n'
+            state['data'] = True
+            return b'354 End data with <CR><LF>.<CR><LF>\r\n'
+        if verb == 'RSET':
+            state.update(sender=None, recipients=[])
+            return b'250 2.0.0 Ok\r\n'
+        if verb == 'QUIT':
+            state['quit'] = True
+            return b'221 2.0.0 Bye\r\n'
+        return b'502 5.5.2 Command not recognized\r\n'
+
+
+def _address(argument):
+    """Address inside FROM:<...> / TO:<...>"""
+    start, end = argument.find('<'), argument.find('>')
+    return argument[start + 1:end] if 0 <= start < end else argument.partition(':')[2].strip()
@@ -2,7 +2,252 @@ import os
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
+
+def _env_int(name, default):
+    """Read an integer setting from the environment"""
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_float(name, default):
+    """Read a float setting from the environment"""
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+def _env_bool(name, default):
+    """Read a boolean setting from the environment"""
+    value = os.environ.get(name)
+    if value in (None, ''):
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
 class Config:
-    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(BASE_DIR, "app.db")
+    """Base configuration shared by every profile"""
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or "sqlite:///" + os.path.join(BASE_DIR, "app.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    
\ No newline at end of file
+
+    # Extra keyword arguments passed to create_engine()
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    # PRAGMA statements applied to every new SQLite connection (ignored for other databases)
+    SQLITE_PRAGMAS = {}
+
+    # Read replica for analytics and listing queries (unset = everything reads the primary)
+    SQLALCHEMY_REPLICA_URI = os.environ.get('REPLICA_DATABASE_URL') or None
+    REPLICA_MAX_LAG_SECONDS = _env_int('REPLICA_MAX_LAG_SECONDS', 30)
+    REPLICA_LAG_CHECK_INTERVAL = _env_int('REPLICA_LAG_CHECK_INTERVAL', 5)
+    # Reads stay on the primary this long after an API write (read-your-writes)
+    REPLICA_READ_AFTER_WRITE_SECONDS = _env_int('REPLICA_READ_AFTER_WRITE_SECONDS', 5)
+
+    # Per-request SQL query stats: X-Query-* headers in debug, JSON log line otherwise
+    SQL_QUERY_STATS = _env_bool('SQL_QUERY_STATS', True)
+    # A statement run with this many distinct parameter sets in one request is reported as an N+1
+    SQL_N_PLUS_ONE_THRESHOLD = _env_int('SQL_N_PLUS_ONE_THRESHOLD', 10)
+    SQL_N_PLUS_ONE_RAISE = False
+
+    # Prometheus metrics at /metrics; set the directory under a prefork server so
+    # every worker's counters are included in each scrape
+    METRICS_ENABLED = _env_bool('METRICS_ENABLED', True)
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR') or None
+    METRICS_FLUSH_INTERVAL = _env_int('METRICS_FLUSH_INTERVAL', 5)
+
+    # Serve /track/pixel and /track/click from WSGI middleware instead of Flask routing
+    TRACKING_FAST_PATH = _env_bool('TRACKING_FAST_PATH', False)
+
+    # Token buckets on pixel/click hits per client IP and per tracking ID (tokens per second,
+    # 0 = off); over-limit hits are answered but not recorded. Set TRACKING_LIMITER_PATH
+    # (e.g. on /dev/shm) to share the buckets between workers without gunicorn --preload
+    TRACKING_IP_RATE = _env_float('TRACKING_IP_RATE', 0)
+    TRACKING_IP_BURST = _env_int('TRACKING_IP_BURST', 20)
+    TRACKING_ID_RATE = _env_float('TRACKING_ID_RATE', 0)
+    TRACKING_ID_BURST = _env_int('TRACKING_ID_BURST', 50)
+    TRACKING_LIMITER_SLOTS = _env_int('TRACKING_LIMITER_SLOTS', 65536)
+    TRACKING_LIMITER_PATH = os.environ.get('TRACKING_LIMITER_PATH') or None
+
+    # Derived event columns (device type, location): 'inline' parses at ingest,
+    # 'background' stores raw facts only and leaves them to `flask enrichment run`
+    TRACKING_ENRICHMENT = os.environ.get('TRACKING_ENRICHMENT') or 'inline'
+    ENRICHMENT_BATCH_SIZE = _env_int('ENRICHMENT_BATCH_SIZE', 1000)
+    # MaxMind GeoLite2/GeoIP2 City database for IP locations (needs geoip2)
+    GEOIP_DATABASE = os.environ.get('GEOIP_DATABASE') or None
+
+    # Machine opens and scanner clicks (see app.machine_events): 'flag' stores them
+    # with a machine_reason, 'drop' does not store them, 'off' skips classification
+    MACHINE_EVENTS = os.environ.get('MACHINE_EVENTS') or 'flag'
+    # Comma-separated networks of privacy proxies / link scanners (17.0.0.0/8 = Apple)
+    MACHINE_IP_RANGES = tuple(value for value in (os.environ.get('MACHINE_IP_RANGES') or '17.0.0.0/8').split(',')
+                              if value.strip())
+    # Opens/clicks this soon after sending are prefetches/scans
+    MACHINE_OPEN_SECONDS = _env_int('MACHINE_OPEN_SECONDS', 2)
+    MACHINE_CLICK_SECONDS = _env_int('MACHINE_CLICK_SECONDS', 10)
+    # MACHINE_BURST_CLICKS clicks on one email within MACHINE_BURST_SECONDS are a scanner;
+    # burst windows are kept for the MACHINE_BURST_EMAILS most recently clicked emails
+    MACHINE_BURST_SECONDS = _env_int('MACHINE_BURST_SECONDS', 2)
+    MACHINE_BURST_CLICKS = _env_int('MACHINE_BURST_CLICKS', 3)
+    MACHINE_BURST_EMAILS = _env_int('MACHINE_BURST_EMAILS', 10000)
+
+    # Fold an open repeating one from the same email, IP and user agent within this many
+    # seconds into that row's repeat_count (0 = off); the map holds TRACKING_COLLAPSE_KEYS opens
+    TRACKING_COLLAPSE_SECONDS = _env_int('TRACKING_COLLAPSE_SECONDS', 0)
+    TRACKING_COLLAPSE_KEYS = _env_int('TRACKING_COLLAPSE_KEYS', 100000)
+
+    # User agents and IPs (and other dimension values) each worker keeps interned, per dimension
+    DIMENSION_CACHE_SIZE = _env_int('DIMENSION_CACHE_SIZE', 100000)
+
+    # Idempotency keys of POST /track/event are kept this long (`flask idempotency purge`);
+    # each worker caches the last IDEMPOTENCY_CACHE_SIZE of them
+    IDEMPOTENCY_TTL_SECONDS = _env_int('IDEMPOTENCY_TTL_SECONDS', 86400)
+    IDEMPOTENCY_CACHE_SIZE = _env_int('IDEMPOTENCY_CACHE_SIZE', 10000)
+
+    # Top links / domains / IPs / user agents sketches (app.heavy_hitters): values kept per
+    # sketch (0 = off, answer exactly), and how often each worker writes its pending hits
+    HEAVY_HITTERS_CAPACITY = _env_int('HEAVY_HITTERS_CAPACITY', 100)
+    HEAVY_HITTERS_FLUSH_SECONDS = _env_int('HEAVY_HITTERS_FLUSH_SECONDS', 30)
+    HEAVY_HITTERS_PENDING_KEYS = _env_int('HEAVY_HITTERS_PENDING_KEYS', 50000)
+
+    # Live stream at /api/analytics/stream (app.event_stream): seconds per delta update,
+    # updates queued per client before the oldest are folded together, streams per worker
+    EVENT_STREAM_INTERVAL = _env_float('EVENT_STREAM_INTERVAL', 1.0)
+    EVENT_STREAM_QUEUE_SIZE = _env_int('EVENT_STREAM_QUEUE_SIZE', 30)
+    EVENT_STREAM_MAX_SUBSCRIBERS = _env_int('EVENT_STREAM_MAX_SUBSCRIBERS', 1000)
+    EVENT_STREAM_HEARTBEAT = _env_int('EVENT_STREAM_HEARTBEAT', 15)
+
+    # Outbound webhooks (app.webhooks, `flask webhooks run`): events per batch, seconds a
+    # partial batch may wait, attempts before a batch is parked, backoff doubling from base to max
+    WEBHOOK_BATCH_SIZE = _env_int('WEBHOOK_BATCH_SIZE', 100)
+    WEBHOOK_BATCH_SECONDS = _env_float('WEBHOOK_BATCH_SECONDS', 5.0)
+    WEBHOOK_TIMEOUT = _env_float('WEBHOOK_TIMEOUT', 10.0)
+    WEBHOOK_MAX_ATTEMPTS = _env_int('WEBHOOK_MAX_ATTEMPTS', 10)
+    WEBHOOK_RETRY_BASE_SECONDS = _env_float('WEBHOOK_RETRY_BASE_SECONDS', 10.0)
+    WEBHOOK_RETRY_MAX_SECONDS = _env_float('WEBHOOK_RETRY_MAX_SECONDS', 3600.0)
+    WEBHOOK_POOL_SIZE = _env_int('WEBHOOK_POOL_SIZE', 4)
+
+    # SMTP send engine (app.mailer, `flask mail send`) for emails created with queue=True
+    MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'localhost'
+    MAIL_PORT = _env_int('MAIL_PORT', 25)
+    MAIL_USE_TLS = _env_bool('MAIL_USE_TLS', False)
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME') or None
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD') or None
+    MAIL_TIMEOUT = _env_float('MAIL_TIMEOUT', 30.0)
+    # Worker threads (and pooled connections), emails per recorded chunk, messages before a
+    # connection is replaced, sends per second to one recipient domain (0 = unthrottled)
+    MAIL_SEND_WORKERS = _env_int('MAIL_SEND_WORKERS', 8)
+    MAIL_SEND_BATCH_SIZE = _env_int('MAIL_SEND_BATCH_SIZE', 500)
+    MAIL_MAX_MESSAGES_PER_CONNECTION = _env_int('MAIL_MAX_MESSAGES_PER_CONNECTION', 100)
+    MAIL_DOMAIN_RATE = _env_float('MAIL_DOMAIN_RATE', 0)
+    # Public URL of this app; when set, sent HTML bodies get the tracking pixel
+    MAIL_TRACKING_BASE_URL = os.environ.get('MAIL_TRACKING_BASE_URL') or None
+
+    # Asyncio campaign dispatcher (`flask mail dispatch`): SMTP sessions at once, sends in flight
+    # and per rate window to one recipient domain (rate 0 = no limit), recipients held in memory
+    DISPATCH_CONNECTIONS = _env_int('DISPATCH_CONNECTIONS', 50)
+    DISPATCH_DOMAIN_CONCURRENCY = _env_int('DISPATCH_DOMAIN_CONCURRENCY', 5)
+    DISPATCH_DOMAIN_RATE = _env_int('DISPATCH_DOMAIN_RATE', 0)
+    DISPATCH_RATE_WINDOW = _env_float('DISPATCH_RATE_WINDOW', 60.0)
+    DISPATCH_BUFFER_SIZE = _env_int('DISPATCH_BUFFER_SIZE', 2000)
+    # Seconds between progress checkpoints and between Campaign.status polls (pause / resume)
+    DISPATCH_CHECKPOINT_SECONDS = _env_float('DISPATCH_CHECKPOINT_SECONDS', 1.0)
+    DISPATCH_STATUS_SECONDS = _env_float('DISPATCH_STATUS_SECONDS', 2.0)
+
+    # Compiled email templates kept per process (app.templating)
+    TEMPLATE_CACHE_SIZE = _env_int('TEMPLATE_CACHE_SIZE', 256)
+
+    # Store tracking events in per-period tables behind a view: 'month', 'week', 'day' or unset
+    TRACKING_PARTITION_PERIOD = os.environ.get('TRACKING_PARTITION_PERIOD') or None
+
+    # Retention: raw events older than this many days are rolled into daily aggregates
+    # by `flask compact-events`, deleting RETENTION_CHUNK_SIZE rows per transaction
+    RETENTION_DAYS = _env_int('RETENTION_DAYS', 90)
+    RETENTION_CHUNK_SIZE = _env_int('RETENTION_CHUNK_SIZE', 500)
+
+    # Cold archive: when set, events are copied into compressed segment files here
+    # before retention deletes them (see app.archive)
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or None
+    ARCHIVE_SEGMENT_ROWS = _env_int('ARCHIVE_SEGMENT_ROWS', 100000)
+
+    # Analytics engine: 'sql' (default) or 'columnar' - NumPy column arrays per
+    # worker, topped up from the database at most every COLUMNAR_REFRESH_SECONDS
+    ANALYTICS_ENGINE = os.environ.get('ANALYTICS_ENGINE') or 'sql'
+    COLUMNAR_REFRESH_SECONDS = _env_float('COLUMNAR_REFRESH_SECONDS', 1.0)
+
+
+class DevelopmentConfig(Config):
+    """Local development: plain SQLite file, no tuning"""
+    DEBUG = True
+
+
+class TestingConfig(Config):
+    """Test runs: isolated in-memory SQLite database"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_REPLICA_URI = None
+    TRACKING_FAST_PATH = False
+    TRACKING_PARTITION_PERIOD = None
+    ARCHIVE_DIR = None
+    ANALYTICS_ENGINE = 'sql'
+    TRACKING_ENRICHMENT = 'inline'
+    GEOIP_DATABASE = None
+    METRICS_MULTIPROC_DIR = None
+    # Fail the request (and the test) on N+1 query regressions
+    SQL_N_PLUS_ONE_RAISE = True
+
+
+class ProductionSQLiteConfig(Config):
+    """
+    Single-box production on SQLite
+
+    WAL lets the analytics readers run while the pixel endpoint is writing,
+    synchronous=NORMAL drops the fsync on every commit (safe with WAL), and
+    the mmap/cache sizes keep the hot pages of tracking_events in memory.
+    """
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'cache_size': _env_int('SQLITE_CACHE_SIZE', -64000),  # negative = KiB, i.e. ~64 MB
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT', 5000),  # milliseconds
+        'temp_store': 'MEMORY',
+    }
+
+
+class ProductionServerConfig(Config):
+    """Production on a database server (PostgreSQL/MySQL) with a tuned connection pool"""
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': _env_int('DB_POOL_SIZE', 10),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True,
+    }
+
+
+config_profiles = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production_sqlite': ProductionSQLiteConfig,
+    'production': ProductionServerConfig,
+}
+
+
+def get_config(profile=None):
+    """
+    Resolve a configuration class by profile name
+
+    Args:
+        profile: Profile name (defaults to the FLASK_CONFIG environment variable,
+                 then 'development')
+
+    Returns:
+        type: Configuration class
+
+    Raises:
+        ValueError: If the profile name is unknown
+    """
+    profile = profile or os.environ.get('FLASK_CONFIG') or 'development'
+
+    if profile not in config_profiles:
+        raise ValueError(f"Unknown config profile: {profile}. Must be one of {list(config_profiles)}")
+
+    return config_profiles[profile]
@@ -0,0 +1,77 @@
+"""Add daily event aggregates written by the retention job
+
+Revision ID: 3b7e2c9d4f10
+Revises: 94fe9d85a66d
+Create Date: 2026-10-19 10:12:44.318402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7e2c9d4f10'
+down_revision = '94fe9d85a66d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('email_daily_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('event_type', sa.String(length=50), nullable=False),
+    sa.Column('device_type', sa.String(length=50), nullable=True),
+    sa.Column('event_count', sa.Integer(), nullable=False),
+    sa.Column('first_at', sa.DateTime(), nullable=False),
+    sa.Column('last_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['email_id'], ['emails.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email_id', 'day', 'event_type', 'device_type', name='uq_email_daily_stats_key')
+    )
+    with op.batch_alter_table('email_daily_stats', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_email_daily_stats_day'), ['day'], unique=False)
+        batch_op.create_index(batch_op.f('ix_email_daily_stats_email_id'), ['email_id'], unique=False)
+
+    op.create_table('email_unique_ips',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email_id', sa.Integer(), nullable=False),
+    sa.Column('event_type', sa.String(length=50), nullable=False),
+    sa.Column('ip_address', sa.String(length=45), nullable=False),
+    sa.ForeignKeyConstraint(['email_id'], ['emails.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email_id', 'event_type', 'ip_address', name='uq_email_unique_ips_key')
+    )
+    with op.batch_alter_table('email_unique_ips', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_email_unique_ips_email_id'), ['email_id'], unique=False)
+
+    op.create_table('campaign_daily_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('event_type', sa.String(length=50), nullable=False),
+    sa.Column('event_count', sa.Integer(), nullable=False),
+    sa.Column('email_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaigns.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('campaign_id', 'day', 'event_type', name='uq_campaign_daily_stats_key')
+    )
+    with op.batch_alter_table('campaign_daily_stats', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_campaign_daily_stats_campaign_id'), ['campaign_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('campaign_daily_stats', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_campaign_daily_stats_campaign_id'))
+
+    op.drop_table('campaign_daily_stats')
+    with op.batch_alter_table('email_unique_ips', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_email_unique_ips_email_id'))
+
+    op.drop_table('email_unique_ips')
+    with op.batch_alter_table('email_daily_stats', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_email_daily_stats_email_id'))
+        batch_op.drop_index(batch_op.f('ix_email_daily_stats_day'))
+
+    op.drop_table('email_daily_stats')
@@ -0,0 +1,189 @@
+"""Store tracking event types, devices, user agents and IPs as dimension keys
+
+Revision ID: 6a1f0c3e8b52
+Revises: 3b7e2c9d4f10
+Create Date: 2026-10-19 15:41:07.902113
+
+The backfill walks tracking_events by id in batches of BATCH_SIZE rows, so
+each statement stays small on large tables. Hashes and built-in codes are
+copied from app.dimensions at the time of writing - a migration must not
+change when the application code does.
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a1f0c3e8b52'
+down_revision = '3b7e2c9d4f10'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+EVENT_TYPES = ('open', 'click', 'bounce', 'unsubscribe')
+DEVICE_TYPES = ('desktop', 'mobile', 'tablet', 'unknown')
+
+event_types = sa.table('event_types', sa.column('id', sa.Integer), sa.column('value', sa.String))
+device_types = sa.table('device_types', sa.column('id', sa.Integer), sa.column('value', sa.String))
+user_agents = sa.table('user_agents', sa.column('id', sa.BigInteger), sa.column('value', sa.String))
+ip_addresses = sa.table('ip_addresses', sa.column('id', sa.BigInteger), sa.column('value', sa.String))
+tracking_events = sa.table(
+    'tracking_events',
+    sa.column('id', sa.Integer),
+    sa.column('event_type', sa.String), sa.column('device_type', sa.String),
+    sa.column('user_agent', sa.String), sa.column('ip_address', sa.String),
+    sa.column('event_type_id', sa.SmallInteger), sa.column('device_type_id', sa.SmallInteger),
+    sa.column('user_agent_id', sa.BigInteger), sa.column('ip_address_id', sa.BigInteger),
+)
+
+
+def value_hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def batches(connection, columns):
+    """tracking_events rows (id first) in id order, BATCH_SIZE at a time"""
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(tracking_events.c.id, *columns)
+            .where(tracking_events.c.id > last_id)
+            .order_by(tracking_events.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def code_table(connection, table, builtins, values):
+    """value -> code of a code dimension, adding values beyond the built-ins"""
+    codes = {value: code for code, value in enumerate(builtins, 1)}
+    for value in sorted(values - codes.keys()):
+        codes[value] = len(codes) + 1
+    connection.execute(table.insert(), [{'id': code, 'value': value} for value, code in codes.items()])
+    return codes
+
+
+def upgrade():
+    op.create_table('event_types',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('value', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('value')
+    )
+    op.create_table('device_types',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('value', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('value')
+    )
+    op.create_table('user_agents',
+    sa.Column('id', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('value', sa.String(length=500), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('ip_addresses',
+    sa.Column('id', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('value', sa.String(length=45), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tracking_events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('event_type_id', sa.SmallInteger(), nullable=True))
+        batch_op.add_column(sa.Column('device_type_id', sa.SmallInteger(), nullable=True))
+        batch_op.add_column(sa.Column('user_agent_id', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('ip_address_id', sa.BigInteger(), nullable=True))
+
+    connection = op.get_bind()
+    te = tracking_events.c
+    event_codes = code_table(connection, event_types, EVENT_TYPES, set(
+        connection.execute(sa.select(te.event_type).distinct()).scalars()))
+    device_codes = code_table(connection, device_types, DEVICE_TYPES, set(
+        connection.execute(sa.select(te.device_type).where(te.device_type.isnot(None)).distinct()).scalars()))
+
+    seen_agents, seen_ips = set(), set()
+    update = tracking_events.update().where(te.id == sa.bindparam('row_id')).values(
+        event_type_id=sa.bindparam('event_type_key'), device_type_id=sa.bindparam('device_type_key'),
+        user_agent_id=sa.bindparam('user_agent_key'), ip_address_id=sa.bindparam('ip_address_key'))
+
+    for rows in batches(connection, (te.event_type, te.device_type, te.user_agent, te.ip_address)):
+        new_agents, new_ips, keys = {}, {}, []
+        for row_id, event_type, device_type, user_agent, ip_address in rows:
+            user_agent_key = value_hash(user_agent) if user_agent is not None else None
+            ip_address_key = value_hash(ip_address) if ip_address is not None else None
+            if user_agent_key is not None and user_agent_key not in seen_agents:
+                new_agents[user_agent_key] = user_agent
+            if ip_address_key is not None and ip_address_key not in seen_ips:
+                new_ips[ip_address_key] = ip_address
+            keys.append({'row_id': row_id, 'event_type_key': event_codes[event_type],
+                         'device_type_key': device_codes.get(device_type),
+                         'user_agent_key': user_agent_key, 'ip_address_key': ip_address_key})
+
+        for table, new, seen in ((user_agents, new_agents, seen_agents), (ip_addresses, new_ips, seen_ips)):
+            if new:
+                connection.execute(table.insert(), [{'id': key, 'value': value} for key, value in new.items()])
+                seen.update(new)
+        connection.execute(update, keys)
+
+    with op.batch_alter_table('tracking_events', schema=None) as batch_op:
+        batch_op.alter_column('event_type_id', existing_type=sa.SmallInteger(), nullable=False)
+        batch_op.create_foreign_key(batch_op.f('fk_tracking_events_event_type_id_event_types'),
+                                    'event_types', ['event_type_id'], ['id'])
+        batch_op.create_foreign_key(batch_op.f('fk_tracking_events_device_type_id_device_types'),
+                                    'device_types', ['device_type_id'], ['id'])
+        batch_op.create_foreign_key(batch_op.f('fk_tracking_events_user_agent_id_user_agents'),
+                                    'user_agents', ['user_agent_id'], ['id'])
+        batch_op.create_foreign_key(batch_op.f('fk_tracking_events_ip_address_id_ip_addresses'),
+                                    'ip_addresses', ['ip_address_id'], ['id'])
+        batch_op.drop_column('event_type')
+        batch_op.drop_column('device_type')
+        batch_op.drop_column('user_agent')
+        batch_op.drop_column('ip_address')
+
+
+def downgrade():
+    with op.batch_alter_table('tracking_events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('event_type', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('device_type', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('user_agent', sa.String(length=500), nullable=True))
+        batch_op.add_column(sa.Column('ip_address', sa.String(length=45), nullable=True))
+
+    # Decode in the same batches (the dimension tables are small enough to hold)
+    connection = op.get_bind()
+    te = tracking_events.c
+    values = {table.name: dict(connection.execute(sa.select(table.c.id, table.c.value)).all())
+              for table in (event_types, device_types, user_agents, ip_addresses)}
+    update = tracking_events.update().where(te.id == sa.bindparam('row_id')).values(
+        event_type=sa.bindparam('event_type_value'), device_type=sa.bindparam('device_type_value'),
+        user_agent=sa.bindparam('user_agent_value'), ip_address=sa.bindparam('ip_address_value'))
+
+    for rows in batches(connection, (te.event_type_id, te.device_type_id, te.user_agent_id, te.ip_address_id)):
+        connection.execute(update, [
+            {'row_id': row_id,
+             'event_type_value': values['event_types'][event_type_id],
+             'device_type_value': values['device_types'].get(device_type_id),
+             'user_agent_value': values['user_agents'].get(user_agent_id),
+             'ip_address_value': values['ip_addresses'].get(ip_address_id)}
+            for row_id, event_type_id, device_type_id, user_agent_id, ip_address_id in rows
+        ])
+
+    with op.batch_alter_table('tracking_events', schema=None) as batch_op:
+        batch_op.alter_column('event_type', existing_type=sa.String(length=50), nullable=False)
+        batch_op.drop_constraint(batch_op.f('fk_tracking_events_ip_address_id_ip_addresses'), type_='foreignkey')
+        batch_op.drop_constraint(batch_op.f('fk_tracking_events_user_agent_id_user_agents'), type_='foreignkey')
+        batch_op.drop_constraint(batch_op.f('fk_tracking_events_device_type_id_device_types'), type_='foreignkey')
+        batch_op.drop_constraint(batch_op.f('fk_tracking_events_event_type_id_event_types'), type_='foreignkey')
+        batch_op.drop_column('ip_address_id')
+        batch_op.drop_column('user_agent_id')
+        batch_op.drop_column('device_type_id')
+        batch_op.drop_column('event_type_id')
+
+    op.drop_table('ip_addresses')
+    op.drop_table('user_agents')
+    op.drop_table('device_types')
+    op.drop_table('event_types')
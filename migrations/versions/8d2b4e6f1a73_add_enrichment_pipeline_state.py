@@ -0,0 +1,58 @@
+"""Add enrichment columns to user agents and IPs, and the enrichment high-water mark
+
+Revision ID: 8d2b4e6f1a73
+Revises: 6a1f0c3e8b52
+Create Date: 2026-10-19 17:05:32.481290
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2b4e6f1a73'
+down_revision = '6a1f0c3e8b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('enrichment_state',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('high_water_mark', sa.BigInteger(), nullable=False),
+    sa.Column('generation', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    with op.batch_alter_table('user_agents', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('device_type_id', sa.SmallInteger(), nullable=True))
+        batch_op.add_column(sa.Column('browser', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('os', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('is_bot', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('enriched_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_user_agents_enriched_at'), ['enriched_at'], unique=False)
+        batch_op.create_foreign_key(batch_op.f('fk_user_agents_device_type_id_device_types'),
+                                    'device_types', ['device_type_id'], ['id'])
+
+    with op.batch_alter_table('ip_addresses', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('location', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('enriched_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_ip_addresses_enriched_at'), ['enriched_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ip_addresses', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ip_addresses_enriched_at'))
+        batch_op.drop_column('enriched_at')
+        batch_op.drop_column('location')
+
+    with op.batch_alter_table('user_agents', schema=None) as batch_op:
+        batch_op.drop_constraint(batch_op.f('fk_user_agents_device_type_id_device_types'), type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_user_agents_enriched_at'))
+        batch_op.drop_column('enriched_at')
+        batch_op.drop_column('is_bot')
+        batch_op.drop_column('os')
+        batch_op.drop_column('browser')
+        batch_op.drop_column('device_type_id')
+
+    op.drop_table('enrichment_state')
@@ -0,0 +1,42 @@
+"""Add templates and emails.template_id
+
+The Template model and Email.template_id predate this migration; databases
+built with `flask db upgrade` never had them.
+
+Revision ID: b1e4f7a2c8d5
+Revises: d6c1f8a3e5b7
+Create Date: 2026-10-20 03:12:48.207316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1e4f7a2c8d5'
+down_revision = 'd6c1f8a3e5b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('templates',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('subject', sa.String(length=500), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('emails', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('template_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_emails_template_id_templates', 'templates', ['template_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('emails', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_emails_template_id_templates', type_='foreignkey')
+        batch_op.drop_column('template_id')
+
+    op.drop_table('templates')
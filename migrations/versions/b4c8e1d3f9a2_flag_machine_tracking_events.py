@@ -0,0 +1,35 @@
+"""Add tracking_events.machine_reason and the machine share of compacted events
+
+Revision ID: b4c8e1d3f9a2
+Revises: 8d2b4e6f1a73
+Create Date: 2026-10-19 18:42:10.517304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4c8e1d3f9a2'
+down_revision = '8d2b4e6f1a73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing events predate classification and stay human (0)
+    with op.batch_alter_table('tracking_events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('machine_reason', sa.SmallInteger(), server_default='0', nullable=False))
+        batch_op.create_index(batch_op.f('ix_tracking_events_machine_reason'), ['machine_reason'], unique=False)
+
+    with op.batch_alter_table('email_daily_stats', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('machine_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('email_daily_stats', schema=None) as batch_op:
+        batch_op.drop_column('machine_count')
+
+    with op.batch_alter_table('tracking_events', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tracking_events_machine_reason'))
+        batch_op.drop_column('machine_reason')
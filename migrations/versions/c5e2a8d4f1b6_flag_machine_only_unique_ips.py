@@ -0,0 +1,27 @@
+"""Add email_unique_ips.machine_only
+
+Revision ID: c5e2a8d4f1b6
+Revises: b1e4f7a2c8d5
+Create Date: 2026-10-20 09:26:31.804175
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e2a8d4f1b6'
+down_revision = 'b1e4f7a2c8d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows can't be told apart any more and stay human, like unclassified events
+    with op.batch_alter_table('email_unique_ips', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('machine_only', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('email_unique_ips', schema=None) as batch_op:
+        batch_op.drop_column('machine_only')
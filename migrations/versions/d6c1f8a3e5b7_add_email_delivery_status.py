@@ -0,0 +1,32 @@
+"""Add delivery_status, delivery_result and message_id to emails for the send engine
+
+Revision ID: d6c1f8a3e5b7
+Revises: a9d3e5f7b2c4
+Create Date: 2026-10-20 00:41:17.560914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6c1f8a3e5b7'
+down_revision = 'a9d3e5f7b2c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('emails', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('delivery_status', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('delivery_result', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('message_id', sa.String(length=255), nullable=True))
+        batch_op.create_index(batch_op.f('ix_emails_delivery_status'), ['delivery_status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('emails', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_emails_delivery_status'))
+        batch_op.drop_column('message_id')
+        batch_op.drop_column('delivery_result')
+        batch_op.drop_column('delivery_status')
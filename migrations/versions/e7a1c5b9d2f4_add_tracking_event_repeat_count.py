@@ -0,0 +1,27 @@
+"""Add tracking_events.repeat_count for collapsed repeat opens
+
+Revision ID: e7a1c5b9d2f4
+Revises: b4c8e1d3f9a2
+Create Date: 2026-10-19 20:11:47.903518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a1c5b9d2f4'
+down_revision = 'b4c8e1d3f9a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tracking_events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('repeat_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    # Collapsed repeats are lost - each row counts as one open again
+    with op.batch_alter_table('tracking_events', schema=None) as batch_op:
+        batch_op.drop_column('repeat_count')
@@ -0,0 +1,32 @@
+"""Add heavy_hitter_sketches for top links, domains, IPs and user agents
+
+Revision ID: f2b7d4a9c6e3
+Revises: c3f8a2d6e9b1
+Create Date: 2026-10-19 21:48:09.125704
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b7d4a9c6e3'
+down_revision = 'c3f8a2d6e9b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('heavy_hitter_sketches',
+    sa.Column('dimension', sa.String(length=20), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('total', sa.BigInteger(), nullable=False),
+    sa.Column('floor', sa.BigInteger(), nullable=False),
+    sa.Column('entries', sa.Text(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('dimension', 'campaign_id')
+    )
+
+
+def downgrade():
+    op.drop_table('heavy_hitter_sketches')
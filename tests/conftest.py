@@ -8,10 +8,11 @@ available to all test files in the tests/ directory.
 import pytest
 from app import create_app, db
 from app.models import Email, Campaign, TrackingEvent
+from config import TestingConfig
 
 
 @pytest.fixture
-def app():
+def app(app_factory):
     """
     Create and configure a test Flask app instance
 
@@ -26,15 +27,45 @@ def app():
             with app.app_context():
                 # Do something with app
     """
-    app = create_app()
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    return app_factory()
 
-    with app.app_context():
+
+@pytest.fixture
+def app_factory():
+    """
+    Build test Flask apps with config overrides
+
+    Each call subclasses TestingConfig with the given settings, pushes an
+    app context and creates all tables. When the test ends the tables are
+    dropped and the contexts popped, newest first. A config that fails
+    validation raises from the call, before anything needs cleaning up.
+
+    Usage in tests:
+        def test_something(app_factory):
+            app = app_factory(TRACKING_COLLAPSE_SECONDS=300)
+            # Do something with app, inside its context
+    """
+    contexts = []
+
+    def make_app(**settings):
+        app = create_app(type('OverrideConfig', (TestingConfig,), settings))
+        context = app.app_context()
+        context.push()
+        contexts.append(context)
         db.create_all()
-        yield app
+        return app
+
+    yield make_app
+
+    for context in reversed(contexts):
         db.session.remove()
-        db.drop_all()
+        # Partitioned apps write to a file under tmp_path, where tracking_events
+        # is a view drop_all can't drop; the file goes with the directory
+        if not context.app.config['TRACKING_PARTITION_PERIOD']:
+            db.drop_all()
+        for engine in db.engines.values():
+            engine.dispose()
+        context.pop()
 
 
 @pytest.fixture
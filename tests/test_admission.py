@@ -0,0 +1,100 @@
+"""
+Tests for per-IP and per-tracking-ID admission control on tracking hits
+"""
+
+import fcntl
+import os
+
+import pytest
+
+from app.admission import BucketTable
+from app.exceptions import ValidationError
+from app.metrics import registry
+from app.models import TrackingEvent
+from app.services.email_service import EmailService
+
+
+@pytest.fixture
+def limited_app(app_factory):
+    return app_factory(TRACKING_IP_RATE=0.001, TRACKING_IP_BURST=3)
+
+
+def pixel(client, email, ip_address='203.0.113.7'):
+    return client.get(f'/track/pixel/{email.tracking_id}.png', environ_base={'REMOTE_ADDR': ip_address})
+
+
+class TestBucketTable:
+    """Test the shared token buckets"""
+
+    def test_refill(self):
+        table = BucketTable(16)
+
+        assert [table.take('a', 1, 2, now=0) for _ in range(3)] == [True, True, False]
+        assert table.take('a', 1, 2, now=0.5) is False
+        assert table.take('a', 1, 2, now=1.1) is True
+        assert table.take('b', 1, 2, now=1.1) is True
+
+    def test_file_shared(self, tmp_path):
+        """Test that tables mapping the same file share buckets, as workers do"""
+        path = str(tmp_path / 'limiter')
+        first, second = BucketTable(16, path), BucketTable(16, path)
+
+        assert first.take('a', 1, 1, now=0) is True
+        assert second.take('a', 1, 1, now=0) is False
+
+    def test_file_lock_excludes_forked_workers(self, tmp_path):
+        """Test that a worker forked with the table open can't lock it while the parent holds it"""
+        table = BucketTable(16, str(tmp_path / 'limiter'))
+
+        with table._lock:
+            pid = os.fork()
+            if pid == 0:  # pragma: no cover - child process
+                try:
+                    fcntl.lockf(table._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os._exit(0)
+                os._exit(1)
+            _, status = os.waitpid(pid, 0)
+
+        assert os.waitstatus_to_exitcode(status) == 0
+
+
+class TestTrackingRoutes:
+    """Test that over-limit hits are answered but not recorded"""
+
+    def test_ip_limit(self, limited_app):
+        registry.reset()
+        client = limited_app.test_client()
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+
+        responses = [pixel(client, email) for _ in range(5)]
+        pixel(client, email, ip_address='198.51.100.4')
+
+        assert [response.status_code for response in responses] == [200] * 5
+        assert TrackingEvent.query.count() == 4
+        rendered = registry.render()
+        assert 'tracking_admissions_total{event_type="open",decision="limited_ip"} 2' in rendered
+        assert 'tracking_events_dropped_total{event_type="open",reason="rate_limited"} 2' in rendered
+
+    def test_tracking_id_limit_click(self, app_factory):
+        app = app_factory(TRACKING_ID_RATE=0.001, TRACKING_ID_BURST=1, TRACKING_FAST_PATH=True)
+        client = app.test_client()
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+
+        responses = [client.get(f'/track/click/{email.tracking_id}?url=https://example.com',
+                                environ_base={'REMOTE_ADDR': ip}) for ip in ('203.0.113.7', '198.51.100.4')]
+
+        assert [response.status_code for response in responses] == [302, 302]
+        assert TrackingEvent.query.count() == 1
+
+    def test_off_by_default(self, app, client):
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        for _ in range(30):
+            pixel(client, email)
+
+        assert app.extensions['admission_control'] is None
+        assert TrackingEvent.query.count() == 30
+
+    def test_invalid_config(self, app_factory):
+        with pytest.raises(ValidationError):
+            app_factory(TRACKING_IP_RATE=5, TRACKING_IP_BURST=0)
@@ -0,0 +1,190 @@
+"""
+Tests for the cold event archive
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app, db
+from app.archive import Segment, event_archive
+from app.exceptions import ValidationError
+from app.models import TrackingEvent
+from app.services.analytics_service import AnalyticsService
+from app.services.archive_service import ArchiveService
+from app.services.email_service import EmailService
+from app.services.retention_service import RetentionService
+from app.services.tracking_service import TrackingService
+from config import TestingConfig
+
+CUTOFF = datetime(2024, 3, 1)
+
+
+@pytest.fixture
+def archive_app(tmp_path):
+    """App with an archive directory"""
+    class ArchiveConfig(TestingConfig):
+        ARCHIVE_DIR = str(tmp_path / 'archive')
+
+    app = create_app(ArchiveConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def emails(archive_app):
+    """Three emails with one event a day through January and February, plus one recent event"""
+    service = EmailService()
+    created = [service.create_email(f'user{i}@example.com', 'sender@example.com') for i in range(3)]
+    for day in range(60):
+        email = created[day % 3]
+        db.session.add(TrackingEvent(email_id=email.id, event_type='click' if day % 4 == 0 else 'open',
+                                     device_type='mobile' if day % 2 else 'desktop',
+                                     ip_address='203.0.113.9', created_at=datetime(2024, 1, 1, 8) + timedelta(days=day)))
+    db.session.add(TrackingEvent(email_id=created[0].id, event_type='open', created_at=CUTOFF + timedelta(days=3)))
+    db.session.commit()
+    return created
+
+
+class TestArchiveService:
+    """Test writing events to the archive"""
+
+    def test_archive_writes_segments(self, emails):
+        """Test that events before the cutoff are written into segments of the given size"""
+        result = ArchiveService().archive(CUTOFF, segment_rows=25)
+
+        assert result == {'events': 60, 'segments': 3, 'archived_before': CUTOFF.isoformat()}
+        assert [meta['rows'] for meta in event_archive.manifest()['segments']] == [25, 25, 10]
+        assert event_archive.archived_before == CUTOFF
+        # Archiving copies - deleting is the retention job's part
+        assert TrackingEvent.query.count() == 61
+
+    def test_archive_resumes(self, emails):
+        """Test that a later run only writes events after the last archived one"""
+        ArchiveService().archive(datetime(2024, 2, 1))
+
+        result = ArchiveService().archive(CUTOFF)
+
+        assert result['events'] == 29
+        assert sum(meta['rows'] for meta in event_archive.manifest()['segments']) == 60
+
+    def test_archive_disabled(self, app):
+        """Test that archiving needs ARCHIVE_DIR"""
+        with pytest.raises(ValidationError):
+            ArchiveService().archive(CUTOFF)
+
+    def test_retention_archives_before_deleting(self, emails):
+        """Test that compaction archives events first"""
+        result = RetentionService().compact(cutoff=CUTOFF)
+
+        assert result['archived']['events'] == 60
+        assert result['events'] == 60
+        assert sum(1 for _ in event_archive.scan()) == 60
+
+
+class TestArchiveReads:
+    """Test reading archived events back"""
+
+    def test_segment_skipping(self, emails):
+        """Test that only segments overlapping the filters are read"""
+        ArchiveService().archive(CUTOFF, segment_rows=20)
+
+        # Segments hold Jan 1-20, Jan 21-Feb 9 and Feb 10-29
+        assert len(event_archive.segments(start=datetime(2024, 1, 15), end=datetime(2024, 1, 25))) == 2
+        assert len(event_archive.segments(start=datetime(2024, 1, 25), end=datetime(2024, 2, 5))) == 1
+        assert len(event_archive.segments(start=datetime(2025, 1, 1))) == 0
+        assert len(event_archive.segments(email_ids={999})) == 0
+
+    def test_events_include_archived(self, archive_app, emails):
+        """Test that an email's archived events can be listed with its hot events"""
+        RetentionService().compact(cutoff=CUTOFF)
+        email = emails[0]
+
+        hot = TrackingService().get_events_for_email(email.id)
+        both = TrackingService().get_events_for_email(email.id, include_archived=True)
+
+        assert len(hot) == 1
+        assert len(both) == 21
+        assert both[0].created_at == datetime(2024, 1, 1, 8)
+
+        response = archive_app.test_client().get(f'/api/emails/{email.id}/events?include_archived=true&event_type=click'
+                              f'&start_date=2024-01-01&end_date=2024-02-01')
+        assert response.status_code == 200
+        assert {event['event_type'] for event in response.get_json()['events']} == {'click'}
+        assert response.get_json()['total'] == 3
+
+    def test_archive_stats(self, archive_app, emails):
+        """Test GET /api/analytics/archive recomputing stats from archived events"""
+        RetentionService().compact(cutoff=CUTOFF)
+
+        response = archive_app.test_client().get('/api/analytics/archive?start_date=2024-01-01&end_date=2024-02-01')
+
+        assert response.status_code == 200
+        stats = response.get_json()
+        assert stats['total_events'] == 31
+        assert stats['events_by_type'] == {'open': 23, 'click': 8}
+        assert stats['unique_emails_by_type']['open'] == 3
+        assert stats['archived_before'] == CUTOFF.isoformat()
+
+        # Archived raw events agree with the compacted aggregates
+        email_stats = AnalyticsService().get_email_stats(emails[1].id)
+        archived = AnalyticsService().get_archive_stats(email_id=emails[1].id)
+        assert archived['events_by_type'].get('open', 0) == email_stats['total_opens']
+
+    def test_repeat_counts(self, emails):
+        """Test that collapsed repeats are archived, and segments written before them read as 0"""
+        TrackingEvent.query.filter(TrackingEvent.id == 1).update({TrackingEvent.repeat_count: 4})
+        db.session.commit()
+        ArchiveService().archive(CUTOFF)
+        segment = Segment(os.path.join(event_archive.directory, event_archive.manifest()['segments'][0]['file']))
+        del segment.header['columns']['repeat_count']
+
+        assert AnalyticsService().get_archive_stats()['total_events'] == 64
+        assert sum(row['repeat_count'] for row in event_archive.scan()) == 4
+        assert set(segment.column('repeat_count')) == {0}
+
+    def test_machine_reasons(self, archive_app, emails):
+        """Test that machine classification survives archiving, and older segments read as human"""
+        TrackingEvent.query.filter(TrackingEvent.id.in_([1, 2])).update({TrackingEvent.machine_reason: 1})
+        db.session.commit()
+        RetentionService().compact(cutoff=CUTOFF)
+        segment = Segment(os.path.join(event_archive.directory, event_archive.manifest()['segments'][0]['file']))
+        del segment.header['columns']['machine_reason']
+
+        response = archive_app.test_client().get('/api/analytics/archive?exclude_machine=true')
+        archived = TrackingService().get_events_for_email(emails[0].id, include_archived=True)
+
+        assert response.get_json()['total_events'] == 58
+        assert AnalyticsService().get_archive_stats()['total_events'] == 60
+        assert archived[0].to_dict()['machine_reason'] == 'proxy_ip'
+        assert set(segment.column('machine_reason')) == {0}
+
+    def test_archive_stats_disabled(self, client):
+        """Test that the archive endpoint reports a missing ARCHIVE_DIR"""
+        response = client.get('/api/analytics/archive')
+
+        assert response.status_code == 400
+
+    def test_cli(self, archive_app, emails, tmp_path):
+        """Test flask archive write/list/export"""
+        runner = archive_app.test_cli_runner()
+
+        result = runner.invoke(args=['archive', 'write', '--before', '2024-03-01', '--segment-rows', '40'])
+        assert result.exit_code == 0, result.output
+        assert 'Archived 60 events in 2 segments' in result.output
+
+        result = runner.invoke(args=['archive', 'list'])
+        assert result.output.count('segment-') == 2
+
+        output = tmp_path / 'export.jsonl'
+        result = runner.invoke(args=['archive', 'export', '--email-id', str(emails[0].id), '--include-hot',
+                                     '--output', str(output)])
+        assert result.exit_code == 0, result.output
+        rows = [json.loads(line) for line in output.read_text().splitlines()]
+        assert len(rows) == 21 + 20  # archived copies and hot rows (nothing compacted yet)
+        assert all(row['email_id'] == emails[0].id for row in rows)
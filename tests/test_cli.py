@@ -33,3 +33,78 @@ class TestCLI:
             assert Email.query.count() == 0  # Should work if table exists
             assert Campaign.query.count() == 0
             assert TrackingEvent.query.count() == 0
+
+
+class TestSeedCommand:
+    """Test the seed CLI command"""
+
+    def seed(self, runner, *args):
+        result = runner.invoke(args=['seed', '--campaigns', '3', '--emails', '50', '--events', '400',
+                                     '--end-date', '2024-01-31', '--batch-size', '64', *args])
+        assert result.exit_code == 0, result.output
+        return result
+
+    def dump(self, app):
+        with app.app_context():
+            return (
+                [(e.tracking_id, e.campaign_id, e.sent_at) for e in Email.query.order_by(Email.id)],
+                [(t.email_id, t.event_type, t.ip_address, t.user_agent, t.clicked_url, t.created_at)
+                 for t in TrackingEvent.query.order_by(TrackingEvent.id)],
+            )
+
+    def test_seed_row_counts(self, runner, app):
+        """Test that the requested number of rows is inserted"""
+        result = self.seed(runner)
+
+        assert 'Seeded 3 campaigns, 50 emails, 400 events' in result.output
+        with app.app_context():
+            assert Campaign.query.count() == 3
+            assert Email.query.count() == 50
+            assert TrackingEvent.query.count() == 400
+
+    def test_seed_is_reproducible(self, runner, app):
+        """Test that the same seed produces identical rows"""
+        self.seed(runner, '--seed', '7')
+        first = self.dump(app)
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        self.seed(runner, '--seed', '7')
+
+        assert self.dump(app) == first
+
+    def test_different_seed_differs(self, runner, app):
+        """Test that a different seed produces different rows"""
+        self.seed(runner, '--seed', '1')
+        first = self.dump(app)
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        self.seed(runner, '--seed', '2')
+
+        assert self.dump(app) != first
+
+    def test_seed_distributions(self, runner, app):
+        """Test event shape: after sent_at, click URLs set, opens skewed"""
+        self.seed(runner, '--open-rate', '0.5', '--click-ratio', '0.25')
+        emails, events = self.dump(app)
+        sent_at = {i + 1: email[2] for i, email in enumerate(emails)}
+
+        assert all(created_at >= sent_at[email_id] for email_id, *_, created_at in events)
+        assert all((event_type == 'click') == (url is not None)
+                   for _, event_type, _, _, url, _ in events)
+        assert 0 < sum(1 for event in events if event[1] == 'click') < len(events)
+
+        opened = {event[0] for event in events}
+        assert len(opened) < len(emails)
+
+    def test_seed_appends_to_existing_data(self, runner, app):
+        """Test that seeding twice appends instead of colliding on ids"""
+        self.seed(runner)
+        self.seed(runner, '--seed', '3')
+
+        with app.app_context():
+            assert Email.query.count() == 100
+            assert TrackingEvent.query.count() == 800
@@ -0,0 +1,275 @@
+"""
+Tests for the optional NumPy columnar analytics engine
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from app import create_app, db
+from app.columnar import columnar_events
+from app.exceptions import ValidationError
+from app.models import Campaign, TrackingEvent
+from app.services.analytics_service import AnalyticsService
+from app.services.email_service import EmailService
+from app.services.retention_service import RetentionService
+from config import TestingConfig
+
+START = datetime(2024, 1, 1, 8)
+
+
+@pytest.fixture
+def columnar_app():
+    """App using the columnar engine, refreshing on every use"""
+    class ColumnarConfig(TestingConfig):
+        ANALYTICS_ENGINE = 'columnar'
+        COLUMNAR_REFRESH_SECONDS = 0
+
+    app = create_app(ColumnarConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def emails(columnar_app):
+    """A campaign of three emails with a month of mixed events, plus one email outside it"""
+    campaign = Campaign(name='Launch')
+    db.session.add(campaign)
+    db.session.commit()
+
+    service = EmailService()
+    created = [service.create_email(f'user{i}@example.com', 'sender@example.com', campaign_id=campaign.id)
+               for i in range(3)]
+    created.append(service.create_email('other@example.com', 'sender@example.com'))
+    for day in range(40):
+        email = created[day % 4]
+        event_type = ('open', 'open', 'click', 'bounce')[day % 4 if day % 5 else 0]
+        db.session.add(TrackingEvent(
+            email_id=email.id, event_type=event_type,
+            device_type=(None, 'desktop', 'mobile')[day % 3],
+            ip_address=f'203.0.113.{day % 6}' if day % 7 else None,
+            created_at=START + timedelta(days=day, hours=day % 5)))
+    db.session.commit()
+    return campaign, created
+
+
+def snapshot(campaign, emails):
+    """Email, campaign and global stats with the current engine"""
+    analytics = AnalyticsService()
+    return {
+        'emails': [analytics.get_email_stats(email.id) for email in emails],
+        'campaign': analytics.get_campaign_stats(campaign.id),
+        'global': analytics.get_global_stats(),
+        'global_range': analytics.get_global_stats(start_date=datetime(2024, 1, 10),
+                                                   end_date=datetime(2024, 1, 25)),
+    }
+
+
+def both_engines(app, campaign, emails):
+    """Snapshots with the SQL engine, then with the columnar engine"""
+    app.config['ANALYTICS_ENGINE'] = 'sql'
+    expected = snapshot(campaign, emails)
+    app.config['ANALYTICS_ENGINE'] = 'columnar'
+    return expected, snapshot(campaign, emails)
+
+
+class TestColumnarEngine:
+    """Test that the columnar engine reports what the SQL engine does"""
+
+    def test_matches_sql(self, columnar_app, emails):
+        """Test email, campaign and global stats against the SQL engine"""
+        campaign, created = emails
+
+        expected, actual = both_engines(columnar_app, campaign, created)
+
+        assert actual == expected
+        assert actual['global']['total_events'] == 40
+
+    def test_matches_sql_after_compaction(self, columnar_app, emails):
+        """Test that compacted aggregates are merged the same way"""
+        campaign, created = emails
+        RetentionService().compact(cutoff=datetime(2024, 1, 20))
+
+        expected, actual = both_engines(columnar_app, campaign, created)
+
+        assert actual == expected
+        assert actual['global']['total_events'] == 40
+
+    def test_refresh_appends_new_events(self, columnar_app, emails):
+        """Test that events above the watermark are appended to the existing store"""
+        _, created = emails
+        store = columnar_events.store(db.session)
+
+        db.session.add(TrackingEvent(email_id=created[0].id, event_type='open', created_at=datetime(2024, 3, 1)))
+        db.session.commit()
+
+        assert columnar_events.store(db.session) is store
+        assert store.size == 41
+        assert AnalyticsService().get_global_stats()['total_events'] == 41
+
+    def test_refresh_reloads_after_delete(self, columnar_app, emails):
+        """Test that deleted rows trigger a full reload"""
+        _, created = emails
+        store = columnar_events.store(db.session)
+
+        EmailService().delete_email(created[0].id)
+
+        reloaded = columnar_events.store(db.session)
+        assert reloaded is not store
+        assert reloaded.size == TrackingEvent.query.count()
+
+    def test_refresh_reloads_after_compaction(self, columnar_app, emails):
+        """Test that retention bumps the generation the store was loaded at"""
+        campaign, created = emails
+        store = columnar_events.store(db.session)
+
+        RetentionService().compact(cutoff=datetime(2024, 1, 20))
+
+        reloaded = columnar_events.store(db.session)
+        assert reloaded is not store
+        assert reloaded.size == TrackingEvent.query.count() < 40
+
+    def test_refresh_reloads_after_late_commit(self, columnar_app, emails):
+        """Test that a recent row appearing below the watermark triggers a reload"""
+        _, created = emails
+        for event_type in ('open', 'click'):
+            db.session.add(TrackingEvent(email_id=created[0].id, event_type=event_type))
+        db.session.commit()
+        late = TrackingEvent.query.filter_by(event_type='open').order_by(TrackingEvent.id.desc()).first().id
+        db.session.execute(TrackingEvent.__table__.delete().where(TrackingEvent.id == late))
+        db.session.commit()
+        store = columnar_events.store(db.session)
+
+        # Another transaction's row commits with the lower id only now
+        db.session.add(TrackingEvent(id=late, email_id=created[0].id, event_type='open'))
+        db.session.commit()
+
+        reloaded = columnar_events.store(db.session)
+        assert reloaded is not store
+        assert reloaded.size == store.size + 1
+
+    def test_refresh_interval(self, columnar_app, emails):
+        """Test that the store is not refreshed again within COLUMNAR_REFRESH_SECONDS"""
+        _, created = emails
+        columnar_app.config['COLUMNAR_REFRESH_SECONDS'] = 3600
+        store = columnar_events.store(db.session)
+
+        db.session.add(TrackingEvent(email_id=created[0].id, event_type='open'))
+        db.session.commit()
+
+        assert columnar_events.store(db.session).size == store.size == 40
+        columnar_events.invalidate()
+        assert columnar_events.store(db.session).size == 41
+
+    def test_many_event_types(self, columnar_app, emails):
+        """Test that event type codes widen past 255 distinct types"""
+        _, created = emails
+        db.session.add_all(TrackingEvent(email_id=created[0].id, event_type=f'custom_{i}') for i in range(300))
+        db.session.add(TrackingEvent(email_id=created[0].id, event_type='open'))
+        db.session.commit()
+
+        store = columnar_events.store(db.session)
+
+        assert store.event.values.dtype == np.uint16
+        assert AnalyticsService().get_global_stats()['total_events'] == 341
+        assert AnalyticsService().get_email_stats(created[0].id)['total_opens'] == \
+            TrackingEvent.query.filter_by(email_id=created[0].id, event_type='open').count()
+
+
+class TestColumnarEnrichment:
+    """Test that the column store follows background enrichment"""
+
+    def test_devices_filled_in_after_load(self, columnar_app):
+        """Test that loaded rows get their device once the pipeline passes them, and rerun reloads"""
+        from app.services.enrichment_service import EnrichmentService
+        from app.services.tracking_service import TrackingService
+
+        columnar_app.config['TRACKING_ENRICHMENT'] = 'background'
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        TrackingService().record_open(email.tracking_id, user_agent='Mozilla/5.0 (iPhone; CPU iPhone OS 17_1)')
+        assert AnalyticsService().get_global_stats()['device_breakdown'] == {}
+        store = columnar_events.store(db.session)
+
+        EnrichmentService().run()
+
+        assert AnalyticsService().get_global_stats()['device_breakdown'] == {'mobile': 1}
+        assert columnar_events.store(db.session) is store
+        EnrichmentService().rerun()
+        assert columnar_events.store(db.session) is not store
+
+
+class TestColumnarMachineEvents:
+    """Test machine event exclusion in the column store"""
+
+    def test_matches_sql_engine(self, columnar_app, emails):
+        """Test that exclude_machine gives the same stats as the SQL engine"""
+        campaign, created = emails
+        TrackingEvent.query.filter(TrackingEvent.id % 3 == 0).update({TrackingEvent.machine_reason: 1})
+        db.session.commit()
+
+        columnar = AnalyticsService().get_campaign_stats(campaign.id, exclude_machine=True)
+        columnar_global = AnalyticsService().get_global_stats(exclude_machine=True)
+        columnar_app.config['ANALYTICS_ENGINE'] = 'sql'
+
+        assert columnar == AnalyticsService().get_campaign_stats(campaign.id, exclude_machine=True)
+        assert columnar_global == AnalyticsService().get_global_stats(exclude_machine=True)
+        assert columnar['total_opens'] < AnalyticsService().get_campaign_stats(campaign.id)['total_opens']
+
+    def test_burst_flags_loaded_clicks(self, columnar_app):
+        """Test that a refresh picks up clicks a burst flagged after they were loaded"""
+        from app.services.tracking_service import TrackingService
+
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        email.sent_at = datetime(2024, 1, 1)
+        db.session.commit()
+        service = TrackingService()
+        for url in ('https://example.com/a', 'https://example.com/b'):
+            service.record_click(email.tracking_id, url)
+        assert AnalyticsService().get_email_stats(email.id, exclude_machine=True)['total_clicks'] == 2
+
+        service.record_click(email.tracking_id, 'https://example.com/c')
+
+        assert AnalyticsService().get_email_stats(email.id, exclude_machine=True)['total_clicks'] == 0
+
+
+class TestColumnarRepeatOpens:
+    """Test collapsed repeat opens in the column store"""
+
+    def test_repeats_after_load(self, columnar_app):
+        """Test that a refresh picks up repeats added to a loaded open"""
+        from app.services.tracking_service import TrackingService
+
+        columnar_app.config['TRACKING_COLLAPSE_SECONDS'] = 300
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        service = TrackingService()
+        service.record_open(email.tracking_id, ip_address='203.0.113.7', user_agent='Mozilla/5.0 (X11; Linux)')
+        assert AnalyticsService().get_global_stats()['total_opens'] == 1
+
+        for _ in range(2):
+            service.record_open(email.tracking_id, ip_address='203.0.113.7', user_agent='Mozilla/5.0 (X11; Linux)')
+
+        stats = AnalyticsService().get_email_stats(email.id)
+        assert (stats['total_opens'], stats['device_breakdown']) == (3, {'desktop': 3})
+        assert TrackingEvent.query.count() == 1
+
+
+class TestEngineConfig:
+    """Test ANALYTICS_ENGINE validation"""
+
+    def test_unknown_engine(self):
+        """Test that an unknown engine is rejected at startup"""
+        class BadConfig(TestingConfig):
+            ANALYTICS_ENGINE = 'duckdb'
+
+        with pytest.raises(ValidationError):
+            create_app(BadConfig)
+
+    def test_sql_is_default(self, app):
+        """Test that the testing app uses the SQL engine"""
+        assert app.config['ANALYTICS_ENGINE'] == 'sql'
+        assert not columnar_events.enabled
@@ -0,0 +1,74 @@
+"""
+Tests for configuration profiles and database engine setup
+"""
+
+import pytest
+from app import create_app, db
+from app.database import get_sqlite_pragmas
+from config import (
+    get_config, DevelopmentConfig, TestingConfig,
+    ProductionSQLiteConfig, ProductionServerConfig
+)
+
+
+class TestConfigProfiles:
+    """Test profile selection"""
+
+    def test_default_profile_is_development(self, monkeypatch):
+        """Test that development is used when FLASK_CONFIG is unset"""
+        monkeypatch.delenv('FLASK_CONFIG', raising=False)
+        assert get_config() is DevelopmentConfig
+
+    def test_profile_from_env(self, monkeypatch):
+        """Test that FLASK_CONFIG selects the profile"""
+        monkeypatch.setenv('FLASK_CONFIG', 'production_sqlite')
+        assert get_config() is ProductionSQLiteConfig
+
+    def test_explicit_profile_overrides_env(self, monkeypatch):
+        """Test that an explicit profile name wins over the environment"""
+        monkeypatch.setenv('FLASK_CONFIG', 'production')
+        assert get_config('testing') is TestingConfig
+
+    def test_unknown_profile(self):
+        """Test that an unknown profile name is rejected"""
+        with pytest.raises(ValueError):
+            get_config('staging')
+
+    def test_server_profile_pool_options(self):
+        """Test that the server profile configures the connection pool"""
+        options = ProductionServerConfig.SQLALCHEMY_ENGINE_OPTIONS
+        assert options['pool_pre_ping'] is True
+        assert options['pool_size'] > 0
+        assert options['pool_recycle'] > 0
+
+
+class TestSQLitePragmas:
+    """Test that SQLite pragmas are applied on connect"""
+
+    def test_production_sqlite_pragmas_applied(self, tmp_path):
+        """Test WAL, synchronous and busy_timeout on a production SQLite engine"""
+        class BenchConfig(ProductionSQLiteConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'prod.db')
+
+        app = create_app(BenchConfig)
+
+        with app.app_context():
+            with db.engine.connect() as connection:
+                pragmas = get_sqlite_pragmas(connection, ['journal_mode', 'synchronous', 'busy_timeout'])
+
+        assert pragmas['journal_mode'] == 'wal'
+        assert pragmas['synchronous'] == 1  # NORMAL
+        assert pragmas['busy_timeout'] == 5000
+
+    def test_development_uses_sqlite_defaults(self, tmp_path):
+        """Test that the development profile leaves the journal mode alone"""
+        class DevConfig(DevelopmentConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'dev.db')
+
+        app = create_app(DevConfig)
+
+        with app.app_context():
+            with db.engine.connect() as connection:
+                pragmas = get_sqlite_pragmas(connection, ['journal_mode'])
+
+        assert pragmas['journal_mode'] == 'delete'
@@ -0,0 +1,147 @@
+"""
+Tests for read/write session routing between the primary and a replica
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from app import create_app, db, session_router
+from app.db_routing import read_session
+from app.dimensions import EVENT_TYPE
+from app.exceptions import DatabaseError
+from app.models import Email, Campaign, TrackingEvent
+from app.services.analytics_service import AnalyticsService
+from app.services.email_service import EmailService
+from app.services.tracking_service import TrackingService
+from config import TestingConfig
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    """App with separate primary and replica SQLite files (no replication between them)"""
+    class ReplicaConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'primary.db')
+        SQLALCHEMY_REPLICA_URI = 'sqlite:///' + str(tmp_path / 'replica.db')
+        REPLICA_READ_AFTER_WRITE_SECONDS = 0
+        REPLICA_LAG_CHECK_INTERVAL = 0
+
+    app = create_app(ReplicaConfig)
+
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(session_router.replica_engine)
+
+    yield app
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+        session_router.replica_engine.dispose()
+
+
+def add_email(engine, tracking_id, campaign_id=None):
+    """Insert an email directly on one engine, bypassing the session router"""
+    with engine.begin() as connection:
+        now = datetime.utcnow()
+        result = connection.execute(Email.__table__.insert().values(
+            tracking_id=tracking_id,
+            recipient_email='user@example.com',
+            sender_email='sender@example.com',
+            campaign_id=campaign_id,
+            sent_at=now,
+            created_at=now
+        ))
+        return result.inserted_primary_key[0]
+
+
+def add_event(engine, email_id, age_seconds=0):
+    """Insert an open event directly on one engine"""
+    with engine.begin() as connection:
+        connection.execute(TrackingEvent.__table__.insert().values(
+            email_id=email_id,
+            event_type_id=EVENT_TYPE.static_key('open'),
+            created_at=datetime.utcnow() - timedelta(seconds=age_seconds)
+        ))
+
+
+class TestSessionRouting:
+    """Test which engine read-only service paths use"""
+
+    def test_no_replica_reads_primary(self, app):
+        """Test that reads use db.session when no replica is configured"""
+        assert session_router.read_session() is db.session
+
+    def test_list_reads_go_to_replica(self, replica_app):
+        """Test that list_emails reads from the replica"""
+        with replica_app.app_context():
+            add_email(db.engines[None], 'primary-only')
+            add_email(session_router.replica_engine, 'replica-only')
+
+        with replica_app.app_context():
+            emails, total = EmailService().list_emails()
+            assert [e.tracking_id for e in emails] == ['replica-only']
+            assert total == 1
+
+    def test_analytics_reads_go_to_replica(self, replica_app):
+        """Test that AnalyticsService queries the replica"""
+        with replica_app.app_context():
+            add_email(session_router.replica_engine, 'replica-1')
+            add_email(session_router.replica_engine, 'replica-2')
+
+        with replica_app.app_context():
+            assert AnalyticsService().get_global_stats()['total_emails'] == 2
+
+    def test_read_your_writes_in_same_context(self, replica_app):
+        """Test that reads fall back to the primary after a commit in the same context"""
+        with replica_app.app_context():
+            email = EmailService().create_email('user@example.com', 'sender@example.com')
+
+            emails, total = EmailService().list_emails()
+            assert total == 1
+            assert emails[0].id == email.id
+
+    def test_api_write_pins_reads_to_primary(self, replica_app):
+        """Test that later requests read the primary during the read-after-write window"""
+        replica_app.config['REPLICA_READ_AFTER_WRITE_SECONDS'] = 60
+
+        with replica_app.app_context():
+            EmailService().create_email('user@example.com', 'sender@example.com')
+
+        with replica_app.app_context():
+            assert read_session.get_bind() is db.engines[None]
+
+    def test_ingest_write_does_not_pin_reads(self, replica_app):
+        """Test that tracking ingest commits do not send later requests to the primary"""
+        replica_app.config['REPLICA_READ_AFTER_WRITE_SECONDS'] = 60
+        replica_app.config['REPLICA_MAX_LAG_SECONDS'] = 3600
+
+        with replica_app.app_context():
+            add_email(db.engines[None], 'abc123')
+            replica_email_id = add_email(session_router.replica_engine, 'abc123')
+            TrackingService().record_open('abc123', ip_address='1.2.3.4')
+            # Replica has caught up with the open
+            add_event(session_router.replica_engine, replica_email_id)
+
+        with replica_app.app_context():
+            assert read_session.get_bind() is session_router.replica_engine
+
+    def test_lagging_replica_falls_back_to_primary(self, replica_app):
+        """Test that reads go to the primary while the replica is too far behind"""
+        replica_app.config['REPLICA_MAX_LAG_SECONDS'] = 60
+
+        with replica_app.app_context():
+            for engine, age in [(db.engines[None], 0), (session_router.replica_engine, 600)]:
+                add_event(engine, add_email(engine, 'abc123'), age_seconds=age)
+
+        with replica_app.app_context():
+            assert session_router.replica_lag() > 500
+            assert read_session.get_bind() is db.engines[None]
+
+    def test_replica_session_is_read_only(self, replica_app):
+        """Test that flushing changes through the replica session fails"""
+        with replica_app.app_context():
+            session = session_router.read_session()
+            session.add(Campaign(name='Nope'))
+
+            with pytest.raises(DatabaseError):
+                session.flush()
@@ -0,0 +1,183 @@
+"""
+Tests for the compact encoding of tracking event attributes
+"""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from app import create_app, db
+from app.dimensions import EVENT_TYPE, DEVICE_TYPE, USER_AGENT, event_dimensions, value_hash
+from app.models import Email, EventType, IpAddress, TrackingEvent, UserAgent
+from app.partitions import event_partitions
+from app.query_stats import count_queries
+from app.services.email_service import EmailService
+from app.services.tracking_service import TrackingService
+from config import TestingConfig
+
+CHROME = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+
+
+@pytest.fixture
+def email(app):
+    return EmailService().create_email('user@example.com', 'sender@example.com', subject='Hi')
+
+
+def stored(event_id):
+    """Raw key columns of a tracking_events row"""
+    table = TrackingEvent.__table__
+    return db.session.execute(select(table.c.event_type_id, table.c.device_type_id, table.c.user_agent_id,
+                                     table.c.ip_address_id).where(table.c.id == event_id)).one()
+
+
+class TestEncoding:
+    """Test how events are written"""
+
+    def test_builtin_codes_and_hashes(self, email):
+        """Test that built-in types store fixed codes and UA/IP store their hash"""
+        event = TrackingService().record_open(email.tracking_id, ip_address='203.0.113.7', user_agent=CHROME)
+
+        assert tuple(stored(event.id)) == (EVENT_TYPE.static_key('open'), DEVICE_TYPE.static_key('desktop'),
+                                           value_hash(CHROME), value_hash('203.0.113.7'))
+        assert db.session.get(UserAgent, value_hash(CHROME)).value == CHROME
+        assert db.session.get(IpAddress, value_hash('203.0.113.7')).value == '203.0.113.7'
+
+    def test_reads_decode(self, email):
+        """Test that attributes and to_dict() return strings"""
+        event_id = TrackingService().record_open(email.tracking_id, ip_address='203.0.113.7', user_agent=CHROME).id
+        db.session.expunge_all()
+
+        event = db.session.get(TrackingEvent, event_id)
+
+        assert (event.event_type, event.device_type, event.user_agent, event.ip_address) == \
+            ('open', 'desktop', CHROME, '203.0.113.7')
+        assert event.to_dict()['user_agent'] == CHROME
+
+    def test_custom_event_type(self, email):
+        """Test that unknown event types get the next code on first use"""
+        db.session.add_all([TrackingEvent(email_id=email.id, event_type='spam_report'),
+                            TrackingEvent(email_id=email.id, event_type='spam_report')])
+        db.session.commit()
+
+        code = db.session.query(EventType.id).filter_by(value='spam_report').scalar()
+        assert code == len(EVENT_TYPE.builtins) + 1
+        assert db.session.query(TrackingEvent.event_type_id).distinct().all() == [(code,)]
+        assert TrackingEvent.query.filter_by(event_type='spam_report').count() == 2
+
+    def test_repeated_values_stored_once(self, email):
+        """Test that dimension rows are shared between events"""
+        for _ in range(3):
+            TrackingService().record_open(email.tracking_id, ip_address='203.0.113.7', user_agent=CHROME)
+
+        assert UserAgent.query.count() == IpAddress.query.count() == 1
+
+
+class TestInternCache:
+    """Test the dictionary cache in front of the dimension tables"""
+
+    def test_known_values_cost_no_statements(self, email):
+        """Test that a committed value is not looked up again"""
+        TrackingService().record_open(email.tracking_id, ip_address='203.0.113.7', user_agent=CHROME)
+        email_id = email.id
+
+        with count_queries() as stats:
+            db.session.add(TrackingEvent(email_id=email_id, event_type='open', ip_address='203.0.113.7',
+                                         user_agent=CHROME, device_type='desktop'))
+            db.session.commit()
+
+        assert stats.count == 1
+
+    def test_rollback_is_not_cached(self, email):
+        """Test that values of a rolled back transaction are inserted again"""
+        db.session.add(TrackingEvent(email_id=email.id, event_type='spam_report', user_agent=CHROME))
+        db.session.flush()
+        db.session.rollback()
+
+        db.session.add(TrackingEvent(email_id=email.id, event_type='spam_report', user_agent=CHROME))
+        db.session.commit()
+
+        assert db.session.get(UserAgent, value_hash(CHROME)).value == CHROME
+        assert EventType.query.filter_by(value='spam_report').count() == 1
+
+    def test_cache_is_bounded(self, app, email):
+        """Test that each dimension keeps only DIMENSION_CACHE_SIZE values, least recently used out first"""
+        app.config['DIMENSION_CACHE_SIZE'] = 3
+        event_dimensions.reset()
+        addresses = [f'203.0.113.{i}' for i in range(5)]
+        for address in addresses:
+            TrackingService().record_open(email.tracking_id, ip_address=address)
+
+        cache = app.extensions['event_dimensions']['ip_address']
+        assert len(cache) == 3
+        assert cache.key(addresses[0]) is None
+        assert cache.key(addresses[-1]) == value_hash(addresses[-1])
+
+        # An evicted value is interned again, still onto its one row
+        TrackingService().record_open(email.tracking_id, ip_address=addresses[0])
+        assert IpAddress.query.count() == 5
+
+    def test_decode_after_reset(self, email):
+        """Test that keys missing from the cache are loaded from the table"""
+        event_id = TrackingService().record_open(email.tracking_id, user_agent=CHROME).id
+        event_dimensions.reset()
+        db.session.expunge_all()
+
+        assert db.session.get(TrackingEvent, event_id).user_agent == CHROME
+        assert event_dimensions.decode(None, USER_AGENT, value_hash('unseen')) is None
+
+
+class TestQueries:
+    """Test that filters on the string attributes use the key columns"""
+
+    def test_filters_compile_to_keys(self, app):
+        """Test that comparisons with built-in values and hashes need no join"""
+        sql = str(TrackingEvent.query.filter(
+            TrackingEvent.event_type == 'open', TrackingEvent.ip_address == '203.0.113.7',
+            TrackingEvent.device_type.isnot(None)).statement.compile(compile_kwargs={'literal_binds': True}))
+
+        assert f"event_type_id = {EVENT_TYPE.static_key('open')}" in sql
+        assert f"ip_address_id = {value_hash('203.0.113.7')}" in sql
+        assert 'device_type_id IS NOT NULL' in sql
+        assert 'event_types' not in sql and 'ip_addresses' not in sql
+
+    def test_filters_and_grouping(self, email):
+        """Test equality, membership and grouping against stored events"""
+        for event_type, device in [('open', 'mobile'), ('open', 'desktop'), ('click', 'mobile'),
+                                   ('spam_report', None)]:
+            db.session.add(TrackingEvent(email_id=email.id, event_type=event_type, device_type=device))
+        db.session.commit()
+
+        assert TrackingEvent.query.filter(TrackingEvent.event_type != 'open').count() == 2
+        assert TrackingEvent.query.filter(TrackingEvent.event_type.in_(['click', 'spam_report'])).count() == 2
+        assert TrackingEvent.query.filter(TrackingEvent.event_type != 'never_seen').count() == 4
+        assert TrackingEvent.query.filter(TrackingEvent.device_type.is_(None)).count() == 1
+        assert dict(db.session.query(TrackingEvent.device_type, func.count(TrackingEvent.id)).filter(
+            TrackingEvent.device_type.isnot(None)).group_by(TrackingEvent.device_type)) == {'mobile': 2, 'desktop': 1}
+
+
+class TestPartitionedEncoding:
+    """Test that the partition router writes keys too"""
+
+    def test_partitioned_add(self, tmp_path):
+        class PartitionConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'events.db')
+            TRACKING_PARTITION_PERIOD = 'month'
+
+        app = create_app(PartitionConfig)
+        with app.app_context():
+            db.create_all()
+            email = EmailService().create_email('user@example.com', 'sender@example.com')
+            event = TrackingEvent(email_id=email.id, event_type='open', user_agent=CHROME,
+                                  ip_address='203.0.113.7', created_at=datetime(2024, 1, 5))
+            event_partitions.add(db.session, event)
+            db.session.commit()
+            db.session.expunge_all()
+
+            loaded = TrackingEvent.query.filter_by(ip_address='203.0.113.7').one()
+            assert (loaded.event_type, loaded.user_agent) == ('open', CHROME)
+            assert db.session.query(Email).count() == 1
+
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
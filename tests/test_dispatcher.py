@@ -0,0 +1,235 @@
+"""
+Tests for the asyncio campaign dispatcher, against a local SMTP sink
+"""
+
+import asyncio
+from collections import namedtuple
+
+import pytest
+
+from app import db
+from app.dispatcher import AsyncSmtpPool, Dispatcher, DomainLimits
+from app.mailer import mailer
+from app.models import Campaign, Email
+from app.services.campaign_service import CampaignService
+from app.services.dispatch_service import DispatchService
+from app.services.email_service import EmailService
+from benchmarks.smtp_sink import SmtpSink
+
+Row = namedtuple('Row', 'id tracking_id recipient_email sender_email subject body')
+
+
+@pytest.fixture
+def sink():
+    with SmtpSink(reject={'gone@example.com'}, defer={'busy@example.org'}) as server:
+        yield server
+
+
+@pytest.fixture
+def dispatch_app(app_factory, sink):
+    yield app_factory(MAIL_SERVER=sink.host, MAIL_PORT=sink.port, MAIL_SEND_BATCH_SIZE=4,
+                      DISPATCH_CONNECTIONS=3, DISPATCH_BUFFER_SIZE=6)
+    mailer.close()
+
+
+def campaign_with(recipients, status='active'):
+    campaign = CampaignService().create_campaign('Launch', status=status)
+    for recipient in recipients:
+        EmailService().create_email(recipient, 'news@sender.example.com', subject='Launch', body='<p>Hi</p>',
+                                    campaign_id=campaign.id, queue=True)
+    return campaign
+
+
+class FakePool:
+    """Records sends and the most in flight per domain; each send takes delay seconds"""
+
+    def __init__(self, delay=0.005):
+        self.delay = delay
+        self.sent = []
+        self.in_flight = {}
+        self.most_in_flight = {}
+
+    async def send(self, sender, recipient, data):
+        domain = recipient.rpartition('@')[2]
+        self.in_flight[domain] = self.in_flight.get(domain, 0) + 1
+        self.most_in_flight[domain] = max(self.most_in_flight.get(domain, 0), self.in_flight[domain])
+        await asyncio.sleep(self.delay)
+        self.in_flight[domain] -= 1
+        self.sent.append(recipient)
+        return 250, b'2.0.0 Ok'
+
+    async def close(self):
+        pass
+
+
+def rows(recipients):
+    return [Row(i, f't{i}', recipient, 'news@sender.example.com', 'Launch', '<p>Hi</p>')
+            for i, recipient in enumerate(recipients, start=1)]
+
+
+def dispatcher(pool, recipients, statuses=None, recorded=None, **settings):
+    """Dispatcher over an in-memory list; statuses (a list) are returned by the status polls in turn"""
+    table = rows(recipients)
+    recorded = [] if recorded is None else recorded
+    statuses = statuses or []
+
+    def fetch(after_id, size):
+        return [row for row in table if row.id > after_id][:size]
+
+    def status():
+        return statuses.pop(0) if len(statuses) > 1 else (statuses[0] if statuses else 'active')
+
+    return Dispatcher(pool, fetch, recorded.extend, status, **dict({'batch_size': 4, 'buffer_size': 8}, **settings))
+
+
+class TestDomainLimits:
+    """Test per-domain concurrency and rate windows"""
+
+    def test_concurrency(self):
+        limits = DomainLimits(concurrency=2)
+        limits.acquire('example.com', 0)
+        limits.acquire('example.com', 0)
+
+        assert limits.wait('example.com', 0) is None
+        assert limits.wait('example.org', 0) == 0
+        limits.release('example.com', 1)
+        assert limits.wait('example.com', 1) == 0
+
+    def test_rate_window(self):
+        limits = DomainLimits(concurrency=10, rate=2, window=60)
+        for now in (0, 10):
+            limits.acquire('example.com', now)
+            limits.release('example.com', now)
+
+        assert limits.wait('example.com', 30) == 30
+        assert limits.wait('example.com', 60) == 0
+        limits.prune(100)
+        assert len(limits) == 0
+
+
+class TestDispatcher:
+    """Test the event loop, with a stand-in SMTP pool"""
+
+    def test_domain_concurrency(self):
+        pool = FakePool()
+        big = [f'user{i}@big.example.com' for i in range(12)]
+        recipients = big[:6] + [f'user{i}@small{i}.example' for i in range(4)] + big[6:]
+        run = dispatcher(pool, recipients, connections=6, domain_concurrency=2)
+
+        result = asyncio.run(run.run())
+
+        assert result == {'sent': 16, 'deferred': 0, 'failed': 0}
+        assert pool.most_in_flight['big.example.com'] == 2
+        assert run.peak_buffered <= 8
+        # Once buffered, the small domains don't wait behind the big one's backlog
+        assert max(pool.sent.index(f'user{i}@small{i}.example') for i in range(4)) < 8
+
+    def test_pause_and_resume(self):
+        pool = FakePool(delay=0)
+        recorded = []
+        run = dispatcher(pool, [f'user{i}@example.com' for i in range(3)], statuses=['paused', 'paused', 'active'],
+                         recorded=recorded, status_seconds=0.01)
+
+        assert asyncio.run(run.run())['sent'] == 3
+        assert len(recorded) == 3
+
+    def test_stops_when_status_changes(self):
+        pool = FakePool(delay=0)
+        run = dispatcher(pool, ['user@example.com'], statuses=['draft'])
+
+        assert asyncio.run(run.run())['sent'] == 0
+        assert pool.sent == []
+
+    def test_cancel_checkpoints_sends_in_flight(self):
+        pool = FakePool(delay=0.05)
+        recorded = []
+        run = dispatcher(pool, [f'user{i}@example{i}.com' for i in range(20)], recorded=recorded, connections=4,
+                         checkpoint_seconds=60)
+
+        async def cancel_soon():
+            task = asyncio.ensure_future(run.run())
+            await asyncio.sleep(0.07)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_soon())
+
+        assert 0 < len(recorded) == len(pool.sent) < 20
+
+
+class TestDispatchService:
+    """Test dispatching campaigns from the emails table"""
+
+    def test_dispatch(self, dispatch_app, sink):
+        campaign = campaign_with([f'user{i}@example{i % 3}.com' for i in range(10)] +
+                                 ['gone@example.com', 'busy@example.org'])
+        other = campaign_with(['other@example.com'])
+
+        result = DispatchService().dispatch(campaign.id)
+
+        assert (result['sent'], result['deferred'], result['failed']) == (10, 1, 1)
+        assert result['status'] == 'active'  # the deferred email is left for the next run
+        assert sink.received == 10
+        assert sink.connections <= 3
+        assert Email.query.filter_by(campaign_id=other.id).one().delivery_status == 'queued'
+
+        sink.defer.clear()
+        result = DispatchService().dispatch(campaign.id)
+
+        assert (result['sent'], result['status']) == (1, 'completed')
+        assert db.session.get(Campaign, campaign.id).status == 'completed'
+
+    def test_resume_without_resending(self, dispatch_app, sink):
+        campaign = campaign_with([f'user{i}@example.com' for i in range(9)])
+
+        assert DispatchService().dispatch(campaign.id, limit=5)['sent'] == 5
+        result = DispatchService().dispatch(campaign.id)
+
+        assert (result['sent'], result['status']) == (4, 'completed')
+        recipients = [recipients[0] for _, recipients, _ in sink.messages]
+        assert sorted(recipients) == sorted(f'user{i}@example.com' for i in range(9))
+
+    def test_requires_active_campaign(self, dispatch_app):
+        campaign = campaign_with(['user@example.com'], status='draft')
+
+        runner = dispatch_app.test_cli_runner()
+        result = runner.invoke(args=['mail', 'dispatch', str(campaign.id)])
+
+        assert result.exit_code == 1 and 'set it to active' in result.output
+        assert runner.invoke(args=['mail', 'dispatch', '99']).exit_code == 1
+
+    def test_cli(self, dispatch_app, sink):
+        campaign = campaign_with(['user@example.com'])
+
+        result = dispatch_app.test_cli_runner().invoke(args=['mail', 'dispatch', str(campaign.id)])
+
+        assert result.exit_code == 0
+        assert 'Sent 1, deferred 0, failed 0' in result.output and 'campaign is completed' in result.output
+
+    def test_server_down(self, dispatch_app):
+        campaign = campaign_with(['user@example.com'])
+        dispatch_app.config['MAIL_PORT'] = 9
+
+        result = DispatchService().dispatch(campaign.id)
+
+        assert (result['deferred'], result['status']) == (1, 'active')
+        assert Email.query.one().delivery_result.startswith('ConnectionRefusedError')
+
+
+class TestAsyncSmtpPool:
+    """Test the asyncio SMTP client against the sink"""
+
+    def test_without_pipelining(self):
+        with SmtpSink(pipelining=False) as plain:
+            pool = AsyncSmtpPool(plain.host, plain.port, max_messages=2)
+
+            async def send_three():
+                replies = [await pool.send('a@example.com', f'b{i}@example.com', b'Subject: x\r\n\r\n.dot\r\n')
+                           for i in range(3)]
+                await pool.close()
+                return replies
+
+            assert [code for code, _ in asyncio.run(send_three())] == [250, 250, 250]
+            assert plain.connections == 2
+            assert plain.messages[0][2].endswith(b'\r\n.dot')
@@ -0,0 +1,225 @@
+"""
+Tests for the background enrichment pipeline
+"""
+
+from datetime import datetime
+
+import pytest
+
+from app import create_app, db
+from app.enrichment import event_enrichment
+from app.exceptions import ValidationError
+from app.models import EmailDailyStats, EnrichmentState, TrackingEvent, UserAgent
+from app.partitions import event_partitions
+from app.services import enrichment_service
+from app.services.email_service import EmailService
+from app.services.enrichment_service import EnrichmentService
+from app.services.retention_service import RetentionService
+from app.services.tracking_service import TrackingService
+from config import TestingConfig
+
+IPHONE = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148'
+CHROME = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+CRAWLER = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+
+
+class BackgroundConfig(TestingConfig):
+    TRACKING_ENRICHMENT = 'background'
+
+
+@pytest.fixture
+def background_app():
+    """App that leaves derived event columns to the pipeline"""
+    app = create_app(BackgroundConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def email(background_app):
+    return EmailService().create_email('user@example.com', 'sender@example.com')
+
+
+def record_opens(email, user_agents):
+    service = TrackingService()
+    return [service.record_open(email.tracking_id, ip_address='203.0.113.7', user_agent=user_agent).id
+            for user_agent in user_agents]
+
+
+def devices(event_ids):
+    db.session.expire_all()
+    return [db.session.get(TrackingEvent, event_id).device_type for event_id in event_ids]
+
+
+class TestBackgroundIngest:
+    """Test that ingest stores raw facts only"""
+
+    def test_no_device_at_ingest(self, email):
+        """Test that background mode stores no device type"""
+        event_ids = record_opens(email, [IPHONE, CHROME])
+
+        assert devices(event_ids) == [None, None]
+
+    def test_inline_mode_unchanged(self, app):
+        """Test that the default mode still parses the device type at ingest"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+
+        assert TrackingService().record_open(email.tracking_id, user_agent=IPHONE).device_type == 'mobile'
+
+    def test_unknown_mode(self):
+        """Test that an unknown TRACKING_ENRICHMENT is rejected at startup"""
+        class BadConfig(TestingConfig):
+            TRACKING_ENRICHMENT = 'eventually'
+
+        with pytest.raises(ValidationError):
+            create_app(BadConfig)
+
+
+class TestPipeline:
+    """Test the staged run over user agents and events"""
+
+    def test_run_enriches_events_and_user_agents(self, email):
+        """Test that a run fills in devices and classifies each user agent once"""
+        event_ids = record_opens(email, [IPHONE, CHROME, IPHONE, CRAWLER, None])
+
+        result = EnrichmentService().run()
+
+        assert (result['user_agents'], result['events'], result['high_water_mark']) == (3, 5, max(event_ids))
+        assert devices(event_ids) == ['mobile', 'desktop', 'mobile', 'desktop', None]
+        crawler = UserAgent.query.filter_by(value=CRAWLER).one()
+        assert (crawler.browser, crawler.os, crawler.is_bot) == ('unknown', 'unknown', True)
+        assert UserAgent.query.filter_by(value=IPHONE).one().is_bot is False
+
+    def test_high_water_mark(self, email):
+        """Test that a second run only touches events written since the first"""
+        record_opens(email, [IPHONE, CHROME])
+        EnrichmentService().run()
+        new_ids = record_opens(email, [CHROME])
+
+        result = EnrichmentService().run()
+
+        assert (result['user_agents'], result['events'], result['high_water_mark']) == (0, 1, new_ids[0])
+        assert EnrichmentService().run()['events'] == 0
+        assert devices(new_ids) == ['desktop']
+
+    def test_batches(self, email):
+        """Test that events are enriched batch_size per transaction and max_batches stops early"""
+        event_ids = record_opens(email, [IPHONE] * 5)
+
+        first = EnrichmentService().run(batch_size=2, max_batches=1)
+        rest = EnrichmentService().run(batch_size=2)
+
+        assert (first['batches'], first['high_water_mark']) == (1, event_ids[1])
+        assert (rest['batches'], rest['events']) == (2, 3)
+        assert devices(event_ids) == ['mobile'] * 5
+
+    def test_invalid_batch_size(self, email):
+        with pytest.raises(ValidationError):
+            EnrichmentService().run(batch_size=0)
+
+    def test_locations(self, background_app, email, monkeypatch):
+        """Test that locations from the IP stage only fill in events without one"""
+        background_app.config['GEOIP_DATABASE'] = 'GeoLite2-City.mmdb'
+        monkeypatch.setattr(event_enrichment, 'locate', lambda ip_address: 'Berlin, Germany')
+        service = TrackingService()
+        located = service.record_open(email.tracking_id, ip_address='203.0.113.7').id
+        given = service.record_open(email.tracking_id, ip_address='203.0.113.7', location='Paris, France').id
+
+        result = EnrichmentService().run()
+
+        db.session.expire_all()
+        assert result['ip_addresses'] == 1
+        assert db.session.get(TrackingEvent, located).location == 'Berlin, Germany'
+        assert db.session.get(TrackingEvent, given).location == 'Paris, France'
+
+    def test_status(self, email):
+        record_opens(email, [IPHONE, CHROME])
+
+        before = EnrichmentService().status()
+        EnrichmentService().run()
+        after = EnrichmentService().status()
+
+        assert (before['mode'], before['pending_events'], before['pending_user_agents']) == ('background', 2, 2)
+        assert (after['pending_events'], after['pending_user_agents']) == (0, 0)
+        assert after['high_water_mark'] == after['latest_event_id']
+
+
+class TestRerun:
+    """Test re-enrichment of history after classifier changes"""
+
+    def test_rerun_applies_new_classification(self, email, monkeypatch):
+        """Test that rerun re-classifies user agents and rewrites enriched events"""
+        event_ids = record_opens(email, [IPHONE, CHROME])
+        EnrichmentService().run()
+        later = record_opens(email, [CHROME])
+        monkeypatch.setattr(enrichment_service, 'parse_user_agent',
+                            lambda value: {'device_type': 'tablet', 'browser': 'safari', 'os': 'ios'})
+
+        result = EnrichmentService().rerun()
+
+        assert (result['user_agents'], result['events']) == (2, 2)
+        # Events above the high-water mark are left for run()
+        assert devices(event_ids + later) == ['tablet', 'tablet', None]
+        assert db.session.get(EnrichmentState, 'events').generation == 1
+
+    def test_rerun_since(self, email):
+        """Test that --since limits which events are re-applied"""
+        service = TrackingService()
+        old = TrackingEvent(email_id=email.id, event_type='open', user_agent=IPHONE, created_at=datetime(2024, 1, 1))
+        db.session.add(old)
+        db.session.commit()
+        recent = service.record_open(email.tracking_id, user_agent=IPHONE).id
+        EnrichmentService().run()
+
+        assert EnrichmentService().rerun(since=datetime(2024, 6, 1))['events'] == 1
+        assert devices([old.id, recent]) == ['mobile', 'mobile']
+
+
+class TestIntegration:
+    """Test the pipeline together with partitions, retention and the CLI"""
+
+    def test_partitioned_events(self, tmp_path):
+        """Test that events are updated in their partition tables"""
+        class PartitionConfig(BackgroundConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'events.db')
+            TRACKING_PARTITION_PERIOD = 'month'
+
+        app = create_app(PartitionConfig)
+        with app.app_context():
+            db.create_all()
+            email = EmailService().create_email('user@example.com', 'sender@example.com')
+            event_ids = record_opens(email, [IPHONE])
+            event_partitions.add(db.session, TrackingEvent(email_id=email.id, event_type='open',
+                                                           user_agent=CHROME, created_at=datetime(2024, 1, 5)))
+            db.session.commit()
+
+            assert EnrichmentService().run()['events'] == 2
+            assert devices(event_ids) == ['mobile']
+            assert TrackingEvent.query.filter_by(device_type='desktop').count() == 1
+
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+    def test_retention_enriches_first(self, email):
+        """Test that compaction runs the pipeline so aggregates keep device types"""
+        db.session.add(TrackingEvent(email_id=email.id, event_type='open', user_agent=IPHONE,
+                                     created_at=datetime(2024, 1, 10)))
+        db.session.commit()
+
+        RetentionService().compact(cutoff=datetime(2024, 2, 1))
+
+        assert [stats.device_type for stats in EmailDailyStats.query] == ['mobile']
+
+    def test_cli(self, background_app, email):
+        record_opens(email, [IPHONE])
+        runner = background_app.test_cli_runner()
+
+        run = runner.invoke(args=['enrichment', 'run'])
+        status = runner.invoke(args=['enrichment', 'status'])
+
+        assert run.exit_code == 0 and 'Enriched 1 user agents, 0 IPs and 1 events' in run.output
+        assert status.exit_code == 0 and 'pending: 0 events, 0 user agents' in status.output
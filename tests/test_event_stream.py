@@ -0,0 +1,118 @@
+"""
+Tests for the live event stream (SSE) and its in-process fan-out
+"""
+
+import json
+
+import pytest
+
+from app.event_stream import event_stream
+from app.services.campaign_service import CampaignService
+from app.services.email_service import EmailService
+from app.services.tracking_service import TrackingService
+
+
+@pytest.fixture
+def stream_app(app_factory):
+    # The ticker is left asleep; tests tick the hub themselves
+    return app_factory(EVENT_STREAM_INTERVAL=3600, EVENT_STREAM_QUEUE_SIZE=2, EVENT_STREAM_MAX_SUBSCRIBERS=2)
+
+
+@pytest.fixture
+def emails(stream_app):
+    launch, other = CampaignService().create_campaign('Launch'), CampaignService().create_campaign('Other')
+    return [EmailService().create_email('user@example.com', 'sender@example.com', campaign_id=campaign.id)
+            for campaign in (launch, other)]
+
+
+def tick(app):
+    app.extensions['event_stream'].tick()
+
+
+def open_email(email, times=1):
+    for _ in range(times):
+        TrackingService().record_open(email.tracking_id, ip_address='203.0.113.7')
+
+
+class TestFanOut:
+    """Test coalesced delta updates per scope"""
+
+    def test_coalesced_per_tick(self, stream_app, emails):
+        launch, other = emails
+        everything = event_stream.subscribe()
+        launch_only = event_stream.subscribe(launch.campaign_id)
+
+        open_email(launch, times=50)
+        open_email(other)
+        TrackingService().record_click(launch.tracking_id, 'https://example.com')
+        tick(stream_app)
+
+        assert launch_only.get(timeout=0)['events'] == {'open': 50, 'click': 1}
+        assert everything.get(timeout=0)['events'] == {'open': 51, 'click': 1}
+        assert launch_only.get(timeout=0) is None
+
+    def test_full_queue_folds_oldest(self, stream_app, emails):
+        subscription = event_stream.subscribe()
+        for times in (1, 2, 3):
+            open_email(emails[0], times=times)
+            tick(stream_app)
+
+        first, second = subscription.get(timeout=0), subscription.get(timeout=0)
+
+        assert (first['events'], second['events']) == ({'open': 3}, {'open': 3})
+        assert subscription.get(timeout=0) is None
+
+    def test_ticker(self, app_factory):
+        """Test that the ticker thread delivers without anyone ticking"""
+        app_factory(EVENT_STREAM_INTERVAL=0.01)
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        subscription = event_stream.subscribe()
+
+        open_email(email)
+
+        assert subscription.get(timeout=5)['events'] == {'open': 1}
+        subscription.close()
+
+    def test_no_subscribers(self, stream_app, emails):
+        open_email(emails[0])
+
+        assert stream_app.extensions['event_stream'].pending == {}
+
+    def test_close(self, stream_app, emails):
+        event_stream.subscribe().close()
+
+        open_email(emails[0])
+
+        assert stream_app.extensions['event_stream'].subscriptions == {}
+
+
+class TestStreamRoute:
+    """Test GET /api/analytics/stream"""
+
+    def test_delta_events(self, stream_app, emails):
+        launch = emails[0]
+        response = stream_app.test_client().get(f'/api/analytics/stream?campaign_id={launch.campaign_id}',
+                                                buffered=False)
+        body = iter(response.response)
+
+        assert response.mimetype == 'text/event-stream'
+        assert next(body) == b': connected\n\n'
+
+        open_email(launch, times=2)
+        tick(stream_app)
+        event, data = next(body).decode().strip().split('\n')
+
+        assert event == 'event: delta'
+        assert json.loads(data[len('data: '):])['events'] == {'open': 2}
+        response.close()
+        assert stream_app.extensions['event_stream'].subscriptions == {}
+
+    def test_limits(self, stream_app, emails):
+        client = stream_app.test_client()
+        streams = [client.get('/api/analytics/stream', buffered=False) for _ in range(2)]
+
+        assert client.get('/api/analytics/stream').status_code == 503
+        assert client.get('/api/analytics/stream?campaign_id=999').status_code == 404
+        for response in streams:
+            response.close()
+        assert stream_app.extensions['event_stream'].subscriptions == {}
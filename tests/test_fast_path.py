@@ -0,0 +1,131 @@
+"""
+Tests for the WSGI fast path serving tracking pixel and click hits
+"""
+
+import pytest
+from app import create_app, db
+from config import TestingConfig
+
+
+class FastPathConfig(TestingConfig):
+    TRACKING_FAST_PATH = True
+
+
+@pytest.fixture
+def fast_app():
+    """App with the tracking fast path mounted"""
+    app = create_app(FastPathConfig)
+    app.flask_dispatches = 0
+
+    @app.before_request
+    def count_dispatch():
+        app.flask_dispatches += 1
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def fast_client(fast_app):
+    return fast_app.test_client()
+
+
+def create_email(client):
+    response = client.post('/api/emails', json={
+        'recipient_email': 'user@example.com',
+        'sender_email': 'sender@example.com'
+    })
+    return response.json['email']
+
+
+class TestTrackingFastPath:
+    """Test pixel/click handling in the WSGI middleware"""
+
+    def test_pixel_bypasses_flask(self, fast_app, fast_client):
+        """Test that a pixel hit is recorded without Flask dispatch"""
+        email = create_email(fast_client)
+        dispatches = fast_app.flask_dispatches
+
+        response = fast_client.get(f"/track/pixel/{email['tracking_id']}.png",
+                                   headers={'User-Agent': 'Mozilla/5.0 (iPhone; Mobile)'})
+
+        assert response.status_code == 200
+        assert response.content_type == 'image/png'
+        assert response.data.startswith(b'\x89PNG')
+        assert fast_app.flask_dispatches == dispatches
+
+        events = fast_client.get(f"/api/emails/{email['id']}/events").json
+        assert events['total'] == 1
+        assert events['events'][0]['event_type'] == 'open'
+        assert events['events'][0]['device_type'] == 'mobile'
+
+    def test_pixel_invalid_tracking_id(self, fast_client):
+        """Test that an unknown tracking ID still gets the pixel"""
+        response = fast_client.get('/track/pixel/invalid123.png')
+        assert response.status_code == 200
+        assert response.content_type == 'image/png'
+
+    def test_click_redirects_and_records(self, fast_app, fast_client):
+        """Test that a click is recorded and redirected without Flask dispatch"""
+        email = create_email(fast_client)
+        dispatches = fast_app.flask_dispatches
+
+        response = fast_client.get(f"/track/click/{email['tracking_id']}",
+                                   query_string={'url': 'https://example.com/page?a=1'})
+
+        assert response.status_code == 302
+        assert response.location == 'https://example.com/page?a=1'
+        assert fast_app.flask_dispatches == dispatches
+
+        events = fast_client.get(f"/api/emails/{email['id']}/events?event_type=click").json
+        assert events['total'] == 1
+        assert events['events'][0]['clicked_url'] == 'https://example.com/page?a=1'
+
+    def test_click_default_url(self, fast_client):
+        """Test that a click without a URL redirects to /"""
+        email = create_email(fast_client)
+        response = fast_client.get(f"/track/click/{email['tracking_id']}")
+        assert response.status_code == 302
+        assert response.location == '/'
+
+    def test_click_invalid_url_falls_through(self, fast_app, fast_client):
+        """Test that invalid destinations are handled by the Flask route"""
+        email = create_email(fast_client)
+        dispatches = fast_app.flask_dispatches
+
+        response = fast_client.get(f"/track/click/{email['tracking_id']}",
+                                   query_string={'url': 'not-a-valid-url'})
+
+        assert response.status_code == 400
+        assert response.json['error'] == 'Invalid destination URL'
+        assert fast_app.flask_dispatches == dispatches + 1
+
+    def test_click_empty_url_matches_flask(self, app, client, fast_app, fast_client):
+        """Test that an empty url is rejected like the Flask route rejects it"""
+        email = create_email(fast_client)
+        dispatches = fast_app.flask_dispatches
+
+        fast = fast_client.get(f"/track/click/{email['tracking_id']}?url=")
+        flask = client.get(f"/track/click/{create_email(client)['tracking_id']}?url=")
+
+        assert fast.status_code == flask.status_code == 400
+        assert fast.json == flask.json
+        assert fast_app.flask_dispatches == dispatches + 1
+
+    def test_other_routes_fall_through(self, fast_client):
+        """Test that non-tracking routes still go through Flask"""
+        response = fast_client.get('/health')
+        assert response.status_code == 200
+        assert response.json == {'status': 'healthy'}
+
+    def test_custom_event_falls_through(self, fast_client):
+        """Test that POST /track/event is not intercepted"""
+        email = create_email(fast_client)
+        response = fast_client.post('/track/event', json={
+            'tracking_id': email['tracking_id'],
+            'event_type': 'bounce'
+        })
+        assert response.status_code == 201
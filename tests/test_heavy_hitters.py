@@ -0,0 +1,155 @@
+"""
+Tests for the heavy-hitter sketches of top links, domains, IPs and user agents
+"""
+
+import random
+import threading
+from collections import Counter
+
+import pytest
+
+from app import db
+from app.heavy_hitters import heavy_hitters, merge_counts
+from app.models import HeavyHitterSketch
+from app.services.campaign_service import CampaignService
+from app.services.email_service import EmailService
+from app.services.heavy_hitter_service import HeavyHitterService
+from app.services.tracking_service import TrackingService
+
+
+@pytest.fixture
+def sketch_app(app_factory):
+    return app_factory(HEAVY_HITTERS_FLUSH_SECONDS=0)
+
+
+@pytest.fixture
+def campaign_email(sketch_app):
+    campaign = CampaignService().create_campaign('Launch')
+    return EmailService().create_email('user@example.com', 'sender@example.com', campaign_id=campaign.id)
+
+
+def click(email, url, ip_address='203.0.113.7'):
+    TrackingService().record_click(email.tracking_id, url, ip_address=ip_address)
+    assert heavy_hitters.wait_flushed(timeout=5)
+
+
+def values(response):
+    return [(item['value'], item['count']) for item in response.get_json()['items']]
+
+
+class TestMergeCounts:
+    """Test the summary bounds"""
+
+    def test_bounds_hold(self):
+        rng = random.Random(7)
+        stream = [min(int(rng.paretovariate(1.2)), 500) for _ in range(20000)]
+        entries, floor = {}, 0
+        for start in range(0, len(stream), 1000):
+            ranked, floor = merge_counts(entries, floor, Counter(stream[start:start + 1000]), capacity=20)
+            entries = {value: (count, error) for value, count, error in ranked}
+
+        exact = Counter(stream)
+        assert len(entries) == 20
+        for value, (count, error) in entries.items():
+            assert count - error <= exact[value] <= count
+        assert all(hits <= floor for value, hits in exact.items() if value not in entries)
+        assert [value for value, _ in exact.most_common(3)] == sorted(entries, key=lambda v: -entries[v][0])[:3]
+
+    def test_exact_under_capacity(self):
+        ranked, floor = merge_counts({'a': (2, 0)}, 0, {'a': 1, 'b': 5}, capacity=5)
+
+        assert (ranked, floor) == ([['b', 5, 0], ['a', 3, 0]], 0)
+
+
+class TestTopValues:
+    """Test the top-values endpoints"""
+
+    def test_campaign_top_links(self, sketch_app, campaign_email):
+        for url, times in (('https://a.example.com/x', 3), ('https://b.example.org/', 1), ('https://a.example.com/y', 2)):
+            for _ in range(times):
+                click(campaign_email, url)
+        client = sketch_app.test_client()
+
+        response = client.get(f'/api/analytics/campaign/{campaign_email.campaign_id}/top-links?limit=2')
+        domains = client.get('/api/analytics/top-domains')
+        exact = client.get(f'/api/analytics/campaign/{campaign_email.campaign_id}/top-links?limit=2&exact=true')
+
+        assert response.status_code == 200
+        body = response.get_json()
+        assert (body['exact'], body['total'], body['unlisted_max']) == (False, 6, 1)
+        assert values(response) == [('https://a.example.com/x', 3), ('https://a.example.com/y', 2)]
+        assert values(domains) == [('a.example.com', 5), ('b.example.org', 1)]
+        assert exact.get_json()['exact'] is True
+        assert values(exact) == values(response)
+
+    def test_top_ips_and_user_agents(self, sketch_app, campaign_email):
+        service = TrackingService()
+        service.record_open(campaign_email.tracking_id, ip_address='198.51.100.4', user_agent='Thunderbird')
+        heavy_hitters.wait_flushed(timeout=5)
+        click(campaign_email, 'https://example.com')
+        click(campaign_email, 'https://example.com')
+        client = sketch_app.test_client()
+
+        assert values(client.get('/api/analytics/top-ips')) == [('203.0.113.7', 2), ('198.51.100.4', 1)]
+        assert values(client.get('/api/analytics/top-user-agents')) == [('Thunderbird', 1)]
+        assert values(client.get('/api/analytics/top-ips?exact=true')) == [('203.0.113.7', 2), ('198.51.100.4', 1)]
+
+    def test_exact_without_sketch(self, app_factory):
+        """Test that values are counted exactly until a sketch is flushed"""
+        app = app_factory(HEAVY_HITTERS_FLUSH_SECONDS=3600)
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        click(email, 'https://example.com')
+
+        body = app.test_client().get('/api/analytics/top-links').get_json()
+
+        assert body['exact'] is True
+        assert body['items'] == [{'value': 'https://example.com', 'count': 1, 'error': 0}]
+        assert HeavyHitterSketch.query.count() == 0
+
+    def test_errors(self, sketch_app):
+        client = sketch_app.test_client()
+
+        assert client.get('/api/analytics/campaign/999/top-links').status_code == 404
+        assert client.get('/api/analytics/top-links?limit=0').status_code == 400
+
+
+class TestFlush:
+    """Test writing pending hits"""
+
+    def test_flushed_off_the_ingest_thread(self, campaign_email, monkeypatch):
+        """Test that a due flush runs on the flusher thread, not in the tracked request"""
+        flushed_on = []
+        flush = HeavyHitterService.flush
+        monkeypatch.setattr(HeavyHitterService, 'flush',
+                            lambda service: flushed_on.append(threading.current_thread()) or flush(service))
+
+        click(campaign_email, 'https://example.com')
+        click(campaign_email, 'https://example.com')
+
+        assert flushed_on and threading.current_thread() not in flushed_on
+        assert {thread.name for thread in flushed_on} == {'heavy-hitters-flusher'}
+        assert HeavyHitterSketch.query.filter_by(dimension='links', campaign_id=0).one().total == 2
+
+
+class TestMaintenance:
+    """Test rebuilding and deleting sketches"""
+
+    def test_rebuild(self, sketch_app, campaign_email):
+        click(campaign_email, 'https://example.com')
+        db.session.query(HeavyHitterSketch).delete()
+        db.session.commit()
+
+        result = sketch_app.test_cli_runner().invoke(args=['heavy-hitters', 'rebuild'])
+
+        assert result.exit_code == 0
+        assert 'Rebuilt 6 sketches' in result.output  # no user agent sketches: the click had none
+        response = sketch_app.test_client().get(f'/api/analytics/campaign/{campaign_email.campaign_id}/top-links')
+        assert response.get_json()['exact'] is False
+        assert values(response) == [('https://example.com', 1)]
+
+    def test_campaign_delete(self, campaign_email):
+        click(campaign_email, 'https://example.com')
+
+        CampaignService().delete_campaign(campaign_email.campaign_id)
+
+        assert {sketch.campaign_id for sketch in HeavyHitterSketch.query} == {0}
@@ -0,0 +1,140 @@
+"""
+Tests for idempotency keys on POST /track/event
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.exceptions import ValidationError
+from app.idempotency import ReplayedEvent
+from app.metrics import registry
+from app.models import IdempotencyKey, TrackingEvent
+from app.services.email_service import EmailService
+from app.services.tracking_service import TrackingService
+
+
+@pytest.fixture
+def email(app):
+    return EmailService().create_email('user@example.com', 'sender@example.com')
+
+
+def post_event(client, email, headers=None, **fields):
+    return client.post('/track/event', headers=headers,
+                       json=dict({'tracking_id': email.tracking_id, 'event_type': 'bounce'}, **fields))
+
+
+def forget_cached(app):
+    """Empty the worker's key cache, as if another worker got the retry"""
+    app.extensions['idempotency_keys'].entries.clear()
+
+
+class TestRoute:
+    """Test that retried requests are recorded once"""
+
+    def test_header(self, client, email):
+        first = post_event(client, email, headers={'Idempotency-Key': 'evt-1'})
+        retry = post_event(client, email, headers={'Idempotency-Key': 'evt-1'})
+
+        assert (first.status_code, retry.status_code) == (201, 201)
+        assert retry.json == first.json
+        assert 'Idempotent-Replayed' not in first.headers
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        assert TrackingEvent.query.count() == 1
+
+    def test_event_id(self, client, email):
+        first = post_event(client, email, event_id='evt-1')
+        post_event(client, email, event_id='evt-2')
+        retry = post_event(client, email, event_id='evt-1')
+
+        assert retry.json['event']['id'] == first.json['event']['id']
+        assert TrackingEvent.query.count() == 2
+
+    def test_without_key(self, client, email):
+        post_event(client, email)
+        post_event(client, email)
+
+        assert TrackingEvent.query.count() == 2
+        assert IdempotencyKey.query.count() == 0
+
+    def test_cached_retry(self, client, email):
+        """Test that a retry this worker saw is answered from memory"""
+        first = post_event(client, email, event_id='evt-1')
+        IdempotencyKey.query.delete()
+        db.session.commit()
+
+        replayed = TrackingService().replay('evt-1')
+
+        assert isinstance(replayed, ReplayedEvent)
+        assert replayed.to_dict() == first.json['event']
+        assert TrackingService().replay('evt-2') is None
+
+    def test_uncached_retry(self, app, client, email):
+        """Test that the unique key catches a retry the cache missed"""
+        registry.reset()
+        first = post_event(client, email, event_id='evt-1')
+        forget_cached(app)
+
+        retry = post_event(client, email, event_id='evt-1')
+
+        assert retry.json == first.json
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        assert TrackingEvent.query.count() == 1
+        assert 'reason="duplicate"' in registry.render()
+
+    def test_key_too_long(self, client, email):
+        response = post_event(client, email, event_id='x' * 256)
+
+        assert response.status_code == 400
+        assert response.json['field'] == 'Idempotency-Key'
+
+
+class TestService:
+    """Test idempotency keys with the other ingest paths"""
+
+    def test_collapsed_open(self, app_factory):
+        app = app_factory(TRACKING_COLLAPSE_SECONDS=300)
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        service = TrackingService()
+        service.record_open(email.tracking_id, ip_address='203.0.113.7')
+        collapsed = service.record_open(email.tracking_id, ip_address='203.0.113.7', idempotency_key='evt-1')
+        forget_cached(app)
+
+        retry = service.record_open(email.tracking_id, ip_address='203.0.113.7', idempotency_key='evt-1')
+
+        assert retry.to_dict() == collapsed.to_dict()
+        db.session.expire_all()
+        assert [event.repeat_count for event in TrackingEvent.query] == [1]
+
+    def test_purge(self, email):
+        service = TrackingService()
+        service.record_event(email.tracking_id, 'bounce', idempotency_key='old')
+        service.record_event(email.tracking_id, 'bounce', idempotency_key='new')
+        db.session.get(IdempotencyKey, 'old').created_at = datetime.utcnow() - timedelta(days=2)
+        db.session.commit()
+
+        assert service.purge_idempotency_keys() == 1
+        assert [key.key for key in IdempotencyKey.query] == ['new']
+
+    def test_cache_bounded(self, app_factory):
+        app = app_factory(IDEMPOTENCY_CACHE_SIZE=2)
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        for key in ('a', 'b', 'c'):
+            TrackingService().record_event(email.tracking_id, 'bounce', idempotency_key=key)
+
+        assert list(app.extensions['idempotency_keys'].entries) == ['b', 'c']
+
+    def test_invalid_config(self, app_factory):
+        with pytest.raises(ValidationError):
+            app_factory(IDEMPOTENCY_TTL_SECONDS=0)
+
+
+class TestPurgeCommand:
+    """Test flask idempotency purge"""
+
+    def test_purge(self, runner):
+        result = runner.invoke(args=['idempotency', 'purge'])
+
+        assert result.exit_code == 0
+        assert 'Purged 0 idempotency keys' in result.output
@@ -0,0 +1,241 @@
+"""
+Tests for machine open / scanner click classification at ingest
+"""
+
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.exceptions import ValidationError
+from app.machine_events import BURST, FAST, HUMAN, PROXY_IP, USER_AGENT, machine_events
+from app.metrics import registry
+from app.models import Campaign, EmailDailyStats, EmailUniqueIp, TrackingEvent
+from app.services.analytics_service import AnalyticsService
+from app.services.email_service import EmailService
+from app.services.retention_service import RetentionService
+from app.services.tracking_service import TrackingService
+
+CHROME = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+SCANNER = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+HUMAN_IP = '203.0.113.7'
+APPLE_IP = '17.58.100.1'
+
+
+@pytest.fixture
+def policy_app(request, app_factory):
+    """App with the MACHINE_EVENTS policy given by the test's parametrization"""
+    return app_factory(MACHINE_EVENTS=request.param)
+
+
+def sent_email(campaign_id=None, sent_at=datetime(2024, 1, 1)):
+    """An email sent long enough ago that only the other rules apply"""
+    email = EmailService().create_email('user@example.com', 'sender@example.com', campaign_id=campaign_id)
+    email.sent_at = sent_at
+    db.session.commit()
+    return email
+
+
+def reasons(email):
+    db.session.expire_all()
+    return [event.machine_reason for event in
+            TrackingEvent.query.filter_by(email_id=email.id).order_by(TrackingEvent.id)]
+
+
+class TestClassification:
+    """Test the ingest rules, first match wins"""
+
+    def test_human(self, app):
+        email = sent_email()
+
+        event = TrackingService().record_open(email.tracking_id, ip_address=HUMAN_IP, user_agent=CHROME)
+
+        assert (event.machine_reason, event.to_dict()['machine_reason']) == (HUMAN, None)
+
+    @pytest.mark.parametrize('ip_address,user_agent,expected', [
+        (APPLE_IP, CHROME, PROXY_IP),
+        (HUMAN_IP, SCANNER, USER_AGENT),
+        (HUMAN_IP, 'Mozilla/5.0', USER_AGENT),
+    ])
+    def test_open_rules(self, app, ip_address, user_agent, expected):
+        email = sent_email()
+
+        event = TrackingService().record_open(email.tracking_id, ip_address=ip_address, user_agent=user_agent)
+
+        assert reasons(email) == [expected]
+        assert event.is_machine
+
+    def test_fast_after_send(self, app):
+        """Test that opens and clicks right after sending are taken for prefetches/scans"""
+        email = sent_email(sent_at=datetime.utcnow())
+        service = TrackingService()
+
+        service.record_open(email.tracking_id, ip_address=HUMAN_IP, user_agent=CHROME)
+        service.record_click(email.tracking_id, 'https://example.com', ip_address=HUMAN_IP, user_agent=CHROME)
+
+        assert reasons(email) == [FAST, FAST]
+
+    def test_burst_flags_earlier_clicks(self, app):
+        """Test that the click completing a burst flags the clicks before it too"""
+        email = sent_email()
+        other = sent_email()
+        service = TrackingService()
+
+        for url in ('https://example.com/a', 'https://example.com/b'):
+            service.record_click(email.tracking_id, url, ip_address=HUMAN_IP, user_agent=CHROME)
+        service.record_click(other.tracking_id, 'https://example.com/a', ip_address=HUMAN_IP, user_agent=CHROME)
+        assert reasons(email) == [HUMAN, HUMAN]
+
+        service.record_click(email.tracking_id, 'https://example.com/c', ip_address=HUMAN_IP, user_agent=CHROME)
+
+        assert reasons(email) == [BURST, BURST, BURST]
+        assert reasons(other) == [HUMAN]
+
+    def test_burst_windows_are_bounded(self, app):
+        """Test that only the most recently clicked emails keep a window"""
+        app.extensions['machine_events'].burst_emails = 2
+        service = TrackingService()
+
+        for _ in range(3):
+            email = sent_email()
+            service.record_click(email.tracking_id, 'https://example.com', ip_address=HUMAN_IP, user_agent=CHROME)
+
+        assert len(app.extensions['machine_events'].clicks) == 2
+
+    def test_other_event_types(self, app):
+        """Test that only the IP and user agent rules apply to bounces and the like"""
+        email = sent_email(sent_at=datetime.utcnow())
+        service = TrackingService()
+
+        service.record_event(email.tracking_id, 'bounce', ip_address=HUMAN_IP, user_agent='Mozilla/5.0')
+        service.record_event(email.tracking_id, 'bounce', ip_address=APPLE_IP)
+
+        assert reasons(email) == [HUMAN, PROXY_IP]
+
+
+class TestPolicies:
+    """Test MACHINE_EVENTS"""
+
+    @pytest.mark.parametrize('policy_app', ['drop'], indirect=True)
+    def test_drop(self, policy_app):
+        """Test that dropped machine hits are counted but not stored"""
+        registry.reset()
+        email = sent_email()
+        service = TrackingService()
+
+        dropped = service.record_open(email.tracking_id, ip_address=APPLE_IP, user_agent=CHROME)
+        kept = service.record_open(email.tracking_id, ip_address=HUMAN_IP, user_agent=CHROME)
+
+        assert dropped.id is None and dropped.machine_reason == PROXY_IP
+        assert [event.id for event in TrackingEvent.query] == [kept.id]
+        assert 'reason="machine_proxy_ip"} 1' in registry.render()
+        registry.reset()
+
+    @pytest.mark.parametrize('policy_app', ['off'], indirect=True)
+    def test_off(self, policy_app):
+        email = sent_email(sent_at=datetime.utcnow())
+
+        TrackingService().record_open(email.tracking_id, ip_address=APPLE_IP, user_agent=SCANNER)
+
+        assert reasons(email) == [HUMAN]
+        assert not machine_events.enabled
+
+    @pytest.mark.parametrize('settings', [
+        {'MACHINE_EVENTS': 'quarantine'},
+        {'MACHINE_IP_RANGES': ('17.0.0.0/33',)},
+        {'MACHINE_BURST_CLICKS': 1},
+    ])
+    def test_invalid_config(self, app_factory, settings):
+        with pytest.raises(ValidationError):
+            app_factory(**settings)
+
+
+class TestAnalytics:
+    """Test that analytics leave machine events out on request"""
+
+    @pytest.fixture
+    def campaign_email(self, app):
+        campaign = Campaign(name='Launch')
+        db.session.add(campaign)
+        db.session.commit()
+        email = sent_email(campaign_id=campaign.id)
+        service = TrackingService()
+        service.record_open(email.tracking_id, ip_address=APPLE_IP, user_agent=CHROME)
+        service.record_open(email.tracking_id, ip_address=HUMAN_IP, user_agent=CHROME)
+        service.record_click(email.tracking_id, 'https://example.com', ip_address=HUMAN_IP, user_agent=SCANNER)
+        return campaign, email
+
+    def test_email_stats(self, campaign_email):
+        _, email = campaign_email
+        service = AnalyticsService()
+
+        everything = service.get_email_stats(email.id)
+        human = service.get_email_stats(email.id, exclude_machine=True)
+
+        assert (everything['total_opens'], everything['unique_opens'], everything['total_clicks']) == (2, 2, 1)
+        assert (human['total_opens'], human['unique_opens'], human['total_clicks']) == (1, 1, 0)
+
+    def test_campaign_and_global_stats(self, campaign_email):
+        campaign, _ = campaign_email
+        service = AnalyticsService()
+
+        campaign_stats = service.get_campaign_stats(campaign.id, exclude_machine=True)
+        global_stats = service.get_global_stats(exclude_machine=True)
+
+        assert (campaign_stats['total_opens'], campaign_stats['unique_clicks']) == (1, 0)
+        assert (global_stats['total_events'], global_stats['unique_clicks']) == (1, 0)
+        assert service.get_global_stats()['total_events'] == 3
+
+    def test_compacted_events(self, campaign_email):
+        """Test that retention keeps the machine share of each aggregate"""
+        campaign, email = campaign_email
+        TrackingEvent.query.update({TrackingEvent.created_at: datetime(2024, 1, 10)})
+        db.session.commit()
+
+        RetentionService().compact(cutoff=datetime(2024, 2, 1))
+
+        counts = {(stats.event_type, stats.event_count, stats.machine_count) for stats in EmailDailyStats.query}
+        assert counts == {('open', 2, 1), ('click', 1, 1)}
+        stats = AnalyticsService().get_campaign_stats(campaign.id, exclude_machine=True)
+        assert (stats['total_opens'], stats['total_clicks'], stats['unique_clicks']) == (1, 0, 0)
+        assert AnalyticsService().get_global_stats(exclude_machine=True)['total_events'] == 1
+        human = AnalyticsService().get_email_stats(email.id, exclude_machine=True)
+        assert (human['unique_opens'], human['unique_clicks']) == (1, 0)
+        assert AnalyticsService().get_email_stats(email.id)['unique_opens'] == 2
+
+    def test_compacted_ip_used_by_a_person(self, campaign_email):
+        """Test that an IP stops being machine-only once a person's event from it is compacted"""
+        _, email = campaign_email
+        TrackingService().record_click(email.tracking_id, 'https://example.com', ip_address=HUMAN_IP,
+                                       user_agent=CHROME)
+        TrackingEvent.query.update({TrackingEvent.created_at: datetime(2024, 1, 10)})
+        db.session.commit()
+
+        RetentionService().compact(cutoff=datetime(2024, 2, 1), chunk_size=1)
+
+        assert EmailUniqueIp.query.filter_by(event_type='click').one().machine_only is False
+        assert AnalyticsService().get_email_stats(email.id, exclude_machine=True)['unique_clicks'] == 1
+
+    def test_route_flag(self, client, campaign_email):
+        campaign, email = campaign_email
+
+        assert client.get(f'/api/analytics/email/{email.id}?exclude_machine=true').get_json()['total_opens'] == 1
+        assert client.get(f'/api/analytics/campaign/{campaign.id}?exclude_machine=1').get_json()['total_opens'] == 1
+        assert client.get('/api/analytics/overview?exclude_machine=yes').get_json()['total_events'] == 1
+        assert client.get('/api/analytics/overview').get_json()['total_events'] == 3
+
+
+class TestPartitionedIngest:
+    """Test classification with time-partitioned storage"""
+
+    def test_burst_updates_partitions(self, app_factory, tmp_path):
+        app_factory(SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'events.db'),
+                    TRACKING_PARTITION_PERIOD='month')
+        email = sent_email()
+        service = TrackingService()
+
+        service.record_open(email.tracking_id, ip_address=HUMAN_IP, user_agent=CHROME)
+        for url in ('https://example.com/a', 'https://example.com/b', 'https://example.com/c'):
+            service.record_click(email.tracking_id, url, ip_address=HUMAN_IP, user_agent=CHROME)
+
+        assert reasons(email) == [HUMAN, BURST, BURST, BURST]
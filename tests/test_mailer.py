@@ -0,0 +1,171 @@
+"""
+Tests for the SMTP send engine, against a local SMTP sink
+"""
+
+import email
+import time
+from collections import namedtuple
+from datetime import datetime
+from email import policy
+
+import pytest
+
+from app import db
+from app.mailer import DomainThrottle, build_message, html_to_text, mailer
+from app.models import Email
+from app.services.campaign_service import CampaignService
+from app.services.email_service import EmailService
+from app.services.send_service import SendService
+from benchmarks.smtp_sink import SmtpSink
+
+Row = namedtuple('Row', 'id tracking_id recipient_email sender_email subject body')
+
+
+@pytest.fixture
+def sink():
+    with SmtpSink(reject={'gone@example.com'}, defer={'busy@example.org'}) as server:
+        yield server
+
+
+def mail_settings(sink, **settings):
+    return dict({'MAIL_SERVER': sink.host, 'MAIL_PORT': sink.port, 'MAIL_SEND_WORKERS': 2, 'MAIL_SEND_BATCH_SIZE': 3,
+                 'MAIL_TRACKING_BASE_URL': 'https://track.example.com'}, **settings)
+
+
+@pytest.fixture
+def mail_app(app_factory, sink):
+    yield app_factory(**mail_settings(sink))
+    mailer.close()
+
+
+def queue(recipient, campaign_id=None, body='<p>Hi &amp; welcome</p>'):
+    return EmailService().create_email(recipient, 'news@sender.example.com', subject='Launch', body=body,
+                                       campaign_id=campaign_id, queue=True)
+
+
+def parse(data):
+    return email.message_from_bytes(data, policy=policy.default)
+
+
+class TestMessages:
+    """Test building MIME messages"""
+
+    def test_build_message(self, mail_app):
+        queued = queue('user@example.com')
+
+        message = parse(build_message(queued, 'https://track.example.com/'))
+
+        assert message['Message-ID'] == f'<{queued.tracking_id}@sender.example.com>'
+        assert message.get_content_type() == 'multipart/alternative'
+        assert message.get_body(('plain',)).get_content().strip() == 'Hi & welcome'
+        assert f'https://track.example.com/track/pixel/{queued.tracking_id}.png' in \
+            message.get_body(('html',)).get_content()
+
+    def test_encoded_headers(self):
+        row = Row(1, 'abc123', 'user@example.com', 'news@sender.example.com', 'Grüße – 20% off', '<p>Café=ok</p>')
+
+        message = parse(build_message(row))
+
+        assert message['Subject'] == 'Grüße – 20% off'
+        assert message.get_body(('html',)).get_content() == '<p>Café=ok</p>'
+        with pytest.raises(ValueError):
+            build_message(row._replace(subject='Hi\r\nBcc: all@example.com'))
+
+    def test_html_to_text(self):
+        assert html_to_text('<style>p {}</style><p>One</p>\n\n\n<p>Two&amp;</p>') == 'One\n\nTwo&'
+
+    def test_throttle(self):
+        throttle = DomainThrottle(rate=50)
+        started = time.monotonic()
+        for _ in range(3):
+            throttle.wait('example.com')
+        throttle.wait('example.org')
+
+        assert 0.04 <= time.monotonic() - started < 0.5
+
+
+class TestSending:
+    """Test sending queued emails"""
+
+    def test_send_queued(self, mail_app, sink):
+        campaign = CampaignService().create_campaign('Launch')
+        emails = [queue(f'user{i}@example.com', campaign.id) for i in range(5)]
+        already_sent = EmailService().create_email('old@example.com', 'news@sender.example.com')
+        before = datetime.utcnow()
+
+        result = SendService().send_queued(campaign_id=campaign.id)
+
+        assert (result['sent'], result['deferred'], result['failed']) == (5, 0, 0)
+        assert sink.received == 5
+        assert sink.connections <= 2  # one persistent connection per worker
+        for sent in emails:
+            db.session.refresh(sent)
+            assert sent.delivery_status == 'sent' and sent.sent_at >= before
+            assert sent.delivery_result.startswith('250')
+            assert sent.tracking_id in sent.message_id
+        assert already_sent.delivery_status is None
+        assert SendService().send_queued()['sent'] == 0  # nothing queued is left
+
+    def test_outcomes(self, mail_app, sink):
+        rejected, deferred, accepted = (queue(address) for address in (
+            'gone@example.com', 'busy@example.org', 'user@example.com'))
+
+        result = SendService().send_queued()
+
+        assert (result['sent'], result['deferred'], result['failed']) == (1, 1, 1)
+        assert (rejected.delivery_status, rejected.delivery_result) == ('failed', '550 5.1.1 No such user')
+        assert deferred.delivery_status == 'deferred'
+        assert accepted.delivery_status == 'sent'
+        # A rejected recipient does not spoil the pipelined connection for the next message
+        assert [recipients for _, recipients, _ in sink.messages] == [['user@example.com']]
+
+        sink.defer.clear()
+        assert SendService().send_queued()['sent'] == 1  # deferred emails are retried
+        assert SendService().delivery_counts() == {'queued': 0, 'sent': 2, 'deferred': 0, 'failed': 1}
+
+    def test_without_pipelining(self, app_factory):
+        with SmtpSink(pipelining=False) as plain:
+            app_factory(**mail_settings(plain))
+            queue('user@example.com', body='<p>Hi</p>\n.\n<p>dots</p>')
+
+            assert SendService().send_queued()['sent'] == 1
+            message = parse(plain.messages[0][2])
+            assert '\n.\n' in message.get_body(('plain',)).get_content().replace('\r\n', '\n')
+
+    def test_server_down(self, app_factory, sink):
+        app_factory(**mail_settings(sink, MAIL_PORT=9))
+        queued = queue('user@example.com')
+
+        assert SendService().send_queued()['deferred'] == 1
+        assert queued.delivery_status == 'deferred'
+        assert queued.delivery_result.startswith('ConnectionRefusedError')
+
+    def test_connection_rotation(self, app_factory, sink):
+        app_factory(**mail_settings(sink, MAIL_SEND_WORKERS=1, MAIL_MAX_MESSAGES_PER_CONNECTION=2))
+        for i in range(5):
+            queue(f'user{i}@example.com')
+
+        assert SendService().send_queued()['sent'] == 5
+        assert sink.connections == 3
+
+
+class TestCli:
+    """Test the mail commands"""
+
+    def test_send_and_status(self, mail_app, sink):
+        queue('user@example.com')
+        runner = mail_app.test_cli_runner()
+
+        sent = runner.invoke(args=['mail', 'send'])
+        status = runner.invoke(args=['mail', 'status'])
+
+        assert sent.exit_code == 0 and 'Sent 1, deferred 0, failed 0' in sent.output
+        assert status.output.strip() == '0 queued, 1 sent, 0 deferred, 0 failed'
+        assert runner.invoke(args=['mail', 'send', '--campaign-id', '9']).exit_code == 1
+
+    def test_queue_through_api(self, mail_app):
+        response = mail_app.test_client().post('/api/emails', json={
+            'recipient_email': 'user@example.com', 'sender_email': 'news@sender.example.com', 'queue': True})
+
+        assert response.status_code == 201
+        assert Email.query.one().delivery_status == 'queued'
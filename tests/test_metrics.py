@@ -0,0 +1,66 @@
+"""
+Tests for the /metrics endpoint
+"""
+
+import pytest
+from app.metrics import registry
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    registry.reset()
+    yield
+    registry.reset()
+
+
+def create_email(client):
+    response = client.post('/api/emails', json={
+        'recipient_email': 'user@example.com',
+        'sender_email': 'sender@example.com'
+    })
+    return response.json['email']['tracking_id']
+
+
+class TestMetricsEndpoint:
+    """Test metrics exposition"""
+
+    def test_prometheus_content_type(self, client):
+        """Test that /metrics is served as Prometheus text"""
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        assert '# TYPE http_request_duration_seconds histogram' in response.get_data(as_text=True)
+
+    def test_route_latency_and_status(self, client):
+        """Test per-route histograms and status counts"""
+        client.get('/health')
+        client.get('/api/emails/999')
+
+        text = client.get('/metrics').get_data(as_text=True)
+        assert 'http_request_duration_seconds_count{blueprint="",route="/health",method="GET"} 1' in text
+        assert 'http_requests_total{blueprint="emails",route="/api/emails/<int:email_id>",method="GET",status="404"} 1' in text
+
+    def test_tracking_recorded_and_dropped(self, client):
+        """Test ingest counters by event type"""
+        tracking_id = create_email(client)
+        client.get(f'/track/pixel/{tracking_id}.png')
+        client.get(f'/track/pixel/{tracking_id}.png')
+        client.get('/track/pixel/unknown.png')
+        client.get(f'/track/click/{tracking_id}?url=https://example.com')
+
+        text = client.get('/metrics').get_data(as_text=True)
+        assert 'tracking_events_recorded_total{event_type="open"} 2' in text
+        assert 'tracking_events_recorded_total{event_type="click"} 1' in text
+        assert 'tracking_events_dropped_total{event_type="open",reason="not_found"} 1' in text
+
+    def test_db_time_and_cache_ratio(self, client):
+        """Test DB time per route and the compiled-statement cache hit ratio"""
+        create_email(client)
+        client.get('/api/emails')
+        client.get('/api/emails')
+
+        text = client.get('/metrics').get_data(as_text=True)
+        # POST (create) + two GETs share the route
+        assert 'db_request_duration_seconds_count{blueprint="emails",route="/api/emails/"} 3' in text
+        assert 'db_queries_total{blueprint="emails",route="/api/emails/"}' in text
+        assert 'cache_hit_ratio{cache="sqlalchemy_compiled"}' in text
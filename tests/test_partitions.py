@@ -0,0 +1,296 @@
+"""
+Tests for time-partitioned tracking_events storage
+"""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import inspect as sa_inspect
+
+from app import create_app, db
+from app.exceptions import ValidationError
+from app.models import Email, TrackingEvent
+from app.partitions import event_partitions
+from app.query_stats import count_queries
+from app.seeding import seed_database
+from app.services.analytics_service import AnalyticsService
+from app.services.email_service import EmailService
+from app.services.retention_service import RetentionService
+from app.services.tracking_service import TrackingService
+from config import TestingConfig
+
+
+def make_app(tmp_path, period='month'):
+    class PartitionConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'events.db')
+        TRACKING_PARTITION_PERIOD = period
+
+    return create_app(PartitionConfig)
+
+
+@pytest.fixture
+def partitioned_app(tmp_path):
+    """App storing events in monthly partitions of a SQLite file"""
+    app = make_app(tmp_path)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def add_event(email_id, created_at, event_type='open'):
+    """Write an event with a fixed timestamp through the partition router"""
+    event = TrackingEvent(email_id=email_id, event_type=event_type, created_at=created_at)
+    event_partitions.add(db.session, event)
+    db.session.commit()
+    return event
+
+
+def partition_names():
+    with db.engine.connect() as connection:
+        return [name for name, _, _ in event_partitions.partitions(connection)]
+
+
+class TestPartitionedWrites:
+    """Test routing of new events to per-period tables"""
+
+    def test_record_open_creates_current_partition(self, partitioned_app):
+        """Test that ingest installs the layout and writes to this month's table"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+
+        event = TrackingService().record_open(email.tracking_id, ip_address='203.0.113.1')
+
+        name = event_partitions.scheme.name(datetime.utcnow())
+        assert name in partition_names()
+        assert sa_inspect(db.engine).get_view_names() == ['tracking_events']
+        assert db.session.get(TrackingEvent, event.id).ip_address == '203.0.113.1'
+
+    def test_ids_encode_partition(self, partitioned_app):
+        """Test that ids are unique across partitions and carry the period ordinal"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+
+        january = add_event(email.id, datetime(2024, 1, 15))
+        february = add_event(email.id, datetime(2024, 2, 3))
+
+        scheme = event_partitions.scheme
+        assert january.id >> 32 == scheme.ordinal(datetime(2024, 1, 1).date())
+        assert february.id >> 32 == scheme.ordinal(datetime(2024, 2, 1).date())
+        assert {'tracking_events_p20240101', 'tracking_events_p20240201'} <= set(partition_names())
+
+    def test_reads_span_partitions(self, partitioned_app):
+        """Test that relationships and analytics see every partition through the view"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        add_event(email.id, datetime(2024, 1, 15))
+        add_event(email.id, datetime(2024, 2, 3), event_type='click')
+
+        assert email.events.count() == 2
+        stats = AnalyticsService().get_email_stats(email.id)
+        assert stats['total_opens'] == 1
+        assert stats['total_clicks'] == 1
+
+    def test_custom_event_type(self, partitioned_app, client):
+        """Test that POST /track/event writes other event types into partitions"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+
+        response = client.post('/track/event', json={'tracking_id': email.tracking_id, 'event_type': 'bounce'})
+
+        assert response.status_code == 201
+        assert response.get_json()['event']['event_type'] == 'bounce'
+
+    def test_delete_email_cascades(self, partitioned_app):
+        """Test that deleting an email removes its events from their partitions"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        add_event(email.id, datetime(2024, 1, 15))
+        add_event(email.id, datetime(2024, 2, 3))
+
+        EmailService().delete_email(email.id)
+
+        assert db.session.query(TrackingEvent).count() == 0
+
+
+class TestPartitionPruning:
+    """Test that range reads only touch covering partitions"""
+
+    def test_events_for_email_range(self, partitioned_app):
+        """Test that a one-month range only queries that month's table"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        add_event(email.id, datetime(2024, 1, 15))
+        add_event(email.id, datetime(2024, 2, 3))
+        add_event(email.id, datetime(2024, 3, 9))
+
+        with count_queries() as stats:
+            events = TrackingService().get_events_for_email(
+                email.id, start_date=datetime(2024, 2, 1), end_date=datetime(2024, 3, 1))
+
+        assert [event.created_at for event in events] == [datetime(2024, 2, 3)]
+        statement = next(s for s in stats.statements if 'tracking_events_pruned' in s)
+        assert 'tracking_events_p20240201' in statement
+        assert 'tracking_events_p20240101' not in statement
+        assert 'tracking_events_p20240301' not in statement
+
+    def test_global_stats_range(self, partitioned_app):
+        """Test that global stats respect the date range"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        add_event(email.id, datetime(2024, 1, 15))
+        add_event(email.id, datetime(2024, 2, 3), event_type='click')
+
+        stats = AnalyticsService().get_global_stats(start_date=datetime(2024, 2, 1))
+
+        assert stats['total_events'] == 1
+        assert stats['total_clicks'] == 1
+        assert stats['total_opens'] == 0
+        assert AnalyticsService().get_global_stats()['total_events'] == 2
+
+    def test_range_without_partitions(self, partitioned_app):
+        """Test that a range no partition covers returns nothing"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        add_event(email.id, datetime(2024, 1, 15))
+
+        events = TrackingService().get_events_for_email(email.id, start_date=datetime(2030, 1, 1))
+
+        assert events == []
+
+
+class TestPartitionLifecycle:
+    """Test install, drop and CLI management"""
+
+    def test_install_migrates_existing_rows(self, tmp_path):
+        """Test that rows in an unpartitioned table move into partitions with their ids"""
+        plain = make_app(tmp_path, period=None)
+        with plain.app_context():
+            db.create_all()
+            email = EmailService().create_email('user@example.com', 'sender@example.com')
+            for created_at in (datetime(2024, 1, 15), datetime(2024, 2, 3)):
+                db.session.add(TrackingEvent(email_id=email.id, event_type='open', created_at=created_at))
+            db.session.commit()
+            ids = sorted(event.id for event in db.session.query(TrackingEvent))
+            db.session.remove()
+            db.engine.dispose()
+
+        app = make_app(tmp_path)
+        with app.app_context():
+            with db.engine.begin() as connection:
+                event_partitions.install(connection)
+                event_partitions.install(connection)  # idempotent
+
+            assert {'tracking_events_p20240101', 'tracking_events_p20240201'} <= set(partition_names())
+            assert sorted(event.id for event in db.session.query(TrackingEvent)) == ids
+            db.session.remove()
+            db.engine.dispose()
+
+    def test_drop_partition(self, partitioned_app):
+        """Test that dropping a period removes its table and rows only"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        add_event(email.id, datetime(2024, 1, 15))
+        add_event(email.id, datetime(2024, 2, 3))
+
+        with db.engine.begin() as connection:
+            event_partitions.drop_partition(connection, 'tracking_events_p20240101')
+
+        assert 'tracking_events_p20240101' not in partition_names()
+        assert [event.created_at for event in db.session.query(TrackingEvent)] == [datetime(2024, 2, 3)]
+
+    def test_drop_before(self, partitioned_app):
+        """Test that --before style drops every partition ending by the cutoff"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        for month in (1, 2, 3):
+            add_event(email.id, datetime(2024, month, 10))
+
+        with db.engine.begin() as connection:
+            dropped = event_partitions.drop_before(connection, datetime(2024, 3, 1))
+
+        assert dropped == ['tracking_events_p20240101', 'tracking_events_p20240201']
+        assert db.session.query(TrackingEvent).count() == 1
+
+    def test_drop_unknown_partition(self, partitioned_app):
+        """Test that only existing partitions can be dropped"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        add_event(email.id, datetime(2024, 1, 15))
+
+        with db.engine.begin() as connection:
+            with pytest.raises(ValidationError):
+                event_partitions.drop_partition(connection, 'emails')
+
+    def test_compaction_drops_emptied_partitions(self, partitioned_app):
+        """Test that retention deletes through the view and drops partitions it empties"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        add_event(email.id, datetime(2024, 1, 15))
+        add_event(email.id, datetime(2024, 2, 3))
+        add_event(email.id, datetime(2024, 3, 9))
+
+        result = RetentionService().compact(cutoff=datetime(2024, 3, 1))
+
+        assert result['events'] == 2
+        assert result['partitions_dropped'] == ['tracking_events_p20240101', 'tracking_events_p20240201']
+        assert AnalyticsService().get_email_stats(email.id)['total_opens'] == 3
+
+    def test_cli(self, partitioned_app):
+        """Test the partitions create/list/drop commands"""
+        runner = partitioned_app.test_cli_runner()
+
+        result = runner.invoke(args=['partitions', 'create', '--ahead', '2'])
+        assert result.exit_code == 0, result.output
+        assert len(result.output.split()) == 3
+
+        result = runner.invoke(args=['partitions', 'list'])
+        assert result.exit_code == 0
+        assert result.output.count('tracking_events_p') == 3
+
+        first = partition_names()[0]
+        result = runner.invoke(args=['partitions', 'drop', first])
+        assert result.exit_code == 0
+        assert f'dropped {first}' in result.output
+        assert first not in partition_names()
+
+    def test_cli_requires_partitioning(self, runner):
+        """Test that the commands refuse to run when partitioning is disabled"""
+        result = runner.invoke(args=['partitions', 'list'])
+
+        assert result.exit_code != 0
+        assert 'TRACKING_PARTITION_PERIOD' in result.output
+
+    def test_seed_writes_partitions(self, partitioned_app):
+        """Test that the seed generator bulk-loads into partitions"""
+        seed_database(campaigns=2, emails=20, events=200, end_date=datetime(2024, 3, 1), days=60)
+
+        assert db.session.query(TrackingEvent).count() == 200
+        assert len(partition_names()) >= 3
+
+
+class TestEventDateFilters:
+    """Test start_date/end_date filters on the unpartitioned layout"""
+
+    def test_email_events_date_range(self, client, app):
+        """Test GET /api/emails/<id>/events with a date range"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        for created_at in (datetime(2024, 1, 15), datetime(2024, 2, 3)):
+            db.session.add(TrackingEvent(email_id=email.id, event_type='open', created_at=created_at))
+        db.session.commit()
+
+        response = client.get(f'/api/emails/{email.id}/events?start_date=2024-02-01')
+
+        assert response.status_code == 200
+        assert response.get_json()['total'] == 1
+
+    def test_invalid_date(self, client, app):
+        """Test that a malformed date is a 400"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+
+        response = client.get(f'/api/emails/{email.id}/events?start_date=yesterday')
+
+        assert response.status_code == 400
+
+    def test_overview_date_range(self, client, app):
+        """Test GET /api/analytics/overview with a date range"""
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        for created_at in (datetime(2024, 1, 15), datetime(2024, 2, 3)):
+            db.session.add(TrackingEvent(email_id=email.id, event_type='open', created_at=created_at))
+        db.session.commit()
+
+        response = client.get('/api/analytics/overview?end_date=2024-02-01')
+
+        assert response.status_code == 200
+        assert response.get_json()['total_events'] == 1
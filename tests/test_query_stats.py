@@ -0,0 +1,172 @@
+"""
+Tests for per-request SQL query counting and N+1 detection
+"""
+
+import json
+import logging
+
+import pytest
+from app import db
+from app.exceptions import NPlusOneError
+from app.models import Email
+from app.query_stats import count_queries
+from app.services.email_service import EmailService
+
+
+def create_emails(count):
+    service = EmailService()
+    return [service.create_email('user@example.com', 'sender@example.com') for _ in range(count)]
+
+
+@pytest.fixture
+def loop_route(app):
+    """Route that fires a lazy relationship per email - a textbook N+1"""
+    @app.route('/_test/lazy-loop')
+    def lazy_loop():
+        return {'opens': [email.events.count() for email in Email.query.all()]}
+
+    return '/_test/lazy-loop'
+
+
+class TestCountQueries:
+    """Test the count_queries collector"""
+
+    def test_counts_queries_and_time(self, app):
+        """Test that statements and DB time are recorded"""
+        create_emails(2)
+
+        with count_queries() as stats:
+            db.session.query(Email).count()
+            db.session.query(Email).all()
+
+        assert stats.count == 2
+        assert stats.total_time > 0
+
+    def test_no_collection_outside_block(self, app):
+        """Test that queries outside the block are not counted"""
+        with count_queries() as stats:
+            pass
+
+        db.session.query(Email).count()
+        assert stats.count == 0
+
+    def test_detects_repeated_statement(self, app):
+        """Test that a lazy load in a loop is reported with distinct parameters"""
+        emails = create_emails(5)
+
+        with count_queries() as stats:
+            for email in emails:
+                email.events.count()
+
+        # Both the per-email count and the refresh of each expired email repeat
+        repeated = {statement: (executions, distinct) for statement, executions, distinct
+                    in stats.repeated(threshold=5)}
+        statement = next(s for s in repeated if 'FROM tracking_events' in s)
+        executions, distinct = repeated[statement]
+        assert executions == 5
+        assert distinct == 5
+        assert stats.max_repeat == 5
+
+    def test_below_threshold_not_reported(self, app):
+        """Test that statements under the threshold are not reported"""
+        emails = create_emails(3)
+
+        with count_queries() as stats:
+            for email in emails:
+                email.events.count()
+
+        assert stats.repeated(threshold=4) == []
+
+    def test_identical_parameters_not_reported(self, app):
+        """Test that re-running a statement with the same parameters is not an N+1"""
+        email = create_emails(1)[0]
+
+        with count_queries() as stats:
+            for _ in range(5):
+                email.events.count()
+
+        assert stats.max_repeat == 5
+        assert stats.repeated(threshold=2) == []
+
+    def test_nested_collectors(self, app):
+        """Test that an outer collector also counts queries of an inner one"""
+        with count_queries() as outer:
+            db.session.query(Email).count()
+            with count_queries() as inner:
+                db.session.query(Email).all()
+
+        assert inner.count == 1
+        assert outer.count == 2
+
+    def test_outer_collector_sees_requests(self, app, client):
+        """Test that queries made by a request count towards an enclosing collector"""
+        create_emails(1)
+
+        with count_queries() as stats:
+            client.get('/api/emails')
+
+        assert stats.count >= 2
+
+
+class TestRequestQueryStats:
+    """Test per-request reporting"""
+
+    def test_debug_headers(self, app, client):
+        """Test that debug mode returns query stats as headers"""
+        app.debug = True
+        create_emails(1)
+
+        response = client.get('/api/emails')
+
+        assert int(response.headers['X-Query-Count']) >= 2
+        assert float(response.headers['X-Query-Time-Ms']) >= 0
+        assert 'X-Query-Max-Repeat' in response.headers
+
+    def test_production_log_line(self, app, client, caplog):
+        """Test that non-debug mode logs one structured line per request"""
+        create_emails(1)
+
+        with caplog.at_level(logging.INFO, logger='app.sql'):
+            response = client.get('/api/emails')
+
+        assert 'X-Query-Count' not in response.headers
+        records = [json.loads(r.getMessage()) for r in caplog.records if r.name == 'app.sql']
+        assert records[0]['event'] == 'sql_stats'
+        assert records[0]['path'] == '/api/emails'
+        assert records[0]['status'] == 200
+        assert records[0]['queries'] >= 2
+
+    def test_n_plus_one_fails_request(self, app, client, loop_route):
+        """Test that the testing profile fails requests over the threshold"""
+        app.config['SQL_N_PLUS_ONE_THRESHOLD'] = 3
+        create_emails(3)
+
+        with pytest.raises(NPlusOneError):
+            client.get(loop_route)
+
+    def test_identical_queries_pass_request(self, app, client):
+        """Test that the testing profile lets a request repeat an identical query"""
+        app.config['SQL_N_PLUS_ONE_THRESHOLD'] = 3
+        email_id = create_emails(1)[0].id
+
+        @app.route('/_test/same-query')
+        def same_query():
+            return {'opens': [db.session.get(Email, email_id).events.count() for _ in range(5)]}
+
+        assert client.get('/_test/same-query').status_code == 200
+
+    def test_n_plus_one_logged_when_not_raising(self, app, client, loop_route, caplog):
+        """Test that N+1 suspects are logged as warnings when raising is off"""
+        app.config['SQL_N_PLUS_ONE_THRESHOLD'] = 3
+        app.config['SQL_N_PLUS_ONE_RAISE'] = False
+        create_emails(3)
+
+        with caplog.at_level(logging.INFO, logger='app.sql'):
+            response = client.get(loop_route)
+
+        assert response.status_code == 200
+        warnings = [json.loads(r.getMessage()) for r in caplog.records
+                    if r.name == 'app.sql' and r.levelno == logging.WARNING]
+        assert warnings[0]['event'] == 'sql_n_plus_one'
+        assert warnings[0]['executions'] == 3
+        assert warnings[0]['distinct_parameters'] == 3
@@ -0,0 +1,119 @@
+"""
+Tests for the lightweight read models used by listings and analytics scans
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import Email, Campaign, TrackingEvent
+from app.query_stats import count_queries
+from app.read_models import EmailRow, EventRow
+from app.services.analytics_service import AnalyticsService
+from app.services.email_service import EmailService
+from app.services.retention_service import RetentionService
+from app.services.tracking_service import TrackingService
+
+OLD = datetime(2024, 1, 10, 9, 0)
+
+
+@pytest.fixture
+def mailbox(app):
+    """A campaign email and a standalone email with raw and compacted events"""
+    campaign = Campaign(name='Launch')
+    db.session.add(campaign)
+    db.session.commit()
+
+    first = EmailService().create_email('a@example.com', 'sender@example.com', subject='Hi', campaign_id=campaign.id)
+    second = EmailService().create_email('b@example.com', 'sender@example.com')
+    for i, (email, event_type) in enumerate([(first, 'open'), (first, 'open'), (first, 'click'),
+                                             (second, 'open'), (second, 'bounce')]):
+        db.session.add(TrackingEvent(email_id=email.id, event_type=event_type, ip_address='203.0.113.1',
+                                     user_agent='Mozilla/5.0', device_type='desktop',
+                                     clicked_url='https://example.com' if event_type == 'click' else None,
+                                     created_at=OLD + timedelta(days=i)))
+        db.session.add(TrackingEvent(email_id=email.id, event_type=event_type, created_at=datetime.utcnow()))
+    db.session.commit()
+    RetentionService().compact(cutoff=datetime(2024, 2, 1))
+    return campaign, first, second
+
+
+class TestReadModels:
+    """Test that read models serialize like the ORM models"""
+
+    def test_list_emails_rows(self, mailbox):
+        """Test that list_emails returns EmailRow with the same JSON as Email.to_dict()"""
+        _, first, second = mailbox
+
+        emails, total = EmailService().list_emails()
+
+        assert total == 2
+        assert all(isinstance(email, EmailRow) for email in emails)
+        assert [email.to_dict() for email in emails] == [db.session.get(Email, email.id).to_dict()
+                                                         for email in (first, second)]
+        assert (emails[0].campaign_name, emails[0].total_opens, emails[0].total_clicks) == ('Launch', 4, 2)
+
+    def test_list_emails_query_count(self, mailbox):
+        """Test that a page costs the same number of queries however many emails it holds"""
+        for i in range(20):
+            EmailService().create_email(f'user{i}@example.com', 'sender@example.com')
+
+        with count_queries() as small:
+            EmailService().list_emails(limit=2)
+        with count_queries() as large:
+            EmailService().list_emails(limit=22)
+
+        assert small.count == large.count == 4
+
+    def test_event_rows(self, mailbox):
+        """Test that event listings return EventRow with the same JSON as TrackingEvent.to_dict()"""
+        campaign, first, _ = mailbox
+        expected = [event.to_dict() for event in TrackingEvent.query.filter_by(email_id=first.id)
+                    .order_by(TrackingEvent.id)]
+
+        by_email = TrackingService().get_events_for_email(first.id)
+        by_campaign = TrackingService().get_events_for_campaign(campaign.id)
+
+        assert all(isinstance(event, EventRow) for event in by_email + by_campaign)
+        assert [event.to_dict() for event in by_email] == expected
+        assert sorted(event.to_dict()['id'] for event in by_campaign) == [event['id'] for event in expected]
+
+    def test_rows_are_not_tracked(self, mailbox):
+        """Test that listings leave the identity map empty"""
+        campaign_id, email_id = mailbox[0].id, mailbox[1].id
+        db.session.expunge_all()
+
+        # Hold on to the results - the identity map only keeps weak references
+        results = (EmailService().list_emails(), TrackingService().get_events_for_email(email_id),
+                   TrackingService().get_events_for_campaign(campaign_id))
+
+        assert all(len(listing) for listing in results)
+        assert not [obj for obj in db.session.identity_map.values() if isinstance(obj, (TrackingEvent, Campaign))]
+
+    def test_campaign_stats_single_scan(self, mailbox):
+        """Test that campaign stats read events in one statement, not one per email"""
+        campaign, _, _ = mailbox
+        for i in range(12):
+            EmailService().create_email(f'user{i}@example.com', 'sender@example.com', campaign_id=campaign.id)
+
+        with count_queries() as stats:
+            result = AnalyticsService().get_campaign_stats(campaign.id)
+
+        assert result['total_emails'] == 13
+        assert (result['total_opens'], result['total_clicks']) == (4, 2)
+        assert not stats.repeated(threshold=3)
+
+
+class TestReadModelEndpoints:
+    """Test API output built from read models"""
+
+    def test_list_emails_endpoint(self, client, mailbox):
+        """Test that GET /api/emails returns the ORM serialization"""
+        _, first, second = mailbox
+        expected = [db.session.get(Email, email.id).to_dict() for email in (first, second)]
+
+        response = client.get('/api/emails')
+
+        assert response.status_code == 200
+        assert response.get_json()['emails'] == expected
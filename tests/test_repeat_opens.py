@@ -0,0 +1,147 @@
+"""
+Tests for collapsing repeat opens into repeat_count
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.exceptions import ValidationError
+from app.models import EmailDailyStats, TrackingEvent
+from app.services.analytics_service import AnalyticsService
+from app.services.email_service import EmailService
+from app.services.retention_service import RetentionService
+from app.services.tracking_service import TrackingService
+
+CHROME = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+IP = '203.0.113.7'
+
+
+@pytest.fixture
+def collapse_app(app_factory):
+    return app_factory(TRACKING_COLLAPSE_SECONDS=300)
+
+
+@pytest.fixture
+def email(collapse_app):
+    email = EmailService().create_email('user@example.com', 'sender@example.com')
+    email.sent_at = datetime(2024, 1, 1)
+    db.session.commit()
+    return email
+
+
+def rows(email):
+    db.session.expire_all()
+    return [(event.ip_address, event.repeat_count) for event in
+            TrackingEvent.query.filter_by(email_id=email.id).order_by(TrackingEvent.id)]
+
+
+def open_email(email, ip_address=IP, user_agent=CHROME):
+    return TrackingService().record_open(email.tracking_id, ip_address=ip_address, user_agent=user_agent)
+
+
+class TestCollapse:
+    """Test that repeats become repeat_count increments"""
+
+    def test_repeats_share_a_row(self, email):
+        first = open_email(email)
+        repeats = [open_email(email) for _ in range(3)]
+
+        assert rows(email) == [(IP, 3)]
+        assert [event.id for event in repeats] == [first.id] * 3
+        assert [event.repeat_count for event in repeats] == [1, 2, 3]
+        assert db.session.get(TrackingEvent, first.id).hits == 4
+
+    def test_different_clients_get_rows(self, email):
+        open_email(email)
+        open_email(email, ip_address='198.51.100.4')
+        open_email(email, user_agent='Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X)')
+        open_email(email)
+
+        assert rows(email) == [(IP, 1), ('198.51.100.4', 0), (IP, 0)]
+
+    def test_window(self, collapse_app, email, monkeypatch):
+        """Test that an open after the window starts a new row"""
+        open_email(email)
+        later = datetime.utcnow() + timedelta(seconds=301)
+        monkeypatch.setattr('app.services.tracking_service.datetime',
+                            type('Later', (), {'utcnow': staticmethod(lambda: later)}))
+
+        open_email(email)
+        open_email(email)
+
+        assert rows(email) == [(IP, 0), (IP, 1)]
+
+    def test_deleted_row(self, email):
+        """Test that a repeat of a row that is gone writes a new row"""
+        open_email(email)
+        TrackingEvent.query.delete()
+        db.session.commit()
+
+        open_email(email)
+
+        assert rows(email) == [(IP, 0)]
+
+    def test_clicks_not_collapsed(self, email):
+        service = TrackingService()
+        for _ in range(2):
+            service.record_click(email.tracking_id, 'https://example.com', ip_address=IP, user_agent=CHROME)
+
+        assert len(rows(email)) == 2
+
+    def test_off_by_default(self, app):
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+        open_email(email)
+        open_email(email)
+
+        assert len(rows(email)) == 2
+
+    def test_invalid_config(self, app_factory):
+        with pytest.raises(ValidationError):
+            app_factory(TRACKING_COLLAPSE_SECONDS=-1)
+
+
+class TestCounts:
+    """Test that totals count every hit a row stands for"""
+
+    def test_analytics_and_listings(self, collapse_app, email):
+        for _ in range(3):
+            open_email(email)
+        open_email(email, ip_address='198.51.100.4')
+
+        stats = AnalyticsService().get_email_stats(email.id)
+        global_stats = AnalyticsService().get_global_stats()
+        listed = collapse_app.test_client().get('/api/emails').get_json()
+
+        assert (stats['total_opens'], stats['unique_opens'], stats['device_breakdown']) == (4, 2, {'desktop': 4})
+        assert (global_stats['total_opens'], global_stats['total_events']) == (4, 4)
+        assert email.to_dict()['total_opens'] == 4
+        assert listed['emails'][0]['total_opens'] == 4
+
+    def test_retention(self, email):
+        """Test that compacted days keep the repeats"""
+        for _ in range(3):
+            open_email(email)
+        TrackingEvent.query.update({TrackingEvent.created_at: datetime(2024, 1, 10)})
+        db.session.commit()
+
+        RetentionService().compact(cutoff=datetime(2024, 2, 1))
+
+        assert [stats.event_count for stats in EmailDailyStats.query] == [3]
+        assert AnalyticsService().get_email_stats(email.id)['total_opens'] == 3
+
+
+class TestPartitioned:
+    """Test collapsing into partition tables"""
+
+    def test_repeat_updates_partition(self, app_factory, tmp_path):
+        app_factory(SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'events.db'),
+                    TRACKING_PARTITION_PERIOD='month', TRACKING_COLLAPSE_SECONDS=300)
+        email = EmailService().create_email('user@example.com', 'sender@example.com')
+
+        for _ in range(3):
+            open_email(email)
+
+        assert rows(email) == [(IP, 2)]
+        assert AnalyticsService().get_global_stats(start_date=datetime(2024, 1, 1))['total_opens'] == 3
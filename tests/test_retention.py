@@ -0,0 +1,183 @@
+"""
+Tests for the retention job that compacts raw events into daily aggregates
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.exceptions import ValidationError
+from app.models import Email, Campaign, TrackingEvent, EmailDailyStats, EmailUniqueIp, CampaignDailyStats
+from app.services.analytics_service import AnalyticsService
+from app.services.campaign_service import CampaignService
+from app.services.email_service import EmailService
+from app.services.retention_service import RetentionService
+
+OLD = datetime(2024, 1, 10, 9, 0)
+CUTOFF = datetime(2024, 2, 1)
+
+
+@pytest.fixture
+def history(app):
+    """Two campaign emails with events on several old days and one recent day"""
+    campaign = Campaign(name='Launch')
+    db.session.add(campaign)
+    db.session.commit()
+
+    first = EmailService().create_email('a@example.com', 'sender@example.com', campaign_id=campaign.id)
+    second = EmailService().create_email('b@example.com', 'sender@example.com', campaign_id=campaign.id)
+
+    events = [
+        (first, 'open', '203.0.113.1', 'desktop', OLD),
+        (first, 'open', '203.0.113.1', 'desktop', OLD + timedelta(hours=2)),
+        (first, 'open', '203.0.113.2', 'mobile', OLD + timedelta(days=1)),
+        (first, 'click', '203.0.113.2', 'mobile', OLD + timedelta(days=1, hours=1)),
+        (second, 'open', '198.51.100.7', None, OLD + timedelta(days=3)),
+        (second, 'bounce', None, None, OLD + timedelta(days=4)),
+        (first, 'open', '203.0.113.3', 'tablet', CUTOFF + timedelta(days=5)),
+        (second, 'click', '198.51.100.7', 'desktop', CUTOFF + timedelta(days=6)),
+    ]
+    for email, event_type, ip_address, device_type, created_at in events:
+        db.session.add(TrackingEvent(email_id=email.id, event_type=event_type, ip_address=ip_address,
+                                     device_type=device_type, created_at=created_at,
+                                     clicked_url='https://example.com' if event_type == 'click' else None))
+    db.session.commit()
+    return campaign, first, second
+
+
+def snapshot(campaign, *emails):
+    """Every stat that should survive compaction unchanged"""
+    analytics = AnalyticsService()
+    return {
+        'emails': [analytics.get_email_stats(email.id) for email in emails],
+        'to_dict': [db.session.get(Email, email.id).to_dict() for email in emails],
+        'campaign': analytics.get_campaign_stats(campaign.id),
+        'campaign_service': CampaignService().get_campaign_stats(campaign.id),
+        'daily': analytics.get_campaign_daily_stats(campaign.id),
+        'global': analytics.get_global_stats(),
+        'global_range': analytics.get_global_stats(start_date=datetime(2024, 1, 11), end_date=CUTOFF),
+    }
+
+
+class TestCompaction:
+    """Test rolling raw events into aggregates"""
+
+    def test_compact_moves_old_events(self, history):
+        """Test that only events before the cutoff are aggregated and deleted"""
+        result = RetentionService().compact(cutoff=CUTOFF)
+
+        assert result['events'] == 6
+        assert result['chunks'] == 1
+        assert TrackingEvent.query.count() == 2
+        assert all(event.created_at >= CUTOFF for event in TrackingEvent.query)
+
+        _, first, _ = history
+        stats = EmailDailyStats.query.filter_by(email_id=first.id, event_type='open', device_type='desktop').one()
+        assert stats.event_count == 2
+        assert stats.day == OLD.date()
+        assert (stats.first_at, stats.last_at) == (OLD, OLD + timedelta(hours=2))
+
+    def test_totals_unchanged(self, history):
+        """Test that every analytics view reports the same numbers after compaction"""
+        campaign, first, second = history
+        before = snapshot(campaign, first, second)
+
+        RetentionService().compact(cutoff=CUTOFF)
+        db.session.expire_all()
+
+        assert snapshot(campaign, first, second) == before
+
+    def test_totals_unchanged_mid_compaction(self, history):
+        """Test that totals also hold between chunks (aggregate and delete share a transaction)"""
+        campaign, first, second = history
+        before = snapshot(campaign, first, second)
+
+        result = RetentionService().compact(cutoff=CUTOFF, chunk_size=2, max_chunks=2)
+        db.session.expire_all()
+
+        assert result['events'] == 4
+        assert snapshot(campaign, first, second) == before
+
+    def test_small_chunks_merge(self, history):
+        """Test that chunks landing in the same day add up"""
+        campaign, first, second = history
+
+        result = RetentionService().compact(cutoff=CUTOFF, chunk_size=1)
+
+        assert result['chunks'] == 6
+        assert EmailDailyStats.query.filter_by(email_id=first.id, day=OLD.date()).one().event_count == 2
+        opens = CampaignDailyStats.query.filter_by(campaign_id=campaign.id, day=OLD.date(), event_type='open').one()
+        assert (opens.event_count, opens.email_count) == (2, 1)
+        assert EmailUniqueIp.query.filter_by(email_id=first.id, event_type='open').count() == 2
+
+    def test_compact_is_idempotent(self, history):
+        """Test that a second run finds nothing left to compact"""
+        RetentionService().compact(cutoff=CUTOFF)
+
+        result = RetentionService().compact(cutoff=CUTOFF)
+
+        assert result['events'] == 0
+        assert EmailDailyStats.query.filter_by(event_type='open').with_entities(
+            db.func.sum(EmailDailyStats.event_count)).scalar() == 4
+
+    def test_cutoff_from_days(self, app):
+        """Test that the cutoff is midnight `days` ago"""
+        cutoff = RetentionService().cutoff(days=30, now=datetime(2024, 3, 31, 15, 30))
+
+        assert cutoff == datetime(2024, 3, 1)
+
+    def test_invalid_arguments(self, app):
+        """Test validation of days and chunk size"""
+        with pytest.raises(ValidationError):
+            RetentionService().cutoff(days=0)
+        with pytest.raises(ValidationError):
+            RetentionService().compact(cutoff=CUTOFF, chunk_size=0)
+
+    def test_delete_email_removes_aggregates(self, history):
+        """Test that aggregates go with their email"""
+        _, first, _ = history
+        RetentionService().compact(cutoff=CUTOFF)
+
+        EmailService().delete_email(first.id)
+
+        assert EmailDailyStats.query.filter_by(email_id=first.id).count() == 0
+        assert EmailUniqueIp.query.filter_by(email_id=first.id).count() == 0
+
+
+class TestCompactionEndpoints:
+    """Test API and CLI access"""
+
+    def test_campaign_daily(self, client, history):
+        """Test GET /api/analytics/campaign/<id>/daily"""
+        campaign, _, _ = history
+        RetentionService().compact(cutoff=CUTOFF)
+
+        response = client.get(f'/api/analytics/campaign/{campaign.id}/daily?end_date=2024-01-12')
+
+        assert response.status_code == 200
+        assert response.get_json()['days'] == [
+            {'day': '2024-01-10', 'opens': 2, 'clicks': 0, 'emails_opened': 1, 'emails_clicked': 0},
+            {'day': '2024-01-11', 'opens': 1, 'clicks': 1, 'emails_opened': 1, 'emails_clicked': 1},
+        ]
+
+    def test_campaign_daily_not_found(self, client):
+        """Test daily stats for a missing campaign"""
+        response = client.get('/api/analytics/campaign/999/daily')
+
+        assert response.status_code == 404
+
+    def test_cli(self, runner, history):
+        """Test flask compact-events"""
+        result = runner.invoke(args=['compact-events', '--days', '1', '--chunk-size', '3', '--pause', '0'])
+
+        assert result.exit_code == 0, result.output
+        assert 'Compacted 8 events' in result.output
+        assert TrackingEvent.query.count() == 0
+
+    def test_cli_invalid_days(self, runner):
+        """Test that a bad retention period is reported, not raised"""
+        result = runner.invoke(args=['compact-events', '--days', '0'])
+
+        assert result.exit_code != 0
+        assert 'at least 1 day' in result.output
@@ -0,0 +1,158 @@
+"""
+Tests for email templates: CRUD endpoints, compiled rendering and bulk personalization
+"""
+
+import pytest
+
+from app.exceptions import ValidationError
+from app.models import Email
+from app.services.campaign_service import CampaignService
+from app.services.template_service import TemplateService
+from app.templating import compile_template, template_engine
+
+WELCOME = {
+    'name': 'Welcome',
+    'subject': 'Welcome, {{ first_name|friend }}!',
+    'body': '<p>Hi {{ first_name }}, your plan is {{plan}}. {json: true}</p>',
+}
+
+
+def create(client, **fields):
+    response = client.post('/api/emails/templates', json=dict(WELCOME, **fields))
+    assert response.status_code == 201
+    return response.json['template']
+
+
+class TestTemplateEndpoints:
+    """Test template CRUD endpoints"""
+
+    def test_create_and_get(self, client):
+        template = create(client)
+
+        response = client.get(f"/api/emails/templates/{template['id']}")
+
+        assert response.status_code == 200
+        assert response.json['name'] == 'Welcome'
+        assert response.json['subject'] == WELCOME['subject']
+
+    def test_create_invalid(self, client):
+        missing = client.post('/api/emails/templates', json={'name': 'No body', 'subject': 'Hi'})
+        broken = client.post('/api/emails/templates', json=dict(WELCOME, body='<p>Hi {{ first name }}</p>'))
+
+        assert missing.status_code == 400
+        assert broken.status_code == 400 and broken.json['field'] == 'body'
+
+    def test_list(self, client):
+        create(client)
+        create(client, name='Reminder')
+
+        response = client.get('/api/emails/templates?name=Reminder')
+
+        assert response.status_code == 200
+        assert [template['name'] for template in response.json['templates']] == ['Reminder']
+        assert client.get('/api/emails/templates?limit=0').status_code == 400
+
+    def test_update(self, client):
+        template = create(client)
+
+        response = client.put(f"/api/emails/templates/{template['id']}", json={'subject': 'Hello {{ first_name }}'})
+
+        assert response.status_code == 200
+        assert response.json['template']['subject'] == 'Hello {{ first_name }}'
+        assert response.json['template']['body'] == WELCOME['body']
+        assert client.put('/api/emails/templates/999', json={'name': 'x'}).status_code == 404
+
+    def test_delete_keeps_emails(self, client):
+        template = create(client)
+        client.post(f"/api/emails/templates/{template['id']}/emails", json={
+            'sender_email': 'news@example.com', 'recipients': [{'recipient_email': 'ada@example.com'}]})
+
+        response = client.delete(f"/api/emails/templates/{template['id']}")
+
+        assert response.status_code == 200
+        assert client.get(f"/api/emails/templates/{template['id']}").status_code == 404
+        email = Email.query.one()
+        assert email.template_id is None and email.subject == 'Welcome, friend!'
+
+
+class TestRendering:
+    """Test compiled templates"""
+
+    def test_render(self):
+        compiled = compile_template(WELCOME['subject'], WELCOME['body'])
+
+        subject, body = compiled.render({'first_name': '<Ada>', 'plan': 3})
+
+        assert subject == 'Welcome, <Ada>!'
+        assert body == '<p>Hi &lt;Ada&gt;, your plan is 3. {json: true}</p>'
+        assert compiled.render({})[0] == 'Welcome, friend!'
+        assert compiled.variables == ('first_name', 'plan')
+
+    def test_subject_values_cannot_add_headers(self):
+        subject, _ = compile_template('Hi {{ name }}', '').render({'name': 'Ada\r\nBcc: all@example.com'})
+
+        assert subject == 'Hi Ada Bcc: all@example.com'
+
+    def test_invalid_placeholder(self):
+        with pytest.raises(ValidationError):
+            compile_template('Hi {{ name', '')
+
+    def test_cache_keyed_by_version(self, app):
+        service = TemplateService()
+        template = service.create_template('Welcome', 'Hi {{ name }}', '<p>{{ name }}</p>')
+
+        first = template_engine.compiled(template)
+        assert template_engine.compiled(template) is first
+
+        service.update_template(template.id, subject='Hello {{ name }}')
+
+        assert service.render(template.id, {'name': 'Ada'})['subject'] == 'Hello Ada'
+        assert template_engine.compiled(template) is not first
+
+    def test_render_endpoint(self, client):
+        template = create(client)
+
+        response = client.post(f"/api/emails/templates/{template['id']}/render", json={
+            'recipients': [{'first_name': 'Ada', 'plan': 'Pro'}, {'plan': 'Free'}]})
+
+        assert response.status_code == 200
+        assert [rendered['subject'] for rendered in response.json['rendered']] == ['Welcome, Ada!', 'Welcome, friend!']
+        assert response.json['rendered'][1]['body'].startswith('<p>Hi , your plan is Free.')
+        assert client.post(f"/api/emails/templates/{template['id']}/render",
+                           json={'recipients': ['Ada']}).status_code == 400
+        assert client.post('/api/emails/templates/999/render', json={'recipients': [{}]}).status_code == 404
+
+
+class TestCampaignEmails:
+    """Test creating personalized emails for a campaign send"""
+
+    def test_create_emails(self, client):
+        template = create(client, body='<a href="https://example.com/?t={{ tracking_id }}">{{ recipient_email }}</a>')
+        campaign = CampaignService().create_campaign('Launch')
+
+        response = client.post(f"/api/emails/templates/{template['id']}/emails", json={
+            'sender_email': 'news@example.com', 'campaign_id': campaign.id,
+            'recipients': [{'recipient_email': f'user{i}@example.com', 'first_name': f'User {i}'} for i in range(3)]})
+
+        assert response.status_code == 201
+        assert response.json['total'] == 3
+        emails = Email.query.order_by(Email.id).all()
+        assert [email.id for email in emails] == [email['id'] for email in response.json['emails']]
+        assert emails[1].subject == 'Welcome, User 1!'
+        assert emails[1].body == f'<a href="https://example.com/?t={emails[1].tracking_id}">user1@example.com</a>'
+        assert {(email.delivery_status, email.template_id, email.campaign_id) for email in emails} == {
+            ('queued', template['id'], campaign.id)}
+
+    def test_create_emails_invalid(self, client):
+        template = create(client)
+        url = f"/api/emails/templates/{template['id']}/emails"
+
+        bad_recipient = client.post(url, json={'sender_email': 'news@example.com',
+                                               'recipients': [{'recipient_email': 'ada@example.com'},
+                                                              {'recipient_email': 'not-an-address'}]})
+        no_campaign = client.post(url, json={'sender_email': 'news@example.com', 'campaign_id': 42,
+                                             'recipients': [{'recipient_email': 'ada@example.com'}]})
+
+        assert bad_recipient.status_code == 400 and 'at 1' in bad_recipient.json['error']
+        assert no_campaign.status_code == 404
+        assert Email.query.count() == 0
@@ -0,0 +1,190 @@
+"""
+Tests for batched outbound webhooks, against a local HTTP stand-in
+"""
+
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.models import WebhookDelivery
+from app.services.campaign_service import CampaignService
+from app.services.email_service import EmailService
+from app.services.tracking_service import TrackingService
+from app.services.webhook_service import WebhookService
+from app.webhooks import backoff, sign
+
+
+class Receiver(ThreadingHTTPServer):
+    """Downstream endpoint that records each POST and answers with the next queued status"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            server = self.server
+            server.requests.append((dict(self.headers), body))
+            server.connections.add(self.client_address)
+            status = server.statuses.pop(0) if server.statuses else 200
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), self.Handler)
+        self.requests, self.connections, self.statuses = [], set(), []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/hooks/events'
+
+    def events(self, index):
+        return json.loads(self.requests[index][1])['events']
+
+
+@pytest.fixture
+def receiver():
+    server = Receiver()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def webhook_app(app_factory):
+    app = app_factory(WEBHOOK_BATCH_SIZE=3, WEBHOOK_BATCH_SECONDS=60, WEBHOOK_MAX_ATTEMPTS=2)
+    yield app
+    app.extensions['webhooks'].close()
+
+
+@pytest.fixture
+def email(webhook_app):
+    campaign = CampaignService().create_campaign('Launch')
+    return EmailService().create_email('user@example.com', 'sender@example.com', campaign_id=campaign.id)
+
+
+def open_email(email, times=1):
+    for _ in range(times):
+        TrackingService().record_open(email.tracking_id, ip_address='203.0.113.7')
+
+
+def later(seconds):
+    return datetime.utcnow() + timedelta(seconds=seconds)
+
+
+class TestBatching:
+    """Test cutting recorded events into outbox batches"""
+
+    def test_size_and_time(self, webhook_app, email, receiver):
+        open_email(email)  # before the endpoint: not sent
+        service = WebhookService()
+        service.add_endpoint(receiver.url)
+        open_email(email, times=4)
+
+        assert service.enqueue() == 1  # one full batch, the fourth open waits
+        assert service.enqueue(now=later(61)) == 1
+        assert service.deliver() == {'delivered': 2, 'retried': 0, 'failed': 0}
+
+        assert [len(receiver.events(i)) for i in range(2)] == [3, 1]
+        assert receiver.events(0)[0]['campaign_id'] == email.campaign_id
+        assert len(receiver.connections) == 1  # both POSTs on one pooled connection
+        assert WebhookDelivery.query.count() == 0
+
+    def test_filters(self, webhook_app, email, receiver):
+        other = EmailService().create_email('other@example.com', 'sender@example.com')
+        service = WebhookService()
+        endpoint = service.add_endpoint(receiver.url, event_types=['click'], campaign_id=email.campaign_id)
+
+        open_email(email)
+        TrackingService().record_click(other.tracking_id, 'https://example.com/other')
+        TrackingService().record_click(email.tracking_id, 'https://example.com')
+        service.run()
+        service.enqueue(now=later(61))
+        service.deliver()
+
+        assert [event['clicked_url'] for event in receiver.events(0)] == ['https://example.com']
+        assert endpoint.high_water_mark == 3
+
+    def test_signature(self, webhook_app, email, receiver):
+        endpoint = WebhookService().add_endpoint(receiver.url)
+        open_email(email, times=3)
+
+        WebhookService().run()
+
+        headers, body = receiver.requests[0]
+        assert headers['X-Webhook-Signature'] == sign(endpoint.secret, body)
+        assert headers['Content-Type'] == 'application/json'
+
+
+class TestRetries:
+    """Test backoff, giving up and requeueing"""
+
+    def test_backoff(self):
+        class Fixed:
+            @staticmethod
+            def uniform(low, high):
+                return high
+
+        assert [backoff(attempts, 10, 60, rng=Fixed) for attempts in (1, 2, 3, 4, 5)] == [10, 20, 40, 60, 60]
+
+    def test_retry_then_give_up(self, webhook_app, email, receiver):
+        service = WebhookService()
+        service.add_endpoint(receiver.url)
+        open_email(email, times=6)
+        receiver.statuses = [500, 503]
+
+        assert service.run() == {'batched': 2, 'delivered': 0, 'retried': 1, 'failed': 0}
+        assert service.deliver() == {'delivered': 0, 'retried': 0, 'failed': 0}  # backing off
+        # The second attempt is the last: the batch is parked and the next one goes out
+        assert service.deliver(now=later(3600)) == {'delivered': 1, 'retried': 0, 'failed': 1}
+
+        failed = WebhookDelivery.query.one()
+        assert (failed.status, failed.attempts, failed.last_error) == ('failed', 2, 'HTTP 503')
+        assert [event['id'] for event in receiver.events(2)] == [4, 5, 6]
+
+        runner = webhook_app.test_cli_runner()
+        assert 'Queued 1 failed' in runner.invoke(args=['webhooks', 'retry']).output
+        assert service.deliver() == {'delivered': 1, 'retried': 0, 'failed': 0}
+
+    def test_unreachable(self, webhook_app, email):
+        service = WebhookService()
+        service.add_endpoint('http://127.0.0.1:9/hooks')
+        open_email(email, times=3)
+
+        assert service.run()['retried'] == 1
+        assert WebhookDelivery.query.one().last_error.startswith('ConnectionRefusedError')
+
+
+class TestEndpoints:
+    """Test managing endpoints"""
+
+    def test_cli(self, webhook_app, email, receiver):
+        runner = webhook_app.test_cli_runner()
+
+        added = runner.invoke(args=['webhooks', 'add', receiver.url, '--event-type', 'open'])
+        open_email(email, times=3)
+        WebhookService().enqueue()
+        listed = runner.invoke(args=['webhooks', 'list'])
+        run = runner.invoke(args=['webhooks', 'run'])
+        removed = runner.invoke(args=['webhooks', 'remove', '1'])
+
+        assert added.exit_code == 0 and 'signing secret' in added.output
+        assert f'{receiver.url}\topen\t1 pending, 0 failed' in listed.output
+        assert 'delivered 1' in run.output
+        assert removed.exit_code == 0
+        assert WebhookService().list_endpoints() == []
+
+    def test_errors(self, webhook_app):
+        runner = webhook_app.test_cli_runner()
+
+        assert runner.invoke(args=['webhooks', 'add', 'not a url']).exit_code == 1
+        assert runner.invoke(args=['webhooks', 'add', 'https://example.com/h', '--campaign-id', '9']).exit_code == 1
+        assert runner.invoke(args=['webhooks', 'remove', '9']).exit_code == 1
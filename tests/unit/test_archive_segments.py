@@ -0,0 +1,77 @@
+"""
+Unit tests for archive segment files
+
+These are pure unit tests - they test the segment encoding in isolation
+without any database or web framework dependencies.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.archive import Segment, write_segment
+from app.exceptions import ValidationError
+
+
+def make_rows(count, start=datetime(2024, 1, 1), email_ids=(1, 2, 3)):
+    return [{
+        'id': 100 + i,
+        'email_id': email_ids[i % len(email_ids)],
+        'event_type': 'click' if i % 5 == 0 else 'open',
+        'ip_address': f'203.0.113.{i % 7}',
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)',
+        'location': None,
+        'device_type': 'desktop' if i % 2 else None,
+        'clicked_url': 'https://example.com/a' if i % 5 == 0 else None,
+        'created_at': start + timedelta(minutes=i, microseconds=i),
+        'repeat_count': i % 3,
+        'machine_reason': 1 if i % 11 == 0 else 0,
+    } for i in range(count)]
+
+
+class TestSegment:
+    """Test writing and reading segments"""
+
+    def test_round_trip(self, tmp_path):
+        """Test that every column comes back unchanged"""
+        rows = make_rows(50)
+        write_segment(str(tmp_path / 'a.etseg'), rows)
+
+        assert list(Segment(str(tmp_path / 'a.etseg')).scan()) == rows
+
+    def test_metadata(self, tmp_path):
+        """Test the min/max index in the segment metadata"""
+        rows = make_rows(10, email_ids=(7, 3, 9))
+        meta = write_segment(str(tmp_path / 'a.etseg'), rows)
+
+        assert meta['rows'] == 10
+        assert (meta['min_email_id'], meta['max_email_id']) == (3, 9)
+        assert meta['min_created_at'] < meta['max_created_at']
+        assert meta['bytes'] > 0
+        assert not (tmp_path / 'a.etseg.tmp').exists()
+
+    def test_filters(self, tmp_path):
+        """Test email and created_at filters inside a segment"""
+        rows = make_rows(30)
+        write_segment(str(tmp_path / 'a.etseg'), rows)
+        segment = Segment(str(tmp_path / 'a.etseg'))
+
+        start, end = rows[10]['created_at'], rows[20]['created_at']
+        result = list(segment.scan(email_ids={2}, start=start, end=end))
+
+        assert result == [row for row in rows[10:20] if row['email_id'] == 2]
+
+    def test_compresses(self, tmp_path):
+        """Test that repetitive event data is stored much smaller than its text form"""
+        rows = make_rows(2000)
+        meta = write_segment(str(tmp_path / 'a.etseg'), rows)
+
+        assert meta['bytes'] < len(repr(rows)) / 10
+
+    def test_rejects_other_files(self, tmp_path):
+        """Test that a non-segment file is refused"""
+        path = tmp_path / 'notes.txt'
+        path.write_text('hello')
+
+        with pytest.raises(ValidationError):
+            Segment(str(path))
@@ -0,0 +1,81 @@
+"""
+Unit tests for the benchmark suite's statistics and baseline comparison
+
+These are pure unit tests - no database or Flask app is exercised.
+"""
+
+from benchmarks.bench_suite import compare, parse_scale, percentile, summarize
+
+
+def result(p50_ms, queries):
+    return {'p50_ms': p50_ms, 'queries': queries}
+
+
+class TestParseScale:
+    """Test scale parsing"""
+
+    def test_suffixes(self):
+        """Test k and m suffixes"""
+        assert parse_scale('10k') == 10000
+        assert parse_scale('1M') == 1000000
+        assert parse_scale('2500') == 2500
+
+
+class TestPercentile:
+    """Test nearest-rank percentiles"""
+
+    def test_percentiles(self):
+        """Test p50/p95/p99 over 1..100"""
+        samples = list(range(1, 101))
+        assert percentile(samples, 50) == 50
+        assert percentile(samples, 95) == 95
+        assert percentile(samples, 99) == 99
+
+    def test_single_sample(self):
+        """Test that every percentile of one sample is that sample"""
+        assert percentile([7], 50) == 7
+        assert percentile([7], 99) == 7
+
+    def test_empty(self):
+        """Test that no samples gives None"""
+        assert percentile([], 50) is None
+
+
+class TestSummarize:
+    """Test sample reduction"""
+
+    def test_summary(self):
+        """Test milliseconds, throughput and median query count"""
+        summary = summarize([0.002, 0.001, 0.003, 0.004], [2, 2, 3, 2])
+
+        assert summary['samples'] == 4
+        assert summary['p50_ms'] == 2.0
+        assert summary['p99_ms'] == 4.0
+        assert summary['mean_ms'] == 2.5
+        assert summary['throughput_per_s'] == 400.0
+        assert summary['queries'] == 2
+
+
+class TestCompare:
+    """Test baseline comparison"""
+
+    def test_no_regression_within_tolerance(self):
+        """Test that a small slowdown passes"""
+        baseline = {'10k': {'a': result(10.0, 2)}}
+        assert compare({'10k': {'a': result(12.0, 2)}}, baseline, 0.25) == []
+
+    def test_latency_regression(self):
+        """Test that a p50 beyond tolerance is reported"""
+        baseline = {'10k': {'a': result(10.0, 2)}}
+        regressions = compare({'10k': {'a': result(13.0, 2)}}, baseline, 0.25)
+        assert [(scale, name) for scale, name, _ in regressions] == [('10k', 'a')]
+
+    def test_query_count_regression(self):
+        """Test that any extra query per call is reported"""
+        baseline = {'10k': {'a': result(10.0, 2)}}
+        regressions = compare({'10k': {'a': result(5.0, 3)}}, baseline, 0.25)
+        assert 'queries 2 -> 3' in regressions[0][2]
+
+    def test_new_scenarios_ignored(self):
+        """Test that scenarios or scales missing from the baseline are skipped"""
+        assert compare({'1m': {'a': result(10.0, 2)}}, {'10k': {'a': result(1.0, 1)}}, 0.25) == []
@@ -0,0 +1,80 @@
+"""
+Unit tests for the load-test traffic mix and HTTP response reader
+
+These are pure unit tests - no server or database is started.
+"""
+
+import asyncio
+
+from benchmarks.load_test import TargetMix, _read_response
+
+
+def make_campaigns():
+    return [[f'hot{i}' for i in range(10)], [f'warm{i}' for i in range(10)], [f'cold{i}' for i in range(10)]]
+
+
+def read(raw):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await _read_response(reader)
+    return asyncio.run(run())
+
+
+class TestTargetMix:
+    """Test request generation"""
+
+    def test_hot_campaign_dominates(self):
+        """Test that the first campaign gets the most hits"""
+        mix = TargetMix(make_campaigns(), invalid_ratio=0)
+        paths = [mix.next()[0] for _ in range(3000)]
+
+        hot = sum('hot' in path for path in paths)
+        cold = sum('cold' in path for path in paths)
+        assert hot > cold * 2
+
+    def test_invalid_ratio(self):
+        """Test that unknown IDs are generated and flagged invalid"""
+        mix = TargetMix(make_campaigns(), invalid_ratio=0.2)
+        results = [mix.next() for _ in range(5000)]
+
+        invalid = [path for path, _, valid in results if not valid]
+        assert 800 < len(invalid) < 1200
+        assert not any('hot' in path or 'warm' in path or 'cold' in path for path in invalid)
+
+    def test_click_paths(self):
+        """Test that clicks carry an encoded destination and opens use the pixel"""
+        mix = TargetMix(make_campaigns(), click_ratio=0.5)
+        for path, event_type, _ in (mix.next() for _ in range(200)):
+            if event_type == 'click':
+                assert path.startswith('/track/click/') and '?url=https%3A%2F%2F' in path
+            else:
+                assert path.startswith('/track/pixel/') and path.endswith('.png')
+
+    def test_reproducible(self):
+        """Test that the same seed gives the same sequence"""
+        first = TargetMix(make_campaigns(), seed=3)
+        second = TargetMix(make_campaigns(), seed=3)
+        assert [first.next() for _ in range(50)] == [second.next() for _ in range(50)]
+
+
+class TestReadResponse:
+    """Test the minimal HTTP/1.1 response reader"""
+
+    def test_keep_alive_response(self):
+        """Test status and keep-alive for an HTTP/1.1 response with a body"""
+        status, keep_alive = read(b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nabc')
+        assert status == 200
+        assert keep_alive is True
+
+    def test_connection_close(self):
+        """Test that Connection: close ends keep-alive"""
+        status, keep_alive = read(b'HTTP/1.1 302 FOUND\r\nConnection: close\r\nContent-Length: 0\r\n\r\n')
+        assert status == 302
+        assert keep_alive is False
+
+    def test_http10_defaults_to_close(self):
+        """Test that HTTP/1.0 responses are not kept alive"""
+        _, keep_alive = read(b'HTTP/1.0 200 OK\r\nContent-Length: 0\r\n\r\n')
+        assert keep_alive is False
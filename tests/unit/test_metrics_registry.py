@@ -0,0 +1,153 @@
+"""
+Unit tests for the in-process metrics registry
+
+These are pure unit tests - they exercise MetricsRegistry directly
+without any database or web framework dependencies.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from app.metrics import MetricsRegistry
+
+
+def make_registry():
+    registry = MetricsRegistry()
+    counter = registry.counter('hits_total', 'Hits', ('kind',))
+    histogram = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+    return registry, counter, histogram
+
+
+class TestCounters:
+    """Test counter recording and merging"""
+
+    def test_inc_and_render(self):
+        """Test that counter increments show up in the text format"""
+        registry, counter, _ = make_registry()
+        counter.inc('open')
+        counter.inc('open', amount=2)
+        counter.inc('click')
+
+        text = registry.render()
+        assert '# TYPE hits_total counter' in text
+        assert 'hits_total{kind="open"} 3' in text
+        assert 'hits_total{kind="click"} 1' in text
+
+    def test_threads_merge(self):
+        """Test that per-thread shards are summed at collect time"""
+        registry, counter, _ = make_registry()
+
+        def work():
+            for _ in range(1000):
+                counter.inc('open')
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert registry.collect()[('hits_total', ('open',))] == 4000
+
+    def test_exited_threads_are_retired(self):
+        """Test that short-lived threads don't leave a shard each, and keep their counts"""
+        registry, counter, histogram = make_registry()
+
+        def work():
+            counter.inc('open')
+            histogram.observe(0.5, '/a')
+
+        for _ in range(200):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        assert len(registry._shards) <= 1
+        values = registry.collect()
+        assert values[('hits_total', ('open',))] == 200
+        assert values[('latency_seconds', ('/a',))][-1] == 200
+
+    def test_label_escaping(self):
+        """Test that quotes in label values are escaped"""
+        registry, counter, _ = make_registry()
+        counter.inc('say "hi"')
+        assert 'hits_total{kind="say \\"hi\\""} 1' in registry.render()
+
+
+class TestHistograms:
+    """Test histogram buckets"""
+
+    def test_cumulative_buckets(self):
+        """Test that buckets are cumulative with sum and count"""
+        registry, _, histogram = make_registry()
+        histogram.observe(0.05, '/a')
+        histogram.observe(0.1, '/a')
+        histogram.observe(0.5, '/a')
+        histogram.observe(3.0, '/a')
+
+        text = registry.render()
+        assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in text
+        assert 'latency_seconds_bucket{route="/a",le="1.0"} 3' in text
+        assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in text
+        assert 'latency_seconds_sum{route="/a"} 3.65' in text
+        assert 'latency_seconds_count{route="/a"} 4' in text
+
+
+class TestMultiprocess:
+    """Test aggregation across prefork workers"""
+
+    def test_other_worker_snapshots_are_summed(self, tmp_path):
+        """Test that snapshot files from other workers are merged into the scrape"""
+        registry, counter, histogram = make_registry()
+        registry.multiproc_dir = str(tmp_path)
+
+        counter.inc('open', amount=2)
+        histogram.observe(0.05, '/a')
+
+        (tmp_path / '99999.json').write_text(json.dumps([
+            ['hits_total', ['open'], 5],
+            ['latency_seconds', ['/a'], [1, 0, 0, 0.02, 1]],
+        ]))
+
+        text = registry.render()
+        assert 'hits_total{kind="open"} 7' in text
+        assert 'latency_seconds_count{route="/a"} 2' in text
+
+    def test_flush_writes_own_snapshot(self, tmp_path):
+        """Test that flush writes this process's values and they are not double counted"""
+        registry, counter, _ = make_registry()
+        registry.multiproc_dir = str(tmp_path)
+
+        counter.inc('open')
+        registry.flush()
+
+        assert len(list(tmp_path.glob('*.json'))) == 1
+        assert 'hits_total{kind="open"} 1' in registry.render()
+
+    def test_exited_worker_snapshots_are_retired(self, tmp_path):
+        """Test that an exited worker's file is folded into retired.json and still counted"""
+        registry, _, _ = make_registry()
+        registry.multiproc_dir = str(tmp_path)
+        worker = subprocess.Popen([sys.executable, '-c', 'pass'])
+        worker.wait()
+        for name, hits in ((f'{worker.pid}.json', 2), ('retired.json', 3)):
+            (tmp_path / name).write_text(json.dumps([['hits_total', ['open'], hits]]))
+
+        assert 'hits_total{kind="open"} 5' in registry.render()
+        assert sorted(path.name for path in tmp_path.glob('*.json')) == ['retired.json']
+        assert 'hits_total{kind="open"} 5' in registry.render()
+
+    def test_reused_pid_snapshot_is_retired(self, tmp_path):
+        """Test that a snapshot left under this process's pid is kept, not overwritten"""
+        registry, counter, _ = make_registry()
+        registry.multiproc_dir = str(tmp_path)
+        (tmp_path / f'{os.getpid()}.json').write_text(json.dumps([['hits_total', ['open'], 4]]))
+
+        counter.inc('open')
+        registry.flush()
+
+        assert json.loads((tmp_path / 'retired.json').read_text()) == [['hits_total', ['open'], 4]]
+        assert 'hits_total{kind="open"} 5' in registry.render()
@@ -0,0 +1,56 @@
+"""
+Unit tests for the tracking_events partition scheme
+
+These are pure unit tests - they test period arithmetic and partition
+naming in isolation without any database or web framework dependencies.
+"""
+
+from datetime import date, datetime
+
+import pytest
+
+from app.exceptions import ValidationError
+from app.partitions import PartitionScheme
+
+
+class TestPartitionScheme:
+    """Test mapping timestamps to partition periods"""
+
+    def test_month(self):
+        """Test monthly periods, including the December rollover"""
+        scheme = PartitionScheme('month')
+
+        assert scheme.name(datetime(2024, 12, 31, 23, 59)) == 'tracking_events_p20241201'
+        assert scheme.next_start(date(2024, 12, 1)) == date(2025, 1, 1)
+        assert scheme.bounds('tracking_events_p20240201') == (datetime(2024, 2, 1), datetime(2024, 3, 1))
+
+    def test_week(self):
+        """Test that weekly periods start on Monday"""
+        scheme = PartitionScheme('week')
+
+        assert scheme.period_start(datetime(2024, 1, 7, 12)) == date(2024, 1, 1)
+        assert scheme.next_start(date(2024, 1, 1)) == date(2024, 1, 8)
+
+    def test_day(self):
+        """Test daily periods"""
+        scheme = PartitionScheme('day')
+
+        assert scheme.name(datetime(2024, 3, 9, 8)) == 'tracking_events_p20240309'
+        assert scheme.bounds('tracking_events_p20240309') == (datetime(2024, 3, 9), datetime(2024, 3, 10))
+
+    def test_ordinals_are_consecutive(self):
+        """Test that consecutive periods get consecutive ordinals (disjoint id ranges)"""
+        for period in ('month', 'week', 'day'):
+            scheme = PartitionScheme(period)
+            start = scheme.period_start(date(2024, 12, 30))
+            assert scheme.ordinal(scheme.next_start(start)) == scheme.ordinal(start) + 1
+
+    def test_parse_other_tables(self):
+        """Test that non-partition names are not parsed"""
+        assert PartitionScheme.parse('tracking_events') is None
+        assert PartitionScheme.parse('emails') is None
+
+    def test_unknown_period(self):
+        """Test rejection of an unsupported period"""
+        with pytest.raises(ValidationError):
+            PartitionScheme('year')
@@ -6,7 +6,7 @@ without any database or web framework dependencies.
 """
 
 import pytest
-from app.utils.user_agent import parse_user_agent
+from app.utils.user_agent import parse_user_agent, is_bot_user_agent
 
 
 class TestParseUserAgent:
@@ -162,3 +162,25 @@ class TestParseUserAgent:
         ua = 'Mozilla/5.0 (BlackBerry; U; BlackBerry 9900; en) AppleWebKit/534.11+ Version/7.1.0.346 Mobile Safari/534.11+'
         result = parse_user_agent(ua)
         assert result['device_type'] == 'mobile'
+
+
+class TestIsBotUserAgent:
+    """Test bot user agent detection"""
+
+    def test_crawlers_and_libraries(self):
+        """Test that crawlers, link checkers and HTTP libraries are bots"""
+        for ua in ['Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+                   'curl/8.4.0', 'python-requests/2.31.0',
+                   'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 HeadlessChrome/120.0.0.0 Safari/537.36']:
+            assert is_bot_user_agent(ua), ua
+
+    def test_mail_clients_are_not_bots(self):
+        """Test that browsers and mail clients are not bots"""
+        for ua in ['Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+                   'Microsoft Office/16.0 (Windows NT 10.0; Microsoft Outlook 16.0.17029; Pro)']:
+            assert not is_bot_user_agent(ua), ua
+
+    def test_empty(self):
+        """Test that a missing user agent is not flagged"""
+        assert not is_bot_user_agent(None)
+        assert not is_bot_user_agent('')
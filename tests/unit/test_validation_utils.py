@@ -5,8 +5,10 @@ These are pure unit tests - they test individual functions in isolation
 without any database or web framework dependencies.
 """
 
+from datetime import datetime
+
 import pytest
-from app.utils.validation import validate_email, validate_url, validate_template
+from app.utils.validation import validate_email, validate_url, validate_template, parse_datetime
 
 
 class TestValidateEmail:
@@ -168,3 +170,25 @@ class TestValidateTemplate:
     def test_with_empty_string(self):
         """Test validate_template with empty string"""
         assert validate_template('') is False
+
+
+class TestParseDatetime:
+    """Test ISO 8601 query parameter parsing"""
+
+    def test_date_only(self):
+        """Test that a bare date is midnight"""
+        assert parse_datetime('2024-02-01') == datetime(2024, 2, 1)
+
+    def test_datetime(self):
+        """Test a full timestamp"""
+        assert parse_datetime('2024-02-01T13:45:00') == datetime(2024, 2, 1, 13, 45)
+
+    def test_empty(self):
+        """Test that a missing value is None"""
+        assert parse_datetime(None) is None
+        assert parse_datetime('') is None
+
+    def test_invalid(self):
+        """Test that a malformed value raises ValueError"""
+        with pytest.raises(ValueError):
+            parse_datetime('yesterday')